@@ -0,0 +1,55 @@
+"""durable telegram update queue
+
+Revision ID: 20261018_000002
+Revises: 20250903_000001
+Create Date: 2026-10-18 00:00:02
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '20261018_000002'
+down_revision = '20250903_000001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    existing_tables = inspect(conn).get_table_names()
+
+    # Очередь сырых обновлений Telegram (TG_UPDATE_MODE=durable)
+    if 'tg_update_queue' not in existing_tables:
+        op.create_table(
+            'tg_update_queue',
+            sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=True),
+            sa.Column('update_id', sa.BigInteger(), nullable=False, unique=True),
+            sa.Column('chat_id', sa.BigInteger(), nullable=True),
+            sa.Column('payload', sa.Text(), nullable=False),
+            sa.Column('status', sa.String(length=16), nullable=False, server_default='pending'),
+            sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+            sa.Column('locked_at', sa.DateTime(), nullable=True),
+            sa.Column('locked_by', sa.String(length=128), nullable=True),
+        )
+        op.create_index('ix_tg_update_queue_chat', 'tg_update_queue', ['chat_id', 'id'])
+        op.create_index('ix_tg_update_queue_status', 'tg_update_queue', ['status', 'id'])
+
+    # Пульс воркеров очереди
+    if 'tg_update_workers' not in existing_tables:
+        op.create_table(
+            'tg_update_workers',
+            sa.Column('worker_id', sa.String(length=128), primary_key=True),
+            sa.Column('processed', sa.BigInteger(), nullable=False, server_default='0'),
+            sa.Column('failed', sa.BigInteger(), nullable=False, server_default='0'),
+            sa.Column('rate_per_sec', sa.Float(), nullable=False, server_default='0'),
+            sa.Column('started_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+            sa.Column('heartbeat_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table('tg_update_workers')
+    op.drop_index('ix_tg_update_queue_status', table_name='tg_update_queue')
+    op.drop_index('ix_tg_update_queue_chat', table_name='tg_update_queue')
+    op.drop_table('tg_update_queue')
@@ -0,0 +1,35 @@
+"""postgres fsm storage
+
+Revision ID: 20261018_000003
+Revises: 20261018_000002
+Create Date: 2026-10-18 00:00:03
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '20261018_000003'
+down_revision = '20261018_000002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    existing_tables = inspect(conn).get_table_names()
+
+    # Состояния FSM (FSM_STORAGE=postgres)
+    if 'fsm_states' not in existing_tables:
+        op.create_table(
+            'fsm_states',
+            sa.Column('key', sa.String(length=256), primary_key=True),
+            sa.Column('state', sa.String(length=256), nullable=True),
+            sa.Column('data', sa.JSON(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        )
+        op.create_index('ix_fsm_states_updated_at', 'fsm_states', ['updated_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_fsm_states_updated_at', table_name='fsm_states')
+    op.drop_table('fsm_states')
@@ -0,0 +1,33 @@
+"""telegram update dedup journal
+
+Revision ID: 20261018_000004
+Revises: 20261018_000003
+Create Date: 2026-10-18 00:00:04
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '20261018_000004'
+down_revision = '20261018_000003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    existing_tables = inspect(conn).get_table_names()
+
+    # Журнал принятых update_id (TG_DEDUP=postgres)
+    if 'tg_processed_updates' not in existing_tables:
+        op.create_table(
+            'tg_processed_updates',
+            sa.Column('update_id', sa.BigInteger(), primary_key=True, autoincrement=False),
+            sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        )
+        op.create_index('ix_tg_processed_updates_created_at', 'tg_processed_updates', ['created_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tg_processed_updates_created_at', table_name='tg_processed_updates')
+    op.drop_table('tg_processed_updates')
@@ -0,0 +1,61 @@
+"""broadcasts
+
+Revision ID: 20261018_000005
+Revises: 20261018_000004
+Create Date: 2026-10-18 00:00:05
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '20261018_000005'
+down_revision = '20261018_000004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    existing_tables = inspector.get_table_names()
+
+    # Отметка о блокировке бота пользователем
+    user_columns = {c['name'] for c in inspector.get_columns('users')}
+    if 'blocked_at' not in user_columns:
+        op.add_column('users', sa.Column('blocked_at', sa.DateTime(), nullable=True))
+
+    if 'broadcasts' not in existing_tables:
+        op.create_table(
+            'broadcasts',
+            sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column('text', sa.Text(), nullable=False),
+            sa.Column('status', sa.String(length=16), nullable=False, server_default='pending'),
+            sa.Column('created_by', sa.String(length=64), nullable=True),
+            sa.Column('last_user_id', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('total', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('delivered', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('blocked', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('failed', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+            sa.Column('started_at', sa.DateTime(), nullable=True),
+            sa.Column('finished_at', sa.DateTime(), nullable=True),
+            sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+        )
+
+    if 'broadcast_deliveries' not in existing_tables:
+        op.create_table(
+            'broadcast_deliveries',
+            sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=True),
+            sa.Column('broadcast_id', sa.Integer(), sa.ForeignKey('broadcasts.id', ondelete='CASCADE'), nullable=False),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+            sa.Column('status', sa.String(length=16), nullable=False),
+            sa.Column('error', sa.String(length=255), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+            sa.UniqueConstraint('broadcast_id', 'user_id', name='uq_broadcast_delivery_user'),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table('broadcast_deliveries')
+    op.drop_table('broadcasts')
+    op.drop_column('users', 'blocked_at')
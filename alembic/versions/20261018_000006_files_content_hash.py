@@ -0,0 +1,44 @@
+"""telegram file_id cache
+
+Revision ID: 20261018_000006
+Revises: 20261018_000005
+Create Date: 2026-10-18 00:00:06
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '20261018_000006'
+down_revision = '20261018_000005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    existing_tables = inspector.get_table_names()
+
+    # Кэш file_id загруженных в Telegram файлов
+    if 'files' not in existing_tables:
+        op.create_table(
+            'files',
+            sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column('path', sa.String(length=512), nullable=False, unique=True),
+            sa.Column('tg_file_id', sa.String(length=256), nullable=True),
+            sa.Column('mime_type', sa.String(length=128), nullable=True),
+            sa.Column('content_hash', sa.String(length=64), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+        )
+        return
+
+    columns = {c['name'] for c in inspector.get_columns('files')}
+    if 'content_hash' not in columns:
+        op.add_column('files', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    if 'updated_at' not in columns:
+        op.add_column('files', sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('files', 'updated_at')
+    op.drop_column('files', 'content_hash')
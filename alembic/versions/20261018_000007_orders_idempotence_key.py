@@ -0,0 +1,28 @@
+"""orders idempotence key
+
+Revision ID: 20261018_000007
+Revises: 20261018_000006
+Create Date: 2026-10-18 00:00:07
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '20261018_000007'
+down_revision = '20261018_000006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    # Ключ идемпотентности платежа в ЮKassa: повторные попытки создать платёж по заказу идут с тем же ключом
+    columns = {c['name'] for c in inspector.get_columns('orders')}
+    if 'idempotence_key' not in columns:
+        op.add_column('orders', sa.Column('idempotence_key', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('orders', 'idempotence_key')
@@ -0,0 +1,31 @@
+"""orders created_at and reconciled_at
+
+Revision ID: 20261018_000008
+Revises: 20261018_000007
+Create Date: 2026-10-18 00:00:08
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '20261018_000008'
+down_revision = '20261018_000007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    # Время создания заказа и последней сверки с ЮKassa — для поиска зависших в pending заказов
+    columns = {c['name'] for c in inspector.get_columns('orders')}
+    if 'created_at' not in columns:
+        op.add_column('orders', sa.Column('created_at', sa.DateTime(), nullable=True))
+    if 'reconciled_at' not in columns:
+        op.add_column('orders', sa.Column('reconciled_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('orders', 'reconciled_at')
+    op.drop_column('orders', 'created_at')
@@ -0,0 +1,44 @@
+"""outbox for payment side effects
+
+Revision ID: 20261018_000009
+Revises: 20261018_000008
+Create Date: 2026-10-18 00:00:09
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '20261018_000009'
+down_revision = '20261018_000008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    existing_tables = inspector.get_table_names()
+
+    # Сообщения и выдачи товара после оплаты: пишутся вместе со сменой статуса заказа, отправляются диспетчером
+    if 'outbox' not in existing_tables:
+        op.create_table(
+            'outbox',
+            sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=True),
+            sa.Column('kind', sa.String(length=32), nullable=False),
+            sa.Column('chat_id', sa.BigInteger(), nullable=False),
+            sa.Column('payload', sa.JSON(), nullable=False),
+            sa.Column('order_id', sa.Integer(), nullable=True),
+            sa.Column('status', sa.String(length=16), nullable=False, server_default='pending'),
+            sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('last_error', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+            sa.Column('available_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+            sa.Column('locked_at', sa.DateTime(), nullable=True),
+            sa.Column('done_at', sa.DateTime(), nullable=True),
+        )
+        op.create_index('ix_outbox_status_available', 'outbox', ['status', 'available_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_outbox_status_available', table_name='outbox')
+    op.drop_table('outbox')
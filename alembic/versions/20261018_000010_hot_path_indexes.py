@@ -0,0 +1,48 @@
+"""indexes for hot bot and webhook queries
+
+Revision ID: 20261018_000010
+Revises: 20261018_000009
+Create Date: 2026-10-18 00:00:10
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '20261018_000010'
+down_revision = '20261018_000009'
+branch_labels = None
+depends_on = None
+
+# (имя, таблица, колонки, условие частичного индекса)
+INDEXES = [
+    # «Куплено ли» в карточке товара и корзине; список купленных — по префиксу user_id
+    ('ix_purchases_user_item', 'purchases', ['user_id', 'item_id'], None),
+    # Покупки заказа: вебхук, админка
+    ('ix_purchases_order', 'purchases', ['order_id'], None),
+    # Поиск заказов по покупателю в админке
+    ('ix_orders_buyer_tg_id', 'orders', ['buyer_tg_id'], None),
+    # Сверка pending-заказов и статистика оплат
+    ('ix_orders_status', 'orders', ['status'], None),
+    # Резерв кодов: первые свободные коды товара по id; проданные коды в индекс не попадают
+    ('ix_item_codes_unsold', 'item_codes', ['item_id', 'id'], sa.text('is_sold = false')),
+    # Диспетчер outbox: есть ли у чата более ранняя неотправленная запись
+    ('ix_outbox_chat', 'outbox', ['chat_id', 'id'], None),
+]
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+
+    for name, table, columns, where in INDEXES:
+        if table not in existing_tables:
+            continue
+        if name in {ix['name'] for ix in inspector.get_indexes(table)}:
+            continue
+        op.create_index(name, table, columns, postgresql_where=where)
+
+
+def downgrade() -> None:
+    for name, table, _, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
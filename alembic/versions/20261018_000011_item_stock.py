@@ -0,0 +1,57 @@
+"""item stock counters
+
+Revision ID: 20261018_000011
+Revises: 20261018_000010
+Create Date: 2026-10-18 00:00:11
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '20261018_000011'
+down_revision = '20261018_000010'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    existing_tables = inspector.get_table_names()
+
+    # Счётчики остатков: свободные коды и остаток оффлайн-товаров без COUNT(*) по item_codes
+    if 'item_stock' not in existing_tables:
+        op.create_table(
+            'item_stock',
+            sa.Column('item_id', sa.Integer(), sa.ForeignKey('items.id', ondelete='CASCADE'), primary_key=True),
+            sa.Column('available', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('sold', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('low_alerted', sa.Boolean(), nullable=False, server_default=sa.false()),
+            sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        )
+        # Раньше 0 в items.stock означал «без учёта остатков»; теперь это NULL, а 0 — товар закончился
+        op.execute("UPDATE items SET stock = NULL WHERE stock = 0")
+        # Начальные значения из исходных строк: коды — по item_codes, оффлайн-товары — из items.stock
+        op.execute(
+            """
+            INSERT INTO item_stock (item_id, available, sold)
+            SELECT item_id,
+                   count(*) FILTER (WHERE NOT is_sold),
+                   count(*) FILTER (WHERE is_sold)
+            FROM item_codes
+            GROUP BY item_id
+            """
+        )
+        op.execute(
+            """
+            INSERT INTO item_stock (item_id, available, sold)
+            SELECT id, coalesce(stock, 0), 0
+            FROM items
+            WHERE stock IS NOT NULL
+            ON CONFLICT (item_id) DO NOTHING
+            """
+        )
+
+
+def downgrade() -> None:
+    op.drop_table('item_stock')
@@ -0,0 +1,46 @@
+"""stock holds for unpaid orders
+
+Revision ID: 20261018_000012
+Revises: 20261018_000011
+Create Date: 2026-10-18 00:00:12
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '20261018_000012'
+down_revision = '20261018_000011'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    existing_tables = inspector.get_table_names()
+
+    # Сколько единиц товара зарезервировано неоплаченными заказами
+    columns = {c['name'] for c in inspector.get_columns('item_stock')}
+    if 'held' not in columns:
+        op.add_column('item_stock', sa.Column('held', sa.Integer(), nullable=False, server_default='0'))
+
+    # Резервы остатка на время оплаты: снимаются при оплате или по истечении срока
+    if 'stock_holds' not in existing_tables:
+        op.create_table(
+            'stock_holds',
+            sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=True),
+            sa.Column('order_id', sa.Integer(), sa.ForeignKey('orders.id', ondelete='CASCADE'), nullable=False),
+            sa.Column('item_id', sa.Integer(), sa.ForeignKey('items.id', ondelete='CASCADE'), nullable=False),
+            sa.Column('quantity', sa.Integer(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+            sa.Column('expires_at', sa.DateTime(), nullable=False),
+        )
+        op.create_index('ix_stock_holds_order', 'stock_holds', ['order_id'])
+        op.create_index('ix_stock_holds_expires', 'stock_holds', ['expires_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_stock_holds_expires', table_name='stock_holds')
+    op.drop_index('ix_stock_holds_order', table_name='stock_holds')
+    op.drop_table('stock_holds')
+    op.drop_column('item_stock', 'held')
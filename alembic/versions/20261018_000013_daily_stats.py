@@ -0,0 +1,37 @@
+"""daily stats rollups for the admin dashboard
+
+Revision ID: 20261018_000013
+Revises: 20261018_000012
+Create Date: 2026-10-18 00:00:13
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '20261018_000013'
+down_revision = '20261018_000012'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    existing_tables = inspector.get_table_names()
+
+    # Сводки по дням и товарам; заполняются приложением, исторические данные — python -m app.services.stats backfill
+    if 'daily_stats' not in existing_tables:
+        op.create_table(
+            'daily_stats',
+            sa.Column('day', sa.Date(), primary_key=True),
+            sa.Column('item_id', sa.Integer(), primary_key=True),
+            sa.Column('new_users', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('checkouts', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('orders_paid', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('units_sold', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('revenue_minor', sa.BigInteger(), nullable=False, server_default='0'),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table('daily_stats')
@@ -0,0 +1,33 @@
+"""fsm state versions for cross-process cache validation
+
+Revision ID: 20261018_000014
+Revises: 20261018_000013
+Create Date: 2026-10-18 00:00:14
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '20261018_000014'
+down_revision = '20261018_000013'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    # Версия записи FSM: кэш процесса сверяет её с БД и не отдаёт состояние, изменённое другим процессом
+    op.execute("CREATE SEQUENCE IF NOT EXISTS fsm_state_version_seq")
+    columns = {c['name'] for c in inspector.get_columns('fsm_states')}
+    if 'version' not in columns:
+        op.add_column(
+            'fsm_states',
+            sa.Column('version', sa.BigInteger(), nullable=False, server_default=sa.text("nextval('fsm_state_version_seq')")),
+        )
+
+
+def downgrade() -> None:
+    op.drop_column('fsm_states', 'version')
+    op.execute("DROP SEQUENCE IF EXISTS fsm_state_version_seq")
@@ -0,0 +1,34 @@
+"""catalog version for cross-process catalog cache invalidation
+
+Revision ID: 20261018_000015
+Revises: 20261018_000014
+Create Date: 2026-10-18 00:00:15
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = '20261018_000015'
+down_revision = '20261018_000014'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    existing_tables = inspector.get_table_names()
+
+    # Версия каталога: админка увеличивает её при правке товаров, кэши процессов бота сверяются с ней
+    if 'catalog_version' not in existing_tables:
+        op.create_table(
+            'catalog_version',
+            sa.Column('id', sa.SmallInteger(), primary_key=True),
+            sa.Column('version', sa.BigInteger(), nullable=False, server_default='0'),
+            sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        )
+    op.execute("INSERT INTO catalog_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING")
+
+
+def downgrade() -> None:
+    op.drop_table('catalog_version')
@@ -18,6 +18,20 @@ class Settings(BaseSettings):
     yk_webhook_user: str | None = Field(alias="YK_WEBHOOK_USER", default=None)
     yk_webhook_password: str | None = Field(alias="YK_WEBHOOK_PASSWORD", default=None)
     trusted_webhook_ips: str | None = Field(alias="TRUSTED_WEBHOOK_IPS", default=None)
+    # Пул соединений с API ЮKassa (один на процесс); YK_HTTP2 требует пакета h2 (pip install httpx[http2])
+    yk_api_url: str = Field(alias="YK_API_URL", default="https://api.yookassa.ru/v3/")
+    yk_http2: bool = Field(alias="YK_HTTP2", default=False)
+    yk_max_connections: int = Field(alias="YK_MAX_CONNECTIONS", default=20)
+    yk_max_keepalive: int = Field(alias="YK_MAX_KEEPALIVE", default=10)
+    yk_keepalive_expiry: float = Field(alias="YK_KEEPALIVE_EXPIRY", default=60.0)
+    # Устойчивость к сбоям ЮKassa: границы адаптивного таймаута чтения (сек), число повторов и базовая пауза,
+    # сколько сбоев подряд размыкают автомат и через сколько секунд пробовать снова
+    yk_timeout_min: float = Field(alias="YK_TIMEOUT_MIN", default=2.0)
+    yk_timeout_max: float = Field(alias="YK_TIMEOUT_MAX", default=30.0)
+    yk_retries: int = Field(alias="YK_RETRIES", default=2)
+    yk_retry_backoff: float = Field(alias="YK_RETRY_BACKOFF", default=0.3)
+    yk_breaker_threshold: int = Field(alias="YK_BREAKER_THRESHOLD", default=5)
+    yk_breaker_reset: float = Field(alias="YK_BREAKER_RESET", default=30.0)
 
     # Server
     server_ip: str = Field(alias="SERVER_IP", default="127.0.0.1")
@@ -46,6 +60,73 @@ class Settings(BaseSettings):
     webhook_url: str | None = Field(alias="WEBHOOK_URL", default=None)
     webhook_secret: str | None = Field(alias="WEBHOOK_SECRET", default=None)
 
+    # Обработка входящих обновлений: inline — прямо в запросе вебхука, queue — через пул воркеров,
+    # durable — запись в таблицу tg_update_queue и обработка отдельным процессом (python -m bot.run_worker)
+    tg_update_mode: str = Field(alias="TG_UPDATE_MODE", default="inline")
+    tg_update_workers: int = Field(alias="TG_UPDATE_WORKERS", default=8)
+    tg_update_queue_size: int = Field(alias="TG_UPDATE_QUEUE_SIZE", default=1000)
+    tg_update_enqueue_timeout: float = Field(alias="TG_UPDATE_ENQUEUE_TIMEOUT", default=0.5)
+    tg_worker_id: str | None = Field(alias="TG_WORKER_ID", default=None)
+    tg_queue_batch_size: int = Field(alias="TG_QUEUE_BATCH_SIZE", default=100)
+    tg_queue_poll_interval: float = Field(alias="TG_QUEUE_POLL_INTERVAL", default=0.2)
+    tg_queue_visibility_timeout: float = Field(alias="TG_QUEUE_VISIBILITY_TIMEOUT", default=300.0)
+    tg_queue_max_attempts: int = Field(alias="TG_QUEUE_MAX_ATTEMPTS", default=5)
+
+    # Дедупликация обновлений по update_id: memory — кольцо в памяти процесса,
+    # postgres — дополнительно общая таблица tg_processed_updates (несколько процессов), off — выключена
+    tg_dedup: str = Field(alias="TG_DEDUP", default="memory")
+    tg_dedup_window: int = Field(alias="TG_DEDUP_WINDOW", default=65536)
+
+    # Исходящие сообщения: общий лимит (сообщений/сек), лимит на личный чат и на группы
+    # (включая ADMIN_CHAT_ID), число повторов после TelegramRetryAfter и сколько чатов отслеживать
+    tg_send_rate: float = Field(alias="TG_SEND_RATE", default=30.0)
+    tg_send_chat_rate: float = Field(alias="TG_SEND_CHAT_RATE", default=1.0)
+    tg_send_chat_burst: float = Field(alias="TG_SEND_CHAT_BURST", default=3.0)
+    tg_send_group_rate: float = Field(alias="TG_SEND_GROUP_RATE", default=0.33)
+    tg_send_max_retries: int = Field(alias="TG_SEND_MAX_RETRIES", default=3)
+    tg_send_max_chats: int = Field(alias="TG_SEND_MAX_CHATS", default=10000)
+
+    # Рассылки: сколько пользователей читать из БД за раз и сколько сообщений отправлять одновременно
+    broadcast_batch_size: int = Field(alias="BROADCAST_BATCH_SIZE", default=500)
+    broadcast_concurrency: int = Field(alias="BROADCAST_CONCURRENCY", default=25)
+
+    # Сверка зависших pending-заказов с ЮKassa (на случай потерянного вебхука): период в секундах (0 — выключена),
+    # размер пачки, число одновременных запросов, минимальный возраст заказа и через сколько часов неоплаченный заказ отменяется
+    reconcile_interval: float = Field(alias="RECONCILE_INTERVAL", default=60.0)
+    reconcile_batch_size: int = Field(alias="RECONCILE_BATCH_SIZE", default=100)
+    reconcile_concurrency: int = Field(alias="RECONCILE_CONCURRENCY", default=5)
+    reconcile_min_age: float = Field(alias="RECONCILE_MIN_AGE", default=300.0)
+    reconcile_expire_hours: float = Field(alias="RECONCILE_EXPIRE_HOURS", default=24.0)
+
+    # Outbox после оплаты: одновременных отправок, записей за выборку, период опроса (сек),
+    # попыток до отметки failed, базовая пауза между попытками (сек, растёт вдвое) и сколько часов хранить отправленные
+    outbox_concurrency: int = Field(alias="OUTBOX_CONCURRENCY", default=10)
+    outbox_batch_size: int = Field(alias="OUTBOX_BATCH_SIZE", default=50)
+    outbox_poll_interval: float = Field(alias="OUTBOX_POLL_INTERVAL", default=1.0)
+    outbox_max_attempts: int = Field(alias="OUTBOX_MAX_ATTEMPTS", default=8)
+    outbox_retry_backoff: float = Field(alias="OUTBOX_RETRY_BACKOFF", default=5.0)
+    outbox_retention_hours: float = Field(alias="OUTBOX_RETENTION_HOURS", default=72.0)
+
+    # Уведомить администратора (один раз до пополнения), когда остаток кодов или оффлайн-товара опустился до этого числа; -1 — не уведомлять
+    stock_low_threshold: int = Field(alias="STOCK_LOW_THRESHOLD", default=3)
+    # Сколько секунд оформленный, но не оплаченный заказ держит резерв товара, и как часто снимать просроченные резервы
+    stock_hold_ttl: float = Field(alias="STOCK_HOLD_TTL", default=1800.0)
+    stock_hold_sweep_interval: float = Field(alias="STOCK_HOLD_SWEEP_INTERVAL", default=30.0)
+
+    # Кэш каталога в памяти процесса: через сколько секунд перечитать витрину, даже если версия каталога не менялась; 0 — без кэша
+    catalog_cache_ttl: float = Field(alias="CATALOG_CACHE_TTL", default=60.0)
+    # Как часто (сек) сверять версию каталога в БД: правки из админки видны другим процессам не позже чем через столько; 0 — на каждый запрос
+    catalog_version_check: float = Field(alias="CATALOG_VERSION_CHECK", default=1.0)
+    # Кэш пользователей бота по tg_id: сколько записей держать и сколько секунд (username может устареть на это время)
+    user_cache_size: int = Field(alias="USER_CACHE_SIZE", default=10000)
+    user_cache_ttl: float = Field(alias="USER_CACHE_TTL", default=300.0)
+
+    # Хранилище FSM: memory — в памяти процесса, postgres — таблица fsm_states с LRU-кэшем
+    fsm_storage: str = Field(alias="FSM_STORAGE", default="memory")
+    fsm_cache_size: int = Field(alias="FSM_CACHE_SIZE", default=10000)
+    fsm_cache_ttl: float = Field(alias="FSM_CACHE_TTL", default=600.0)
+    fsm_state_ttl_hours: float = Field(alias="FSM_STATE_TTL_HOURS", default=72.0)
+
     
 
     # Donate
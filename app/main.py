@@ -16,7 +16,13 @@ def create_app() -> FastAPI:
     from app.routers.payments import router as payments_router
     from app.routers.orders import router as orders_router
     from app.routers.admin import router as admin_router
-    from bot.webhook_app import api_router as tg_router, setup_webhook, delete_webhook
+    from bot.webhook_app import (
+        api_router as tg_router,
+        setup_webhook,
+        delete_webhook,
+        start_update_processing,
+        stop_update_processing,
+    )
 
     app.include_router(health_router)
     app.include_router(payments_router)
@@ -43,13 +49,48 @@ def create_app() -> FastAPI:
             logger.bind(event="db_init_error", error=str(e)).error("Ошибка инициализации базы данных")
             # Не прерываем запуск приложения, но логируем ошибку
         
+        from app.services.yookassa import start_yookassa_client
+        await start_yookassa_client()
+
+        await start_update_processing()
         await setup_webhook()
         logger.bind(event="webhook_setup").info("Webhook configured", url=settings.webhook_url)
 
+        # Продолжаем рассылки, прерванные перезапуском
+        try:
+            from app.services.broadcast import BroadcastService
+            from bot.webhook_app import bot as tg_bot
+            await BroadcastService(tg_bot).resume_all()
+        except Exception as e:
+            logger.bind(event="broadcast.resume_error").error("Не удалось возобновить рассылки: {}", e)
+
+        # Диспетчер outbox: выдача товара и уведомления после оплаты
+        from app.services.outbox import start_outbox_dispatcher
+        from bot.webhook_app import bot as tg_bot
+        start_outbox_dispatcher(tg_bot)
+
+        # Сверка зависших заказов с ЮKassa на случай потерянных вебхуков
+        if settings.reconcile_interval > 0:
+            from app.services.reconciler import start_reconciler
+            start_reconciler()
+
+        # Возврат в продажу товара из резервов неоплаченных заказов
+        from app.services.stock import start_hold_sweeper
+        start_hold_sweeper()
+
     @app.on_event("shutdown")
     async def _on_shutdown() -> None:
+        from app.services.stock import stop_hold_sweeper
+        await stop_hold_sweeper()
+        from app.services.reconciler import stop_reconciler
+        await stop_reconciler()
+        from app.services.outbox import stop_outbox_dispatcher
+        await stop_outbox_dispatcher()
         await delete_webhook()
         logger.bind(event="webhook_delete").info("Webhook removed")
+        await stop_update_processing()
+        from app.services.yookassa import close_yookassa_client
+        await close_yookassa_client()
 
     return app
 
@@ -4,4 +4,13 @@ from .item import Item, ItemType
 from .order import Order, PaymentMethod, OrderStatus
 from .purchase import Purchase
 from .item_code import ItemCode
+from .item_stock import ItemStock
+from .stock_hold import StockHold
+from .daily_stats import DailyStats, TOTAL_ITEM_ID
 from .cart_item import CartItem
+from .catalog_version import CatalogVersion, CATALOG_VERSION_ID
+from .tg_update import QueuedUpdate, UpdateWorker, ProcessedUpdate
+from .fsm_state import FsmState
+from .broadcast import Broadcast, BroadcastDelivery, BroadcastStatus
+from .file import StoredFile
+from .outbox import OutboxMessage, OutboxStatus
@@ -0,0 +1,22 @@
+from sqlalchemy import BigInteger, DateTime, SmallInteger
+from sqlalchemy.orm import Mapped, mapped_column
+from datetime import datetime
+
+from app.db.base import Base
+
+# Единственная строка таблицы
+CATALOG_VERSION_ID = 1
+
+
+class CatalogVersion(Base):
+    """Версия каталога для кэшей всех процессов (app/services/catalog.py).
+
+    Админка увеличивает её в той же транзакции, что и правку товаров; процессы бота сверяют её
+    коротким запросом по ключу и перечитывают витрину, когда версия изменилась.
+    """
+
+    __tablename__ = "catalog_version"
+
+    id: Mapped[int] = mapped_column(SmallInteger, primary_key=True, default=CATALOG_VERSION_ID)
+    version: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
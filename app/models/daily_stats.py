@@ -0,0 +1,27 @@
+from sqlalchemy import Integer, BigInteger, Date
+from sqlalchemy.orm import Mapped, mapped_column
+from datetime import date
+
+from app.db.base import Base
+
+# item_id строки с итогами магазина за день
+TOTAL_ITEM_ID = 0
+
+
+class DailyStats(Base):
+    """Сводка за день по товару (item_id) или по всему магазину (item_id = TOTAL_ITEM_ID).
+
+    Пополняется в тех же транзакциях, что и регистрация пользователя, оформление и оплата заказа
+    (app/services/stats.py), поэтому дашборд не сканирует users и orders.
+    """
+
+    __tablename__ = "daily_stats"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    item_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    new_users: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    # Заказов с выданной ссылкой на оплату; по товару — позиций в таких заказах
+    checkouts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    orders_paid: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    units_sold: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    revenue_minor: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
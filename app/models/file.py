@@ -1,5 +1,6 @@
-from sqlalchemy import String
+from sqlalchemy import String, DateTime
 from sqlalchemy.orm import Mapped, mapped_column
+from datetime import datetime
 
 from app.db.base import Base
 
@@ -11,3 +12,6 @@ class StoredFile(Base):
     path: Mapped[str] = mapped_column(String(512), unique=True)
     tg_file_id: Mapped[str | None] = mapped_column(String(256), nullable=True)
     mime_type: Mapped[str | None] = mapped_column(String(128), nullable=True)
+    # sha256 содержимого, для которого получен tg_file_id: при изменении файла он загружается заново
+    content_hash: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    updated_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
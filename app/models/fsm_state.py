@@ -0,0 +1,22 @@
+from sqlalchemy import String, DateTime, JSON, BigInteger, Sequence
+from sqlalchemy.orm import Mapped, mapped_column
+from datetime import datetime
+
+from app.db.base import Base
+
+# Версии записей FSM берутся из общей последовательности: удалённая и созданная заново запись
+# не повторит версию, которую мог запомнить кэш другого процесса
+fsm_state_version_seq = Sequence("fsm_state_version_seq", metadata=Base.metadata)
+
+
+class FsmState(Base):
+    """Состояние и данные FSM aiogram для одного ключа (бот/чат/пользователь)"""
+
+    __tablename__ = "fsm_states"
+
+    key: Mapped[str] = mapped_column(String(256), primary_key=True)
+    state: Mapped[str | None] = mapped_column(String(256), nullable=True)
+    data: Mapped[dict] = mapped_column(JSON, default=dict, nullable=False)
+    # Меняется при каждой записи; по ней кэш процесса проверяет, не изменил ли запись другой процесс
+    version: Mapped[int] = mapped_column(BigInteger, fsm_state_version_seq, server_default=fsm_state_version_seq.next_value(), nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True, nullable=False)
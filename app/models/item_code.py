@@ -1,4 +1,4 @@
-from sqlalchemy import String, Boolean, Integer, ForeignKey
+from sqlalchemy import String, Boolean, Integer, ForeignKey, Index, text
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.db.base import Base
@@ -6,6 +6,10 @@ from app.db.base import Base
 
 class ItemCode(Base):
     __tablename__ = "item_codes"
+    __table_args__ = (
+        # Свободные коды товара по порядку id — для резерва при оплате
+        Index("ix_item_codes_unsold", "item_id", "id", postgresql_where=text("is_sold = false")),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     item_id: Mapped[int] = mapped_column(ForeignKey("items.id", ondelete="CASCADE"))
@@ -0,0 +1,24 @@
+from sqlalchemy import Integer, Boolean, DateTime, ForeignKey
+from sqlalchemy.orm import Mapped, mapped_column
+from datetime import datetime
+
+from app.db.base import Base
+
+
+class ItemStock(Base):
+    """Остаток товара: свободные коды (DIGITAL с delivery_type='codes') или Item.stock (OFFLINE).
+
+    available — можно купить, held — зарезервировано неоплаченными заказами (StockHold).
+    Меняется в тех же транзакциях, что и загрузка кодов, резерв, продажа и оплата оффлайн-заказа
+    (app/services/stock.py), поэтому чтение остатка — поиск по первичному ключу.
+    """
+
+    __tablename__ = "item_stock"
+
+    item_id: Mapped[int] = mapped_column(ForeignKey("items.id", ondelete="CASCADE"), primary_key=True)
+    available: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    held: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    sold: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    # Уведомление о малом остатке уже отправлено; сбрасывается, когда остаток снова выше порога
+    low_alerted: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
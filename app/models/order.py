@@ -1,5 +1,6 @@
+from datetime import datetime
 from enum import Enum
-from sqlalchemy import String, Integer, Enum as PgEnum, ForeignKey
+from sqlalchemy import String, Integer, Enum as PgEnum, ForeignKey, DateTime, Index
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.db.base import Base
@@ -20,6 +21,10 @@ class OrderStatus(str, Enum):
 
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        Index("ix_orders_buyer_tg_id", "buyer_tg_id"),
+        Index("ix_orders_status", "status"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
@@ -31,3 +36,8 @@ class Order(Base):
     fk_order_id: Mapped[str | None] = mapped_column(String(64), nullable=True)
     fk_payment_url: Mapped[str | None] = mapped_column(String(1024), nullable=True)
     buyer_tg_id: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    # Idempotence-Key платежа в ЮKassa: повторы создания платежа по заказу не создают второй платёж
+    idempotence_key: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    created_at: Mapped[datetime | None] = mapped_column(DateTime, default=datetime.utcnow, nullable=True)
+    # Когда заказ последний раз сверялся с ЮKassa (app/services/reconciler.py)
+    reconciled_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
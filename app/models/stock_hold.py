@@ -0,0 +1,26 @@
+from sqlalchemy import Integer, BigInteger, DateTime, ForeignKey, Index
+from sqlalchemy.orm import Mapped, mapped_column
+from datetime import datetime
+
+from app.db.base import Base
+
+
+class StockHold(Base):
+    """Резерв остатка за неоплаченным заказом на время оплаты.
+
+    Пока резерв жив, эти единицы учтены в ItemStock.held, а не в available; при оплате резерв
+    превращается в продажу, а просроченный возвращается в available (app/services/stock.py)
+    """
+
+    __tablename__ = "stock_holds"
+    __table_args__ = (
+        Index("ix_stock_holds_order", "order_id"),
+        Index("ix_stock_holds_expires", "expires_at"),
+    )
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    order_id: Mapped[int] = mapped_column(ForeignKey("orders.id", ondelete="CASCADE"))
+    item_id: Mapped[int] = mapped_column(ForeignKey("items.id", ondelete="CASCADE"))
+    quantity: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
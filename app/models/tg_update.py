@@ -0,0 +1,47 @@
+from sqlalchemy import String, Integer, BigInteger, DateTime, Text, Index
+from sqlalchemy.orm import Mapped, mapped_column
+from datetime import datetime
+
+from app.db.base import Base
+
+
+class QueuedUpdate(Base):
+    """Сырое обновление Telegram, ожидающее обработки воркером бота"""
+
+    __tablename__ = "tg_update_queue"
+    __table_args__ = (
+        Index("ix_tg_update_queue_chat", "chat_id", "id"),
+        Index("ix_tg_update_queue_status", "status", "id"),
+    )
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    update_id: Mapped[int] = mapped_column(BigInteger, unique=True)
+    chat_id: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    payload: Mapped[str] = mapped_column(Text)
+    status: Mapped[str] = mapped_column(String(16), default="pending", nullable=False)  # pending / processing / failed
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    locked_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    locked_by: Mapped[str | None] = mapped_column(String(128), nullable=True)
+
+
+class UpdateWorker(Base):
+    """Пульс воркера очереди: счётчики и пропускная способность для мониторинга"""
+
+    __tablename__ = "tg_update_workers"
+
+    worker_id: Mapped[str] = mapped_column(String(128), primary_key=True)
+    processed: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
+    failed: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
+    rate_per_sec: Mapped[float] = mapped_column(default=0.0, nullable=False)
+    started_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    heartbeat_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class ProcessedUpdate(Base):
+    """update_id, уже принятый вебхуком — общий журнал дедупликации для нескольких процессов"""
+
+    __tablename__ = "tg_processed_updates"
+
+    update_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True, nullable=False)
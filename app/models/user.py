@@ -17,6 +17,8 @@ class User(Base):
     is_bot: Mapped[bool | None] = mapped_column(Boolean, nullable=True)
     created_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     updated_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    # Когда пользователь заблокировал бота; такие пользователи пропускаются рассылками
+    blocked_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     
     # Добавляем свойство is_admin на основе существующих данных
     @property
@@ -11,7 +11,9 @@ from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.responses import RedirectResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy import select, func, delete
+from sqlalchemy import select, func, delete, literal_column, true
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import aliased
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from aiogram import Bot
@@ -20,8 +22,13 @@ import hmac
 from aiogram.types import FSInputFile
 from app.config import settings
 from app.db.session import get_db_session
-from app.models import Item, ItemType, Order, Purchase, User, ItemCode
-from app.utils.texts import load_texts
+from app.models import Item, ItemType, Order, Purchase, User, ItemCode, ItemStock, Broadcast, BroadcastStatus
+from app.services import stats as stats_service
+from app.services.catalog import bump_catalog_version, catalog_cache
+from app.services.broadcast import BroadcastService, broadcast_progress
+from app.services.stock import add_stock, check_stock, release_holds, set_stock
+from app.utils.pagination import estimated_count, keyset_page
+from app.utils.texts import load_texts, reload_texts, texts_version, TextsError
 
 security = HTTPBasic()
 router = APIRouter(prefix="/admin", tags=["admin"]) 
@@ -51,32 +58,37 @@ async def admin_logout(_: None = Depends(ensure_auth)):
 
 @router.get("/")
 async def admin_index(request: Request, db: AsyncSession = Depends(get_db_session), _: None = Depends(ensure_auth)):
+    # Итоги и графики — из сводок daily_stats, без агрегатов по users и orders
+    dashboard = await stats_service.dashboard(db, days=30)
+    totals = dashboard["totals"]
     stats = {
-        "users": (await db.execute(select(func.count()).select_from(User))).scalar_one(),
+        "users": totals["new_users"],
         "items": (await db.execute(select(func.count()).select_from(Item))).scalar_one(),
-        # Учитываем все оплаченные заказы (включая корзину)
-        "paid_orders": (await db.execute(select(func.count()).select_from(Order).where(Order.status == 'paid'))).scalar_one(),
-        "revenue": (await db.execute(select(func.coalesce(func.sum(Order.amount_minor), 0)).where(Order.status == 'paid'))).scalar_one(),
+        "paid_orders": totals["orders_paid"],
+        "revenue": totals["revenue_minor"],
     }
-    return templates.TemplateResponse("index.html", {"request": request, "stats": stats})
+    peak = max((day["revenue_minor"] for day in dashboard["series"]), default=0)
+    return templates.TemplateResponse(
+        "index.html",
+        {"request": request, "stats": stats, "dashboard": dashboard, "peak": peak, "texts_version": texts_version()},
+    )
 
 
 @router.get("/items")
-async def items_list(request: Request, db: AsyncSession = Depends(get_db_session), _: None = Depends(ensure_auth), page: int = 1, error: str | None = None):
+async def items_list(request: Request, db: AsyncSession = Depends(get_db_session), _: None = Depends(ensure_auth), cursor: str | None = None, error: str | None = None):
     page_size = 10
-    from sqlalchemy import func
-    codes_subq = select(ItemCode.item_id, func.count().label("codes_left")).where(ItemCode.is_sold == False).group_by(ItemCode.item_id).subquery()
-    stmt = select(Item, codes_subq.c.codes_left).outerjoin(codes_subq, Item.id == codes_subq.c.item_id)
-    total = (await db.execute(select(func.count()).select_from(stmt.subquery()))).scalar_one()
-    rows = (await db.execute(stmt.order_by(Item.id.desc()).offset((page-1)*page_size).limit(page_size))).all()
+    # Остаток кодов — из счётчика item_stock, без группировки item_codes на каждой странице
+    stmt = select(Item, ItemStock.available).outerjoin(ItemStock, Item.id == ItemStock.item_id)
+    total = await estimated_count(db, Item)
+    page = await keyset_page(db, stmt, Item.id, cursor, page_size, scalars=False)
     items = []
-    for row in rows:
+    for row in page.rows:
         item = row[0]
         setattr(item, "codes_left", row[1])
         items.append(item)
     return templates.TemplateResponse(
         "items_list.html",
-        {"request": request, "items": items, "ItemType": ItemType, "page": page, "page_size": page_size, "total": total, "error": error}
+        {"request": request, "items": items, "ItemType": ItemType, "page": page, "total": total, "error": error}
     )
 
 
@@ -215,7 +227,9 @@ async def items_restore(file: UploadFile | None = File(None), db: AsyncSession =
                         created[idx].image_file_id = file_id
                 except Exception:
                     pass
+        await bump_catalog_version(db)
         await db.commit()
+        catalog_cache.invalidate()
     return RedirectResponse(url="/admin/items", status_code=303)
 
 
@@ -261,9 +275,9 @@ async def items_create(
     stock_value = None
     if stock_quantity and stock_quantity.strip():
         try:
-            stock_value = int(stock_quantity)
+            stock_value = max(int(stock_quantity), 0)
         except ValueError:
-            stock_value = 0
+            stock_value = None
     
     weight_value = None
     if weight and weight.strip():
@@ -332,7 +346,8 @@ async def items_create(
     
     elif item_type == ItemType.OFFLINE:
         # Обработка полей физических товаров
-        item.stock = stock_value if stock_value is not None else 0
+        # Пустое поле — без учёта остатков
+        item.stock = stock_value
         # Сохраняем информацию о весе и габаритах в поле shipping_info_text
         shipping_parts = []
         if weight_value and weight_value > 0:
@@ -343,7 +358,12 @@ async def items_create(
             item.shipping_info_text = " | ".join(shipping_parts)
 
     db.add(item)
+    if item_type == ItemType.OFFLINE and item.stock is not None:
+        await db.flush()
+        await set_stock(db, item.id, item.stock)
+    await bump_catalog_version(db)
     await db.commit()
+    catalog_cache.invalidate()
 
     return RedirectResponse(url="/admin/items", status_code=302)
 
@@ -403,9 +423,9 @@ async def items_update(
     stock_value = None
     if stock_quantity and stock_quantity.strip():
         try:
-            stock_value = int(stock_quantity)
+            stock_value = max(int(stock_quantity), 0)
         except ValueError:
-            stock_value = 0
+            stock_value = None
     
     weight_value = None
     if weight and weight.strip():
@@ -449,6 +469,7 @@ async def items_update(
             codes = [line.strip() for line in content.splitlines() if line.strip()]
             for c in codes:
                 db.add(ItemCode(item_id=item.id, code=c))
+            await add_stock(db, item.id, len(codes))
         except Exception:
             pass
 
@@ -486,7 +507,8 @@ async def items_update(
     
     elif item_type == ItemType.OFFLINE:
         # Обработка полей физических товаров
-        item.stock = stock_value if stock_value is not None else 0
+        # Пустое поле — без учёта остатков
+        item.stock = stock_value
         # Сохраняем информацию о весе и габаритах в поле shipping_info_text
         shipping_parts = []
         if weight_value and weight_value > 0:
@@ -497,8 +519,11 @@ async def items_update(
             item.shipping_info_text = " | ".join(shipping_parts)
         else:
             item.shipping_info_text = None
+        await set_stock(db, item.id, item.stock)
 
+    await bump_catalog_version(db)
     await db.commit()
+    catalog_cache.invalidate()
     return RedirectResponse(url="/admin/items", status_code=303)
 
 
@@ -512,6 +537,7 @@ async def add_codes(item_id: int, file: UploadFile = File(...), db: AsyncSession
         codes = [line.strip() for line in content.splitlines() if line.strip()]
         for c in codes:
             db.add(ItemCode(item_id=item.id, code=c))
+        await add_stock(db, item.id, len(codes))
         await db.commit()
         return JSONResponse({"ok": True, "added": len(codes)})
     except Exception:
@@ -521,30 +547,69 @@ async def add_codes(item_id: int, file: UploadFile = File(...), db: AsyncSession
 # upload_zip удалён
 
 
+# Размер страницы заказов: ?page_size=, не больше ORDERS_PAGE_SIZE_MAX
+ORDERS_PAGE_SIZE = 10
+ORDERS_PAGE_SIZE_MAX = 500
+
+
+def _orders_view_stmt():
+    """Заказы со всем, что показывает список, одним запросом: покупки заказа агрегируются LATERAL-подзапросом
+    (по индексу ix_purchases_order), товар одиночного заказа и покупатель — внешними JOIN"""
+    lines = (
+        select(
+            func.count(Purchase.id).label("purchases_count"),
+            func.string_agg(Item.title, aggregate_order_by(literal_column("', '"), Purchase.id)).label("titles"),
+            func.coalesce(func.bool_or(Purchase.delivery_fullname.is_not(None)), False).label("has_delivery_info"),
+        )
+        .select_from(Purchase)
+        .outerjoin(Item, Item.id == Purchase.item_id)
+        .where(Purchase.order_id == Order.id)
+        .lateral("lines")
+    )
+    order_item = aliased(Item)
+    return (
+        select(
+            Order,
+            lines.c.purchases_count,
+            func.coalesce(lines.c.titles, order_item.title).label("titles"),
+            lines.c.has_delivery_info,
+            User.username.label("buyer_username"),
+        )
+        .outerjoin(order_item, order_item.id == Order.item_id)
+        .outerjoin(User, User.id == Order.user_id)
+        .join(lines, true())
+    )
+
+
 @router.get("/orders")
-async def orders_list(request: Request, db: AsyncSession = Depends(get_db_session), _: None = Depends(ensure_auth), page: int = 1, q: str | None = None):
-    page_size = 10
+async def orders_list(request: Request, db: AsyncSession = Depends(get_db_session), _: None = Depends(ensure_auth), cursor: str | None = None, q: str | None = None, page_size: int = ORDERS_PAGE_SIZE):
+    page_size = max(1, min(page_size, ORDERS_PAGE_SIZE_MAX))
     # Убираем фильтр item_id.is_not(None), чтобы показывать корзинные заказы
-    stmt = select(Order)
+    stmt = _orders_view_stmt()
     if q:
         try:
-            stmt = stmt.where(Order.buyer_tg_id == str(int(q)))
+            buyer_filter = Order.buyer_tg_id == str(int(q))
         except Exception:
-            stmt = stmt.where(Order.buyer_tg_id == "__no__match__")
-    total = (await db.execute(select(func.count()).select_from(stmt.subquery()))).scalar_one()
-    orders = (await db.execute(stmt.order_by(Order.id.desc()).offset((page-1)*page_size).limit(page_size))).scalars().all()
-    
-    # Проверяем наличие данных доставки для каждого заказа
-    for order in orders:
-        purchase_with_delivery = (await db.execute(
-            select(Purchase).where(
-                Purchase.order_id == order.id,
-                Purchase.delivery_fullname.is_not(None)
-            ).limit(1)
-        )).scalar_one_or_none()
-        order.has_delivery_info = purchase_with_delivery is not None
-    
-    return templates.TemplateResponse("orders_list.html", {"request": request, "orders": orders, "page": page, "page_size": page_size, "total": total, "query": q})
+            buyer_filter = Order.buyer_tg_id == "__no__match__"
+        stmt = stmt.where(buyer_filter)
+        # Заказы одного покупателя — по индексу ix_orders_buyer_tg_id, считаем точно
+        total = (await db.execute(select(func.count()).select_from(Order).where(buyer_filter))).scalar_one()
+    else:
+        total = await estimated_count(db, Order)
+    page = await keyset_page(db, stmt, Order.id, cursor, page_size, scalars=False)
+    orders = []
+    for row in page.rows:
+        order = row[0]
+        order.purchases_count = row.purchases_count
+        order.titles = row.titles
+        order.has_delivery_info = row.has_delivery_info
+        order.buyer_username = row.buyer_username
+        orders.append(order)
+
+    return templates.TemplateResponse(
+        "orders_list.html",
+        {"request": request, "orders": orders, "page": page, "page_size": page_size, "total": total, "query": q},
+    )
 
 
 @router.get("/orders/{order_id}/delivery")
@@ -574,6 +639,7 @@ async def orders_delete(order_id: int, db: AsyncSession = Depends(get_db_session
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     # Удалим связанные покупки (на случай отсутствия каскада в БД)
+    await release_holds(db, order_id)
     await db.execute(delete(Purchase).where(Purchase.order_id == order_id))
     await db.delete(order)
     await db.commit()
@@ -585,6 +651,7 @@ async def orders_delete_form(order_id: int = Form(...), db: AsyncSession = Depen
     order = (await db.execute(select(Order).where(Order.id == int(order_id)))).scalar_one_or_none()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
+    await release_holds(db, int(order_id))
     await db.execute(delete(Purchase).where(Purchase.order_id == int(order_id)))
     await db.delete(order)
     await db.commit()
@@ -592,7 +659,7 @@ async def orders_delete_form(order_id: int = Form(...), db: AsyncSession = Depen
 
 
 @router.get("/users")
-async def users_list(request: Request, db: AsyncSession = Depends(get_db_session), _: None = Depends(ensure_auth), page: int = 1, q: str | None = None):
+async def users_list(request: Request, db: AsyncSession = Depends(get_db_session), _: None = Depends(ensure_auth), cursor: str | None = None, q: str | None = None):
     page_size = 10
     stmt = select(User)
     if q:
@@ -601,9 +668,85 @@ async def users_list(request: Request, db: AsyncSession = Depends(get_db_session
             stmt = stmt.where(User.tg_id == tg)
         except Exception:
             stmt = stmt.where(User.tg_id == -1)
-    total = (await db.execute(select(func.count()).select_from(stmt.subquery()))).scalar_one()
-    users = (await db.execute(stmt.order_by(User.id.desc()).offset((page-1)*page_size).limit(page_size))).scalars().all()
-    return templates.TemplateResponse("users_list.html", {"request": request, "users": users, "page": page, "page_size": page_size, "total": total, "query": q})
+        # tg_id уникален — не больше одной строки
+        total = (await db.execute(select(func.count()).select_from(stmt.subquery()))).scalar_one()
+    else:
+        total = await estimated_count(db, User)
+    page = await keyset_page(db, stmt, User.id, cursor, page_size)
+    return templates.TemplateResponse("users_list.html", {"request": request, "users": page.rows, "page": page, "total": total, "query": q})
+
+
+@router.get("/stock/check")
+async def stock_check(db: AsyncSession = Depends(get_db_session), _: None = Depends(ensure_auth)):
+    """Сверить счётчики остатков с item_codes и items.stock, ничего не меняя"""
+    drift = await check_stock(db)
+    return JSONResponse({"ok": not drift, "drift": drift})
+
+
+@router.post("/stock/rebuild")
+async def stock_rebuild(db: AsyncSession = Depends(get_db_session), _: None = Depends(ensure_auth)):
+    """Пересчитать разошедшиеся счётчики остатков по исходным строкам"""
+    drift = await check_stock(db, repair=True)
+    await db.commit()
+    return JSONResponse({"ok": True, "repaired": len(drift), "drift": drift})
+
+
+@router.get("/stats/check")
+async def stats_check(db: AsyncSession = Depends(get_db_session), _: None = Depends(ensure_auth)):
+    """Сверить итоги daily_stats с users и orders, ничего не меняя"""
+    drift = await stats_service.check_drift(db)
+    return JSONResponse({"ok": not drift, "drift": drift})
+
+
+@router.post("/stats/rebuild")
+async def stats_rebuild(db: AsyncSession = Depends(get_db_session), _: None = Depends(ensure_auth)):
+    """Пересобрать daily_stats по исходным таблицам"""
+    rows = await stats_service.backfill(db)
+    await db.commit()
+    return JSONResponse({"ok": True, "rows": rows})
+
+
+@router.post("/texts/reload")
+async def texts_reload(_: None = Depends(ensure_auth)):
+    """Принудительно перечитать texts.yml"""
+    try:
+        catalog = reload_texts(force=True)
+    except (OSError, TextsError, ValueError) as e:
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=400)
+    return RedirectResponse(url=f"/admin/?texts_version={catalog.version}", status_code=303)
+
+
+@router.get("/broadcasts")
+async def broadcasts_list(request: Request, db: AsyncSession = Depends(get_db_session), _: None = Depends(ensure_auth)):
+    broadcasts = (await db.execute(select(Broadcast).order_by(Broadcast.id.desc()).limit(20))).scalars().all()
+    audience = (await db.execute(select(func.count()).select_from(User).where(User.blocked_at.is_(None)))).scalar_one()
+    return templates.TemplateResponse("broadcasts.html", {"request": request, "broadcasts": broadcasts, "audience": audience})
+
+
+@router.post("/broadcasts")
+async def broadcasts_create(text: str = Form(...), _: None = Depends(ensure_auth)):
+    text = text.strip()
+    if not text:
+        raise HTTPException(status_code=400, detail="Пустой текст рассылки")
+    await BroadcastService(global_bot).create(text, created_by=settings.admin_username or None)
+    return RedirectResponse(url="/admin/broadcasts", status_code=303)
+
+
+@router.post("/broadcasts/{broadcast_id}/{action}")
+async def broadcasts_control(broadcast_id: int, action: str, _: None = Depends(ensure_auth)):
+    statuses = {"pause": BroadcastStatus.PAUSED, "resume": BroadcastStatus.RUNNING, "cancel": BroadcastStatus.CANCELLED}
+    if action not in statuses:
+        raise HTTPException(status_code=404, detail="Unknown action")
+    await BroadcastService(global_bot).set_status(broadcast_id, statuses[action])
+    return RedirectResponse(url="/admin/broadcasts", status_code=303)
+
+
+@router.get("/broadcasts/{broadcast_id}/progress")
+async def broadcasts_progress(broadcast_id: int, _: None = Depends(ensure_auth)):
+    progress = await broadcast_progress(broadcast_id)
+    if progress is None:
+        return JSONResponse({"ok": False, "error": "Рассылка не найдена"}, status_code=404)
+    return JSONResponse({"ok": True, "progress": progress})
 
 
 @router.post("/items/{item_id}/delete")
@@ -629,7 +772,9 @@ async def items_delete(item_id: int, db: AsyncSession = Depends(get_db_session),
     except Exception:
         pass
     await db.delete(item)
+    await bump_catalog_version(db)
     await db.commit()
+    catalog_cache.invalidate()
     return RedirectResponse(url="/admin/items", status_code=303)
 
 
@@ -641,5 +786,7 @@ async def items_toggle_visibility(item_id: int, db: AsyncSession = Depends(get_d
         raise HTTPException(status_code=404, detail="Item not found")
     item.is_visible = not item.is_visible
     db.add(item)
+    await bump_catalog_version(db)
     await db.commit()
+    catalog_cache.invalidate()
     return RedirectResponse(url="/admin/items", status_code=303)
@@ -1,8 +1,54 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 
-router = APIRouter(prefix="/health", tags=["health"]) 
+from app.routers.admin import ensure_auth
+
+router = APIRouter(prefix="/health", tags=["health"])
 
 
 @router.get("/")
 async def healthcheck() -> dict:
     return {"status": "ok"}
+
+
+@router.get("/metrics")
+async def metrics(_: None = Depends(ensure_auth)) -> dict:
+    from app.config import settings
+    from bot.webhook_app import (  # local import to avoid circular deps
+        update_queue, update_dedup, skipped_update_types, peek_fallbacks, send_scheduler, dp,
+    )
+    from bot.durable_queue import durable_queue_stats
+    from bot.user_middleware import user_cache
+    from app.services.media_cache import media_cache
+    from app.services.catalog import catalog_cache
+    from bot.keyboards import keyboard_cache_stats
+    from app.services.orders import create_order_latency
+    from app.services.yookassa import yookassa_stats
+    from app.services import reconciler, outbox, stock
+    from app.routers.payments import webhook_latency
+
+    data = {
+        "telegram_updates": update_queue.stats(),
+        "telegram_skipped_types": dict(skipped_update_types),
+        "telegram_peek_fallbacks": dict(peek_fallbacks),
+        "telegram_send": send_scheduler.stats(),
+        "media_cache": media_cache.stats(),
+        "catalog_cache": catalog_cache.stats(),
+        "user_cache": user_cache.stats(),
+        "keyboard_cache": keyboard_cache_stats(),
+        "orders_create_seconds": create_order_latency.snapshot(),
+        "yookassa": yookassa_stats(),
+        "yookassa_webhook_seconds": webhook_latency.snapshot(),
+    }
+    if reconciler.reconciler is not None:
+        data["reconciler"] = reconciler.reconciler.stats()
+    if outbox.outbox_dispatcher is not None:
+        data["outbox"] = outbox.outbox_dispatcher.stats()
+    if stock.hold_sweeper is not None:
+        data["stock_holds"] = stock.hold_sweeper.stats()
+    if update_dedup is not None:
+        data["telegram_dedup"] = update_dedup.stats()
+    if hasattr(dp.storage, "stats"):
+        data["fsm_storage"] = dp.storage.stats()
+    if settings.tg_update_mode == "durable":
+        data["telegram_durable_queue"] = await durable_queue_stats()
+    return data
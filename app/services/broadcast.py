@@ -0,0 +1,283 @@
+"""
+Рассылка сообщений всем пользователям бота с возобновлением после сбоя
+"""
+import asyncio
+import contextlib
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+from loguru import logger
+from sqlalchemy import select, update, func, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models import Broadcast, BroadcastDelivery, BroadcastStatus, User
+from bot.send_scheduler import SendPriority, send_priority
+
+DELIVERED = "delivered"
+BLOCKED = "blocked"
+FAILED = "failed"
+
+# Если исполнитель не обновлял пульс дольше этого, рассылку может подхватить другой процесс
+STALE_AFTER = timedelta(seconds=60)
+# Как часто исполнитель обновляет пульс, независимо от того, сколько идёт пачка
+HEARTBEAT_EVERY = STALE_AFTER / 4
+
+# Рассылки, которые выполняются в этом процессе, и их недавняя скорость
+_tasks: Dict[int, asyncio.Task] = {}
+_samples: Dict[int, Deque[tuple[float, int]]] = {}
+
+
+def _observe(broadcast_id: int, processed: int) -> None:
+    samples = _samples.setdefault(broadcast_id, deque(maxlen=64))
+    samples.append((time.monotonic(), processed))
+
+
+def _rate(broadcast_id: int, window: float = 10.0) -> float:
+    """Сообщений в секунду за последние window секунд"""
+    samples = _samples.get(broadcast_id)
+    if not samples:
+        return 0.0
+    border = time.monotonic() - window
+    recent = [(t, n) for t, n in samples if t >= border]
+    if not recent:
+        return 0.0
+    span = max(time.monotonic() - recent[0][0], 1.0)
+    return round(sum(n for _, n in recent) / span, 2)
+
+
+class BroadcastService:
+    def __init__(self, bot: Bot) -> None:
+        self.bot = bot
+
+    async def create(self, text: str, created_by: Optional[str] = None) -> Broadcast:
+        """Создать рассылку и сразу запустить её"""
+        async with AsyncSessionLocal() as db:
+            total = (await db.execute(
+                select(func.count()).select_from(User).where(User.blocked_at.is_(None))
+            )).scalar_one()
+            broadcast = Broadcast(text=text, created_by=created_by, total=total, status=BroadcastStatus.RUNNING)
+            db.add(broadcast)
+            await db.commit()
+            await db.refresh(broadcast)
+        logger.bind(event="broadcast.created", broadcast_id=broadcast.id, total=total).info("Рассылка создана")
+        self.start(broadcast.id)
+        return broadcast
+
+    def start(self, broadcast_id: int) -> bool:
+        """Запустить исполнителя в этом процессе, если он ещё не запущен"""
+        task = _tasks.get(broadcast_id)
+        if task is not None and not task.done():
+            return False
+        _tasks[broadcast_id] = asyncio.create_task(self._run(broadcast_id))
+        return True
+
+    async def set_status(self, broadcast_id: int, status: str) -> None:
+        """Пауза, отмена или возобновление; исполнитель заметит смену статуса на следующей пачке"""
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.status.notin_([BroadcastStatus.FINISHED, BroadcastStatus.CANCELLED]))
+                .values(status=status)
+            )
+            await db.commit()
+        if status == BroadcastStatus.RUNNING:
+            self.start(broadcast_id)
+
+    async def resume_all(self) -> int:
+        """Подхватить рассылки, прерванные перезапуском или падением процесса"""
+        border = datetime.utcnow() - STALE_AFTER
+        async with AsyncSessionLocal() as db:
+            ids = (await db.execute(
+                select(Broadcast.id).where(
+                    Broadcast.status == BroadcastStatus.RUNNING,
+                    or_(Broadcast.heartbeat_at.is_(None), Broadcast.heartbeat_at < border),
+                )
+            )).scalars().all()
+        for broadcast_id in ids:
+            logger.bind(event="broadcast.resume", broadcast_id=broadcast_id).info("Возобновление рассылки")
+            self.start(broadcast_id)
+        return len(ids)
+
+    async def _claim(self, broadcast_id: int) -> Optional[tuple[str, int]]:
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(
+                update(Broadcast)
+                .where(
+                    Broadcast.id == broadcast_id,
+                    Broadcast.status == BroadcastStatus.RUNNING,
+                    or_(Broadcast.heartbeat_at.is_(None), Broadcast.heartbeat_at < now - STALE_AFTER),
+                )
+                .values(heartbeat_at=now, started_at=func.coalesce(Broadcast.started_at, now))
+                .returning(Broadcast.text, Broadcast.last_user_id)
+            )).one_or_none()
+            await db.commit()
+        return (row[0], row[1]) if row else None
+
+    async def _release(self, broadcast_id: int) -> None:
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(Broadcast).where(Broadcast.id == broadcast_id).values(heartbeat_at=None))
+            await db.commit()
+
+    async def _run(self, broadcast_id: int) -> None:
+        claimed = await self._claim(broadcast_id)
+        if claimed is None:
+            return
+        text, cursor = claimed
+        log = logger.bind(event="broadcast.run", broadcast_id=broadcast_id)
+        log.info("Рассылка запущена с пользователя id>{}", cursor)
+        heartbeat = asyncio.create_task(self._heartbeat(broadcast_id))
+        try:
+            while True:
+                async with AsyncSessionLocal() as db:
+                    users = (await db.execute(
+                        select(User.id, User.tg_id)
+                        .where(User.id > cursor, User.blocked_at.is_(None))
+                        .order_by(User.id)
+                        .limit(settings.broadcast_batch_size)
+                    )).all()
+                if not users:
+                    await self._finish(broadcast_id)
+                    log.info("Рассылка завершена")
+                    return
+                step = max(1, settings.broadcast_concurrency)
+                for start in range(0, len(users), step):
+                    chunk = users[start:start + step]
+                    results = await asyncio.gather(*(self._send_one(tg_id, text) for _, tg_id in chunk))
+                    cursor = chunk[-1][0]
+                    status = await self._record(broadcast_id, cursor, [(uid, res) for (uid, _), res in zip(chunk, results)])
+                    _observe(broadcast_id, len(chunk))
+                    if status != BroadcastStatus.RUNNING:
+                        log.info("Рассылка остановлена: {}", status)
+                        return
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("Ошибка рассылки, она остановлена; продолжить можно из админки")
+            try:
+                await self._fail(broadcast_id)
+            except Exception:
+                log.exception("Не удалось отметить рассылку остановленной")
+        finally:
+            heartbeat.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await heartbeat
+            try:
+                await self._release(broadcast_id)
+            except Exception:
+                pass
+            _tasks.pop(broadcast_id, None)
+
+    async def _heartbeat(self, broadcast_id: int) -> None:
+        """Обновлять пульс, пока идёт рассылка: пачка под RetryAfter может идти дольше STALE_AFTER"""
+        while True:
+            await asyncio.sleep(HEARTBEAT_EVERY.total_seconds())
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(Broadcast)
+                        .where(Broadcast.id == broadcast_id, Broadcast.status == BroadcastStatus.RUNNING)
+                        .values(heartbeat_at=datetime.utcnow())
+                    )
+                    await db.commit()
+            except Exception as e:
+                logger.bind(event="broadcast.heartbeat_error", broadcast_id=broadcast_id).warning(
+                    "Не удалось обновить пульс рассылки: {}", e
+                )
+
+    async def _fail(self, broadcast_id: int) -> None:
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.status == BroadcastStatus.RUNNING)
+                .values(status=BroadcastStatus.FAILED)
+            )
+            await db.commit()
+
+    async def _send_one(self, tg_id: int, text: str) -> tuple[str, Optional[str]]:
+        try:
+            with send_priority(SendPriority.BROADCAST):
+                await self.bot.send_message(tg_id, text)
+            return DELIVERED, None
+        except TelegramForbiddenError as e:
+            return BLOCKED, str(e)[:255]
+        except TelegramBadRequest as e:
+            # Удалённый аккаунт или чат, который больше недоступен, — писать туда бессмысленно
+            if "chat not found" in str(e).lower() or "user is deactivated" in str(e).lower():
+                return BLOCKED, str(e)[:255]
+            return FAILED, str(e)[:255]
+        except Exception as e:
+            return FAILED, str(e)[:255]
+
+    async def _record(self, broadcast_id: int, cursor: int, results: list) -> str:
+        """Сохранить итоги пачки и курсор одной транзакцией, вернуть актуальный статус рассылки"""
+        now = datetime.utcnow()
+        counts = {DELIVERED: 0, BLOCKED: 0, FAILED: 0}
+        for _, (status, _) in results:
+            counts[status] += 1
+        blocked_ids = [uid for uid, (status, _) in results if status == BLOCKED]
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                pg_insert(BroadcastDelivery)
+                .values([
+                    {"broadcast_id": broadcast_id, "user_id": uid, "status": status, "error": error, "created_at": now}
+                    for uid, (status, error) in results
+                ])
+                .on_conflict_do_nothing(constraint="uq_broadcast_delivery_user")
+            )
+            if blocked_ids:
+                await db.execute(update(User).where(User.id.in_(blocked_ids)).values(blocked_at=now))
+            status = (await db.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id)
+                .values(
+                    last_user_id=cursor,
+                    delivered=Broadcast.delivered + counts[DELIVERED],
+                    blocked=Broadcast.blocked + counts[BLOCKED],
+                    failed=Broadcast.failed + counts[FAILED],
+                    heartbeat_at=now,
+                )
+                .returning(Broadcast.status)
+            )).scalar_one()
+            await db.commit()
+        return status
+
+    async def _finish(self, broadcast_id: int) -> None:
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.status == BroadcastStatus.RUNNING)
+                .values(status=BroadcastStatus.FINISHED, finished_at=datetime.utcnow())
+            )
+            await db.commit()
+
+
+async def broadcast_progress(broadcast_id: int) -> Optional[dict]:
+    """Состояние рассылки для админки и бота"""
+    async with AsyncSessionLocal() as db:
+        b = (await db.execute(select(Broadcast).where(Broadcast.id == broadcast_id))).scalar_one_or_none()
+    if b is None:
+        return None
+    processed = b.delivered + b.blocked + b.failed
+    rate = _rate(broadcast_id)
+    remaining = max(b.total - processed, 0)
+    return {
+        "id": b.id,
+        "status": b.status,
+        "total": b.total,
+        "processed": processed,
+        "delivered": b.delivered,
+        "blocked": b.blocked,
+        "failed": b.failed,
+        "percent": round(processed * 100 / b.total, 1) if b.total else 100.0,
+        "rate_per_sec": rate,
+        "eta_seconds": round(remaining / rate) if rate else None,
+        "started_at": b.started_at.isoformat() if b.started_at else None,
+        "finished_at": b.finished_at.isoformat() if b.finished_at else None,
+    }
@@ -0,0 +1,263 @@
+"""
+Кэш каталога в памяти процесса: листание витрины и карточки товаров не обращаются к таблице items.
+
+Снимок каталога перечитывается целиком, когда:
+- админка сбросила кэш своего процесса (invalidate() после commit);
+- изменилась версия каталога в БД (bump_catalog_version() в транзакции правки) — её каждый процесс
+  сверяет запросом по ключу не чаще раза в CATALOG_VERSION_CHECK секунд;
+- снимок старше CATALOG_CACHE_TTL.
+"""
+import asyncio
+import bisect
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import exists, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models import CATALOG_VERSION_ID, CartItem, CatalogVersion, Item, ItemType, Purchase
+from app.utils.pagination import AFTER, BEFORE, Page, decode_cursor, encode_cursor
+
+_MAX_PAGES = 1024
+
+
+class CatalogItem(NamedTuple):
+    """Неизменяемая копия строки items с полями, которые нужны витрине и карточке"""
+    id: int
+    title: str
+    description: str
+    price_minor: int
+    item_type: ItemType
+    image_file_id: Optional[str]
+    delivery_type: Optional[str]
+    is_visible: bool
+
+    @classmethod
+    def from_item(cls, item: Item) -> "CatalogItem":
+        return cls(
+            id=item.id,
+            title=item.title,
+            description=item.description,
+            price_minor=item.price_minor,
+            item_type=item.item_type,
+            image_file_id=item.image_file_id,
+            delivery_type=item.delivery_type,
+            is_visible=item.is_visible,
+        )
+
+
+class _Snapshot:
+    """Все товары по id и видимые товары каждого типа по убыванию id; страницы считаются один раз на снимок"""
+
+    def __init__(self, version: int, items: Iterable[CatalogItem], shared_version: int = 0) -> None:
+        self.version = version
+        # Версия каталога в БД, с которой прочитан снимок
+        self.shared_version = shared_version
+        self.loaded_at = self.checked_at = time.monotonic()
+        self.stale = False
+        self.by_id: Dict[int, CatalogItem] = {}
+        self.by_type: Dict[ItemType, Tuple[CatalogItem, ...]] = {}
+        grouped: Dict[ItemType, List[CatalogItem]] = {}
+        for item in sorted(items, key=lambda it: it.id, reverse=True):
+            self.by_id[item.id] = item
+            if item.is_visible:
+                grouped.setdefault(item.item_type, []).append(item)
+        self.by_type = {item_type: tuple(rows) for item_type, rows in grouped.items()}
+        # -id по возрастанию для bisect
+        self._keys = {item_type: [-it.id for it in rows] for item_type, rows in self.by_type.items()}
+        self._pages: Dict[Tuple[ItemType, str, int], Page] = {}
+
+    def page(self, item_type: ItemType, cursor: Optional[str], page_size: int) -> Page:
+        key = (item_type, cursor or "", page_size)
+        page = self._pages.get(key)
+        if page is None:
+            if len(self._pages) >= _MAX_PAGES:
+                # Курсоры приходят из callback_data — не даём произвольным значениям раздувать снимок
+                self._pages.clear()
+            page = self._pages[key] = self._slice(item_type, cursor, page_size)
+        return page
+
+    def _slice(self, item_type: ItemType, cursor: Optional[str], page_size: int) -> Page:
+        """Та же страница, что вернул бы keyset_page() по Item.id, и совместимые с ним курсоры"""
+        rows = self.by_type.get(item_type, ())
+        keys = self._keys.get(item_type, [])
+        decoded = decode_cursor(cursor)
+        if decoded and decoded[0] == BEFORE:
+            # Назад — только товары новее курсора, даже если их меньше страницы (как у keyset_page)
+            stop = bisect.bisect_left(keys, -decoded[1])
+            start = max(0, stop - page_size)
+        else:
+            start = bisect.bisect_right(keys, -decoded[1]) if decoded else 0
+            stop = start + page_size
+        chunk = list(rows[start:stop])
+        if not chunk and decoded:
+            return self._slice(item_type, None, page_size)
+        end = start + len(chunk)
+        return Page(
+            rows=chunk,
+            next_cursor=encode_cursor(AFTER, chunk[-1].id) if end < len(rows) else None,
+            prev_cursor=encode_cursor(BEFORE, chunk[0].id) if start > 0 else None,
+        )
+
+
+async def bump_catalog_version(db: AsyncSession) -> None:
+    """Каталог изменён в транзакции db: увеличить версию для кэшей остальных процессов (вызывать до commit)"""
+    stmt = pg_insert(CatalogVersion).values(id=CATALOG_VERSION_ID, version=1, updated_at=datetime.utcnow())
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[CatalogVersion.id],
+        set_={"version": CatalogVersion.version + 1, "updated_at": stmt.excluded.updated_at},
+    ))
+
+
+async def _shared_version(db: AsyncSession) -> int:
+    return await db.scalar(select(CatalogVersion.version).where(CatalogVersion.id == CATALOG_VERSION_ID)) or 0
+
+
+class CatalogCache:
+    def __init__(self) -> None:
+        self.version = 0
+        self._snapshot: Optional[_Snapshot] = None
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.version_checks = 0
+
+    def invalidate(self) -> None:
+        """Каталог изменился — следующий запрос этого процесса перечитает его (вызывать после commit).
+
+        Остальные процессы узнают о правке по версии, которую bump_catalog_version() увеличил в той же транзакции.
+        """
+        self.version += 1
+        self.invalidations += 1
+
+    def _fresh(self, snapshot: Optional[_Snapshot]) -> bool:
+        return (
+            snapshot is not None
+            and not snapshot.stale
+            and snapshot.version == self.version
+            and time.monotonic() - snapshot.loaded_at < settings.catalog_cache_ttl
+        )
+
+    async def _check_shared_version(self, snapshot: _Snapshot) -> None:
+        """Не чаще раза в CATALOG_VERSION_CHECK секунд сверить версию каталога в БД; изменилась — снимок устарел"""
+        now = time.monotonic()
+        if now - snapshot.checked_at < settings.catalog_version_check:
+            return
+        # Отметка до запроса: одновременные запросы процесса не сверяют версию каждый сам
+        snapshot.checked_at = now
+        self.version_checks += 1
+        try:
+            async with AsyncSessionLocal() as db:
+                shared = await _shared_version(db)
+        except Exception as e:
+            # Витрина продолжает работать по снимку; не позже CATALOG_CACHE_TTL он перечитается
+            logger.bind(event="catalog_cache.version_error").warning("Не удалось сверить версию каталога: {}", e)
+            return
+        if shared != snapshot.shared_version:
+            snapshot.stale = True
+
+    async def _get(self) -> _Snapshot:
+        snapshot = self._snapshot
+        if self._fresh(snapshot):
+            await self._check_shared_version(snapshot)
+            if self._fresh(snapshot):
+                self.hits += 1
+                return snapshot
+        async with self._lock:
+            # Пока ждали блокировку, снимок мог перечитать другой запрос
+            if self._fresh(self._snapshot):
+                self.hits += 1
+                return self._snapshot
+            self.misses += 1
+            version = self.version
+            async with AsyncSessionLocal() as db:
+                # Версия читается до товаров: правка между двумя запросами приведёт к лишнему перечитыванию, а не к устаревшему снимку
+                shared = await _shared_version(db)
+                items = (await db.execute(select(Item))).scalars().all()
+            snapshot = _Snapshot(version, (CatalogItem.from_item(item) for item in items), shared)
+            self._snapshot = snapshot
+            logger.bind(event="catalog_cache.load", version=version, shared_version=shared).debug(
+                "Каталог перечитан: {} товаров", len(snapshot.by_id)
+            )
+            return snapshot
+
+    async def page(self, item_type: ItemType, cursor: Optional[str] = None, page_size: int = 5) -> Page:
+        """Страница видимых товаров типа по убыванию id"""
+        return (await self._get()).page(item_type, cursor, page_size)
+
+    async def get(self, item_id: int) -> Optional[CatalogItem]:
+        """Товар по id, в том числе скрытый (карточка купленного товара)"""
+        return (await self._get()).by_id.get(item_id)
+
+    async def get_many(self, item_ids: Iterable[int]) -> List[CatalogItem]:
+        """Товары в порядке первого упоминания, без повторов и без удалённых"""
+        snapshot = await self._get()
+        seen = set()
+        items = []
+        for item_id in item_ids:
+            item = snapshot.by_id.get(item_id)
+            if item is not None and item_id not in seen:
+                seen.add(item_id)
+                items.append(item)
+        return items
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "version": self.version,
+            "shared_version": snapshot.shared_version if snapshot else None,
+            "items": len(snapshot.by_id) if snapshot else 0,
+            "age_seconds": round(time.monotonic() - snapshot.loaded_at, 1) if snapshot else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "version_checks": self.version_checks,
+        }
+
+
+catalog_cache = CatalogCache()
+
+
+class ItemCard(NamedTuple):
+    """Данные карточки товара в боте: товар и его состояние для пользователя"""
+    item: CatalogItem
+    purchased: bool
+    in_cart: bool
+
+    @property
+    def caption(self) -> str:
+        item = self.item
+        caption = (
+            f"*{item.title}*\n\n"
+            f"{item.description}\n\n"
+            f"💰 Цена: `{item.price_minor/100:.2f}` ₽"
+        )
+        if self.purchased:
+            caption += "\n\n✅ _Вы уже покупали этот товар_"
+        return caption
+
+
+async def load_item_card(item_id: int, user_id: Optional[int], in_cart: Optional[bool] = None) -> Optional[ItemCard]:
+    """Карточка товара: товар из кэша каталога, «куплен» и «в корзине» для users.id — одним запросом.
+
+    in_cart передаёт обработчик, который только что сам изменил корзину; без пользователя оба признака ложны.
+    """
+    item = await catalog_cache.get(item_id)
+    if item is None:
+        return None
+    if user_id is None:
+        return ItemCard(item, False, False)
+    purchased = exists().where(Purchase.user_id == user_id, Purchase.item_id == item_id)
+    if in_cart is not None:
+        stmt = select(purchased)
+    else:
+        stmt = select(purchased, exists().where(CartItem.user_id == user_id, CartItem.item_id == item_id))
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(stmt)).one()
+    return ItemCard(item, row[0], row[1] if in_cart is None else in_cart)
@@ -1,11 +1,18 @@
 from typing import Optional
 from pathlib import Path
 from aiogram import Bot
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from app.models import Item, ItemType
-from app.utils.texts import load_texts
+from app.utils.texts import texts_catalog
 from app.config import settings
+from app.db.session import AsyncSessionLocal
+from app.services.media_cache import media_cache
+from bot.send_scheduler import SendPriority, send_priority
+
+# Ошибки выдачи файла, которые повтор не исправит: неверный file_id, файла нет или он недоступен
+_FILE_ERRORS = (TelegramBadRequest, FileNotFoundError, PermissionError)
 
 
 class DeliveryService:
@@ -13,38 +20,57 @@ class DeliveryService:
         self.bot = bot
 
     async def deliver(self, chat_id: int, item: Item) -> None:
-        texts_all = load_texts()
-        texts = texts_all.get("delivery", {})
-        main_menu_text = texts_all.get("buttons", {}).get("main_menu", "Главное меню")
+        # Выдача оплаченного товара обгоняет остальные отправки при упоре в лимиты Telegram
+        with send_priority(SendPriority.DELIVERY):
+            await self._deliver(chat_id, item)
+
+    async def _deliver(self, chat_id: int, item: Item) -> None:
+        texts = texts_catalog()
+        main_menu_text = texts.text("buttons.main_menu", "Главное меню")
         kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=main_menu_text, callback_data="back:main")]])
         if item.item_type == ItemType.SERVICE:
             # Приоритет: CONTACT_ADMIN из окружения -> поле товара -> фраза по умолчанию
             contact = settings.contact_admin or item.service_admin_contact or "администратору"
             await self.bot.send_message(
                 chat_id,
-                texts.get("service", "Спасибо за покупку! Чтобы получить услугу — напишите {contact}.").format(contact=contact),
+                texts.render("delivery.service", "Спасибо за покупку! Чтобы получить услугу — напишите {contact}.", contact=contact),
                 reply_markup=kb,
             )
             return
 
         if item.item_type == ItemType.DIGITAL:
             if item.digital_file_path:
-                # Пробуем отправить файл как документ: сначала локальный путь, иначе как file_id
+                # Пробуем отправить файл как документ: сначала локальный путь, иначе как file_id.
+                # Сетевые ошибки, RetryAfter и 5xx не перехватываются — outbox повторит выдачу
                 try:
-                    file_source = FSInputFile(item.digital_file_path) if Path(item.digital_file_path).is_file() else item.digital_file_path
+                    file_source = await media_cache.resolve(item.digital_file_path) if Path(item.digital_file_path).is_file() else item.digital_file_path
                     await self.bot.send_document(chat_id, file_source, reply_markup=kb)
-                except Exception:
-                    await self.bot.send_message(
-                        chat_id,
-                        texts.get("digital_fallback", "Файл будет отправлен администратором. Спасибо за покупку!"),
-                        reply_markup=kb,
-                    )
+                    return
+                except _FILE_ERRORS as e:
+                    reason = str(e)
             else:
-                # Путь не указан — сообщаем пользователю, что файл пришлёт администратор
-                await self.bot.send_message(
-                    chat_id,
-                    texts.get("digital_fallback", "Файл будет отправлен администратором. Спасибо за покупку!"),
-                    reply_markup=kb,
-                )
+                reason = "у товара не указан файл"
+            # Сообщаем пользователю, что файл пришлёт администратор, и ставим администратору задачу
+            await self.bot.send_message(
+                chat_id,
+                texts.text("delivery.digital_fallback", "Файл будет отправлен администратором. Спасибо за покупку!"),
+                reply_markup=kb,
+            )
+            await self._notify_admin(chat_id, item, reason)
             return
 
+    async def _notify_admin(self, chat_id: int, item: Item, reason: str) -> None:
+        if not settings.admin_chat_id:
+            return
+        # Локальный импорт: outbox сам импортирует DeliveryService
+        from app.services.outbox import enqueue_message, wake_outbox
+        text = (
+            "⚠️ Файл не выдан автоматически — отправьте его вручную\n"
+            f"Товар: {item.title} (id={item.id})\n"
+            f"Покупатель: {chat_id}\n"
+            f"Причина: {reason}"
+        )
+        async with AsyncSessionLocal() as db:
+            enqueue_message(db, int(settings.admin_chat_id), text)
+            await db.commit()
+        wake_outbox()
@@ -0,0 +1,195 @@
+"""
+Кэш file_id Telegram для отправляемых файлов: файл загружается один раз и переиспользуется
+"""
+import asyncio
+import hashlib
+import os
+from datetime import datetime
+from typing import Dict, Optional, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import FSInputFile, InputMedia, Message
+from loguru import logger
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.db.session import AsyncSessionLocal
+from app.models import StoredFile
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _message_file(message: Message) -> Optional[tuple[str, str]]:
+    """file_id и тип содержимого из отправленного сообщения"""
+    if message.photo:
+        return message.photo[-1].file_id, "image/jpeg"
+    for attr in ("document", "video", "animation", "audio", "voice"):
+        media = getattr(message, attr, None)
+        if media is not None:
+            return media.file_id, getattr(media, "mime_type", None) or attr
+    return None
+
+
+class _Entry:
+    __slots__ = ("mtime_ns", "size", "content_hash", "file_id")
+
+    def __init__(self, mtime_ns: int, size: int, content_hash: str, file_id: Optional[str]) -> None:
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.content_hash = content_hash
+        self.file_id = file_id
+
+
+class MediaCache(BaseRequestMiddleware):
+    """Подменяет локальные файлы на сохранённые file_id.
+
+    resolve(path) возвращает file_id, если файл уже загружался и с тех пор не менялся
+    (сверяется sha256 содержимого, пересчитывается только при смене mtime/размера), иначе
+    FSInputFile. Как middleware сессии бота кэш сам запоминает file_id из ответа Telegram
+    на отправку файла, полученного через resolve(), — в обработчиках достаточно заменить
+    FSInputFile(path) на await media_cache.resolve(path). Соответствия хранятся в таблице files.
+    """
+
+    def __init__(self) -> None:
+        self._entries: Dict[str, _Entry] = {}
+        self._by_file_id: Dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+        self.uploads = 0
+        self.invalidated = 0
+
+    async def resolve(self, path: str) -> Union[str, FSInputFile]:
+        path = str(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return FSInputFile(path)
+        entry = self._entries.get(path)
+        if entry is None or entry.mtime_ns != st.st_mtime_ns or entry.size != st.st_size:
+            content_hash = await asyncio.to_thread(_hash_file, path)
+            if entry is not None and entry.content_hash == content_hash:
+                entry.mtime_ns, entry.size = st.st_mtime_ns, st.st_size
+            else:
+                entry = _Entry(st.st_mtime_ns, st.st_size, content_hash, await self._load(path, content_hash))
+                self._entries[path] = entry
+                if entry.file_id:
+                    self._by_file_id[entry.file_id] = path
+        if entry.file_id:
+            self.hits += 1
+            return entry.file_id
+        self.misses += 1
+        return FSInputFile(path)
+
+    async def _load(self, path: str, content_hash: str) -> Optional[str]:
+        try:
+            async with AsyncSessionLocal() as db:
+                row = (await db.execute(
+                    select(StoredFile.tg_file_id, StoredFile.content_hash).where(StoredFile.path == path)
+                )).one_or_none()
+        except Exception as e:
+            logger.bind(event="media_cache.load_error", path=path).warning("Не удалось прочитать кэш файлов: {}", e)
+            return None
+        if row and row[1] == content_hash:
+            return row[0]
+        return None
+
+    async def remember(self, path: str, file_id: str, mime_type: Optional[str] = None) -> None:
+        entry = self._entries.get(path)
+        if entry is None:
+            return
+        if entry.file_id:
+            self._by_file_id.pop(entry.file_id, None)
+        entry.file_id = file_id
+        self._by_file_id[file_id] = path
+        self.uploads += 1
+        try:
+            async with AsyncSessionLocal() as db:
+                stmt = pg_insert(StoredFile).values(
+                    path=path,
+                    tg_file_id=file_id,
+                    mime_type=mime_type,
+                    content_hash=entry.content_hash,
+                    updated_at=datetime.utcnow(),
+                )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[StoredFile.path],
+                    set_={
+                        "tg_file_id": stmt.excluded.tg_file_id,
+                        "mime_type": stmt.excluded.mime_type,
+                        "content_hash": stmt.excluded.content_hash,
+                        "updated_at": stmt.excluded.updated_at,
+                    },
+                )
+                await db.execute(stmt)
+                await db.commit()
+        except Exception as e:
+            logger.bind(event="media_cache.save_error", path=path).warning("Не удалось сохранить file_id: {}", e)
+
+    async def forget(self, path: str) -> None:
+        """Сбросить file_id (например, Telegram перестал его принимать) — при следующей отправке файл загрузится заново"""
+        entry = self._entries.pop(path, None)
+        if entry is not None and entry.file_id:
+            self._by_file_id.pop(entry.file_id, None)
+        self.invalidated += 1
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(delete(StoredFile).where(StoredFile.path == path))
+                await db.commit()
+        except Exception as e:
+            logger.bind(event="media_cache.save_error", path=path).warning("Не удалось сбросить file_id: {}", e)
+
+    @staticmethod
+    def _inputs(method: TelegramMethod) -> list:
+        values = []
+        for name in type(method).model_fields:
+            value = getattr(method, name, None)
+            if isinstance(value, InputMedia):
+                value = value.media
+            if isinstance(value, (FSInputFile, str)):
+                values.append(value)
+        return values
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        inputs = self._inputs(method)
+        uploads = [v.path for v in inputs if isinstance(v, FSInputFile) and str(v.path) in self._entries]
+        cached = [self._by_file_id[v] for v in inputs if isinstance(v, str) and v in self._by_file_id]
+        try:
+            response = await make_request(bot, method)
+        except TelegramBadRequest as e:
+            # Сохранённый file_id больше не принимается — следующая отправка загрузит файл заново
+            if "file" in str(e).lower():
+                for path in cached:
+                    await self.forget(path)
+            raise
+        if len(uploads) == 1 and isinstance(response.result, Message):
+            found = _message_file(response.result)
+            if found:
+                await self.remember(str(uploads[0]), *found)
+        return response
+
+    def stats(self) -> dict:
+        return {
+            "files": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "uploads": self.uploads,
+            "invalidated": self.invalidated,
+        }
+
+
+media_cache = MediaCache()
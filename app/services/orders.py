@@ -0,0 +1,214 @@
+"""
+Создание заказа и платежа в ЮKassa; вызывается и из HTTP-маршрута /orders/, и из бота напрямую
+"""
+import time
+import uuid
+from typing import Any, Dict, Iterable, Optional
+
+from loguru import logger
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models import Item, Order, PaymentMethod, Purchase, User, OrderStatus
+from app.schemas.orders import CreateOrderRequest, CreateOrderResponse
+from app.services.stats import record_checkout
+from app.services.stock import OutOfStock, hold_stock, release_holds
+from app.services.yookassa import YooKassaClient, YooKassaUnavailable
+from app.utils.metrics import LatencyStats
+from app.utils.texts import texts_catalog
+
+# Время создания заказа целиком (БД + запрос к ЮKassa)
+create_order_latency = LatencyStats()
+
+
+class OrderError(Exception):
+    """Заказ не создан; status_code и detail отдаются HTTP-маршрутом как есть"""
+
+    def __init__(self, status_code: int, detail: str) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def payment_error_text(error: Exception, default: Optional[str] = None) -> str:
+    """Сообщение пользователю о неудачной попытке оплаты: товар закончился, ЮKassa недоступна или общая ошибка"""
+    texts = texts_catalog()
+    if isinstance(error, OutOfStock) or (isinstance(error, OrderError) and error.status_code == 409):
+        return texts.text("payment.errors.out_of_stock", "❌ Товар закончился, пока вы оформляли заказ.")
+    if isinstance(error, YooKassaUnavailable) or (isinstance(error, OrderError) and error.status_code == 503):
+        return texts.text("payment.errors.unavailable", "⏳ Платёжный сервис временно недоступен. Попробуйте через пару минут.")
+    return default or texts.text("payment.errors.failed", "Не удалось создать заказ. Попробуйте позже.")
+
+
+async def hold_for_checkout(db: AsyncSession, order: Order, items: Iterable[Item]) -> None:
+    """Зарезервировать товары заказа (order уже в сессии, flush сделан) и зафиксировать заказ до запроса к ЮKassa.
+
+    Резерв берётся в отдельной короткой транзакции: строки остатков заблокированы только на время
+    её commit, а покупатель, которому не хватило товара, получает OutOfStock до создания платежа.
+    При любой ошибке транзакция откатывается (заказа нет), исключение поднимается дальше.
+    Если платёж потом не создан, заказ снимает release_checkout.
+    """
+    try:
+        await hold_stock(db, order.id, items)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        if not isinstance(e, OutOfStock):
+            logger.bind(event="stock.hold.error", error=str(e)).error("Не удалось зарезервировать товар")
+        raise
+
+
+async def release_checkout(db: AsyncSession, order: Order) -> None:
+    """Платёж по заказу из hold_for_checkout не создан: снять резерв и удалить заказ с позициями.
+
+    Заказ, который уже ждёт оплаты (status != CREATED), не трогается. Ошибка только логируется:
+    резерв тогда вернёт в продажу HoldSweeper по истечении STOCK_HOLD_TTL.
+    """
+    order_id = order.id
+    await db.rollback()
+    try:
+        status = (await db.execute(
+            select(Order.status).where(Order.id == order_id).with_for_update()
+        )).scalar_one_or_none()
+        if status != OrderStatus.CREATED:
+            await db.rollback()
+            return
+        await release_holds(db, order_id)
+        await db.execute(delete(Purchase).where(Purchase.order_id == order_id))
+        await db.execute(delete(Order).where(Order.id == order_id))
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.bind(event="stock.hold.release_error", order_id=order_id, error=str(e)).error(
+            "Не удалось снять резерв заказа {} без платежа", order_id
+        )
+
+
+def _payment_method_type(payment_method: Optional[int]) -> Optional[str]:
+    # Маппинг способов оплаты: 36=карта, 44=СБП
+    if payment_method == PaymentMethod.CARD_RF.value:
+        return "bank_card"
+    if payment_method == PaymentMethod.SBP_QR.value:
+        return "sbp"
+    return None
+
+
+async def create_order(db: AsyncSession, payload: CreateOrderRequest) -> CreateOrderResponse:
+    """Создать заказ (для доната — только платёж) и вернуть ссылку на оплату"""
+    started = time.monotonic()
+    try:
+        return await _create_order(db, payload)
+    finally:
+        create_order_latency.observe(time.monotonic() - started)
+
+
+async def _create_order(db: AsyncSession, payload: CreateOrderRequest) -> CreateOrderResponse:
+    item = None
+    if payload.item_id is not None and payload.item_id >= 0:
+        item = (await db.execute(select(Item).where(Item.id == payload.item_id))).scalar_one_or_none()
+        if not item:
+            raise OrderError(404, "item not found")
+
+    email = payload.email or (f"{payload.tg_id}@{settings.email_domain}" if payload.tg_id else None)
+    if not email:
+        raise OrderError(400, "email or tg_id required")
+
+    order: Optional[Order] = None
+    metadata: Dict[str, Any]
+    # Для идемпотентности используем UUID; у заказа он сохраняется, чтобы повторы шли с тем же ключом
+    idempotence_key = str(uuid.uuid4())
+    if item is None:
+        # Донаты — не записываем в таблицу orders
+        amount_minor = payload.amount_minor or 0
+        metadata = {"donation": True, "buyer_tg_id": payload.tg_id}
+        payment_id = f"donation:{payload.tg_id or 'anon'}"
+        description = texts_catalog().render("payment.description_templates.donation", "Донат от {buyer}", buyer=payload.tg_id or "-")
+    else:
+        # Привяжем заказ к пользователю, если такой TG есть в базе
+        user_id = None
+        if payload.tg_id is not None:
+            user_id = (await db.execute(select(User.id).where(User.tg_id == int(payload.tg_id)))).scalar_one_or_none()
+        order = Order(
+            user_id=user_id,
+            item_id=item.id,
+            amount_minor=payload.amount_minor or item.price_minor,
+            currency="RUB",
+            payment_method=PaymentMethod(payload.payment_method) if payload.payment_method is not None else PaymentMethod.CARD_RF,
+            status=OrderStatus.CREATED,
+            buyer_tg_id=str(payload.tg_id) if payload.tg_id else None,
+            idempotence_key=idempotence_key,
+        )
+        db.add(order)
+        await db.flush()
+        amount_minor = order.amount_minor
+        metadata = {"paymentId": str(order.id)}
+        payment_id = str(order.id)
+        key = "service" if item.item_type.value == "service" else "digital"
+        description = texts_catalog().render(
+            f"payment.description_templates.{key}", "Оплата: {title} | Заказ {order_id}", title=item.title, order_id=order.id
+        )
+
+    if order is not None:
+        try:
+            # Резерв до запроса к ЮKassa (см. hold_for_checkout): без товара платёж не создаётся
+            await hold_for_checkout(db, order, [item])
+        except OutOfStock as e:
+            raise OrderError(409, "out of stock") from e
+
+    logger.bind(event="yk.create_payment.request").info(
+        "Готовим платеж в ЮKassa: сумма={amount} ₽",
+        amount=f"{amount_minor/100:.2f}",
+    )
+    client = YooKassaClient()
+    try:
+        try:
+            data = await client.create_payment(
+                amount_minor=amount_minor,
+                description=description,
+                payment_id=payment_id,
+                payment_method_type=_payment_method_type(payload.payment_method),
+                metadata=metadata,
+                customer_email=email,
+                idempotence_key=idempotence_key,
+            )
+        except YooKassaUnavailable as e:
+            logger.bind(event="yk.create_payment.unavailable", error=str(e)).warning("ЮKassa недоступна")
+            raise OrderError(503, "YK unavailable") from e
+        except Exception as e:
+            logger.bind(event="yk.create_payment.error", error=str(e)).error("Ошибка запроса к ЮKassa")
+            raise OrderError(502, "YK request error") from e
+        payment_url = ((data or {}).get("confirmation") or {}).get("confirmation_url")
+        logger.bind(event="yk.create_payment.response").info("Ссылка на оплату получена")
+        if not payment_url:
+            raise OrderError(502, "YK did not return confirmation_url")
+    except Exception:
+        if order is not None:
+            await release_checkout(db, order)
+        raise
+    finally:
+        await client.close()
+
+    if order is not None:
+        await record_checkout(db, [item])
+        # Сохраняем id платежа и ссылку для покупок
+        order.fk_order_id = data.get("id")
+        order.fk_payment_url = payment_url
+        order.status = OrderStatus.PENDING
+        await db.commit()
+    # Донаты: уведомление админу отправляется ТОЛЬКО по вебхуку YooKassa
+    return CreateOrderResponse(order_id=order.id if order is not None else None, payment_url=payment_url)
+
+
+async def create_payment_link(
+    item_id: Optional[int],
+    tg_id: int,
+    payment_method: Optional[int] = None,
+    amount_minor: Optional[int] = None,
+) -> str:
+    """Ссылка на оплату для бота: тот же путь, что и у /orders/, но без HTTP-запроса к самому себе"""
+    payload = CreateOrderRequest(item_id=item_id, tg_id=tg_id, payment_method=payment_method, amount_minor=amount_minor)
+    async with AsyncSessionLocal() as db:
+        response = await create_order(db, payload)
+    return response.payment_url
@@ -0,0 +1,284 @@
+"""
+Outbox побочных эффектов оплаты: сообщения и выдача товара записываются в одной транзакции
+со сменой статуса заказа, а отправляются в Telegram отдельным диспетчером с повторами
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+from loguru import logger
+from sqlalchemy import select, update, delete, exists, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models import Item, OutboxMessage, OutboxStatus
+from app.services.delivery import DeliveryService
+from app.utils.metrics import LatencyStats
+from bot.send_scheduler import SendPriority, send_priority
+
+KIND_MESSAGE = "message"
+KIND_DELIVER = "deliver"
+
+# Как часто удалять отправленные записи старше OUTBOX_RETENTION_HOURS
+_PURGE_INTERVAL = 3600.0
+
+
+def enqueue_message(
+    db: AsyncSession,
+    chat_id: int,
+    text: str,
+    parse_mode: Optional[str] = None,
+    priority: SendPriority = SendPriority.NOTIFICATION,
+    order_id: Optional[int] = None,
+) -> None:
+    """Добавить сообщение в outbox текущей транзакции; уйдёт в Telegram после commit"""
+    db.add(OutboxMessage(
+        kind=KIND_MESSAGE,
+        chat_id=chat_id,
+        payload={"text": text, "parse_mode": parse_mode, "priority": priority.name},
+        order_id=order_id,
+    ))
+
+
+def enqueue_delivery(db: AsyncSession, chat_id: int, item_id: int, order_id: Optional[int] = None) -> None:
+    """Добавить выдачу товара (DeliveryService.deliver) в outbox текущей транзакции"""
+    db.add(OutboxMessage(kind=KIND_DELIVER, chat_id=chat_id, payload={"item_id": item_id}, order_id=order_id))
+
+
+class _Permanent(Exception):
+    """Ошибка, которую бессмысленно повторять"""
+
+
+class OutboxDispatcher:
+    """Забирает готовые записи outbox и отправляет их параллельно, с повторами по экспоненте.
+
+    Записи одного чата уходят строго по порядку: берётся только первая неотправленная запись
+    чата (код раньше файла, файл раньше следующего заказа). Забор — UPDATE ... FOR UPDATE
+    SKIP LOCKED, поэтому диспетчеров может быть несколько; запись, зависшая в processing
+    дольше visibility_timeout (процесс упал), забирается повторно.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        concurrency: int = 10,
+        batch_size: int = 50,
+        poll_interval: float = 1.0,
+        max_attempts: int = 8,
+        retry_backoff: float = 5.0,
+        visibility_timeout: float = 300.0,
+        retention_hours: float = 72.0,
+    ) -> None:
+        self.bot = bot
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = poll_interval
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff = retry_backoff
+        self.visibility_timeout = visibility_timeout
+        self.retention = timedelta(hours=retention_hours)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self._purged_at = 0.0
+        self._lag = LatencyStats()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        self._wakeup.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout=30)
+            except asyncio.TimeoutError:
+                self._task.cancel()
+            self._task = None
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            claimed = 0
+            try:
+                claimed = await self.run_once()
+                if time.monotonic() - self._purged_at >= _PURGE_INTERVAL:
+                    await self._purge()
+            except Exception:
+                logger.bind(event="outbox.error").exception("Ошибка диспетчера outbox")
+            if claimed:
+                # Следующие записи тех же чатов становятся доступны сразу после отправки предыдущих
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _claim(self) -> list:
+        cand = aliased(OutboxMessage, name="cand")
+        prev = aliased(OutboxMessage, name="prev")
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=self.visibility_timeout)
+        head_of_chat = ~exists().where(
+            prev.chat_id == cand.chat_id,
+            prev.id < cand.id,
+            prev.status.in_([OutboxStatus.PENDING, OutboxStatus.PROCESSING]),
+        )
+        candidates = (
+            select(cand.id)
+            .where(
+                or_(
+                    and_(cand.status == OutboxStatus.PENDING, cand.available_at <= now),
+                    and_(cand.status == OutboxStatus.PROCESSING, cand.locked_at < stale_before),
+                ),
+                head_of_chat,
+            )
+            .order_by(cand.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        stmt = (
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(candidates.scalar_subquery()))
+            .values(status=OutboxStatus.PROCESSING, locked_at=now, attempts=OutboxMessage.attempts + 1)
+            .returning(
+                OutboxMessage.id,
+                OutboxMessage.kind,
+                OutboxMessage.chat_id,
+                OutboxMessage.payload,
+                OutboxMessage.attempts,
+                OutboxMessage.created_at,
+            )
+        )
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(stmt)).all()
+            await db.commit()
+        return rows
+
+    async def run_once(self) -> int:
+        rows = await self._claim()
+        if not rows:
+            return 0
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def handle(row) -> None:
+            async with semaphore:
+                await self._dispatch(*row)
+
+        await asyncio.gather(*(handle(row) for row in sorted(rows)))
+        return len(rows)
+
+    async def _send(self, kind: str, chat_id: int, payload: dict) -> None:
+        if kind == KIND_MESSAGE:
+            priority = SendPriority[payload.get("priority") or SendPriority.NOTIFICATION.name]
+            with send_priority(priority):
+                await self.bot.send_message(chat_id, payload["text"], parse_mode=payload.get("parse_mode"))
+            return
+        if kind == KIND_DELIVER:
+            async with AsyncSessionLocal() as db:
+                item = (await db.execute(select(Item).where(Item.id == payload["item_id"]))).scalar_one_or_none()
+            if item is None:
+                raise _Permanent(f"item {payload['item_id']} not found")
+            await DeliveryService(self.bot).deliver(chat_id, item)
+            return
+        raise _Permanent(f"unknown kind {kind}")
+
+    async def _dispatch(self, row_id: int, kind: str, chat_id: int, payload: dict, attempts: int, created_at: datetime) -> None:
+        log = logger.bind(event="outbox.dispatch", outbox_id=row_id, kind=kind, chat_id=chat_id)
+        try:
+            await self._send(kind, chat_id, payload)
+        except Exception as e:
+            permanent = isinstance(e, (_Permanent, TelegramForbiddenError)) or (
+                isinstance(e, TelegramBadRequest) and "chat not found" in str(e).lower()
+            )
+            if permanent or attempts >= self.max_attempts:
+                self.failed += 1
+                log.error("Сообщение не доставлено после {} попыток: {}", attempts, e)
+                await self._finish(row_id, OutboxStatus.FAILED, error=str(e))
+            else:
+                self.retried += 1
+                delay = self.retry_backoff * (2 ** (attempts - 1))
+                log.warning("Ошибка отправки, повтор через {:.0f} сек: {}", delay, e)
+                await self._finish(row_id, OutboxStatus.PENDING, error=str(e), retry_in=delay)
+            return
+        self.sent += 1
+        self._lag.observe((datetime.utcnow() - created_at).total_seconds())
+        await self._finish(row_id, OutboxStatus.DONE)
+
+    async def _finish(self, row_id: int, status: str, error: Optional[str] = None, retry_in: float = 0.0) -> None:
+        now = datetime.utcnow()
+        values = {"status": status, "locked_at": None}
+        if status == OutboxStatus.DONE:
+            values["done_at"] = now
+        if error is not None:
+            values["last_error"] = error[:1000]
+        if retry_in:
+            values["available_at"] = now + timedelta(seconds=retry_in)
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(OutboxMessage).where(OutboxMessage.id == row_id).values(**values))
+            await db.commit()
+
+    async def _purge(self) -> None:
+        self._purged_at = time.monotonic()
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                delete(OutboxMessage).where(
+                    OutboxMessage.status == OutboxStatus.DONE,
+                    OutboxMessage.done_at < datetime.utcnow() - self.retention,
+                )
+            )
+            await db.commit()
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            # От commit оплаты до отправки в Telegram
+            "lag_seconds": self._lag.snapshot(),
+        }
+
+
+outbox_dispatcher: Optional[OutboxDispatcher] = None
+
+
+def start_outbox_dispatcher(bot: Bot) -> OutboxDispatcher:
+    """Запустить диспетчер в этом процессе с параметрами из настроек"""
+    global outbox_dispatcher
+    if outbox_dispatcher is None:
+        outbox_dispatcher = OutboxDispatcher(
+            bot,
+            concurrency=settings.outbox_concurrency,
+            batch_size=settings.outbox_batch_size,
+            poll_interval=settings.outbox_poll_interval,
+            max_attempts=settings.outbox_max_attempts,
+            retry_backoff=settings.outbox_retry_backoff,
+            retention_hours=settings.outbox_retention_hours,
+        )
+    outbox_dispatcher.start()
+    return outbox_dispatcher
+
+
+async def stop_outbox_dispatcher() -> None:
+    if outbox_dispatcher is not None:
+        await outbox_dispatcher.stop()
+
+
+def wake_outbox() -> None:
+    """Разбудить диспетчер этого процесса сразу после commit (иначе он заметит записи через poll_interval)"""
+    if outbox_dispatcher is not None:
+        outbox_dispatcher.wake()
@@ -0,0 +1,454 @@
+"""
+Обработка успешной оплаты ЮKassa: смена статуса заказа, резерв кодов и запись сообщений в outbox.
+Общий путь для вебхука и сверки зависших заказов (app/services/reconciler.py); сами сообщения
+и выдачу товара отправляет диспетчер outbox (app/services/outbox.py) уже после ответа ЮKassa
+"""
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+from sqlalchemy import Integer, column, select, true, update, values
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.models import Order, Item, Purchase, ItemType, OrderStatus, User, ItemCode
+from app.services.outbox import enqueue_delivery, enqueue_message, wake_outbox
+from app.services.stats import record_payment
+from app.services.stock import consume_stock, tracks_codes, tracks_stock
+from app.utils.texts import texts_catalog
+from bot.send_scheduler import SendPriority
+
+
+class PaymentError(Exception):
+    """Платёж не обработан; вебхук отдаёт status_code, чтобы ЮKassa повторила уведомление"""
+
+    def __init__(self, status_code: int, detail: str) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _flag(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        return value.strip().lower() in {"true", "1", "yes"}
+    return False
+
+
+async def _buyer_username(db: AsyncSession, tg_id: Any) -> Optional[str]:
+    if tg_id is None or not str(tg_id).isdigit():
+        return None
+    return (await db.execute(select(User.username).where(User.tg_id == int(tg_id)))).scalar_one_or_none()
+
+
+async def _commit(db: AsyncSession) -> None:
+    # Статус заказа и сообщения outbox фиксируются одной транзакцией, после чего будим диспетчер
+    await db.commit()
+    wake_outbox()
+
+
+def _enqueue_admin(db: AsyncSession, text: str, order_id: Optional[int] = None) -> None:
+    if settings.admin_chat_id:
+        enqueue_message(db, int(settings.admin_chat_id), text, order_id=order_id)
+
+
+def _enqueue_item(db: AsyncSession, order: Order, item: Item, code: Optional[str]) -> None:
+    """Код (если есть) и выдача товара покупателю — в этом порядке"""
+    chat_id = int(order.buyer_tg_id)
+    if code:
+        enqueue_message(db, chat_id, f"<b>{code}</b>", parse_mode="HTML", priority=SendPriority.DELIVERY, order_id=order.id)
+    enqueue_delivery(db, chat_id, item.id, order_id=order.id)
+
+
+async def _allocate_codes(db: AsyncSession, order: Order, needed: Dict[int, int], items: Dict[int, Item]) -> Dict[int, List[str]]:
+    """Зарезервировать коды за заказом одним UPDATE ... RETURNING: needed — сколько кодов нужно по item_id.
+
+    Для каждого товара LATERAL-подзапрос берёт первые n свободных кодов с FOR UPDATE SKIP LOCKED,
+    так что параллельные оплаты не ждут друг друга и не получают один код дважды. Если хоть
+    одного товара не хватает, поднимается PaymentError с недостачей по каждому товару, а
+    откат транзакции вызывающим освобождает уже взятые коды — заказ резервируется целиком или никак.
+    """
+    if not needed:
+        return {}
+    wanted = values(
+        column("item_id", Integer), column("n", Integer), name="wanted"
+    ).data(sorted(needed.items()))
+    picked = (
+        select(ItemCode.id)
+        .where(ItemCode.item_id == wanted.c.item_id, ItemCode.is_sold == False)
+        .order_by(ItemCode.id)
+        .limit(wanted.c.n)
+        .with_for_update(skip_locked=True)
+        .lateral("picked")
+    )
+    rows = (await db.execute(
+        update(ItemCode)
+        .where(ItemCode.id.in_(select(picked.c.id).select_from(wanted.join(picked, true()))))
+        .values(is_sold=True, sold_order_id=order.id)
+        .returning(ItemCode.item_id, ItemCode.code)
+        .execution_options(synchronize_session=False)
+    )).all()
+
+    codes: Dict[int, List[str]] = {}
+    for item_id, code in rows:
+        codes.setdefault(item_id, []).append(code)
+    shortfall = {
+        item_id: count - len(codes.get(item_id, ()))
+        for item_id, count in needed.items()
+        if len(codes.get(item_id, ())) < count
+    }
+    if shortfall:
+        for item_id, missing in shortfall.items():
+            logger.error(
+                "Код закончился при обработке платежа | order_id={} item_id={} нужно={} не хватает={}",
+                order.id, item_id, needed[item_id], missing
+            )
+        detail = ", ".join(
+            f"{items[item_id].title if item_id in items else item_id} (-{missing})" for item_id, missing in shortfall.items()
+        )
+        raise PaymentError(500, f"Items out of stock: {detail}")
+    return codes
+
+
+async def _reject_canceled(db: AsyncSession, order: Order, obj: Dict[str, Any]) -> dict:
+    """Пришла оплата отменённого заказа: его резерв уже снят, и товар мог уйти другому покупателю.
+
+    Коды и остатки не трогаем, заказ остаётся отменённым; покупателю и администратору уходит
+    сообщение о возврате, а ЮKassa получает 200, чтобы не повторять уведомление.
+    """
+    amount = f"{order.amount_minor/100:.2f}"
+    logger.bind(event="yk.webhook.order.canceled", order_id=order.id, fk_order_id=obj.get("id")).error(
+        "Оплачен отменённый заказ #{}: товар не выдан, нужен возврат", order.id
+    )
+    texts = texts_catalog()
+    if order.buyer_tg_id:
+        enqueue_message(db, int(order.buyer_tg_id), texts.render(
+            "payment.errors.canceled_paid",
+            "⚠️ Оплата по заказу №{order_id} пришла, когда заказ уже был отменён. Товар не выдан — администратор вернёт деньги.",
+            order_id=order.id,
+        ), order_id=order.id)
+    buyer_username = await _buyer_username(db, order.buyer_tg_id)
+    _enqueue_admin(db, texts.render(
+        "notifications.canceled_order_paid",
+        (
+            "⚠️ Оплачен отменённый заказ №{order_id}\n"
+            "Сумма: {amount} ₽\nПлатёж: {payment_id}\n"
+            "Покупатель: {buyer} {buyer_username}\n"
+            "Товар не выдан — верните оплату в личном кабинете ЮKassa"
+        ),
+        order_id=order.id,
+        amount=amount,
+        payment_id=obj.get("id") or order.fk_order_id or "-",
+        buyer=order.buyer_tg_id or "-",
+        buyer_username=(f"@{buyer_username}" if buyer_username else ""),
+    ), order_id=order.id)
+    await _commit(db)
+    return {"ok": True}
+
+
+async def process_payment_event(db: AsyncSession, event: Optional[str], obj: Dict[str, Any]) -> dict:
+    """Обработать событие о платеже (объект payment из API ЮKassa). Повторный вызов для оплаченного заказа ничего не делает"""
+    obj = obj if isinstance(obj, dict) else {}
+    metadata = obj.get("metadata") or {}
+    status = obj.get("status")
+
+    logger.bind(event="yk.webhook.event").info(
+        "Обработка события: type={}, status={}, metadata={}",
+        event, status, metadata
+    )
+
+    # Проверка события и статуса
+    if not (event == "payment.succeeded" and status == "succeeded"):
+        logger.bind(event="yk.webhook.skip").info(
+            "Пропускаем событие: event={}, status={}", event, status
+        )
+        return {"ok": True}
+
+    logger.bind(event="yk.webhook.processing").info("✅ Обработка успешной оплаты")
+    amount_value = (obj.get("amount", {}) or {}).get("value")
+
+    # ========== ДОНАТЫ ==========
+    if _flag(metadata.get("donation")):
+        logger.bind(event="yk.webhook.donation").info("Обработка доната")
+        if settings.admin_chat_id:
+            buyer_username = await _buyer_username(db, metadata.get("buyer_tg_id"))
+            text = texts_catalog().render(
+                "notifications.donation_received",
+                "🎁 Донат получен\nСумма: {amount} ₽\nОт: {buyer_username}",
+                amount=amount_value or "0.00",
+                buyer_username=(f"@{buyer_username}" if buyer_username else "-"),
+            )
+            _enqueue_admin(db, text)
+            await _commit(db)
+        return {"ok": True}
+
+    # ========== АДМИН-СЧЕТА ==========
+    if _flag(metadata.get("admin_invoice")):
+        logger.bind(event="yk.webhook.admin_invoice").info("Обработка админ-счета")
+        if settings.admin_chat_id:
+            description = obj.get("description") or "—"
+            _enqueue_admin(db, (
+                "🧾 Админ-счёт оплачен\n"
+                f"Сумма: {amount_value or '0.00'} ₽\n"
+                f"Описание: {description}"
+            ))
+            await _commit(db)
+        return {"ok": True}
+
+    # ========== ОФФЛАЙН ЗАКАЗЫ ==========
+    offline_order_id_raw = metadata.get("offline_order_id")
+    if offline_order_id_raw:
+        logger.bind(event="yk.webhook.offline_order").info("Обработка оффлайн заказа #{}", offline_order_id_raw)
+        try:
+            order = (await db.execute(
+                select(Order).where(Order.id == int(offline_order_id_raw)).with_for_update()
+            )).scalar_one_or_none()
+
+            if not order:
+                logger.bind(event="yk.webhook.offline_order.not_found").error("Оффлайн заказ не найден: {}", offline_order_id_raw)
+                raise PaymentError(404, "offline order not found")
+
+            if order.status == OrderStatus.PAID:
+                logger.bind(event="yk.webhook.offline_order.already_paid").info("Заказ уже оплачен")
+                return {"ok": True}
+
+            if order.status == OrderStatus.CANCELED:
+                return await _reject_canceled(db, order, obj)
+
+            # Получаем все покупки с данными доставки
+            purchases = (await db.execute(
+                select(Purchase).where(Purchase.order_id == order.id)
+            )).scalars().all()
+
+            if not purchases:
+                logger.warning(f"No purchases found for offline order {order.id}")
+
+            order.status = OrderStatus.PAID
+
+            item_ids = [p.item_id for p in purchases if p.item_id]
+            items = (await db.execute(
+                select(Item).where(Item.id.in_(item_ids))
+            )).scalars().all() if item_ids else []
+
+            # Резервы заказа становятся продажей, остаток оффлайн-товаров списывается вместе со сменой статуса
+            offline_items = {item.id: item for item in items if item.item_type == ItemType.OFFLINE and tracks_stock(item)}
+            await consume_stock(
+                db, Counter(i for i in item_ids if i in offline_items), offline_items, order_id=order.id
+            )
+            items_by_id = {item.id: item for item in items}
+            await record_payment(db, order, [items_by_id[i] for i in item_ids if i in items_by_id])
+
+            # Уведомление пользователю
+            if order.buyer_tg_id:
+                # Формируем ссылку на администратора
+                admin_contact = settings.contact_admin or settings.admin_tg_username
+                if admin_contact:
+                    contact_link = f"[администратором](https://t.me/{admin_contact.lstrip('@')})"
+                else:
+                    contact_link = "администратором"
+                user_message = (
+                    "✅ *Оплата получена!*\n\n"
+                    f"📦 Заказ №{order.id} успешно оплачен\n"
+                    f"💰 Сумма: `{order.amount_minor/100:.2f}` ₽\n\n"
+                    f"Свяжитесь с {contact_link} для уточнения деталей доставки."
+                )
+                enqueue_message(db, int(order.buyer_tg_id), user_message, parse_mode="Markdown", order_id=order.id)
+
+            # Уведомление администратору с данными доставки
+            if settings.admin_chat_id and purchases:
+                items_text = "\n".join([f"• {item.title} - {item.price_minor/100:.2f} ₽" for item in items])
+
+                # Берём данные доставки из первой покупки (они одинаковые для всех товаров в заказе)
+                first_purchase = purchases[0]
+                buyer_username = await _buyer_username(db, order.buyer_tg_id)
+
+                template = texts_catalog().template("notifications.offline_order_paid", (
+                    "💳 ОФФЛАЙН ЗАКАЗ №{order_id} ОПЛАЧЕН\n\n"
+                    "Товары:\n{items_text}\n\n"
+                    "Сумма: {amount} ₽\n\n"
+                    "📦 Данные доставки:\n"
+                    "👤 ФИО: {fullname}\n"
+                    "📞 Телефон: {phone}\n"
+                    "📍 Адрес: {address}\n"
+                    "💬 Комментарий: {comment}\n\n"
+                    "👥 Покупатель: {buyer} {buyer_username}"
+                ))
+                _enqueue_admin(db, template.render(
+                    order_id=order.id,
+                    items_text=items_text,
+                    amount=f"{order.amount_minor/100:.2f}",
+                    fullname=first_purchase.delivery_fullname or "—",
+                    phone=first_purchase.delivery_phone or "—",
+                    address=first_purchase.delivery_address or "—",
+                    comment=first_purchase.delivery_comment or "—",
+                    buyer=order.buyer_tg_id or "-",
+                    buyer_username=(f"@{buyer_username}" if buyer_username else ""),
+                ), order_id=order.id)
+
+            await _commit(db)
+            return {"ok": True}
+
+        except PaymentError:
+            raise
+        except Exception as e:
+            logger.exception("Критическая ошибка обработки оффлайн заказа: {}", e)
+            await db.rollback()
+            raise PaymentError(500, "Internal server error")
+
+    # ========== КОРЗИНА (цифровые товары) ==========
+    cart_order_id_raw = metadata.get("cart_order_id")
+    if cart_order_id_raw:
+        logger.bind(event="yk.webhook.cart").info("Обработка оплаты корзины, order_id={}", cart_order_id_raw)
+        try:
+            order = (await db.execute(
+                select(Order).where(Order.id == int(cart_order_id_raw)).with_for_update()
+            )).scalar_one_or_none()
+
+            if not order:
+                logger.bind(event="yk.webhook.cart.not_found").error("Заказ корзины не найден: {}", cart_order_id_raw)
+                raise PaymentError(404, "cart order not found")
+
+            if order.status == OrderStatus.PAID:
+                logger.bind(event="yk.webhook.cart.already_paid").info("Корзина уже оплачена")
+                return {"ok": True}
+
+            if order.status == OrderStatus.CANCELED:
+                return await _reject_canceled(db, order, obj)
+
+            purchases = (await db.execute(
+                select(Purchase).where(Purchase.order_id == order.id)
+            )).scalars().all()
+
+            logger.bind(event="yk.webhook.cart.items").info("Найдено покупок: {}", len(purchases))
+
+            # Товары корзины — одним запросом, коды — одним UPDATE в той же транзакции, что и смена статуса
+            item_ids = {p.item_id for p in purchases if p.item_id}
+            items = {
+                item.id: item
+                for item in (await db.execute(select(Item).where(Item.id.in_(item_ids)))).scalars()
+            } if item_ids else {}
+            needed = Counter(
+                p.item_id for p in purchases if p.item_id in items and tracks_codes(items[p.item_id])
+            )
+            codes = await _allocate_codes(db, order, needed, items)
+            # Резервы заказа становятся продажей, счётчики остатков меняются в той же транзакции
+            await consume_stock(db, needed, items, order_id=order.id)
+            await record_payment(db, order, [items[p.item_id] for p in purchases if p.item_id in items])
+
+            if order.buyer_tg_id:
+                for purchase in purchases:
+                    item = items.get(purchase.item_id)
+                    if not item:
+                        continue
+                    item_codes = codes.get(item.id)
+                    _enqueue_item(db, order, item, item_codes.pop(0) if item_codes else None)
+
+            order.status = OrderStatus.PAID
+
+            if settings.admin_chat_id:
+                template = texts_catalog().template("notifications.cart_paid", (
+                    "🛒 Оплата корзины получена\n"
+                    "Товаров: {items_count}\nСумма: {amount} ₽\n"
+                    "Покупатель: {buyer} {buyer_username}\nЗаказ: {order_id}"
+                ))
+                buyer_username = await _buyer_username(db, order.buyer_tg_id)
+                _enqueue_admin(db, template.render(
+                    items_count=len(purchases),
+                    amount=f"{order.amount_minor/100:.2f}",
+                    buyer=order.buyer_tg_id or "-",
+                    buyer_username=(f"@{buyer_username}" if buyer_username else ""),
+                    order_id=order.id,
+                ), order_id=order.id)
+
+            await _commit(db)
+            logger.bind(event="yk.webhook.cart.success").info("✅ Корзина успешно обработана, order_id={}", order.id)
+            return {"ok": True}
+
+        except PaymentError:
+            raise
+        except Exception as e:
+            logger.exception("Критическая ошибка обработки корзины: {}", e)
+            await db.rollback()
+            raise PaymentError(500, "Internal server error")
+
+    # ========== ОБЫЧНЫЕ ЗАКАЗЫ (ОДИН ТОВАР) ==========
+    payment_id = metadata.get("paymentId")
+    if not payment_id:
+        logger.bind(event="yk.webhook.no_payment_id").error("paymentId отсутствует в metadata: {}", metadata)
+        raise PaymentError(400, "paymentId missing")
+
+    logger.bind(event="yk.webhook.order").info("Обработка обычного заказа, payment_id={}", payment_id)
+
+    try:
+        order = (await db.execute(
+            select(Order).where(Order.id == int(payment_id)).with_for_update()
+        )).scalar_one_or_none()
+
+        if not order:
+            logger.bind(event="yk.webhook.order.not_found").error("Заказ не найден: {}", payment_id)
+            raise PaymentError(404, "order not found")
+
+        if order.status == OrderStatus.PAID:
+            logger.bind(event="yk.webhook.order.already_paid").info("Заказ уже оплачен")
+            return {"ok": True}
+
+        if order.status == OrderStatus.CANCELED:
+            return await _reject_canceled(db, order, obj)
+
+        logger.bind(event="yk.webhook.order.processing").info("Обновление статуса заказа на PAID")
+        order.status = OrderStatus.PAID
+
+        item = (await db.execute(
+            select(Item).where(Item.id == order.item_id)
+        )).scalar_one_or_none()
+
+        if item:
+            purchase = Purchase(
+                order_id=order.id,
+                user_id=order.user_id,
+                item_id=item.id,
+                delivery_info=None
+            )
+            db.add(purchase)
+            logger.bind(event="yk.webhook.order.purchase").info("Создана покупка для товара: {}", item.title)
+
+            # ✅ Атомарная резервация кода
+            allocated_code: str | None = None
+            if tracks_codes(item):
+                logger.bind(event="yk.webhook.order.code").info("Резервация кода для товара: {}", item.title)
+                codes = await _allocate_codes(db, order, {item.id: 1}, {item.id: item})
+                allocated_code = codes[item.id][0]
+                logger.bind(event="yk.webhook.order.code.reserved").info("✅ Код зарезервирован")
+            await consume_stock(db, {item.id: 1} if tracks_stock(item) else {}, {item.id: item}, order_id=order.id)
+
+            if order.buyer_tg_id:
+                _enqueue_item(db, order, item, allocated_code)
+        await record_payment(db, order, [item] if item else [])
+
+        # Уведомление админу
+        if settings.admin_chat_id:
+            template = texts_catalog().template("notifications.order_paid", (
+                "💳 Оплата получена\n"
+                "Товар: {item}\nСумма: {amount} ₽\n"
+                "Покупатель: {buyer} {buyer_username}\nЗаказ: {order_id}"
+            ))
+            buyer_username = await _buyer_username(db, order.buyer_tg_id)
+            _enqueue_admin(db, template.render(
+                item=item.title if item else "Донат",
+                amount=f"{order.amount_minor/100:.2f}",
+                buyer=order.buyer_tg_id or "-",
+                buyer_username=(f"@{buyer_username}" if buyer_username else ""),
+                order_id=order.id,
+            ), order_id=order.id)
+
+        await _commit(db)
+        logger.bind(event="yk.webhook.order.complete").info("✅ Заказ #{} оплачен, выдача поставлена в очередь", order.id)
+        return {"ok": True}
+
+    except PaymentError:
+        raise
+    except Exception as e:
+        logger.exception("Критическая ошибка обработки платежа: {}", e)
+        await db.rollback()
+        raise PaymentError(500, "Internal server error")
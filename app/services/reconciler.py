@@ -0,0 +1,224 @@
+"""
+Сверка зависших заказов с ЮKassa: если вебхук потерялся, заказ остаётся pending, а покупатель — без товара
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from loguru import logger
+from sqlalchemy import select, update, or_
+
+from app.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models import Order, OrderStatus
+from app.services.payments import process_payment_event
+from app.services.stock import release_holds
+from app.services.yookassa import YooKassaClient, YooKassaUnavailable
+
+PAID = "paid"
+CANCELED = "canceled"
+EXPIRED = "expired"
+PENDING = "pending"
+ERROR = "error"
+
+
+class PaymentReconciler:
+    """Периодически забирает пачку pending-заказов с fk_order_id и спрашивает у ЮKassa статус платежа.
+
+    Оплаченные проводятся через тот же process_payment_event, что и вебхук (сообщения уходят
+    через outbox); отменённые
+    и просроченные помечаются canceled. Заказ забирается UPDATE ... WHERE id IN (SELECT ...
+    FOR UPDATE SKIP LOCKED) с отметкой reconciled_at, поэтому несколько реплик приложения
+    не проверяют одни и те же заказы, а повторная проверка заказа — не чаще раза в min_age.
+    """
+
+    def __init__(
+        self,
+        interval: float = 60.0,
+        batch_size: int = 100,
+        concurrency: int = 5,
+        min_age: float = 300.0,
+        expire_after: float = 24 * 3600.0,
+    ) -> None:
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.min_age = timedelta(seconds=min_age)
+        self.expire_after = timedelta(seconds=expire_after)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self.passes = 0
+        self.totals = {PAID: 0, CANCELED: 0, EXPIRED: 0, PENDING: 0, ERROR: 0}
+        self.last_pass: Optional[dict] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout=30)
+            except asyncio.TimeoutError:
+                self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await self.run_once()
+            except Exception:
+                logger.bind(event="yk.reconcile.error").exception("Ошибка сверки заказов")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim(self, now: datetime) -> list:
+        border = now - self.min_age
+        candidates = (
+            select(Order.id)
+            .where(
+                Order.status == OrderStatus.PENDING,
+                Order.fk_order_id.is_not(None),
+                or_(Order.created_at.is_(None), Order.created_at < border),
+                or_(Order.reconciled_at.is_(None), Order.reconciled_at < border),
+            )
+            .order_by(Order.reconciled_at.nulls_first(), Order.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        stmt = (
+            update(Order)
+            .where(Order.id.in_(candidates.scalar_subquery()))
+            .values(reconciled_at=now)
+            .returning(Order.id, Order.fk_order_id, Order.created_at)
+        )
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(stmt)).all()
+            await db.commit()
+        return rows
+
+    async def run_once(self) -> dict:
+        """Один проход: забрать пачку, сверить, вернуть итоги прохода"""
+        started = time.monotonic()
+        now = datetime.utcnow()
+        rows = await self._claim(now)
+        counts = {PAID: 0, CANCELED: 0, EXPIRED: 0, PENDING: 0, ERROR: 0}
+        if rows:
+            client = YooKassaClient()
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def check(order_id: int, payment_id: str, created_at: Optional[datetime]) -> str:
+                async with semaphore:
+                    return await self._check(client, order_id, payment_id, created_at, now)
+
+            results = await asyncio.gather(*(check(*row) for row in rows))
+            await client.close()
+            for result in results:
+                counts[result] += 1
+        elapsed = time.monotonic() - started
+        ages = [(now - created_at).total_seconds() for _, _, created_at in rows if created_at is not None]
+        summary = {
+            "checked": len(rows),
+            **counts,
+            "seconds": round(elapsed, 3),
+            "per_second": round(len(rows) / elapsed, 2) if rows and elapsed > 0 else 0.0,
+            # Возраст самого старого проверенного заказа: насколько сверка отстаёт от потерянных вебхуков
+            "lag_seconds": round(max(ages), 1) if ages else 0.0,
+            "at": now.isoformat(),
+        }
+        self.passes += 1
+        for key, value in counts.items():
+            self.totals[key] += value
+        self.last_pass = summary
+        if rows:
+            logger.bind(event="yk.reconcile.pass", **summary).info(
+                "Сверка заказов: проверено {}, оплачено {}, отменено {}, просрочено {}",
+                len(rows), counts[PAID], counts[CANCELED], counts[EXPIRED],
+            )
+        return summary
+
+    async def _check(
+        self,
+        client: YooKassaClient,
+        order_id: int,
+        payment_id: str,
+        created_at: Optional[datetime],
+        now: datetime,
+    ) -> str:
+        log = logger.bind(event="yk.reconcile.order", order_id=order_id)
+        try:
+            payment = await client.get_payment(payment_id)
+        except YooKassaUnavailable as e:
+            log.warning("ЮKassa недоступна, заказ будет проверен позже: {}", e)
+            return ERROR
+        except Exception as e:
+            log.warning("Не удалось получить платёж {}: {}", payment_id, e)
+            return ERROR
+
+        status = payment.get("status")
+        if status == "succeeded":
+            try:
+                async with AsyncSessionLocal() as db:
+                    await process_payment_event(db, "payment.succeeded", payment)
+            except Exception as e:
+                log.error("Оплаченный заказ не проведён: {}", e)
+                return ERROR
+            log.info("Потерянный вебхук: заказ оплачен и проведён при сверке")
+            return PAID
+        if status == "canceled":
+            await self._cancel(order_id)
+            log.info("Платёж отменён в ЮKassa")
+            return CANCELED
+        if created_at is not None and now - created_at > self.expire_after:
+            await self._cancel(order_id)
+            log.info("Платёж не оплачен за отведённое время, заказ отменён")
+            return EXPIRED
+        return PENDING
+
+    async def _cancel(self, order_id: int) -> None:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(Order)
+                .where(Order.id == order_id, Order.status == OrderStatus.PENDING)
+                .values(status=OrderStatus.CANCELED)
+            )
+            if result.rowcount:
+                # Зарезервированный заказом товар сразу возвращается в продажу
+                await release_holds(db, order_id)
+            await db.commit()
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "passes": self.passes,
+            "totals": dict(self.totals),
+            "last_pass": self.last_pass,
+        }
+
+
+reconciler: Optional[PaymentReconciler] = None
+
+
+def start_reconciler() -> PaymentReconciler:
+    """Запустить сверку в этом процессе с параметрами из настроек"""
+    global reconciler
+    if reconciler is None:
+        reconciler = PaymentReconciler(
+            interval=settings.reconcile_interval,
+            batch_size=settings.reconcile_batch_size,
+            concurrency=settings.reconcile_concurrency,
+            min_age=settings.reconcile_min_age,
+            expire_after=settings.reconcile_expire_hours * 3600,
+        )
+    reconciler.start()
+    return reconciler
+
+
+async def stop_reconciler() -> None:
+    if reconciler is not None:
+        await reconciler.stop()
@@ -0,0 +1,271 @@
+"""
+Сводки для дашборда админки (daily_stats): пополняются в транзакциях регистрации пользователя,
+оформления и оплаты заказа, поэтому главная страница админки не агрегирует users и orders.
+
+Исторические данные и проверка расхождений с исходными таблицами:
+    python -m app.services.stats backfill
+    python -m app.services.stats check
+"""
+import argparse
+import asyncio
+import json
+import sys
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import Date, cast, delete, func, literal_column, select, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.session import AsyncSessionLocal
+from app.models import DailyStats, Item, Order, OrderStatus, Purchase, User, TOTAL_ITEM_ID
+
+COUNTERS = ("new_users", "checkouts", "orders_paid", "units_sold", "revenue_minor")
+
+# День для строк без даты (пользователи и заказы, созданные до появления created_at)
+UNDATED = date(1970, 1, 1)
+
+_INSERT_CHUNK = 1000
+
+
+def _today() -> date:
+    return datetime.utcnow().date()
+
+
+async def _bump(db: AsyncSession, rows: Dict[int, Dict[str, int]], day: Optional[date] = None) -> None:
+    """Прибавить счётчики за день одним INSERT ... ON CONFLICT DO UPDATE: item_id -> {счётчик: прирост}"""
+    if not rows:
+        return
+    day = day or _today()
+    # Строки по возрастанию item_id: параллельные транзакции блокируют их в одном порядке
+    data = [
+        {"day": day, "item_id": item_id, **{name: counts.get(name, 0) for name in COUNTERS}}
+        for item_id, counts in sorted(rows.items())
+    ]
+    stmt = pg_insert(DailyStats).values(data)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DailyStats.day, DailyStats.item_id],
+        set_={name: getattr(DailyStats, name) + getattr(stmt.excluded, name) for name in COUNTERS},
+    )
+    await db.execute(stmt)
+
+
+async def record_user_created(db: AsyncSession) -> None:
+    await _bump(db, {TOTAL_ITEM_ID: {"new_users": 1}})
+
+
+async def record_checkout(db: AsyncSession, items: Iterable[Item]) -> None:
+    """Заказ получил ссылку на оплату; items — позиции заказа (товар повторяется по числу единиц)"""
+    units = Counter(item.id for item in items)
+    rows: Dict[int, Dict[str, int]] = {TOTAL_ITEM_ID: {"checkouts": 1}}
+    for item_id, n in units.items():
+        rows[item_id] = {"checkouts": n}
+    await _bump(db, rows)
+
+
+async def record_payment(db: AsyncSession, order: Order, items: Iterable[Item]) -> None:
+    """Заказ оплачен; выручка по товару — по текущей цене позиций, итог дня — по сумме заказа"""
+    items = list(items)
+    units = Counter(item.id for item in items)
+    prices = {item.id: item.price_minor for item in items}
+    rows: Dict[int, Dict[str, int]] = {
+        TOTAL_ITEM_ID: {"orders_paid": 1, "units_sold": len(items), "revenue_minor": order.amount_minor or 0},
+    }
+    for item_id, n in units.items():
+        rows[item_id] = {"orders_paid": 1, "units_sold": n, "revenue_minor": prices[item_id] * n}
+    await _bump(db, rows)
+
+
+async def dashboard(db: AsyncSession, days: int = 30) -> dict:
+    """Данные главной страницы админки: итоги за всё время, ряд по дням и конверсия по товарам за days дней"""
+    totals_row = (await db.execute(
+        select(*(func.coalesce(func.sum(getattr(DailyStats, name)), 0) for name in COUNTERS))
+        .where(DailyStats.item_id == TOTAL_ITEM_ID)
+    )).one()
+    totals = dict(zip(COUNTERS, totals_row))
+
+    since = _today() - timedelta(days=days - 1)
+    by_day = {
+        row.day: row
+        for row in (await db.execute(
+            select(DailyStats).where(DailyStats.item_id == TOTAL_ITEM_ID, DailyStats.day >= since)
+        )).scalars()
+    }
+    series = []
+    for offset in range(days):
+        day = since + timedelta(days=offset)
+        row = by_day.get(day)
+        series.append({"day": day.isoformat(), **{name: getattr(row, name) if row else 0 for name in COUNTERS}})
+
+    per_item = (await db.execute(
+        select(
+            DailyStats.item_id,
+            Item.title,
+            func.sum(DailyStats.checkouts).label("checkouts"),
+            func.sum(DailyStats.orders_paid).label("orders_paid"),
+            func.sum(DailyStats.units_sold).label("units_sold"),
+            func.sum(DailyStats.revenue_minor).label("revenue_minor"),
+        )
+        .join(Item, Item.id == DailyStats.item_id)
+        .where(DailyStats.item_id != TOTAL_ITEM_ID, DailyStats.day >= since)
+        .group_by(DailyStats.item_id, Item.title)
+        .order_by(func.sum(DailyStats.revenue_minor).desc())
+        .limit(20)
+    )).all()
+    items = [
+        {
+            "item_id": row.item_id,
+            "title": row.title,
+            "checkouts": row.checkouts,
+            "orders_paid": row.orders_paid,
+            "units_sold": row.units_sold,
+            "revenue_minor": row.revenue_minor,
+            # Позиции в оплаченных заказах к позициям в оформленных
+            "conversion": round(100.0 * row.units_sold / row.checkouts, 1) if row.checkouts else None,
+        }
+        for row in per_item
+    ]
+    return {"totals": totals, "series": series, "items": items, "days": days}
+
+
+def _day(column):
+    # Константа в тексте запроса, а не параметром: иначе выражения в SELECT и GROUP BY не совпадут
+    return func.coalesce(cast(column, Date), literal_column(f"DATE '{UNDATED.isoformat()}'", Date))
+
+
+def _order_lines():
+    """Позиции заказов: товар одиночного заказа или покупки корзины (у корзины Order.item_id пуст)"""
+    single = select(
+        Order.id.label("order_id"), Order.item_id.label("item_id"), Order.created_at, Order.status, Order.fk_payment_url,
+    ).where(Order.item_id.is_not(None))
+    cart = select(
+        Order.id, Purchase.item_id, Order.created_at, Order.status, Order.fk_payment_url,
+    ).join(Purchase, Purchase.order_id == Order.id).where(Order.item_id.is_(None), Purchase.item_id.is_not(None))
+    return union_all(single, cart).subquery("lines")
+
+
+async def backfill(db: AsyncSession) -> int:
+    """Пересобрать daily_stats по исходным таблицам (в этой транзакции); вернуть число строк.
+
+    Оплата относится ко дню создания заказа (время оплаты не хранится), выручка по товару —
+    по текущей цене товара; строки без даты попадают в день UNDATED.
+    """
+    rows: Dict[tuple, Dict[str, int]] = defaultdict(dict)
+
+    users = select(_day(User.created_at), func.count()).group_by(_day(User.created_at))
+    for day, n in await db.execute(users):
+        rows[(day, TOTAL_ITEM_ID)]["new_users"] = n
+
+    checkouts = (
+        select(_day(Order.created_at), func.count())
+        .where(Order.fk_payment_url.is_not(None))
+        .group_by(_day(Order.created_at))
+    )
+    for day, n in await db.execute(checkouts):
+        rows[(day, TOTAL_ITEM_ID)]["checkouts"] = n
+
+    paid = (
+        select(_day(Order.created_at), func.count(), func.coalesce(func.sum(Order.amount_minor), 0))
+        .where(Order.status == OrderStatus.PAID)
+        .group_by(_day(Order.created_at))
+    )
+    for day, n, revenue in await db.execute(paid):
+        rows[(day, TOTAL_ITEM_ID)].update(orders_paid=n, revenue_minor=revenue)
+
+    lines = _order_lines()
+    line_day = _day(lines.c.created_at)
+    item_checkouts = (
+        select(line_day, lines.c.item_id, func.count())
+        .where(lines.c.fk_payment_url.is_not(None))
+        .group_by(line_day, lines.c.item_id)
+    )
+    for day, item_id, n in await db.execute(item_checkouts):
+        rows[(day, item_id)]["checkouts"] = n
+
+    item_paid = (
+        select(
+            line_day,
+            lines.c.item_id,
+            func.count(lines.c.order_id.distinct()),
+            func.count(),
+            func.coalesce(func.sum(Item.price_minor), 0),
+        )
+        .join(Item, Item.id == lines.c.item_id)
+        .where(lines.c.status == OrderStatus.PAID)
+        .group_by(line_day, lines.c.item_id)
+    )
+    for day, item_id, orders_paid, units, revenue in await db.execute(item_paid):
+        rows[(day, item_id)].update(orders_paid=orders_paid, units_sold=units, revenue_minor=revenue)
+        rows[(day, TOTAL_ITEM_ID)]["units_sold"] = rows[(day, TOTAL_ITEM_ID)].get("units_sold", 0) + units
+
+    await db.execute(delete(DailyStats))
+    data = [
+        {"day": day, "item_id": item_id, **{name: counts.get(name, 0) for name in COUNTERS}}
+        for (day, item_id), counts in sorted(rows.items())
+    ]
+    for start in range(0, len(data), _INSERT_CHUNK):
+        await db.execute(pg_insert(DailyStats).values(data[start:start + _INSERT_CHUNK]))
+    return len(data)
+
+
+async def check_drift(db: AsyncSession) -> List[dict]:
+    """Сравнить daily_stats за всё время с исходными таблицами; вернуть расходящиеся показатели.
+
+    Сверяются итоги магазина и проданные единицы (units_sold) по каждому существующему товару —
+    у расхождения по товару есть item_id. Удалённые товары не сверяются: их позиции в заказах потеряли ссылку.
+    """
+    rollup = (await dashboard(db, days=1))["totals"]
+    raw = {
+        "new_users": (await db.execute(select(func.count()).select_from(User))).scalar_one(),
+        "checkouts": (await db.execute(
+            select(func.count()).select_from(Order).where(Order.fk_payment_url.is_not(None))
+        )).scalar_one(),
+        "orders_paid": (await db.execute(
+            select(func.count()).select_from(Order).where(Order.status == OrderStatus.PAID)
+        )).scalar_one(),
+        "revenue_minor": (await db.execute(
+            select(func.coalesce(func.sum(Order.amount_minor), 0)).where(Order.status == OrderStatus.PAID)
+        )).scalar_one(),
+    }
+    drift = [
+        {"metric": name, "raw": value, "rollup": rollup[name]}
+        for name, value in raw.items()
+        if value != rollup[name]
+    ]
+
+    lines = _order_lines()
+    raw_units = dict((await db.execute(
+        select(lines.c.item_id, func.count())
+        .join(Item, Item.id == lines.c.item_id)
+        .where(lines.c.status == OrderStatus.PAID)
+        .group_by(lines.c.item_id)
+    )).all())
+    rollup_units = dict((await db.execute(
+        select(DailyStats.item_id, func.sum(DailyStats.units_sold))
+        .join(Item, Item.id == DailyStats.item_id)
+        .group_by(DailyStats.item_id)
+    )).all())
+    for item_id in sorted(set(raw_units) | set(rollup_units)):
+        value, rolled = raw_units.get(item_id, 0), rollup_units.get(item_id) or 0
+        if value != rolled:
+            drift.append({"metric": "units_sold", "item_id": item_id, "raw": value, "rollup": rolled})
+    return drift
+
+
+async def _main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.services.stats", description="Сводки дашборда админки")
+    parser.add_argument("command", choices=["backfill", "check"], help="backfill — пересобрать по исходным таблицам, check — найти расхождения")
+    args = parser.parse_args(argv)
+    async with AsyncSessionLocal() as db:
+        if args.command == "backfill":
+            count = await backfill(db)
+            await db.commit()
+            print(f"daily_stats: {count} rows")
+        drift = await check_drift(db)
+    print(json.dumps({"ok": not drift, "drift": drift}, ensure_ascii=False, default=str))
+    return 1 if drift else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
@@ -0,0 +1,389 @@
+"""
+Счётчики остатков (item_stock) и резервы на время оплаты (stock_holds).
+
+Счётчики меняются в той же транзакции, что и загрузка кодов, резерв, продажа и оплата
+оффлайн-заказа, поэтому проверка наличия — поиск по ключу вместо COUNT(*) по item_codes.
+Оформление заказа резервирует единицы товара (available -> held), оплата превращает резерв
+в продажу, а просроченные резервы возвращает в available фоновая задача.
+"""
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import Integer, column, delete, func, select, update, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models import Item, ItemCode, ItemStock, ItemType, StockHold
+from app.services.outbox import enqueue_message
+
+# Сколько просроченных резервов снимать за один запрос
+_SWEEP_BATCH = 500
+
+
+class OutOfStock(Exception):
+    """Зарезервировать не удалось: товаров titles не хватает; вызывающий откатывает транзакцию"""
+
+    def __init__(self, titles: List[str]) -> None:
+        super().__init__(", ".join(titles))
+        self.titles = titles
+
+
+def tracks_codes(item: Item) -> bool:
+    return item.item_type == ItemType.DIGITAL and item.delivery_type == 'codes'
+
+
+def tracks_stock(item: Item) -> bool:
+    """Ведётся ли по товару остаток: пул кодов или оффлайн-товар с заданным количеством"""
+    return tracks_codes(item) or (item.item_type == ItemType.OFFLINE and item.stock is not None)
+
+
+async def stock_levels(db: AsyncSession, item_ids: Iterable[int]) -> Dict[int, int]:
+    """Свободный (не проданный и не зарезервированный) остаток по товарам; товара без счётчика в ответе нет"""
+    ids = set(item_ids)
+    if not ids:
+        return {}
+    rows = await db.execute(select(ItemStock.item_id, ItemStock.available).where(ItemStock.item_id.in_(ids)))
+    return {item_id: available for item_id, available in rows}
+
+
+async def add_stock(db: AsyncSession, item_id: int, count: int) -> None:
+    """Пополнить остаток (загружены новые коды); уведомление о малом остатке снова взводится"""
+    if count <= 0:
+        return
+    stmt = pg_insert(ItemStock).values(item_id=item_id, available=count, updated_at=datetime.utcnow())
+    available = ItemStock.available + stmt.excluded.available
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ItemStock.item_id],
+        set_={
+            "available": available,
+            "low_alerted": ItemStock.low_alerted & (available <= settings.stock_low_threshold),
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    await db.execute(stmt)
+
+
+async def set_stock(db: AsyncSession, item_id: int, available: Optional[int]) -> None:
+    """Задать остаток явно (поле «Количество на складе» оффлайн-товара в админке); None — без учёта остатков.
+
+    Введённое количество включает зарезервированные единицы, свободными считается остальное.
+    """
+    if available is None:
+        await db.execute(delete(ItemStock).where(ItemStock.item_id == item_id))
+        return
+    stmt = pg_insert(ItemStock).values(item_id=item_id, available=available, updated_at=datetime.utcnow())
+    free = func.greatest(stmt.excluded.available - ItemStock.held, 0)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ItemStock.item_id],
+        set_={
+            "available": free,
+            "low_alerted": ItemStock.low_alerted & (free <= settings.stock_low_threshold),
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    await db.execute(stmt)
+
+
+async def _lock(db: AsyncSession, item_ids: Iterable[int]) -> Dict[int, int]:
+    # Блокируем строки счётчиков в порядке item_id: заказы с общими товарами не взаимоблокируются
+    rows = await db.execute(
+        select(ItemStock.item_id, ItemStock.available)
+        .where(ItemStock.item_id.in_(set(item_ids)))
+        .order_by(ItemStock.item_id)
+        .with_for_update()
+    )
+    return {item_id: available for item_id, available in rows}
+
+
+async def _apply(db: AsyncSession, deltas: Dict[int, Tuple[int, int, int]], items: Dict[int, Item]) -> List[tuple]:
+    """Изменить счётчики одним UPDATE: item_id -> (Δavailable, Δheld, Δsold); вернуть (item_id, available, low_alerted)"""
+    if not deltas:
+        return []
+    await _lock(db, deltas)
+    rows_in = values(
+        column("item_id", Integer), column("d_available", Integer), column("d_held", Integer), column("d_sold", Integer),
+        name="deltas",
+    ).data([(item_id, *delta) for item_id, delta in sorted(deltas.items())])
+    rows = (await db.execute(
+        update(ItemStock)
+        .where(ItemStock.item_id == rows_in.c.item_id)
+        .values(
+            available=func.greatest(ItemStock.available + rows_in.c.d_available, 0),
+            held=func.greatest(ItemStock.held + rows_in.c.d_held, 0),
+            sold=ItemStock.sold + rows_in.c.d_sold,
+            updated_at=datetime.utcnow(),
+        )
+        .returning(ItemStock.item_id, ItemStock.available, ItemStock.low_alerted)
+        .execution_options(synchronize_session=False)
+    )).all()
+    missing = set(deltas) - {row[0] for row in rows}
+    if missing:
+        # Учитываемого товара нет в item_stock — недостающие счётчики создаёт check_stock(repair=True)
+        logger.bind(event="stock.missing", item_ids=sorted(missing)).warning("Нет счётчика остатка для товаров {}", sorted(missing))
+    await _alert_low(db, [row for row in rows if deltas[row[0]][0] < 0], items)
+    return rows
+
+
+async def _alert_low(db: AsyncSession, rows: List[tuple], items: Dict[int, Item]) -> None:
+    """Один раз уведомить администратора о товарах, чей свободный остаток опустился до порога.
+
+    Уведомление пишется в outbox той же транзакции, а флаг low_alerted не даёт повторять его
+    на каждой продаже, пока остаток не пополнят. Строки уже заблокированы _apply.
+    """
+    threshold = settings.stock_low_threshold
+    crossed = [(item_id, available) for item_id, available, alerted in rows if threshold >= 0 and available <= threshold and not alerted]
+    if not crossed:
+        return
+    await db.execute(
+        update(ItemStock)
+        .where(ItemStock.item_id.in_([item_id for item_id, _ in crossed]))
+        .values(low_alerted=True)
+        .execution_options(synchronize_session=False)
+    )
+    low = [f"• {items[item_id].title if item_id in items else item_id}: {available}" for item_id, available in crossed]
+    logger.bind(event="stock.low").info("Малый остаток: {}", "; ".join(low))
+    if settings.admin_chat_id:
+        enqueue_message(db, int(settings.admin_chat_id), "⚠️ Заканчивается товар\n" + "\n".join(low))
+
+
+async def hold_stock(db: AsyncSession, order_id: int, items: Iterable[Item], ttl: Optional[float] = None) -> None:
+    """Зарезервировать за заказом товары (по единице на каждое вхождение в items) на время оплаты.
+
+    Строки счётчиков блокируются, остаток проверяется и уменьшается в одной транзакции с созданием
+    заказа: два покупателя не могут зарезервировать последний код. Если хоть одного товара не
+    хватает, поднимается OutOfStock, и откат транзакции вызывающим снимает уже сделанные резервы.
+    Строки счётчиков блокируются до конца транзакции, поэтому она не должна ждать внешних
+    запросов: оформление заказа фиксирует резерв до запроса к ЮKassa (orders.hold_for_checkout).
+    """
+    items = list(items)
+    by_id = {item.id: item for item in items}
+    wanted = Counter(item.id for item in items if tracks_stock(item))
+    if not wanted:
+        return
+    levels = await _lock(db, wanted)
+    short = [by_id[item_id].title for item_id, n in sorted(wanted.items()) if levels.get(item_id, 0) < n]
+    if short:
+        logger.bind(event="stock.hold.short", order_id=order_id).info("Не хватает товара для резерва: {}", ", ".join(short))
+        raise OutOfStock(short)
+    expires_at = datetime.utcnow() + timedelta(seconds=ttl if ttl is not None else settings.stock_hold_ttl)
+    db.add_all([
+        StockHold(order_id=order_id, item_id=item_id, quantity=n, expires_at=expires_at)
+        for item_id, n in sorted(wanted.items())
+    ])
+    await _apply(db, {item_id: (-n, n, 0) for item_id, n in wanted.items()}, by_id)
+
+
+async def _take_holds(db: AsyncSession, order_id: int) -> Dict[int, int]:
+    rows = await db.execute(
+        delete(StockHold)
+        .where(StockHold.order_id == order_id)
+        .returning(StockHold.item_id, StockHold.quantity)
+        .execution_options(synchronize_session=False)
+    )
+    held: Dict[int, int] = Counter()
+    for item_id, quantity in rows:
+        held[item_id] += quantity
+    return held
+
+
+async def consume_stock(db: AsyncSession, sold: Dict[int, int], items: Dict[int, Item], order_id: Optional[int] = None) -> None:
+    """Списать проданное (item_id -> штук) вместе с оплатой заказа order_id.
+
+    Резервы заказа превращаются в продажу; непокрытое резервом (резерв истёк или его не было)
+    списывается из свободного остатка, лишний резерв возвращается в него. Оффлайн-товарам с
+    учётом остатков уменьшается и Item.stock. Остатки не уходят ниже нуля.
+    """
+    held = await _take_holds(db, order_id) if order_id is not None else {}
+    if not sold and not held:
+        return
+    if sold:
+        sold_rows = values(
+            column("item_id", Integer), column("n", Integer), name="sold_rows"
+        ).data(sorted(sold.items()))
+        offline_ids = [item_id for item_id in sold if item_id in items and items[item_id].item_type == ItemType.OFFLINE]
+        if offline_ids:
+            await db.execute(
+                update(Item)
+                .where(Item.id == sold_rows.c.item_id, Item.id.in_(offline_ids), Item.stock.is_not(None))
+                .values(stock=func.greatest(Item.stock - sold_rows.c.n, 0))
+                .execution_options(synchronize_session=False)
+            )
+    deltas = {
+        item_id: (held.get(item_id, 0) - sold.get(item_id, 0), -held.get(item_id, 0), sold.get(item_id, 0))
+        for item_id in set(sold) | set(held)
+    }
+    await _apply(db, deltas, items)
+
+
+async def release_holds(db: AsyncSession, order_id: int) -> None:
+    """Снять резервы заказа (заказ отменён или удалён) и вернуть товар в свободный остаток"""
+    held = await _take_holds(db, order_id)
+    await _apply(db, {item_id: (n, -n, 0) for item_id, n in held.items()}, {})
+
+
+async def release_expired(batch_size: int = _SWEEP_BATCH) -> int:
+    """Снять просроченные резервы пачками по batch_size; вернуть число снятых резервов.
+
+    Резервы забираются DELETE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED), поэтому реплики
+    не мешают друг другу, а резерв, который прямо сейчас превращается в продажу, пропускается.
+    """
+    total = 0
+    while True:
+        expired = (
+            select(StockHold.id)
+            .where(StockHold.expires_at < datetime.utcnow())
+            .order_by(StockHold.expires_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                delete(StockHold)
+                .where(StockHold.id.in_(expired.scalar_subquery()))
+                .returning(StockHold.item_id, StockHold.quantity)
+                .execution_options(synchronize_session=False)
+            )).all()
+            released: Dict[int, int] = Counter()
+            for item_id, quantity in rows:
+                released[item_id] += quantity
+            await _apply(db, {item_id: (n, -n, 0) for item_id, n in released.items()}, {})
+            await db.commit()
+        total += len(rows)
+        if len(rows) < batch_size:
+            break
+    if total:
+        logger.bind(event="stock.hold.expired", holds=total).info("Сняты просроченные резервы: {}", total)
+    return total
+
+
+class HoldSweeper:
+    """Периодически возвращает в продажу товар из резервов, которые не оплатили за отведённое время"""
+
+    def __init__(self, interval: float = 30.0) -> None:
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self.released = 0
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout=30)
+            except asyncio.TimeoutError:
+                self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                self.released += await release_expired()
+            except Exception:
+                logger.bind(event="stock.hold.sweep_error").exception("Ошибка снятия просроченных резервов")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "released": self.released,
+        }
+
+
+hold_sweeper: Optional[HoldSweeper] = None
+
+
+def start_hold_sweeper() -> HoldSweeper:
+    """Запустить снятие просроченных резервов в этом процессе с параметрами из настроек"""
+    global hold_sweeper
+    if hold_sweeper is None:
+        hold_sweeper = HoldSweeper(interval=settings.stock_hold_sweep_interval)
+    hold_sweeper.start()
+    return hold_sweeper
+
+
+async def stop_hold_sweeper() -> None:
+    if hold_sweeper is not None:
+        await hold_sweeper.stop()
+
+
+async def check_stock(db: AsyncSession, repair: bool = False) -> List[dict]:
+    """Сверить счётчики с исходными строками (item_codes, items.stock, stock_holds) и вернуть расхождения.
+
+    repair=True переписывает разошедшиеся и недостающие счётчики по исходным строкам в этой транзакции.
+    """
+    codes = (
+        select(
+            ItemCode.item_id.label("item_id"),
+            func.count().filter(ItemCode.is_sold == False).label("unsold"),
+            func.count().filter(ItemCode.is_sold == True).label("sold"),
+        )
+        .group_by(ItemCode.item_id)
+    )
+    # Остаток по исходным строкам: (не продано, продано или None, если продажи не восстановить)
+    source: Dict[int, tuple] = {item_id: (unsold, sold) for item_id, unsold, sold in await db.execute(codes)}
+    offline = await db.execute(
+        select(Item.id, Item.stock).where(Item.item_type == ItemType.OFFLINE, Item.stock.is_not(None))
+    )
+    for item_id, stock in offline:
+        if item_id not in source:
+            source[item_id] = (stock, None)
+    held: Dict[int, int] = {
+        item_id: quantity
+        for item_id, quantity in await db.execute(
+            select(StockHold.item_id, func.sum(StockHold.quantity)).group_by(StockHold.item_id)
+        )
+    }
+
+    counters = {
+        row.item_id: row
+        for row in (await db.execute(select(ItemStock))).scalars()
+    }
+    drift: List[dict] = []
+    for item_id, (unsold, sold) in sorted(source.items()):
+        expected_held = held.get(item_id, 0)
+        expected_available = max(unsold - expected_held, 0)
+        counter = counters.get(item_id)
+        if (
+            counter is not None
+            and counter.available == expected_available
+            and counter.held == expected_held
+            and (sold is None or counter.sold == sold)
+        ):
+            continue
+        drift.append({
+            "item_id": item_id,
+            "expected_available": expected_available,
+            "expected_held": expected_held,
+            "expected_sold": sold,
+            "available": counter.available if counter is not None else None,
+            "held": counter.held if counter is not None else None,
+            "sold": counter.sold if counter is not None else None,
+        })
+        if not repair:
+            continue
+        if counter is None:
+            db.add(ItemStock(item_id=item_id, available=expected_available, held=expected_held, sold=sold or 0))
+        else:
+            counter.available = expected_available
+            counter.held = expected_held
+            if sold is not None:
+                counter.sold = sold
+            counter.updated_at = datetime.utcnow()
+    if drift:
+        logger.bind(event="stock.drift", items=len(drift), repaired=repair).warning(
+            "Расхождение счётчиков остатков: {} товаров{}", len(drift), " (исправлено)" if repair else ""
+        )
+    return drift
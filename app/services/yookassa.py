@@ -1,29 +1,239 @@
+import asyncio
 import base64
+import random
+import time
+from collections import deque
 from decimal import Decimal, ROUND_HALF_UP
-from typing import Any, Dict, Optional
+from typing import Any, Deque, Dict, Optional
 import ipaddress
 from loguru import logger
 
 import httpx
 
 from app.config import settings
+from app.utils.metrics import LatencyStats
+
+# Один пул соединений на процесс: TLS-рукопожатие с api.yookassa.ru делается один раз,
+# дальше запросы идут по уже открытым keep-alive соединениям
+_shared_client: Optional[httpx.AsyncClient] = None
+_http2_enabled = False
+
+# Задержки вызовов API по операциям, для /health/metrics
+_latency: Dict[str, LatencyStats] = {}
+_errors: Dict[str, int] = {}
+
+
+class YooKassaUnavailable(Exception):
+    """ЮKassa не отвечает или отвечает ошибками: автомат разомкнут либо исчерпаны повторы"""
+
+
+class CircuitBreaker:
+    """Автомат защиты: после threshold сбоев подряд вызовы сразу отклоняются на reset_timeout секунд,
+    затем пропускается один пробный запрос — успех замыкает автомат, сбой снова размыкает"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.threshold = max(1, threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self.trips = 0
+        self._probe = False
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probe = False
+        if self.state == self.HALF_OPEN and not self._probe:
+            self._probe = True
+            return True
+        self.rejected += 1
+        return False
+
+    def release(self) -> None:
+        """Пробный запрос отменён, не получив ответа: следующий вызов снова станет пробным"""
+        self._probe = False
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                self.trips += 1
+                logger.bind(event="yk.breaker_open", failures=self.failures).warning(
+                    "ЮKassa недоступна, запросы приостановлены на {} сек", self.reset_timeout
+                )
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probe = False
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "trips": self.trips, "rejected": self.rejected}
+
+
+class AdaptiveTimeout:
+    """Таймаут чтения по недавним успешным ответам: multiplier × p99, в пределах [minimum, maximum].
+    Пока замеров мало, используется maximum"""
+
+    def __init__(self, minimum: float = 2.0, maximum: float = 30.0, multiplier: float = 3.0, window: int = 200) -> None:
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.multiplier = multiplier
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def current(self) -> float:
+        if len(self._samples) < 20:
+            return self.maximum
+        ordered = sorted(self._samples)
+        p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+        return min(self.maximum, max(self.minimum, p99 * self.multiplier))
+
+
+breaker = CircuitBreaker(settings.yk_breaker_threshold, settings.yk_breaker_reset)
+read_timeout = AdaptiveTimeout(settings.yk_timeout_min, settings.yk_timeout_max)
+
+
+def _retryable(resp: Optional[httpx.Response]) -> bool:
+    # Сетевые ошибки, таймауты, 5xx и 429 — временные; остальные 4xx повторять бессмысленно
+    return resp is None or resp.status_code >= 500 or resp.status_code == 429
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _build_client() -> httpx.AsyncClient:
+    global _http2_enabled
+    # Basic auth: shopId:secretKey
+    basic = f"{settings.yk_shop_id}:{settings.yk_secret_key}".encode("utf-8")
+    auth_header = base64.b64encode(basic).decode("utf-8")
+    http2 = settings.yk_http2
+    if http2 and not _http2_available():
+        logger.bind(event="yk.http2_unavailable").warning("YK_HTTP2 включён, но пакет h2 не установлен — используется HTTP/1.1")
+        http2 = False
+    _http2_enabled = http2
+    return httpx.AsyncClient(
+        base_url=settings.yk_api_url,
+        headers={
+            "Authorization": f"Basic {auth_header}",
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+        },
+        timeout=httpx.Timeout(connect=5.0, read=30.0, write=15.0, pool=5.0),
+        limits=httpx.Limits(
+            max_connections=settings.yk_max_connections,
+            max_keepalive_connections=settings.yk_max_keepalive,
+            keepalive_expiry=settings.yk_keepalive_expiry,
+        ),
+        http2=http2,
+    )
+
+
+def get_yookassa_http() -> httpx.AsyncClient:
+    """Общий HTTP-клиент ЮKassa; создаётся при первом обращении"""
+    global _shared_client
+    if _shared_client is None or _shared_client.is_closed:
+        _shared_client = _build_client()
+    return _shared_client
+
+
+async def start_yookassa_client() -> None:
+    """Открыть пул заранее, при старте приложения"""
+    get_yookassa_http()
+
+
+async def close_yookassa_client() -> None:
+    """Закрыть пул при остановке приложения"""
+    global _shared_client
+    client, _shared_client = _shared_client, None
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+
+def yookassa_stats() -> dict:
+    return {
+        "open": _shared_client is not None and not _shared_client.is_closed,
+        "http2": _http2_enabled,
+        "breaker": breaker.stats(),
+        "read_timeout": round(read_timeout.current(), 3),
+        "errors": dict(_errors),
+        "latency_seconds": {name: stats.snapshot() for name, stats in _latency.items()},
+    }
 
 
 class YooKassaClient:
+    """Тонкая обёртка над общим пулом: создавать и закрывать можно сколько угодно раз,
+    соединения при этом не рвутся"""
+
     def __init__(self) -> None:
-        self.base_url = "https://api.yookassa.ru/v3/"
-        # Basic auth: shopId:secretKey
-        basic = f"{settings.yk_shop_id}:{settings.yk_secret_key}".encode("utf-8")
-        auth_header = base64.b64encode(basic).decode("utf-8")
-        self._client = httpx.AsyncClient(
-            base_url=self.base_url,
-            headers={
-                "Authorization": f"Basic {auth_header}",
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-            },
-            timeout=httpx.Timeout(connect=5.0, read=30.0, write=15.0, pool=5.0),
-        )
+        self.base_url = settings.yk_api_url
+        self._client = get_yookassa_http()
+
+    async def _request(self, operation: str, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        """Запрос с таймаутом по недавним задержкам, повтором с джиттером и автоматом защиты.
+        Повторы безопасны: POST отправляется с тем же Idempotence-Key, GET идемпотентен сам по себе.
+        Автомат учитывает вызов целиком: один сбой, когда повторы исчерпаны, а пробный запрос
+        полуоткрытого автомата не повторяется"""
+        if not breaker.allow():
+            raise YooKassaUnavailable(f"{operation}: circuit open")
+        attempts = 1 if breaker.state == CircuitBreaker.HALF_OPEN else 1 + max(0, settings.yk_retries)
+        for attempt in range(attempts):
+            timeout = httpx.Timeout(connect=5.0, read=read_timeout.current(), write=15.0, pool=5.0)
+            started = time.monotonic()
+            resp: Optional[httpx.Response] = None
+            error: Optional[Exception] = None
+            try:
+                resp = await self._client.request(method, url, timeout=timeout, **kwargs)
+            except httpx.TransportError as e:
+                error = e
+            except asyncio.CancelledError:
+                # Иначе пробный запрос HALF_OPEN остался бы занятым и автомат отклонял бы всё до перезапуска
+                breaker.release()
+                raise
+            except BaseException:
+                breaker.record_failure()
+                _errors[operation] = _errors.get(operation, 0) + 1
+                raise
+            elapsed = time.monotonic() - started
+            stats = _latency.get(operation)
+            if stats is None:
+                stats = _latency[operation] = LatencyStats()
+            stats.observe(elapsed)
+            if not _retryable(resp):
+                breaker.record_success()
+                read_timeout.observe(elapsed)
+                if resp.is_error:
+                    _errors[operation] = _errors.get(operation, 0) + 1
+                return resp
+            _errors[operation] = _errors.get(operation, 0) + 1
+            reason = str(error) if error is not None else f"HTTP {resp.status_code}"
+            if attempt + 1 >= attempts:
+                breaker.record_failure()
+                raise YooKassaUnavailable(f"{operation}: {reason}") from error
+            delay = settings.yk_retry_backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+            logger.bind(event="yk.retry", operation=operation, attempt=attempt + 1).warning(
+                "ЮKassa: {}, повтор через {:.2f} сек", reason, delay
+            )
+            await asyncio.sleep(delay)
+        raise YooKassaUnavailable(operation)
 
     async def create_payment(
         self,
@@ -68,16 +278,17 @@ class YooKassaClient:
         # Idempotence-Key: используем предоставленный ключ или payment_id
         headers = {"Idempotence-Key": (idempotence_key or payment_id)}
         logger.bind(event="yk.request").info("Создание платежа в ЮKassa")
-        resp = await self._client.post("payments", json=payload, headers=headers)
+        resp = await self._request("create_payment", "POST", "payments", json=payload, headers=headers)
         logger.bind(event="yk.response").info("Ответ ЮKassa: статус={status}", status=resp.status_code)
         resp.raise_for_status()
         return resp.json()
 
     async def close(self) -> None:
-        await self._client.aclose()
+        """Пул общий и закрывается при остановке приложения (close_yookassa_client)"""
+        return None
 
     async def get_payment(self, payment_id: str) -> Dict[str, Any]:
-        resp = await self._client.get(f"payments/{payment_id}")
+        resp = await self._request("get_payment", "GET", f"payments/{payment_id}")
         resp.raise_for_status()
         return resp.json()
 
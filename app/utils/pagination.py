@@ -0,0 +1,100 @@
+"""
+Постраничный вывод по ключу (keyset): страница выбирается условием id < / id > курсора, а не OFFSET,
+поэтому дальние страницы стоят столько же, сколько первая.
+
+Курсор — непрозрачная короткая строка (направление + id граничной строки) для URL админки
+и callback_data бота (лимит Telegram — 64 байта).
+"""
+import base64
+import binascii
+from dataclasses import dataclass
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import Select, func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+AFTER = "a"
+BEFORE = "b"
+
+# Ниже этого числа строк по оценке planner'а считаем точно — это дёшево
+EXACT_COUNT_BELOW = 10_000
+
+
+def encode_cursor(direction: str, key: int) -> str:
+    raw = f"{direction}{key}".encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, int]]:
+    """(направление, id) или None для пустого и испорченного курсора (тогда показывается первая страница)"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        direction, key = raw[0], int(raw[1:])
+    except (binascii.Error, UnicodeDecodeError, ValueError, IndexError):
+        return None
+    if direction not in (AFTER, BEFORE):
+        return None
+    return direction, key
+
+
+@dataclass
+class Page:
+    rows: List[Any]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+
+async def keyset_page(
+    db: AsyncSession,
+    stmt: Select,
+    id_column,
+    cursor: Optional[str],
+    page_size: int,
+    scalars: bool = True,
+) -> Page:
+    """Страница stmt по убыванию id_column, начиная с курсора.
+
+    scalars=False — вернуть строки целиком (для select(Model, ...)), тогда id берётся из первой колонки.
+    """
+    decoded = decode_cursor(cursor)
+    if decoded and decoded[0] == BEFORE:
+        # Назад: строки новее курсора по возрастанию, затем разворот
+        page_stmt = stmt.where(id_column > decoded[1]).order_by(id_column.asc())
+    elif decoded:
+        page_stmt = stmt.where(id_column < decoded[1]).order_by(id_column.desc())
+    else:
+        page_stmt = stmt.order_by(id_column.desc())
+    result = await db.execute(page_stmt.limit(page_size + 1))
+    rows = list(result.scalars() if scalars else result.all())
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    def key_of(row) -> int:
+        return (row if scalars else row[0]).id
+
+    if decoded and decoded[0] == BEFORE:
+        rows.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = decoded is not None, more
+    if not rows and decoded:
+        # За курсором строк не осталось (их удалили) — показываем первую страницу
+        return await keyset_page(db, stmt, id_column, None, page_size, scalars)
+    return Page(
+        rows=rows,
+        next_cursor=encode_cursor(AFTER, key_of(rows[-1])) if has_next else None,
+        prev_cursor=encode_cursor(BEFORE, key_of(rows[0])) if has_prev else None,
+    )
+
+
+async def estimated_count(db: AsyncSession, model) -> int:
+    """Число строк таблицы по статистике planner'а (pg_class.reltuples); для небольших таблиц — точный COUNT(*)"""
+    estimate = (await db.execute(
+        text("SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+        {"table": model.__tablename__},
+    )).scalar_one_or_none()
+    if estimate is None or estimate < EXACT_COUNT_BELOW:
+        return (await db.execute(select(func.count()).select_from(model))).scalar_one()
+    return int(estimate)
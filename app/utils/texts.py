@@ -1,10 +1,183 @@
-from functools import lru_cache
+"""
+Каталог текстов бота из texts.yml: проверка, предкомпиляция шаблонов и горячая перезагрузка
+"""
+import threading
+import time
 from pathlib import Path
+from string import Formatter
+from typing import Any, Callable, Dict, List, Optional
+
 import yaml
+from loguru import logger
+
+TEXTS_PATH = Path(__file__).resolve().parent.parent / "texts.yml"
+
+# Как часто (сек) проверять mtime файла; проверка — один stat(), сам файл перечитывается только при изменении
+CHECK_INTERVAL = 2.0
+
+# Ключи, к которым обработчики обращаются через [] — без них бот упадёт на первом же сообщении
+REQUIRED_KEYS = ("main_menu.title", "main_menu.buttons", "buttons.back")
+
+_MISSING = object()
+
+
+class TextsError(ValueError):
+    """texts.yml не прошёл проверку"""
+
+
+class Template:
+    """Шаблон, разобранный при загрузке каталога: ошибки в фигурных скобках видны сразу,
+    а строка без подстановок собирается один раз и дальше отдаётся без вызова format"""
+
+    __slots__ = ("source", "fields", "_text")
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+        parsed = list(Formatter().parse(source))
+        self.fields = tuple(name for _, name, _, _ in parsed if name)
+        # Текст без полей — то же, что вернул бы source.format(): {{ и }} уже раскрыты
+        self._text = None if any(name is not None for _, name, _, _ in parsed) else "".join(literal for literal, _, _, _ in parsed)
+
+    def render(self, **kwargs: Any) -> str:
+        if self._text is not None:
+            return self._text
+        return self.source.format(**kwargs)
+
+    def __str__(self) -> str:
+        return self.source
+
+
+class TextsCatalog:
+    """Неизменяемый снимок texts.yml; при перезагрузке подменяется целиком"""
+
+    def __init__(self, data: dict, version: int, mtime: float) -> None:
+        self.data = data
+        self.version = version
+        self.mtime = mtime
+        self._templates: Dict[str, Template] = {}
+        # Предкомпилируем все строки сразу: битый шаблон не попадёт в рабочий каталог
+        self._compile(data, "")
+
+    def _compile(self, node: Any, prefix: str) -> None:
+        if isinstance(node, dict):
+            for key, value in node.items():
+                self._compile(value, f"{prefix}.{key}" if prefix else str(key))
+        elif isinstance(node, str):
+            try:
+                self._templates[prefix] = Template(node)
+            except ValueError as e:
+                raise TextsError(f"{prefix}: некорректный шаблон: {e}") from e
+
+    def get(self, path: str, default: Any = None) -> Any:
+        """Значение по пути через точку: get("admin.prompts.amount")"""
+        node: Any = self.data
+        for part in path.split("."):
+            if not isinstance(node, dict):
+                return default
+            node = node.get(part, _MISSING)
+            if node is _MISSING:
+                return default
+        return node
+
+    def text(self, path: str, default: str = "") -> str:
+        value = self.get(path)
+        return value if isinstance(value, str) and value else default
+
+    def template(self, path: str, default: str = "") -> Template:
+        tpl = self._templates.get(path)
+        if tpl is not None and tpl.source:
+            return tpl
+        key = "\0" + default
+        tpl = self._templates.get(key)
+        if tpl is None:
+            tpl = self._templates[key] = Template(default)
+        return tpl
+
+    def render(self, path: str, default: str = "", **kwargs: Any) -> str:
+        return self.template(path, default).render(**kwargs)
+
+
+def _validate(catalog: TextsCatalog) -> TextsCatalog:
+    missing = [key for key in REQUIRED_KEYS if catalog.get(key) is None]
+    if missing:
+        raise TextsError("нет обязательных ключей: " + ", ".join(missing))
+    return catalog
+
+
+_lock = threading.Lock()
+_catalog: Optional[TextsCatalog] = None
+_checked_at = 0.0
+_failed_mtime: Optional[float] = None
+_listeners: List[Callable[[TextsCatalog], None]] = []
+
+
+def _load(mtime: float, version: int) -> TextsCatalog:
+    with open(TEXTS_PATH, "r", encoding="utf-8") as f:
+        data = yaml.safe_load(f) or {}
+    if not isinstance(data, dict):
+        raise TextsError("корень texts.yml должен быть словарём")
+    return _validate(TextsCatalog(data, version, mtime))
+
+
+def _swap(catalog: TextsCatalog) -> None:
+    global _catalog
+    _catalog = catalog  # одно присваивание: обработчики видят либо старый, либо новый каталог целиком
+    for listener in list(_listeners):
+        try:
+            listener(catalog)
+        except Exception as e:
+            logger.bind(event="texts.listener_error").warning("Ошибка обработчика перезагрузки текстов: {}", e)
+
+
+def reload_texts(force: bool = False) -> TextsCatalog:
+    """Перечитать texts.yml, если он изменился (или принудительно — тогда ошибка проверки пробрасывается).
+    Битый файл не заменяет рабочий каталог"""
+    global _checked_at, _failed_mtime
+    with _lock:
+        _checked_at = time.monotonic()
+        current = _catalog
+        try:
+            mtime = TEXTS_PATH.stat().st_mtime
+        except OSError as e:
+            if current is None:
+                raise
+            logger.bind(event="texts.stat_error").warning("texts.yml недоступен: {}", e)
+            return current
+        if current is not None and not force and mtime in (current.mtime, _failed_mtime):
+            return current
+        try:
+            catalog = _load(mtime, (current.version + 1) if current else 1)
+        except Exception as e:
+            if current is None:
+                raise
+            _failed_mtime = mtime
+            logger.bind(event="texts.reload_error").error("texts.yml не загружен, остаётся версия {}: {}", current.version, e)
+            if force:
+                raise
+            return current
+        _swap(catalog)
+        if current is not None:
+            logger.bind(event="texts.reloaded", version=catalog.version).info("Тексты перезагружены")
+        return catalog
+
+
+def texts_catalog() -> TextsCatalog:
+    """Актуальный каталог текстов; изменения файла подхватываются не позже чем через CHECK_INTERVAL"""
+    catalog = _catalog
+    if catalog is None or time.monotonic() - _checked_at >= CHECK_INTERVAL:
+        catalog = reload_texts()
+    return catalog
+
+
+def texts_version() -> int:
+    return texts_catalog().version
+
+
+def on_texts_reload(listener: Callable[[TextsCatalog], None]) -> None:
+    """Подписаться на смену каталога (например, чтобы сбросить кэши, построенные из текстов)"""
+    _listeners.append(listener)
 
 
-@lru_cache(maxsize=1)
 def load_texts() -> dict:
-    file_path = Path(__file__).resolve().parent.parent / "texts.yml"
-    with open(file_path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f) or {}
+    """Словарь texts.yml, как раньше; данные не изменяются — каталог заменяется целиком"""
+    return texts_catalog().data
@@ -0,0 +1,302 @@
+"""
+Надёжная очередь обновлений Telegram в Postgres: приём в вебхуке и обработка отдельными воркерами
+"""
+import asyncio
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from loguru import logger
+from sqlalchemy import select, update, delete, exists, func, or_, and_, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import aliased
+
+from app.db.session import AsyncSessionLocal
+from app.models import QueuedUpdate, UpdateWorker
+from .update_queue import UpdateQueue, update_chat_key
+
+STATUS_PENDING = "pending"
+STATUS_PROCESSING = "processing"
+STATUS_FAILED = "failed"
+
+
+async def enqueue_update(update: Update, payload: str) -> None:
+    """Сохранить сырое обновление; повторная доставка того же update_id игнорируется"""
+    chat_key = update_chat_key(update)
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            pg_insert(QueuedUpdate)
+            .values(
+                update_id=update.update_id,
+                chat_id=chat_key if isinstance(chat_key, int) else None,
+                payload=payload,
+                status=STATUS_PENDING,
+                attempts=0,
+                created_at=datetime.utcnow(),
+            )
+            .on_conflict_do_nothing(index_elements=[QueuedUpdate.update_id])
+        )
+        await db.commit()
+
+
+async def durable_queue_stats() -> dict:
+    """Состояние очереди и пульс воркеров для /health/metrics"""
+    async with AsyncSessionLocal() as db:
+        by_status = dict((await db.execute(
+            select(QueuedUpdate.status, func.count()).group_by(QueuedUpdate.status)
+        )).all())
+        oldest = (await db.execute(
+            select(func.min(QueuedUpdate.created_at)).where(QueuedUpdate.status == STATUS_PENDING)
+        )).scalar_one_or_none()
+        workers = (await db.execute(select(UpdateWorker).order_by(UpdateWorker.worker_id))).scalars().all()
+    return {
+        "pending": by_status.get(STATUS_PENDING, 0),
+        "processing": by_status.get(STATUS_PROCESSING, 0),
+        "failed": by_status.get(STATUS_FAILED, 0),
+        "oldest_pending_age_seconds": round((datetime.utcnow() - oldest).total_seconds(), 3) if oldest else 0.0,
+        "workers": [
+            {
+                "worker_id": w.worker_id,
+                "processed": w.processed,
+                "failed": w.failed,
+                "rate_per_sec": w.rate_per_sec,
+                "heartbeat_at": w.heartbeat_at.isoformat(),
+            }
+            for w in workers
+        ],
+    }
+
+
+class DurableUpdateWorker:
+    """Забирает обновления из tg_update_queue пачками (FOR UPDATE SKIP LOCKED) и передаёт их в Dispatcher.
+
+    Забирается только «голова» каждого чата — самое раннее необработанное обновление, поэтому
+    порядок внутри чата сохраняется даже при нескольких процессах-воркерах. Успешно обработанные
+    строки удаляются, упавшие возвращаются в очередь до max_attempts, затем помечаются failed.
+    Строки, захваченные упавшим процессом, снова становятся доступны через visibility_timeout.
+    locked_at захвата служит токеном владения: итог обработки записывается только в строку,
+    которую с тех пор не забрал другой воркер.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        dp: Dispatcher,
+        worker_id: str | None = None,
+        concurrency: int = 8,
+        batch_size: int = 100,
+        poll_interval: float = 0.2,
+        visibility_timeout: float = 300.0,
+        max_attempts: int = 5,
+        heartbeat_interval: float = 10.0,
+    ) -> None:
+        self.bot = bot
+        self.dp = dp
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.heartbeat_interval = heartbeat_interval
+
+        self._queue = UpdateQueue(
+            self._handle,
+            workers=concurrency,
+            maxsize=self.batch_size,
+            enqueue_timeout=visibility_timeout,
+            name="tg-durable",
+        )
+        # update_id -> (id строки очереди, locked_at её захвата), пока обновление в работе
+        self._rows: dict[int, tuple[int, datetime]] = {}
+        self._done: list[tuple[int, datetime]] = []
+        self._failed: list[tuple[int, datetime]] = []
+        self._poison: list[tuple[int, datetime]] = []
+        self._wakeup = asyncio.Event()
+        self._stopping = asyncio.Event()
+
+        self._processed = 0
+        self._failed_total = 0
+        self._last_beat = time.monotonic()
+        self._last_beat_processed = 0
+        self._started_at = datetime.utcnow()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wakeup.set()
+
+    async def run(self) -> None:
+        logger.bind(event="tg.durable.start").info("Воркер очереди {} запущен", self.worker_id)
+        self._queue.start()
+        try:
+            while not self._stopping.is_set():
+                await self._flush()
+                free = self.batch_size - len(self._rows)
+                claimed = await self._claim(free) if free > 0 else 0
+                if time.monotonic() - self._last_beat >= self.heartbeat_interval:
+                    await self._heartbeat()
+                if claimed:
+                    continue
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+        finally:
+            await self._queue.stop(timeout=self.visibility_timeout)
+            await self._flush()
+            await self._heartbeat()
+            logger.bind(event="tg.durable.stop").info("Воркер очереди {} остановлен", self.worker_id)
+
+    async def _claim(self, limit: int) -> int:
+        cand = aliased(QueuedUpdate, name="cand")
+        prev = aliased(QueuedUpdate, name="prev")
+        claimed_at = datetime.utcnow()
+        stale_before = claimed_at - timedelta(seconds=self.visibility_timeout)
+        head_of_chat = ~exists().where(
+            prev.chat_id == cand.chat_id,
+            prev.id < cand.id,
+            prev.status != STATUS_FAILED,
+        )
+        candidates = (
+            select(cand.id)
+            .where(
+                or_(
+                    cand.status == STATUS_PENDING,
+                    and_(cand.status == STATUS_PROCESSING, cand.locked_at < stale_before),
+                ),
+                head_of_chat,
+            )
+            .order_by(cand.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        stmt = (
+            update(QueuedUpdate)
+            .where(QueuedUpdate.id.in_(candidates.scalar_subquery()))
+            .values(
+                status=STATUS_PROCESSING,
+                locked_at=claimed_at,
+                locked_by=self.worker_id,
+                attempts=QueuedUpdate.attempts + 1,
+            )
+            .returning(QueuedUpdate.id, QueuedUpdate.update_id, QueuedUpdate.payload)
+        )
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(stmt)).all()
+            await db.commit()
+
+        for row_id, update_id, payload in sorted(rows):
+            try:
+                tg_update = Update.model_validate_json(payload, context={"bot": self.bot})
+            except Exception:
+                logger.bind(event="tg.durable.bad_payload").exception("Некорректное обновление в очереди: id={}", row_id)
+                self._poison.append((row_id, claimed_at))
+                continue
+            self._rows[update_id] = (row_id, claimed_at)
+            await self._queue.put(tg_update)
+        return len(rows)
+
+    async def _handle(self, tg_update: Update) -> Any:
+        claim = self._rows[tg_update.update_id]
+        try:
+            result = await self.dp.feed_update(self.bot, tg_update)
+        except Exception:
+            self._failed.append(claim)
+            self._failed_total += 1
+            raise
+        else:
+            self._done.append(claim)
+            self._processed += 1
+            return result
+        finally:
+            self._rows.pop(tg_update.update_id, None)
+            self._wakeup.set()
+
+    async def _flush(self) -> None:
+        if not self._done and not self._failed and not self._poison:
+            return
+        done, self._done = self._done, []
+        failed, self._failed = self._failed, []
+        poison, self._poison = self._poison, []
+        written = 0
+        async with AsyncSessionLocal() as db:
+            if done:
+                written += (await db.execute(delete(QueuedUpdate).where(self._owned(done)))).rowcount
+            if failed:
+                owned = self._owned(failed)
+                written += (await db.execute(
+                    update(QueuedUpdate)
+                    .where(owned, QueuedUpdate.attempts >= self.max_attempts)
+                    .values(status=STATUS_FAILED, locked_at=None)
+                )).rowcount
+                written += (await db.execute(
+                    update(QueuedUpdate)
+                    .where(owned, QueuedUpdate.attempts < self.max_attempts)
+                    .values(status=STATUS_PENDING, locked_at=None, locked_by=None)
+                )).rowcount
+            if poison:
+                written += (await db.execute(
+                    update(QueuedUpdate).where(self._owned(poison)).values(status=STATUS_FAILED, locked_at=None)
+                )).rowcount
+            await db.commit()
+        lost = len(done) + len(failed) + len(poison) - written
+        if lost:
+            # Обработка шла дольше visibility_timeout, и строку захватили заново: итог запишет новый захват
+            logger.bind(event="tg.durable.claim_lost", lost=lost).warning(
+                "Воркер {}: {} строк очереди захвачены заново, итог обработки не записан", self.worker_id, lost
+            )
+
+    def _owned(self, claims: list[tuple[int, datetime]]):
+        """Условие «строка всё ещё за этим захватом»: тот же воркер и тот же locked_at, что при _claim"""
+        return and_(
+            QueuedUpdate.locked_by == self.worker_id,
+            tuple_(QueuedUpdate.id, QueuedUpdate.locked_at).in_(claims),
+        )
+
+    async def _heartbeat(self) -> None:
+        now = time.monotonic()
+        elapsed = max(now - self._last_beat, 1e-6)
+        rate = (self._processed - self._last_beat_processed) / elapsed
+        self._last_beat = now
+        self._last_beat_processed = self._processed
+        try:
+            async with AsyncSessionLocal() as db:
+                stmt = pg_insert(UpdateWorker).values(
+                    worker_id=self.worker_id,
+                    processed=self._processed,
+                    failed=self._failed_total,
+                    rate_per_sec=round(rate, 3),
+                    started_at=self._started_at,
+                    heartbeat_at=datetime.utcnow(),
+                )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[UpdateWorker.worker_id],
+                    set_={
+                        "processed": stmt.excluded.processed,
+                        "failed": stmt.excluded.failed,
+                        "rate_per_sec": stmt.excluded.rate_per_sec,
+                        "started_at": stmt.excluded.started_at,
+                        "heartbeat_at": stmt.excluded.heartbeat_at,
+                    },
+                )
+                await db.execute(stmt)
+                await db.commit()
+        except Exception as e:
+            logger.bind(event="tg.durable.heartbeat_error").warning("Не удалось записать пульс воркера: {}", e)
+        logger.bind(event="tg.durable.stats").info(
+            "Воркер {}: обработано={}, ошибок={}, {:.1f} обн/с",
+            self.worker_id, self._processed, self._failed_total, rate,
+        )
+
+    def stats(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "processed": self._processed,
+            "failed": self._failed_total,
+            "in_flight": len(self._rows),
+            "queue": self._queue.stats(),
+        }
@@ -0,0 +1,215 @@
+"""
+Хранилище FSM в Postgres с ограниченным LRU-кэшем в памяти процесса, проверяемым по версии записи
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from loguru import logger
+from sqlalchemy import case, select, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models import FsmState
+from app.models.fsm_state import fsm_state_version_seq
+
+
+class _CacheEntry:
+    __slots__ = ("state", "data", "version", "expires_at")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], version: int, expires_at: float) -> None:
+        self.state = state
+        self.data = data
+        # 0 — записи в таблице нет
+        self.version = version
+        self.expires_at = expires_at
+
+
+class PostgresStorage(BaseStorage):
+    """FSM-хранилище поверх таблицы fsm_states.
+
+    Запись идёт сразу в БД (write-through) и получает новую версию из последовательности.
+    Чтение берёт запись из LRU-кэша с TTL и сверяет её версию с БД одним запросом по ключу:
+    состояние и данные передаются и разбираются, только если запись изменилась, поэтому кэш
+    корректен и при нескольких процессах-обработчиках (uvicorn --workers, bot.run_worker).
+    Записи, не менявшиеся дольше state_ttl, удаляются фоновой чисткой — брошенные сценарии
+    не копятся вечно.
+    """
+
+    def __init__(
+        self,
+        cache_size: int = 10_000,
+        cache_ttl: float = 600.0,
+        state_ttl: float = 72 * 3600.0,
+        purge_interval: float = 3600.0,
+        key_builder: Optional[KeyBuilder] = None,
+    ) -> None:
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.cache_size = max(0, cache_size)
+        self.cache_ttl = cache_ttl
+        self.state_ttl = state_ttl
+        self.purge_interval = purge_interval
+        self._cache: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._last_purge = time.monotonic()
+        self._purge_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        # Запись в кэше устарела: её изменил или удалил другой процесс
+        self.stale = 0
+
+    # --- кэш ---
+
+    def _cache_get(self, key: str) -> Optional[_CacheEntry]:
+        if not self.cache_size:
+            return None
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return entry
+
+    def _cache_put(self, key: str, state: Optional[str], data: Dict[str, Any], version: int) -> None:
+        if not self.cache_size:
+            return
+        self._cache[key] = _CacheEntry(state, data, version, time.monotonic() + self.cache_ttl)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _cache_written(self, key: str, version: int, state: Optional[str], data: Dict[str, Any]) -> None:
+        """Обновить кэш после своей записи строкой из RETURNING: в ней и поля, которые мог поменять другой процесс"""
+        if self._cache_get(key) is not None:
+            self._cache_put(key, state, data, version)
+
+    async def _load(self, key: str) -> _CacheEntry:
+        entry = self._cache_get(key)
+        async with AsyncSessionLocal() as db:
+            if entry is not None:
+                # Данные нужны, только если версия в БД отличается от запомненной
+                changed = FsmState.version != entry.version
+                row = (await db.execute(
+                    select(FsmState.version, case((changed, FsmState.state)), case((changed, FsmState.data)))
+                    .where(FsmState.key == key)
+                )).one_or_none()
+                if (row[0] if row else 0) == entry.version:
+                    self.hits += 1
+                    return entry
+                self.stale += 1
+            else:
+                self.misses += 1
+                row = (await db.execute(
+                    select(FsmState.version, FsmState.state, FsmState.data).where(FsmState.key == key)
+                )).one_or_none()
+        version, state, data = (row[0], row[1], dict(row[2] or {})) if row else (0, None, {})
+        self._cache_put(key, state, data, version)
+        return _CacheEntry(state, data, version, 0.0)
+
+    # --- BaseStorage ---
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = self.key_builder.build(key)
+        value = state.state if isinstance(state, State) else state
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            row = await self._upsert(db, k, {"state": value, "data": {}, "updated_at": now}, ("state",))
+            await db.commit()
+        self._cache_written(k, *row)
+        self._maybe_purge()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(self.key_builder.build(key))).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k = self.key_builder.build(key)
+        data = data.copy()
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            removed = 0
+            if not data:
+                # Пустые данные без состояния — сценарий завершён, запись больше не нужна
+                removed = (await db.execute(
+                    delete(FsmState).where(FsmState.key == k, FsmState.state.is_(None))
+                )).rowcount
+            row = (0, None, {}) if removed else await self._upsert(db, k, {"state": None, "data": data, "updated_at": now}, ("data",))
+            await db.commit()
+        self._cache_written(k, *row)
+        self._maybe_purge()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._load(self.key_builder.build(key))).data.copy()
+
+    @staticmethod
+    async def _upsert(db, key: str, values: Dict[str, Any], columns: tuple) -> tuple:
+        """Вставить или обновить запись (columns и updated_at) с новой версией; вернуть (версия, состояние, данные)"""
+        stmt = pg_insert(FsmState).values(key=key, version=fsm_state_version_seq.next_value(), **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[FsmState.key],
+            set_={
+                **{name: stmt.excluded[name] for name in columns},
+                "version": stmt.excluded.version,
+                "updated_at": stmt.excluded.updated_at,
+            },
+        )
+        version, state, data = (await db.execute(stmt.returning(FsmState.version, FsmState.state, FsmState.data))).one()
+        return version, state, dict(data or {})
+
+    async def close(self) -> None:
+        if self._purge_task and not self._purge_task.done():
+            self._purge_task.cancel()
+        self._cache.clear()
+
+    # --- обслуживание ---
+
+    def _maybe_purge(self) -> None:
+        if time.monotonic() - self._last_purge < self.purge_interval:
+            return
+        if self._purge_task and not self._purge_task.done():
+            return
+        self._last_purge = time.monotonic()
+        self._purge_task = asyncio.create_task(self.purge_expired())
+
+    async def purge_expired(self) -> int:
+        """Удалить брошенные сценарии, не менявшиеся дольше state_ttl"""
+        border = datetime.utcnow() - timedelta(seconds=self.state_ttl)
+        try:
+            async with AsyncSessionLocal() as db:
+                removed = (await db.execute(delete(FsmState).where(FsmState.updated_at < border))).rowcount
+                await db.commit()
+        except Exception as e:
+            logger.bind(event="fsm.purge_error").warning("Не удалось очистить устаревшие FSM-состояния: {}", e)
+            return 0
+        if removed:
+            logger.bind(event="fsm.purge").info("Удалено устаревших FSM-состояний: {}", removed)
+        return removed
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses + self.stale
+        return {
+            "backend": "postgres",
+            "cache_size": len(self._cache),
+            "cache_capacity": self.cache_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def create_fsm_storage() -> BaseStorage:
+    """Хранилище FSM согласно FSM_STORAGE: memory (по умолчанию) или postgres"""
+    if settings.fsm_storage != "postgres":
+        return MemoryStorage()
+    return PostgresStorage(
+        cache_size=settings.fsm_cache_size,
+        cache_ttl=settings.fsm_cache_ttl,
+        state_ttl=settings.fsm_state_ttl_hours * 3600.0,
+    )
@@ -10,9 +10,15 @@ from aiogram.types import CallbackQuery, Message
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 
+from sqlalchemy import select, func
+
 from app.utils.texts import load_texts
-from bot.keyboards import back_kb, payment_link_kb
+from bot.keyboards import back_kb, payment_link_kb, broadcast_confirm_kb, broadcast_status_kb
 from app.services.yookassa import YooKassaClient
+from app.services.orders import payment_error_text
+from app.services.broadcast import BroadcastService, broadcast_progress
+from app.db.session import AsyncSessionLocal
+from app.models import User
 from app.config import settings
 
 logger = logging.getLogger("shopbot")
@@ -24,6 +30,11 @@ class AdminInvoiceStates(StatesGroup):
     waiting_for_amount = State()
 
 
+class AdminBroadcastStates(StatesGroup):
+    waiting_for_text = State()
+    waiting_for_confirm = State()
+
+
 def _is_admin_user(tg_id: int | None, username: str | None) -> bool:
     """Проверка является ли пользователь администратором"""
     try:
@@ -115,8 +126,87 @@ async def admin_invoice_capture_amount(message: Message, state: FSMContext) -> N
             await message.answer(f"{title}\n{url}", reply_markup=payment_link_kb(url))
     except Exception as e:
         logger.error(f"Error creating admin invoice: {e}")
-        await message.answer("Ошибка при создании счёта. Попробуйте позже.")
+        await message.answer(payment_error_text(e, "Ошибка при создании счёта. Попробуйте позже."))
     finally:
         await client.close()
     
     await state.clear()
+
+
+def _broadcast_status_text(progress: dict) -> str:
+    template = load_texts().get("admin", {}).get("broadcast_status") or (
+        "📣 Рассылка #{id}: {status}\nОбработано: {processed} из {total} ({percent}%)\n"
+        "Доставлено: {delivered}, заблокировали бота: {blocked}, ошибок: {failed}\nСкорость: {rate_per_sec} сообщ./с"
+    )
+    return template.format(**progress)
+
+
+@router.callback_query(F.data == "admin:broadcast")
+async def admin_broadcast_start(call: CallbackQuery, state: FSMContext) -> None:
+    """Начало рассылки: запрос текста"""
+    if not _is_admin_user(call.from_user.id, call.from_user.username):
+        await call.answer("Недоступно", show_alert=True)
+        return
+
+    prompt = load_texts().get("admin", {}).get("prompts", {}).get("broadcast", "Отправьте текст сообщения для рассылки всем пользователям:")
+    await call.message.answer(prompt, reply_markup=back_kb("menu:admin"))
+    await state.set_state(AdminBroadcastStates.waiting_for_text)
+    await call.answer()
+
+
+@router.message(AdminBroadcastStates.waiting_for_text)
+async def admin_broadcast_capture_text(message: Message, state: FSMContext) -> None:
+    """Предпросмотр текста рассылки и подтверждение"""
+    if not _is_admin_user(message.from_user.id, message.from_user.username):
+        await state.clear()
+        return
+
+    text = (message.text or "").strip()
+    if not text:
+        await message.answer("Нужен текст сообщения.", reply_markup=back_kb("menu:admin"))
+        return
+    async with AsyncSessionLocal() as db:
+        audience = (await db.execute(select(func.count()).select_from(User).where(User.blocked_at.is_(None)))).scalar_one()
+
+    await state.update_data(broadcast_text=text)
+    template = load_texts().get("admin", {}).get("prompts", {}).get("broadcast_confirm", "Получателей: {audience}. Отправить это сообщение?")
+    await message.answer(text)
+    await message.answer(template.format(audience=audience), reply_markup=broadcast_confirm_kb())
+    await state.set_state(AdminBroadcastStates.waiting_for_confirm)
+
+
+@router.callback_query(AdminBroadcastStates.waiting_for_confirm, F.data == "admin:broadcast_send")
+async def admin_broadcast_send(call: CallbackQuery, state: FSMContext) -> None:
+    """Запуск рассылки"""
+    if not _is_admin_user(call.from_user.id, call.from_user.username):
+        await call.answer("Недоступно", show_alert=True)
+        return
+
+    data = await state.get_data()
+    await state.clear()
+    text = data.get("broadcast_text")
+    if not text:
+        await call.answer("Текст рассылки потерян, начните заново", show_alert=True)
+        return
+
+    broadcast = await BroadcastService(call.bot).create(text, created_by=call.from_user.username or str(call.from_user.id))
+    progress = await broadcast_progress(broadcast.id)
+    await call.message.answer(_broadcast_status_text(progress), reply_markup=broadcast_status_kb(broadcast.id))
+    await call.answer()
+
+
+@router.callback_query(F.data.startswith("admin:broadcast_status:"))
+async def admin_broadcast_status(call: CallbackQuery) -> None:
+    """Текущий прогресс рассылки"""
+    if not _is_admin_user(call.from_user.id, call.from_user.username):
+        await call.answer("Недоступно", show_alert=True)
+        return
+
+    broadcast_id = int(call.data.rsplit(":", 1)[1])
+    progress = await broadcast_progress(broadcast_id)
+    if progress is None:
+        await call.answer("Рассылка не найдена", show_alert=True)
+        return
+    with contextlib.suppress(Exception):
+        await call.message.edit_text(_broadcast_status_text(progress), reply_markup=broadcast_status_kb(broadcast_id))
+    await call.answer()
@@ -6,16 +6,22 @@ import contextlib
 import uuid
 
 from aiogram import Router, F
-from aiogram.types import CallbackQuery, FSInputFile, InputMediaPhoto, InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.types import CallbackQuery, InputMediaPhoto, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.fsm.context import FSMContext
-from sqlalchemy import select, func, delete
+from sqlalchemy import select, delete
 
 from app.utils.texts import load_texts
 from bot.keyboards import main_menu_kb, cart_kb, skip_kb, item_card_kb, payment_link_kb
 from app.db.session import AsyncSessionLocal
-from app.models import Item, ItemType, User, Purchase, CartItem, Order, PaymentMethod, OrderStatus, ItemCode
+from app.models import Item, ItemType, Purchase, CartItem, Order, PaymentMethod, OrderStatus
 from app.config import settings
 from app.services.yookassa import YooKassaClient
+from app.services.orders import hold_for_checkout, payment_error_text, release_checkout
+from app.services.stats import record_checkout
+from app.services.stock import stock_levels, tracks_stock
+from app.services.catalog import load_item_card
+from app.services.media_cache import media_cache
+from bot.user_middleware import BotUser
 
 logger = logging.getLogger("shopbot")
 router = Router()
@@ -40,13 +46,12 @@ async def has_offline_items(items: list) -> bool:
 
 
 @router.callback_query(F.data == "menu:cart")
-async def show_cart(call: CallbackQuery) -> None:
+async def show_cart(call: CallbackQuery, user: BotUser | None = None) -> None:
     """Отображение корзины"""
     logger.info(f"Showing cart for user {call.from_user.id}")
     texts = load_texts()
     
     async with AsyncSessionLocal() as db:
-        user = (await db.execute(select(User).where(User.tg_id == call.from_user.id))).scalar_one_or_none()
         if not user:
             logger.warning(f"User {call.from_user.id} not found in database")
             await call.answer("Пользователь не найден", show_alert=True)
@@ -109,30 +114,26 @@ async def show_cart(call: CallbackQuery) -> None:
 
 
 @router.callback_query(F.data.startswith("cart:add:"))
-async def add_to_cart(call: CallbackQuery) -> None:
+async def add_to_cart(call: CallbackQuery, user: BotUser | None = None) -> None:
     """Добавление товара в корзину"""
     _, _, item_id = call.data.split(":")
     item_id_int = int(item_id)
     
+    if not user:
+        await call.answer("Пользователь не найден", show_alert=True)
+        return
+    
+    # Товар, «куплен» и «в корзине» — одним запросом; этой же карточкой обновим сообщение
+    card = await load_item_card(item_id_int, user.id)
+    if card is None:
+        await call.answer("Товар не найден", show_alert=True)
+        return
+    
+    if card.in_cart:
+        await call.answer("Товар уже в корзине", show_alert=True)
+        return
+    
     async with AsyncSessionLocal() as db:
-        user = (await db.execute(select(User).where(User.tg_id == call.from_user.id))).scalar_one_or_none()
-        if not user:
-            await call.answer("Пользователь не найден", show_alert=True)
-            return
-        
-        item = (await db.execute(select(Item).where(Item.id == item_id_int))).scalar_one_or_none()
-        if not item:
-            await call.answer("Товар не найден", show_alert=True)
-            return
-        
-        existing = (await db.execute(
-            select(CartItem).where(CartItem.user_id == user.id, CartItem.item_id == item_id_int)
-        )).scalar_one_or_none()
-        
-        if existing:
-            await call.answer("Товар уже в корзине", show_alert=True)
-            return
-        
         cart_item = CartItem(user_id=user.id, item_id=item_id_int)
         db.add(cart_item)
         await db.commit()
@@ -141,38 +142,22 @@ async def add_to_cart(call: CallbackQuery) -> None:
     
     # Обновляем карточку товара
     try:
-        async with AsyncSessionLocal() as db:
-            item = (await db.execute(select(Item).where(Item.id == item_id_int))).scalar_one_or_none()
-            user = (await db.execute(select(User).where(User.tg_id == call.from_user.id))).scalar_one_or_none()
-            in_cart = True
-            purchased = False
-            if user:
-                purchased = (await db.execute(
-                    select(Purchase).where(Purchase.user_id == user.id, Purchase.item_id == item_id_int)
-                )).first() is not None
-            
-            caption = (
-                f"*{item.title}*\n\n"
-                f"{item.description}\n\n"
-                f"💰 Цена: `{item.price_minor/100:.2f}` ₽"
-            )
-            await call.message.edit_caption(
-                caption=caption,
-                parse_mode="Markdown",
-                reply_markup=item_card_kb(item.id, item.item_type.value, purchased, from_purchased=False, page=1, in_cart=in_cart)
-            )
+        await call.message.edit_caption(
+            caption=card.caption,
+            parse_mode="Markdown",
+            reply_markup=item_card_kb(card.item.id, card.item.item_type.value, card.purchased, from_purchased=False, in_cart=True)
+        )
     except Exception:
         pass
 
 
 @router.callback_query(F.data.startswith("cart:remove:"))
-async def remove_from_cart(call: CallbackQuery) -> None:
+async def remove_from_cart(call: CallbackQuery, user: BotUser | None = None) -> None:
     """Удаление товара из корзины"""
     _, _, item_id = call.data.split(":")
     item_id_int = int(item_id)
     
     async with AsyncSessionLocal() as db:
-        user = (await db.execute(select(User).where(User.tg_id == call.from_user.id))).scalar_one_or_none()
         if not user:
             await call.answer("Пользователь не найден", show_alert=True)
             return
@@ -186,39 +171,24 @@ async def remove_from_cart(call: CallbackQuery) -> None:
     
     # Если мы в корзине - обновляем её
     if call.message and call.message.caption and "Корзина" in call.message.caption:
-        await show_cart(call)
+        await show_cart(call, user)
     else:
         # Если в карточке товара - обновляем карточку
         try:
-            async with AsyncSessionLocal() as db:
-                item = (await db.execute(select(Item).where(Item.id == item_id_int))).scalar_one_or_none()
-                user = (await db.execute(select(User).where(User.tg_id == call.from_user.id))).scalar_one_or_none()
-                in_cart = False
-                purchased = False
-                if user:
-                    purchased = (await db.execute(
-                        select(Purchase).where(Purchase.user_id == user.id, Purchase.item_id == item_id_int)
-                    )).first() is not None
-                
-                caption = (
-                    f"*{item.title}*\n\n"
-                    f"{item.description}\n\n"
-                    f"💰 Цена: `{item.price_minor/100:.2f}` ₽"
-                )
-                await call.message.edit_caption(
-                    caption=caption,
-                    parse_mode="Markdown",
-                    reply_markup=item_card_kb(item.id, item.item_type.value, purchased, from_purchased=False, page=1, in_cart=in_cart)
-                )
+            card = await load_item_card(item_id_int, user.id, in_cart=False)
+            await call.message.edit_caption(
+                caption=card.caption,
+                parse_mode="Markdown",
+                reply_markup=item_card_kb(card.item.id, card.item.item_type.value, card.purchased, from_purchased=False, in_cart=False)
+            )
         except Exception:
             pass
 
 
 @router.callback_query(F.data == "cart:clear")
-async def clear_cart(call: CallbackQuery) -> None:
+async def clear_cart(call: CallbackQuery, user: BotUser | None = None) -> None:
     """Очистка корзины"""
     async with AsyncSessionLocal() as db:
-        user = (await db.execute(select(User).where(User.tg_id == call.from_user.id))).scalar_one_or_none()
         if not user:
             await call.answer("Пользователь не найден", show_alert=True)
             return
@@ -231,7 +201,7 @@ async def clear_cart(call: CallbackQuery) -> None:
     texts = load_texts()
     try:
         if "image" in texts["main_menu"]:
-            photo = FSInputFile(texts["main_menu"]["image"])
+            photo = await media_cache.resolve(texts["main_menu"]["image"])
             await call.message.edit_media(
                 media=InputMediaPhoto(media=photo, caption=texts["main_menu"]["title"], parse_mode="Markdown"),
                 reply_markup=main_menu_kb(texts, is_admin=_is_admin_user(call.from_user.id, call.from_user.username), cart_count=0)
@@ -251,14 +221,13 @@ async def clear_cart(call: CallbackQuery) -> None:
 
 
 @router.callback_query(F.data == "cart:checkout")
-async def checkout_cart(call: CallbackQuery, state: FSMContext) -> None:
+async def checkout_cart(call: CallbackQuery, state: FSMContext, user: BotUser | None = None) -> None:
     """Оформление заказа из корзины"""
     # Импортируем OfflineDeliveryStates локально чтобы избежать циклических импортов
     from .delivery import OfflineDeliveryStates
     from .items import RepurchaseStates
  
     async with AsyncSessionLocal() as db:
-        user = (await db.execute(select(User).where(User.tg_id == call.from_user.id))).scalar_one_or_none()
         if not user:
             await call.answer("Пользователь не найден", show_alert=True)
             return
@@ -330,19 +299,13 @@ async def checkout_cart(call: CallbackQuery, state: FSMContext) -> None:
                 await call.answer()
                 return
         
-        # Проверка наличия кодов для цифровых товаров
-        for item in items:
-            if item.item_type == ItemType.DIGITAL and item.delivery_type == 'codes':
-                available_codes = (await db.execute(
-                    select(func.count()).select_from(ItemCode).where(
-                        ItemCode.item_id == item.id,
-                        ItemCode.is_sold == False
-                    )
-                )).scalar_one()
-                
-                if available_codes < 1:
-                    await call.answer(f"❌ Товар '{item.title}' закончился", show_alert=True)
-                    return
+        # Проверка наличия: коды цифровых товаров и оффлайн-товары с учётом остатков — одним запросом к счётчикам
+        tracked = [it for it in items if tracks_stock(it)]
+        levels = await stock_levels(db, (it.id for it in tracked))
+        for item in tracked:
+            if levels.get(item.id, 0) < 1:
+                await call.answer(f"❌ Товар '{item.title}' закончился", show_alert=True)
+                return
         
         total_amount = sum(it.price_minor for it in items)
         
@@ -386,6 +349,7 @@ async def checkout_cart(call: CallbackQuery, state: FSMContext) -> None:
             payment_method=PaymentMethod.CARD_RF,
             status=OrderStatus.CREATED,
             buyer_tg_id=str(call.from_user.id),
+            idempotence_key=str(uuid.uuid4()),
         )
         db.add(order)
         await db.flush()
@@ -402,9 +366,16 @@ async def checkout_cart(call: CallbackQuery, state: FSMContext) -> None:
         
         await db.flush()
         
+        # Резерв кодов до создания платежа: проверка наличия выше не защищает от одновременных покупок
+        try:
+            await hold_for_checkout(db, order, items)
+        except Exception as e:
+            await call.answer(payment_error_text(e), show_alert=True)
+            return
+        
         client = YooKassaClient()
         try:
-            idem = str(uuid.uuid4())
+            idem = order.idempotence_key
             templates = load_texts().get("payment", {}).get("description_templates", {})
             description = (templates.get("cart") or "Оплата корзины | Заказ {order_id}").format(order_id=order.id)
             
@@ -419,10 +390,11 @@ async def checkout_cart(call: CallbackQuery, state: FSMContext) -> None:
             )
             url = (resp or {}).get("confirmation", {}).get("confirmation_url")
             if not url:
-                await db.rollback()
+                await release_checkout(db, order)
                 await call.message.answer("Не удалось создать заказ. Попробуйте позже.")
                 return
             
+            await record_checkout(db, items)
             order.fk_order_id = resp.get("id")
             order.fk_payment_url = url
             order.status = OrderStatus.PENDING
@@ -450,9 +422,9 @@ async def checkout_cart(call: CallbackQuery, state: FSMContext) -> None:
             except Exception:
                 await call.message.answer("Ссылка на оплату:", reply_markup=payment_link_kb(url))
         except Exception as e:
-            await db.rollback()
+            await release_checkout(db, order)
             logger.error(f"Error creating cart order: {e}")
-            await call.message.answer("Не удалось создать заказ. Попробуйте позже.")
+            await call.message.answer(payment_error_text(e))
         finally:
             await client.close()
     
@@ -460,7 +432,7 @@ async def checkout_cart(call: CallbackQuery, state: FSMContext) -> None:
 
 
 @router.callback_query(F.data == "cart:checkout:confirm")
-async def cart_checkout_confirm(call: CallbackQuery, state: FSMContext) -> None:
+async def cart_checkout_confirm(call: CallbackQuery, state: FSMContext, user: BotUser | None = None) -> None:
     """Подтверждение оформления корзины с уже купленными товарами"""
     data = await state.get_data()
     cart_item_ids = data.get("cart_item_ids", [])
@@ -474,14 +446,14 @@ async def cart_checkout_confirm(call: CallbackQuery, state: FSMContext) -> None:
     await state.update_data(confirmed_repurchase=True, cart_checkout_pending=False)
     
     # Вызываем оригинальную логику оформления заказа
-    await checkout_cart(call, state)
+    await checkout_cart(call, state, user)
 
 
 @router.callback_query(F.data == "cart:checkout:cancel")
-async def cart_checkout_cancel(call: CallbackQuery, state: FSMContext) -> None:
+async def cart_checkout_cancel(call: CallbackQuery, state: FSMContext, user: BotUser | None = None) -> None:
     """Отмена оформления корзины"""
     await state.clear()
     
     # Возвращаемся к корзине
     from .cart import show_cart
-    await show_cart(call)
+    await show_cart(call, user)
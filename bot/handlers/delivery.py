@@ -13,9 +13,13 @@ from sqlalchemy import select, delete
 from app.utils.texts import load_texts
 from bot.keyboards import skip_kb, payment_link_kb
 from app.db.session import AsyncSessionLocal
-from app.models import Item, ItemType, User, Order, Purchase, CartItem, PaymentMethod, OrderStatus
+from app.models import Item, ItemType, Order, Purchase, CartItem, PaymentMethod, OrderStatus
 from app.config import settings
 from app.services.yookassa import YooKassaClient
+from app.services.orders import hold_for_checkout, payment_error_text, release_checkout
+from app.services.stats import record_checkout
+from bot.send_scheduler import SendPriority, send_priority
+from bot.user_middleware import BotUser
 
 logger = logging.getLogger("shopbot")
 router = Router()
@@ -52,11 +56,12 @@ async def send_offline_order_to_admin(order_id: int, items: list, delivery_data:
         message += f"💬 Комментарий: {delivery_data['comment']}\n"
     
     try:
-        await bot.send_message(
-            chat_id=int(settings.admin_chat_id),
-            text=message,
-            parse_mode="Markdown"
-        )
+        with send_priority(SendPriority.NOTIFICATION):
+            await bot.send_message(
+                chat_id=int(settings.admin_chat_id),
+                text=message,
+                parse_mode="Markdown"
+            )
         logger.info(f"Sent offline order notification to admin for order #{order_id}")
     except Exception as e:
         logger.error(f"Failed to send offline order notification: {e}")
@@ -122,8 +127,8 @@ async def cb_buy_direct(call: CallbackQuery, state: FSMContext) -> None:
                         await call.message.edit_text("Перейдите к оплате:", reply_markup=payment_link_kb(url))
                 except Exception:
                     await call.message.answer("Ссылка на оплату:", reply_markup=payment_link_kb(url))
-        except Exception:
-            await call.message.answer("Не удалось создать заказ. Попробуйте позже.")
+        except Exception as e:
+            await call.message.answer(payment_error_text(e))
     await call.answer()
 
 
@@ -187,7 +192,7 @@ async def skip_address(call: CallbackQuery, state: FSMContext) -> None:
 
 
 @router.callback_query(F.data == "skip_comment", OfflineDeliveryStates.waiting_for_comment)
-async def skip_comment(call: CallbackQuery, state: FSMContext) -> None:
+async def skip_comment(call: CallbackQuery, state: FSMContext, user: BotUser | None = None) -> None:
     """Пропуск ввода комментария"""
     await state.update_data(delivery_comment="")
     
@@ -196,9 +201,9 @@ async def skip_comment(call: CallbackQuery, state: FSMContext) -> None:
     
     # ✅ ИСПРАВЛЕНО: Используем специальные функции для callback
     if quick_buy_item_id:
-        await process_quick_offline_purchase_from_callback(call, state, data, quick_buy_item_id)
+        await process_quick_offline_purchase_from_callback(call, state, data, quick_buy_item_id, user)
     else:
-        await process_cart_offline_purchase_from_callback(call, state, data)
+        await process_cart_offline_purchase_from_callback(call, state, data, user)
     
     await state.clear()
     await call.answer()
@@ -269,7 +274,7 @@ async def offline_capture_address(message: Message, state: FSMContext) -> None:
 
 
 @router.message(OfflineDeliveryStates.waiting_for_comment)
-async def offline_capture_comment(message: Message, state: FSMContext) -> None:
+async def offline_capture_comment(message: Message, state: FSMContext, user: BotUser | None = None) -> None:
     """Обработка ввода комментария"""
     comment = (message.text or "").strip()
     
@@ -282,18 +287,17 @@ async def offline_capture_comment(message: Message, state: FSMContext) -> None:
     
     if quick_buy_item_id:
         # Быстрая покупка одного товара
-        await process_quick_offline_purchase(message, state, data, quick_buy_item_id)
+        await process_quick_offline_purchase(message, state, data, quick_buy_item_id, user)
     else:
         # Корзина
-        await process_cart_offline_purchase(message, state, data)
+        await process_cart_offline_purchase(message, state, data, user)
     
     await state.clear()
 
 
-async def process_quick_offline_purchase(message: Message, state: FSMContext, data: dict, item_id: int) -> None:
+async def process_quick_offline_purchase(message: Message, state: FSMContext, data: dict, item_id: int, user: BotUser | None) -> None:
     """Обработка быстрой покупки физического товара"""
     async with AsyncSessionLocal() as db:
-        user = (await db.execute(select(User).where(User.tg_id == message.from_user.id))).scalar_one_or_none()
         if not user:
             await message.answer("Пользователь не найден")
             return
@@ -312,6 +316,7 @@ async def process_quick_offline_purchase(message: Message, state: FSMContext, da
             payment_method=PaymentMethod.CARD_RF,
             status=OrderStatus.CREATED,
             buyer_tg_id=str(message.from_user.id),
+            idempotence_key=str(uuid.uuid4()),
         )
         db.add(order)
         await db.flush()
@@ -330,10 +335,17 @@ async def process_quick_offline_purchase(message: Message, state: FSMContext, da
         db.add(purchase)
         await db.flush()
         
+        # Резерв товара до создания платежа (см. hold_for_checkout)
+        try:
+            await hold_for_checkout(db, order, [item])
+        except Exception as e:
+            await message.answer(payment_error_text(e))
+            return
+        
         # Создаем платёж через YooKassa
         client = YooKassaClient()
         try:
-            idem = str(uuid.uuid4())
+            idem = order.idempotence_key
             templates = load_texts().get("payment", {}).get("description_templates", {})
             description = (templates.get("offline") or "Оплата: {title} | Заказ {order_id}").format(
                 title=item.title,
@@ -352,10 +364,11 @@ async def process_quick_offline_purchase(message: Message, state: FSMContext, da
             
             url = (resp or {}).get("confirmation", {}).get("confirmation_url")
             if not url:
-                await db.rollback()
+                await release_checkout(db, order)
                 await message.answer("Не удалось создать заказ. Попробуйте позже.")
                 return
             
+            await record_checkout(db, [item])
             order.fk_order_id = resp.get("id")
             order.fk_payment_url = url
             order.status = OrderStatus.PENDING
@@ -364,20 +377,19 @@ async def process_quick_offline_purchase(message: Message, state: FSMContext, da
             
             await message.answer("✅ Данные сохранены. Перейдите к оплате:", reply_markup=payment_link_kb(url))
         except Exception as e:
-            await db.rollback()
+            await release_checkout(db, order)
             logger.error(f"Error creating offline order: {e}")
-            await message.answer("Не удалось создать заказ. Попробуйте позже.")
+            await message.answer(payment_error_text(e))
         finally:
             await client.close()
 
 
-async def process_cart_offline_purchase(message: Message, state: FSMContext, data: dict) -> None:
+async def process_cart_offline_purchase(message: Message, state: FSMContext, data: dict, user: BotUser | None) -> None:
     """Обработка оплаты корзины с физическими товарами"""
     cart_items = data.get("cart_items")
     total_amount = data.get("total_amount", 0)
     
     async with AsyncSessionLocal() as db:
-        user = (await db.execute(select(User).where(User.tg_id == message.from_user.id))).scalar_one_or_none()
         if not user:
             await message.answer("Пользователь не найден")
             return
@@ -391,6 +403,7 @@ async def process_cart_offline_purchase(message: Message, state: FSMContext, dat
             payment_method=PaymentMethod.CARD_RF,
             status=OrderStatus.CREATED,
             buyer_tg_id=str(message.from_user.id),
+            idempotence_key=str(uuid.uuid4()),
         )
         db.add(order)
         await db.flush()
@@ -411,15 +424,23 @@ async def process_cart_offline_purchase(message: Message, state: FSMContext, dat
         
         await db.flush()
         
+        # Резерв товара до создания платежа, по единице на позицию корзины
+        items = (await db.execute(select(Item).where(Item.id.in_(cart_items)))).scalars().all()
+        items_by_id = {it.id: it for it in items}
+        order_items = [items_by_id[i] for i in cart_items if i in items_by_id]
+        try:
+            await hold_for_checkout(db, order, order_items)
+        except Exception as e:
+            await message.answer(payment_error_text(e))
+            return
+        
         # Создаём платёж через YooKassa
         client = YooKassaClient()
         try:
-            idem = str(uuid.uuid4())
+            idem = order.idempotence_key
             templates = load_texts().get("payment", {}).get("description_templates", {})
             description = (templates.get("cart") or "Оплата корзины | Заказ {order_id}").format(order_id=order.id)
             
-            items = (await db.execute(select(Item).where(Item.id.in_(cart_items)))).scalars().all()
-            
             # ✅ ИСПРАВЛЕНО: используем правильный ключ metadata для оффлайн заказов
             resp = await client.create_payment(
                 amount_minor=total_amount,
@@ -433,10 +454,11 @@ async def process_cart_offline_purchase(message: Message, state: FSMContext, dat
             
             url = (resp or {}).get("confirmation", {}).get("confirmation_url")
             if not url:
-                await db.rollback()
+                await release_checkout(db, order)
                 await message.answer("Не удалось создать заказ. Попробуйте позже.")
                 return
             
+            await record_checkout(db, order_items)
             order.fk_order_id = resp.get("id")
             order.fk_payment_url = url
             order.status = OrderStatus.PENDING
@@ -449,17 +471,16 @@ async def process_cart_offline_purchase(message: Message, state: FSMContext, dat
             
             await message.answer("✅ Данные сохранены. Перейдите к оплате:", reply_markup=payment_link_kb(url))
         except Exception as e:
-            await db.rollback()
+            await release_checkout(db, order)
             logger.error(f"Error creating cart offline order: {e}")
-            await message.answer("Не удалось создать заказ. Попробуйте позже.")
+            await message.answer(payment_error_text(e))
         finally:
             await client.close()
 
 
-async def process_quick_offline_purchase_from_callback(call: CallbackQuery, state: FSMContext, data: dict, item_id: int) -> None:
+async def process_quick_offline_purchase_from_callback(call: CallbackQuery, state: FSMContext, data: dict, item_id: int, user: BotUser | None) -> None:
     """Обработка быстрой покупки физического товара из callback"""
     async with AsyncSessionLocal() as db:
-        user = (await db.execute(select(User).where(User.tg_id == call.from_user.id))).scalar_one_or_none()
         if not user:
             await call.message.answer("Пользователь не найден")
             return
@@ -478,6 +499,7 @@ async def process_quick_offline_purchase_from_callback(call: CallbackQuery, stat
             payment_method=PaymentMethod.CARD_RF,
             status=OrderStatus.CREATED,
             buyer_tg_id=str(call.from_user.id),
+            idempotence_key=str(uuid.uuid4()),
         )
         db.add(order)
         await db.flush()
@@ -496,10 +518,17 @@ async def process_quick_offline_purchase_from_callback(call: CallbackQuery, stat
         db.add(purchase)
         await db.flush()
         
+        # Резерв товара до создания платежа (см. hold_for_checkout)
+        try:
+            await hold_for_checkout(db, order, [item])
+        except Exception as e:
+            await call.message.answer(payment_error_text(e))
+            return
+        
         # Создаем платёж через YooKassa
         client = YooKassaClient()
         try:
-            idem = str(uuid.uuid4())
+            idem = order.idempotence_key
             templates = load_texts().get("payment", {}).get("description_templates", {})
             description = (templates.get("offline") or "Оплата: {title} | Заказ {order_id}").format(
                 title=item.title,
@@ -518,10 +547,11 @@ async def process_quick_offline_purchase_from_callback(call: CallbackQuery, stat
             
             url = (resp or {}).get("confirmation", {}).get("confirmation_url")
             if not url:
-                await db.rollback()
+                await release_checkout(db, order)
                 await call.message.answer("Не удалось создать заказ. Попробуйте позже.")
                 return
             
+            await record_checkout(db, [item])
             order.fk_order_id = resp.get("id")
             order.fk_payment_url = url
             order.status = OrderStatus.PENDING
@@ -530,20 +560,19 @@ async def process_quick_offline_purchase_from_callback(call: CallbackQuery, stat
             
             await call.message.answer("✅ Данные сохранены. Перейдите к оплате:", reply_markup=payment_link_kb(url))
         except Exception as e:
-            await db.rollback()
+            await release_checkout(db, order)
             logger.error(f"Error creating offline order: {e}")
-            await call.message.answer("Не удалось создать заказ. Попробуйте позже.")
+            await call.message.answer(payment_error_text(e))
         finally:
             await client.close()
 
 
-async def process_cart_offline_purchase_from_callback(call: CallbackQuery, state: FSMContext, data: dict) -> None:
+async def process_cart_offline_purchase_from_callback(call: CallbackQuery, state: FSMContext, data: dict, user: BotUser | None) -> None:
     """Обработка оплаты корзины с физическими товарами из callback"""
     cart_items = data.get("cart_items")
     total_amount = data.get("total_amount", 0)
     
     async with AsyncSessionLocal() as db:
-        user = (await db.execute(select(User).where(User.tg_id == call.from_user.id))).scalar_one_or_none()
         if not user:
             await call.message.answer("Пользователь не найден")
             return
@@ -557,6 +586,7 @@ async def process_cart_offline_purchase_from_callback(call: CallbackQuery, state
             payment_method=PaymentMethod.CARD_RF,
             status=OrderStatus.CREATED,
             buyer_tg_id=str(call.from_user.id),
+            idempotence_key=str(uuid.uuid4()),
         )
         db.add(order)
         await db.flush()
@@ -577,15 +607,23 @@ async def process_cart_offline_purchase_from_callback(call: CallbackQuery, state
         
         await db.flush()
         
+        # Резерв товара до создания платежа, по единице на позицию корзины
+        items = (await db.execute(select(Item).where(Item.id.in_(cart_items)))).scalars().all()
+        items_by_id = {it.id: it for it in items}
+        order_items = [items_by_id[i] for i in cart_items if i in items_by_id]
+        try:
+            await hold_for_checkout(db, order, order_items)
+        except Exception as e:
+            await call.message.answer(payment_error_text(e))
+            return
+        
         # Создаём платёж через YooKassa
         client = YooKassaClient()
         try:
-            idem = str(uuid.uuid4())
+            idem = order.idempotence_key
             templates = load_texts().get("payment", {}).get("description_templates", {})
             description = (templates.get("cart") or "Оплата корзины | Заказ {order_id}").format(order_id=order.id)
             
-            items = (await db.execute(select(Item).where(Item.id.in_(cart_items)))).scalars().all()
-            
             resp = await client.create_payment(
                 amount_minor=total_amount,
                 description=description,
@@ -598,10 +636,11 @@ async def process_cart_offline_purchase_from_callback(call: CallbackQuery, state
             
             url = (resp or {}).get("confirmation", {}).get("confirmation_url")
             if not url:
-                await db.rollback()
+                await release_checkout(db, order)
                 await call.message.answer("Не удалось создать заказ. Попробуйте позже.")
                 return
             
+            await record_checkout(db, order_items)
             order.fk_order_id = resp.get("id")
             order.fk_payment_url = url
             order.status = OrderStatus.PENDING
@@ -614,8 +653,8 @@ async def process_cart_offline_purchase_from_callback(call: CallbackQuery, state
             
             await call.message.answer("✅ Данные сохранены. Перейдите к оплате:", reply_markup=payment_link_kb(url))
         except Exception as e:
-            await db.rollback()
+            await release_checkout(db, order)
             logger.error(f"Error creating cart offline order: {e}")
-            await call.message.answer("Не удалось создать заказ. Попробуйте позже.")
+            await call.message.answer(payment_error_text(e))
         finally:
             await client.close()
\ No newline at end of file
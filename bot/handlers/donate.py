@@ -6,13 +6,15 @@ import contextlib
 from pathlib import Path
 
 from aiogram import Router, F
-from aiogram.types import CallbackQuery, Message, FSInputFile, InputMediaPhoto
+from aiogram.types import CallbackQuery, Message, InputMediaPhoto
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 
 from app.utils.texts import load_texts
 from bot.keyboards import back_kb, payment_link_kb
 from app.services.orders_client import OrdersClient
+from app.services.orders import payment_error_text
+from app.services.media_cache import media_cache
 
 logger = logging.getLogger("shopbot")
 router = Router()
@@ -50,7 +52,7 @@ async def donate_set_amount(call: CallbackQuery) -> None:
                     await call.message.answer("Ссылка на оплату:", reply_markup=payment_link_kb(url))
         except Exception as e:
             logger.error(f"Failed to create donate order: {e}")
-            await call.message.answer("Не удалось создать донат. Попробуйте позже.")
+            await call.message.answer(payment_error_text(e, "Не удалось создать донат. Попробуйте позже."))
     await call.answer()
 
 
@@ -71,7 +73,7 @@ async def donate_custom_prompt(call: CallbackQuery, state: FSMContext) -> None:
             # Если текстовое - удаляем и создаем с фото
             if image_exists:
                 await call.message.delete()
-                photo = FSInputFile(donate_image)
+                photo = await media_cache.resolve(donate_image)
                 await call.message.answer_photo(
                     photo=photo, 
                     caption="Введите сумму в рублях:", 
@@ -110,6 +112,6 @@ async def donate_custom_amount(message: Message, state: FSMContext) -> None:
             await message.answer(thanks, reply_markup=payment_link_kb(url))
         except Exception as e:
             logger.error(f"Failed to create custom donate order: {e}")
-            await message.answer("Не удалось создать донат. Попробуйте позже.")
+            await message.answer(payment_error_text(e, "Не удалось создать донат. Попробуйте позже."))
     
     await state.clear()
@@ -5,12 +5,12 @@ import logging
 from pathlib import Path
 
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, FSInputFile, InputMediaPhoto, InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.types import Message, CallbackQuery, InputMediaPhoto, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.filters import StateFilter
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
-from sqlalchemy import select, func
+from sqlalchemy import select
 
 from app.utils.texts import load_texts
 from bot.keyboards import (
@@ -18,9 +18,13 @@ from bot.keyboards import (
     main_menu_only_kb, payment_link_kb
 )
 from app.db.session import AsyncSessionLocal
-from app.models import Item, ItemType, User, Purchase, CartItem
+from app.models import ItemType, Purchase
 from app.config import settings
 from app.services.orders_client import OrdersClient
+from app.services.orders import payment_error_text
+from app.services.catalog import catalog_cache, load_item_card
+from app.services.media_cache import media_cache
+from bot.user_middleware import BotUser, user_cache
 
 logger = logging.getLogger("shopbot")
 router = Router()
@@ -43,29 +47,27 @@ def repurchase_confirmation_kb(item_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 
-async def list_items(message: Message, item_type: ItemType, section: str = None, call: CallbackQuery = None, page: int = 1, page_size: int = 5) -> None:
-    """Отображение списка товаров"""
+async def list_items(message: Message, item_type: ItemType, section: str = None, call: CallbackQuery = None, cursor: str | None = None, page_size: int = 5) -> None:
+    """Отображение списка товаров; cursor — курсор страницы из callback_data (пустой — первая страница)"""
     texts = load_texts()
     
-    async with AsyncSessionLocal() as db:
-        base_stmt = select(Item).where(Item.item_type == item_type, Item.is_visible == True)
-        total = (await db.execute(select(func.count()).select_from(base_stmt.subquery()))).scalar_one()
-        items = (await db.execute(
-            base_stmt.order_by(Item.id.desc()).offset((page-1)*page_size).limit(page_size)
-        )).scalars().all()
-        
-        purchased_ids: set[int] = set()
-        try:
-            tg = message.chat.id if message else (call.from_user.id if call else None)
-            if tg:
-                user = (await db.execute(select(User).where(User.tg_id == tg))).scalar_one_or_none()
-                if user:
-                    purchases = (await db.execute(
-                        select(Purchase.item_id).where(Purchase.user_id == user.id)
-                    )).scalars().all()
-                    purchased_ids = set(int(x) for x in purchases if x)
-        except Exception:
-            purchased_ids = set()
+    # Витрина — из кэша каталога, без запроса к items
+    page = await catalog_cache.page(item_type, cursor, page_size)
+    items = page.rows
+
+    purchased_ids: set[int] = set()
+    try:
+        tg = message.chat.id if message else (call.from_user.id if call else None)
+        # list_items вызывается из разных обработчиков — пользователь из общего кэша middleware
+        user = await user_cache.resolve(tg) if tg else None
+        if user:
+            async with AsyncSessionLocal() as db:
+                purchases = (await db.execute(
+                    select(Purchase.item_id).where(Purchase.user_id == user.id)
+                )).scalars().all()
+            purchased_ids = set(int(x) for x in purchases if x)
+    except Exception:
+        purchased_ids = set()
     
     if not items:
         empty_key = {
@@ -102,69 +104,68 @@ async def list_items(message: Message, item_type: ItemType, section: str = None,
                     try:
                         await call.message.edit_caption(
                             caption=description,
-                            reply_markup=items_list_kb(items, item_type.value, purchased_ids, page=page, total=total, page_size=page_size)
+                            reply_markup=items_list_kb(items, item_type.value, purchased_ids, cursor=cursor or "", next_cursor=page.next_cursor, prev_cursor=page.prev_cursor)
                         )
                     except TelegramBadRequest as e:
                         if "message is not modified" not in str(e):
                             logger.error(f"Ошибка редактирования caption: {e}")
                             # Если не получается отредактировать - удаляем и создаем новое
                             await call.message.delete()
-                            photo = FSInputFile(image_path)
+                            photo = await media_cache.resolve(image_path)
                             await call.message.answer_photo(
                                 photo=photo,
                                 caption=description,
-                                reply_markup=items_list_kb(items, item_type.value, purchased_ids, page=page, total=total, page_size=page_size)
+                                reply_markup=items_list_kb(items, item_type.value, purchased_ids, cursor=cursor or "", next_cursor=page.next_cursor, prev_cursor=page.prev_cursor)
                             )
                 else:
                     # Если у сообщения нет фото - удаляем текстовое и создаем с фото
                     await call.message.delete()
-                    photo = FSInputFile(image_path)
+                    photo = await media_cache.resolve(image_path)
                     await call.message.answer_photo(
                         photo=photo,
                         caption=description,
-                        reply_markup=items_list_kb(items, item_type.value, purchased_ids, page=page, total=total, page_size=page_size)
+                        reply_markup=items_list_kb(items, item_type.value, purchased_ids, cursor=cursor or "", next_cursor=page.next_cursor, prev_cursor=page.prev_cursor)
                     )
             else:
                 try:
                     await call.message.edit_text(
                         text=description,
-                        reply_markup=items_list_kb(items, item_type.value, purchased_ids, page=page, total=total, page_size=page_size)
+                        reply_markup=items_list_kb(items, item_type.value, purchased_ids, cursor=cursor or "", next_cursor=page.next_cursor, prev_cursor=page.prev_cursor)
                     )
                 except TelegramBadRequest as e:
                     if "message is not modified" not in str(e):
                         raise
         else:
             if image_path and Path(image_path).is_file():
-                photo = FSInputFile(image_path)
+                photo = await media_cache.resolve(image_path)
                 await message.answer_photo(
                     photo=photo,
                     caption=description,
-                    reply_markup=items_list_kb(items, item_type.value, purchased_ids, page=page, total=total, page_size=page_size)
+                    reply_markup=items_list_kb(items, item_type.value, purchased_ids, cursor=cursor or "", next_cursor=page.next_cursor, prev_cursor=page.prev_cursor)
                 )
             else:
                 await message.answer(
                     text=description,
-                    reply_markup=items_list_kb(items, item_type.value, purchased_ids, page=page, total=total, page_size=page_size)
+                    reply_markup=items_list_kb(items, item_type.value, purchased_ids, cursor=cursor or "", next_cursor=page.next_cursor, prev_cursor=page.prev_cursor)
                 )
     except FileNotFoundError:
         if call:
             try:
-                await call.message.edit_text(description, reply_markup=items_list_kb(items, item_type.value, purchased_ids, page=page, total=total, page_size=page_size))
+                await call.message.edit_text(description, reply_markup=items_list_kb(items, item_type.value, purchased_ids, cursor=cursor or "", next_cursor=page.next_cursor, prev_cursor=page.prev_cursor))
             except TelegramBadRequest as e:
                 if "message is not modified" not in str(e):
                     raise
         else:
-            await message.answer(description, reply_markup=items_list_kb(items, item_type.value, purchased_ids, page=page, total=total, page_size=page_size))
+            await message.answer(description, reply_markup=items_list_kb(items, item_type.value, purchased_ids, cursor=cursor or "", next_cursor=page.next_cursor, prev_cursor=page.prev_cursor))
 
 
 @router.callback_query(F.data.startswith("list:"))
 async def list_pagination(call: CallbackQuery) -> None:
     """Пагинация списков товаров"""
     try:
-        _, type_str, page_str = call.data.split(":", 2)
-        page_num = int(page_str) if page_str.isdigit() else 1
+        _, type_str, cursor = call.data.split(":", 2)
     except Exception:
-        page_num = 1
+        cursor = None
         type_str = "digital"
     
     mapping = {
@@ -175,96 +176,70 @@ async def list_pagination(call: CallbackQuery) -> None:
     
     if type_str in mapping:
         itype, section = mapping[type_str]
-        await list_items(call.message, itype, section=section, call=call, page=page_num)
+        await list_items(call.message, itype, section=section, call=call, cursor=cursor)
     await call.answer()
 
 
 @router.callback_query(F.data.startswith("item:"))
-async def show_item(call: CallbackQuery) -> None:
+async def show_item(call: CallbackQuery, user: BotUser | None = None) -> None:
     """Отображение карточки товара"""
     parts = call.data.split(":")
     item_id = parts[1]
     item_type = parts[2] if len(parts) > 2 else None
-    page_from = int(parts[3]) if len(parts) > 3 and parts[3].isdigit() else 1
+    cursor_from = parts[3] if len(parts) > 3 else ""
     
     logger.info("Карточка товара: callback получен, item_id=%s, type=%s", item_id, item_type)
     
-    async with AsyncSessionLocal() as db:
-        item = (await db.execute(select(Item).where(Item.id == int(item_id)))).scalar_one_or_none()
-        purchased = False
-        in_cart = False
-        
-        try:
-            user = (await db.execute(select(User).where(User.tg_id == call.from_user.id))).scalar_one_or_none()
-            if user:
-                purchased = (await db.execute(
-                    select(Purchase).where(Purchase.user_id == user.id, Purchase.item_id == int(item_id))
-                )).first() is not None
-                in_cart = (await db.execute(
-                    select(CartItem).where(CartItem.user_id == user.id, CartItem.item_id == int(item_id))
-                )).scalar_one_or_none() is not None
-        except Exception:
-            purchased = False
-            in_cart = False
-        
-        if not item:
-            logger.error(f"Товар не найден: id={item_id}")
-            await call.answer(f"Товар не найден: id={item_id}", show_alert=True)
-            return
-        
-        caption = (
-            f"*{item.title}*\n\n"
-            f"{item.description}\n\n"
-            f"💰 Цена: `{item.price_minor/100:.2f}` ₽"
-        )
-        
-        # Добавляем информацию о том, что товар уже покупался
-        if purchased:
-            caption += "\n\n✅ _Вы уже покупали этот товар_"
-        
-        logger.info("Показываем карточку: %s (id=%s, type=%s)", item.title, item.id, item.item_type)
-        
-        try:
-            if call.message.photo:
-                media_source = None
-                if item.image_file_id:
-                    if item.image_file_id.startswith("http") or item.image_file_id.startswith("AgAC"):
-                        media_source = item.image_file_id
-                    elif Path(item.image_file_id).is_file():
-                        media_source = FSInputFile(item.image_file_id)
+    card = await load_item_card(int(item_id), user.id if user else None)
+    if card is None:
+        logger.error(f"Товар не найден: id={item_id}")
+        await call.answer(f"Товар не найден: id={item_id}", show_alert=True)
+        return
+    item, purchased, in_cart, caption = card.item, card.purchased, card.in_cart, card.caption
+    
+    logger.info("Показываем карточку: %s (id=%s, type=%s)", item.title, item.id, item.item_type)
+    
+    try:
+        if call.message.photo:
+            media_source = None
+            if item.image_file_id:
+                if item.image_file_id.startswith("http") or item.image_file_id.startswith("AgAC"):
+                    media_source = item.image_file_id
+                elif Path(item.image_file_id).is_file():
+                    media_source = await media_cache.resolve(item.image_file_id)
 
-                if not media_source:
-                    texts = load_texts()
-                    defaults = texts.get("defaults", {}).get("images", {})
-                    key = {
-                        ItemType.SERVICE: "service",
-                        ItemType.DIGITAL: "digital",
-                    }.get(item.item_type)
-                    default_path = defaults.get(key) if key else None
-                    if default_path and Path(default_path).is_file():
-                        media_source = FSInputFile(default_path)
+            if not media_source:
+                texts = load_texts()
+                defaults = texts.get("defaults", {}).get("images", {})
+                key = {
+                    ItemType.SERVICE: "service",
+                    ItemType.DIGITAL: "digital",
+                }.get(item.item_type)
+                default_path = defaults.get(key) if key else None
+                if default_path and Path(default_path).is_file():
+                    media_source = await media_cache.resolve(default_path)
 
-                if media_source:
-                    await call.message.edit_media(
-                        media=InputMediaPhoto(media=media_source, caption=caption, parse_mode="Markdown"),
-                        reply_markup=item_card_kb(item.id, item_type, purchased, from_purchased=(call.message.caption and "Ваши купленные проекты:" in call.message.caption), page=page_from, in_cart=in_cart)
-                    )
-                else:
-                    await call.message.edit_caption(
-                        caption=caption,
-                        parse_mode="Markdown",
-                        reply_markup=item_card_kb(item.id, item_type, purchased, from_purchased=(call.message.caption and "Ваши купленные проекты:" in call.message.caption), page=page_from, in_cart=in_cart)
-                    )
+            if media_source:
+                await call.message.edit_media(
+                    media=InputMediaPhoto(media=media_source, caption=caption, parse_mode="Markdown"),
+                    reply_markup=item_card_kb(item.id, item_type, purchased, from_purchased=(call.message.caption and "Ваши купленные проекты:" in call.message.caption), cursor=cursor_from, in_cart=in_cart)
+                )
             else:
-                await call.message.edit_text(
-                    text=caption,
+                await call.message.edit_caption(
+                    caption=caption,
                     parse_mode="Markdown",
-                    reply_markup=item_card_kb(item.id, item_type, purchased, from_purchased=False, page=page_from, in_cart=in_cart)
+                    reply_markup=item_card_kb(item.id, item_type, purchased, from_purchased=(call.message.caption and "Ваши купленные проекты:" in call.message.caption), cursor=cursor_from, in_cart=in_cart)
                 )
-        except Exception as e:
-            logger.error(f"Ошибка при показе карточки товара: {e}")
-            await call.answer("Ошибка при показе карточки товара", show_alert=True)
-        await call.answer()
+        else:
+            await call.message.edit_text(
+                text=caption,
+                parse_mode="Markdown",
+                reply_markup=item_card_kb(item.id, item_type, purchased, from_purchased=False, cursor=cursor_from, in_cart=in_cart)
+            )
+    except Exception as e:
+        logger.error(f"Ошибка при показе карточки товара: {e}")
+        await call.answer("Ошибка при показе карточки товара", show_alert=True)
+    await call.answer()
 
 
 @router.callback_query(F.data.startswith("buy:"))
@@ -276,14 +251,13 @@ async def cb_buy(call: CallbackQuery) -> None:
 
 
 @router.callback_query(F.data.startswith("buy_one:"))
-async def cb_buy_one(call: CallbackQuery, state: FSMContext) -> None:
+async def cb_buy_one(call: CallbackQuery, state: FSMContext, user: BotUser | None = None) -> None:
     """Быстрая покупка одного товара с проверкой на повторную покупку"""
     _, item_id = call.data.split(":")
     item_id_int = int(item_id)
  
     # Проверяем, покупал ли пользователь этот товар ранее
     async with AsyncSessionLocal() as db:
-        user = (await db.execute(select(User).where(User.tg_id == call.from_user.id))).scalar_one_or_none()
         if user:
             purchased = (await db.execute(
                 select(Purchase).where(Purchase.user_id == user.id, Purchase.item_id == item_id_int)
@@ -330,7 +304,7 @@ async def repurchase_confirm(call: CallbackQuery, state: FSMContext) -> None:
 
 
 @router.callback_query(F.data.startswith("repurchase:cancel:"))
-async def repurchase_cancel(call: CallbackQuery, state: FSMContext) -> None:
+async def repurchase_cancel(call: CallbackQuery, state: FSMContext, user: BotUser | None = None) -> None:
     """Отмена повторной покупки"""
     _, _, item_id = call.data.split(":")
     item_id_int = int(item_id)
@@ -338,48 +312,20 @@ async def repurchase_cancel(call: CallbackQuery, state: FSMContext) -> None:
     await state.clear()
     
     # Возвращаемся к карточке товара
-    async with AsyncSessionLocal() as db:
-        item = (await db.execute(select(Item).where(Item.id == item_id_int))).scalar_one_or_none()
-        user = (await db.execute(select(User).where(User.tg_id == call.from_user.id))).scalar_one_or_none()
-        
-        if not item:
-            await call.answer("Товар не найден", show_alert=True)
-            return
+    card = await load_item_card(item_id_int, user.id if user else None)
+    if card is None:
+        await call.answer("Товар не найден", show_alert=True)
+        return
 
-        purchased = False
-        in_cart = False
-        if user:
-            purchased = (await db.execute(
-                select(Purchase).where(Purchase.user_id == user.id, Purchase.item_id == item_id_int)
-            )).first() is not None
-            in_cart = (await db.execute(
-                select(CartItem).where(CartItem.user_id == user.id, CartItem.item_id == item_id_int)
-            )).scalar_one_or_none() is not None
-        
-        caption = (
-            f"*{item.title}*\n\n"
-            f"{item.description}\n\n"
-            f"💰 Цена: `{item.price_minor/100:.2f}` ₽"
-        )
-        
-        if purchased:
-            caption += "\n\n✅ _Вы уже покупали этот товар_"
-        
-        try:
-            if call.message.photo:
-                await call.message.edit_caption(
-                    caption=caption,
-                    parse_mode="Markdown",
-                    reply_markup=item_card_kb(item.id, item.item_type.value, purchased, from_purchased=False, page=1, in_cart=in_cart)
-                )
-            else:
-                await call.message.edit_text(
-                    text=caption,
-                    parse_mode="Markdown",
-                    reply_markup=item_card_kb(item.id, item.item_type.value, purchased, from_purchased=False, page=1, in_cart=in_cart)
-                )
-        except Exception:
-            pass
+    item = card.item
+    kb = item_card_kb(item.id, item.item_type.value, card.purchased, from_purchased=False, in_cart=card.in_cart)
+    try:
+        if call.message.photo:
+            await call.message.edit_caption(caption=card.caption, parse_mode="Markdown", reply_markup=kb)
+        else:
+            await call.message.edit_text(text=card.caption, parse_mode="Markdown", reply_markup=kb)
+    except Exception:
+        pass
     
     await call.answer("Покупка отменена")
 
@@ -399,8 +345,8 @@ async def create_order_for_item(call: CallbackQuery, item_id: int) -> None:
                         await call.message.edit_text("Перейдите к оплате:", reply_markup=payment_link_kb(url))
                 except Exception:
                     await call.message.answer("Ссылка на оплату:", reply_markup=payment_link_kb(url))
-        except Exception:
-            await call.message.answer("Не удалось создать заказ. Попробуйте позже.")
+        except Exception as e:
+            await call.message.answer(payment_error_text(e))
 
 
 @router.message(StateFilter(None))
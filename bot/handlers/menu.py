@@ -6,14 +6,17 @@ import contextlib
 from pathlib import Path
 
 from aiogram import Router, F
-from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, FSInputFile, InputMediaPhoto
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
 from sqlalchemy import select, func
 
 from app.utils.texts import load_texts
 from bot.keyboards import main_menu_kb, back_kb, admin_menu_kb, donate_amounts_kb
 from app.db.session import AsyncSessionLocal
-from app.models import Item, ItemType, User, Purchase, CartItem
+from app.models import ItemType, Purchase, CartItem
 from app.config import settings
+from app.services.catalog import catalog_cache
+from app.services.media_cache import media_cache
+from bot.user_middleware import BotUser
 
 logger = logging.getLogger("shopbot")
 router = Router()
@@ -33,7 +36,7 @@ def _is_admin_user(tg_id: int | None, username: str | None) -> bool:
 
 
 @router.callback_query(F.data.startswith("menu:"))
-async def main_menu_callback(call: CallbackQuery) -> None:
+async def main_menu_callback(call: CallbackQuery, user: BotUser | None = None) -> None:
     """Обработчик inline-кнопок главного меню"""
     from .items import list_items  # Локальный импорт
     from .cart import show_cart
@@ -50,7 +53,7 @@ async def main_menu_callback(call: CallbackQuery) -> None:
 
     if data in section_mapping:
         item_type, section = section_mapping[data]
-        await list_items(call.message, item_type, section=section, call=call, page=1)
+        await list_items(call.message, item_type, section=section, call=call)
         await call.answer()
         return
     
@@ -74,7 +77,7 @@ async def main_menu_callback(call: CallbackQuery) -> None:
         return
 
     if data == "cart":
-        await show_cart(call)
+        await show_cart(call, user)
         return
 
     if data == "donate":
@@ -91,7 +94,7 @@ async def main_menu_callback(call: CallbackQuery) -> None:
                 # Если текстовое сообщение - удаляем и создаем новое с фото
                 if image_exists:
                     await call.message.delete()
-                    photo = FSInputFile(donate_image)
+                    photo = await media_cache.resolve(donate_image)
                     await call.message.answer_photo(
                         photo=photo, 
                         caption="Выберите сумму доната:", 
@@ -111,7 +114,6 @@ async def main_menu_callback(call: CallbackQuery) -> None:
 
     if data == "purchased":
         async with AsyncSessionLocal() as db:
-            user = (await db.execute(select(User).where(User.tg_id == call.from_user.id))).scalar_one_or_none()
             empty_text = texts.get("empty", {}).get("purchased", "У вас нет купленных проектов.")
             if not user:
                 await call.answer(empty_text, show_alert=True)
@@ -123,7 +125,7 @@ async def main_menu_callback(call: CallbackQuery) -> None:
                 return
             
             item_ids = [p.item_id for p in purchases if p.item_id is not None]
-            items = (await db.execute(select(Item).where(Item.id.in_(item_ids)))).scalars().all()
+            items = await catalog_cache.get_many(item_ids)
             
             kb = []
             for item in items:
@@ -144,7 +146,7 @@ async def main_menu_callback(call: CallbackQuery) -> None:
                     # Если текстовое - удаляем и создаем с фото
                     if image_path and Path(image_path).is_file():
                         await call.message.delete()
-                        photo = FSInputFile(image_path)
+                        photo = await media_cache.resolve(image_path)
                         await call.message.answer_photo(
                             photo=photo, 
                             caption=title, 
@@ -164,14 +166,14 @@ async def main_menu_callback(call: CallbackQuery) -> None:
 
 
 @router.callback_query(F.data.startswith("back:"))
-async def cb_back(call: CallbackQuery) -> None:
+async def cb_back(call: CallbackQuery, user: BotUser | None = None) -> None:
     """Обработчик кнопки 'Назад'"""
     from .items import list_items  # Локальный импорт
     
     parts = call.data.split(":")
     action = parts[1]
     item_type = parts[2] if len(parts) > 2 else None
-    page = int(parts[3]) if len(parts) > 3 and parts[3].isdigit() else 1
+    cursor = parts[3] if len(parts) > 3 else None
     texts = load_texts()
     
     if action == "list" and item_type:
@@ -185,13 +187,12 @@ async def cb_back(call: CallbackQuery) -> None:
         }
         item_type_enum = item_type_mapping.get(item_type)
         if item_type_enum:
-            await list_items(call.message, item_type_enum, section=section_mapping[item_type], call=call, page=page)
+            await list_items(call.message, item_type_enum, section=section_mapping[item_type], call=call, cursor=cursor)
             await call.answer()
             return
     
     if action == "purchased":
         async with AsyncSessionLocal() as db:
-            user = (await db.execute(select(User).where(User.tg_id == call.from_user.id))).scalar_one_or_none()
             empty_text = texts.get("empty", {}).get("purchased", "У вас нет купленных проектов.")
             if not user:
                 await call.answer(empty_text, show_alert=True)
@@ -203,7 +204,7 @@ async def cb_back(call: CallbackQuery) -> None:
                 return
             
             item_ids = [p.item_id for p in purchases if p.item_id is not None]
-            items = (await db.execute(select(Item).where(Item.id.in_(item_ids)))).scalars().all()
+            items = await catalog_cache.get_many(item_ids)
             
             kb = []
             for item in items:
@@ -224,7 +225,7 @@ async def cb_back(call: CallbackQuery) -> None:
                     # Если текстовое - удаляем и создаем с фото
                     if image_path and Path(image_path).is_file():
                         await call.message.delete()
-                        photo = FSInputFile(image_path)
+                        photo = await media_cache.resolve(image_path)
                         await call.message.answer_photo(
                             photo=photo, 
                             caption=title, 
@@ -244,7 +245,6 @@ async def cb_back(call: CallbackQuery) -> None:
     
     # Возврат в главное меню - получаем счетчик корзины
     async with AsyncSessionLocal() as db:
-        user = (await db.execute(select(User).where(User.tg_id == call.from_user.id))).scalar_one_or_none()
         cart_count = 0
         if user:
             cart_count = (await db.execute(
@@ -264,7 +264,7 @@ async def cb_back(call: CallbackQuery) -> None:
             # Если текстовое - удаляем и создаем с фото
             if image_path and Path(image_path).is_file():
                 await call.message.delete()
-                photo = FSInputFile(image_path)
+                photo = await media_cache.resolve(image_path)
                 await call.message.answer_photo(
                     photo=photo,
                     caption=texts["main_menu"]["title"],
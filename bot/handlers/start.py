@@ -2,17 +2,22 @@
 Обработчики команды /start и быстрых команд
 """
 import logging
+from datetime import datetime
 from pathlib import Path
 
 from aiogram import Router, F
-from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, FSInputFile
+from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup
 from sqlalchemy import select, func
 
 from app.utils.texts import load_texts
 from bot.keyboards import main_menu_kb, donate_amounts_kb
 from app.db.session import AsyncSessionLocal
-from app.models import Item, ItemType, User, Purchase, CartItem
+from app.models import ItemType, User, Purchase, CartItem
 from app.config import settings
+from app.services.media_cache import media_cache
+from app.services.stats import record_user_created
+from app.services.catalog import catalog_cache
+from bot.user_middleware import BotUser, new_user_notice, user_cache
 
 logger = logging.getLogger("shopbot")
 router = Router()
@@ -38,28 +43,31 @@ async def start_handler(message: Message) -> None:
 
     async with AsyncSessionLocal() as db:
         u = (await db.execute(select(User).where(User.tg_id == message.from_user.id))).scalar_one_or_none()
+        # Обычно пользователя уже зарегистрировал UserMiddleware; здесь — если база была недоступна ему
         if not u:
-            u = User(tg_id=message.from_user.id, username=message.from_user.username or None)
+            u = User(
+                tg_id=message.from_user.id,
+                username=message.from_user.username or None,
+                created_at=datetime.utcnow(),
+            )
             db.add(u)
             await db.flush()
+            await record_user_created(db)
             total = (await db.execute(select(func.count()).select_from(User))).scalar_one()
             if settings.admin_chat_id:
                 try:
-                    username = f"@{message.from_user.username}" if message.from_user.username else "—"
-                    text = (
-                        "✅ Новый пользователь\n"
-                        f"{message.from_user.full_name}\n"
-                        f"Username: {username}\n"
-                        f"ID: {message.from_user.id}\n"
-                        f"Всего: {total}"
-                    )
-                    await message.bot.send_message(int(settings.admin_chat_id), text)
+                    await message.bot.send_message(int(settings.admin_chat_id), new_user_notice(message.from_user, total))
                 except Exception:
                     pass
         else:
             if (message.from_user.username or None) != u.username:
                 u.username = message.from_user.username or None
+            if u.blocked_at is not None:
+                # Пользователь вернулся — снова включаем его в рассылки
+                u.blocked_at = None
         await db.commit()
+        # Следующие обновления этого пользователя middleware возьмёт из кэша
+        user_cache.remember(u)
         
         cart_count = (await db.execute(
             select(func.count()).select_from(CartItem).where(CartItem.user_id == u.id)
@@ -71,7 +79,7 @@ async def start_handler(message: Message) -> None:
     # Проверяем существование файла
     if image_path and Path(image_path).is_file():
         try:
-            photo = FSInputFile(image_path)
+            photo = await media_cache.resolve(image_path)
             await message.answer_photo(
                 photo=photo,
                 caption=texts["main_menu"]["title"],
@@ -98,28 +106,27 @@ async def start_handler(message: Message) -> None:
 
 
 @router.message(F.text.startswith("/"))
-async def quick_menu_commands(message: Message) -> None:
+async def quick_menu_commands(message: Message, user: BotUser | None = None) -> None:
     """Обработчик быстрых команд меню"""
     from .items import list_items  # Локальный импорт для избежания циклических зависимостей
     
     cmd = (message.text or "").strip().lstrip("/").lower()
     
     if cmd == "projects":
-        await list_items(message, ItemType.DIGITAL, section="projects", page=1)
+        await list_items(message, ItemType.DIGITAL, section="projects")
         return
     
     if cmd in ("products", "shop", "товары"):
-        await list_items(message, ItemType.OFFLINE, section="products", page=1)
+        await list_items(message, ItemType.OFFLINE, section="products")
         return
     
     if cmd == "services":
-        await list_items(message, ItemType.SERVICE, section="services", page=1)
+        await list_items(message, ItemType.SERVICE, section="services")
         return
     
     if cmd in ("buylist", "purchased", "my"):
         texts = load_texts()
         async with AsyncSessionLocal() as db:
-            user = (await db.execute(select(User).where(User.tg_id == message.from_user.id))).scalar_one_or_none()
             if not user:
                 await message.answer(texts.get("empty", {}).get("purchased", "У вас нет купленных проектов."))
                 return
@@ -130,7 +137,7 @@ async def quick_menu_commands(message: Message) -> None:
                 return
             
             item_ids = [p.item_id for p in purchases if p.item_id is not None]
-            items = (await db.execute(select(Item).where(Item.id.in_(item_ids)))).scalars().all()
+            items = await catalog_cache.get_many(item_ids)
         
         kb = []
         for it in items:
@@ -141,7 +148,7 @@ async def quick_menu_commands(message: Message) -> None:
         image_path = texts["main_menu"].get("images", {}).get("purchased")
         
         if image_path and Path(image_path).is_file():
-            photo = FSInputFile(image_path)
+            photo = await media_cache.resolve(image_path)
             await message.answer_photo(photo=photo, caption=title, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
         else:
             await message.answer(text=title, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
@@ -153,7 +160,7 @@ async def quick_menu_commands(message: Message) -> None:
         image_exists = bool(donate_image and Path(donate_image).is_file())
         
         if image_exists:
-            photo = FSInputFile(donate_image)
+            photo = await media_cache.resolve(donate_image)
             await message.answer_photo(photo=photo, caption="Выберите сумму доната:", reply_markup=donate_amounts_kb())
         else:
             await message.answer(text="Выберите сумму доната:", reply_markup=donate_amounts_kb())
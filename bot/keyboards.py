@@ -1,9 +1,84 @@
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Hashable, List, Optional, Set, Tuple
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from typing import List, Set
+from pydantic import field_serializer
 
-from app.utils.texts import load_texts
+from app.utils.texts import load_texts, texts_version, on_texts_reload
 from app.config import settings
 
+
+class SharedKeyboard(InlineKeyboardMarkup):
+    """Клавиатура из кэша: один экземпляр отдаётся многим обработчикам.
+
+    Ряды — кортежи, добавить или заменить кнопку на месте нельзя; чтобы изменить клавиатуру,
+    соберите новую: InlineKeyboardMarkup(inline_keyboard=[list(row) for row in kb.inline_keyboard] + [...])
+    """
+
+    inline_keyboard: Tuple[Tuple[InlineKeyboardButton, ...], ...]
+
+    @field_serializer("inline_keyboard")
+    def _rows_as_lists(self, rows: Tuple[Tuple[InlineKeyboardButton, ...], ...]) -> List[List[InlineKeyboardButton]]:
+        # Сессия aiogram чистит пустые поля кнопок только внутри списков
+        return [list(row) for row in rows]
+
+
+# Сколько разных клавиатур держать в памяти
+KEYBOARD_CACHE_SIZE = 2048
+
+_kb_cache: "OrderedDict[Hashable, SharedKeyboard]" = OrderedDict()
+_kb_stats = {"hits": 0, "misses": 0}
+
+# Новая версия texts.yml — все клавиатуры строятся заново
+on_texts_reload(lambda catalog: _kb_cache.clear())
+
+
+def _cached(key: Optional[Callable[..., Hashable]] = None) -> Callable:
+    """Мемоизация построителя клавиатуры по версии текстов и значимым аргументам (LRU на KEYBOARD_CACHE_SIZE)"""
+    def decorator(build: Callable[..., InlineKeyboardMarkup]) -> Callable[..., InlineKeyboardMarkup]:
+        @wraps(build)
+        def wrapper(*args: Any, **kwargs: Any) -> InlineKeyboardMarkup:
+            parts = key(*args, **kwargs) if key else (args, tuple(sorted(kwargs.items())))
+            cache_key = (build.__name__, texts_version(), parts)
+            markup = _kb_cache.get(cache_key)
+            if markup is not None:
+                _kb_cache.move_to_end(cache_key)
+                _kb_stats["hits"] += 1
+                return markup
+            _kb_stats["misses"] += 1
+            rows = build(*args, **kwargs).inline_keyboard
+            markup = SharedKeyboard(inline_keyboard=tuple(tuple(row) for row in rows))
+            _kb_cache[cache_key] = markup
+            if len(_kb_cache) > KEYBOARD_CACHE_SIZE:
+                _kb_cache.popitem(last=False)
+            return markup
+        return wrapper
+    return decorator
+
+
+def keyboard_cache_stats() -> dict:
+    return {"size": len(_kb_cache), "capacity": KEYBOARD_CACHE_SIZE, **_kb_stats}
+
+
+def _main_menu_key(texts: dict, is_admin: bool = False, cart_count: int = 0) -> Hashable:
+    # texts — текущий каталог, его версия уже входит в ключ
+    return is_admin, cart_count
+
+
+def _items_list_key(items: list, item_type: str, purchased_ids: set[int] | None = None, cursor: str = "", next_cursor: str | None = None, prev_cursor: str | None = None) -> Hashable:
+    purchased_ids = purchased_ids or set()
+    return (
+        tuple((item.id, item.title, item.id in purchased_ids) for item in items),
+        item_type, cursor, next_cursor, prev_cursor,
+    )
+
+
+def _cart_key(items_in_cart: list, total_price: int) -> Hashable:
+    return tuple((item.id, item.title, item.price_minor) for item in items_in_cart), total_price
+
+
+@_cached(_main_menu_key)
 def main_menu_kb(texts: dict, is_admin: bool = False, cart_count: int = 0) -> InlineKeyboardMarkup:
     b = texts["main_menu"]["buttons"]
     show_btns = texts["main_menu"].get("show_buttons", {})
@@ -55,12 +130,14 @@ def main_menu_kb(texts: dict, is_admin: bool = False, cart_count: int = 0) -> In
     
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
+@_cached()
 def back_kb(cb_data: str = "back:main") -> InlineKeyboardMarkup:
     texts = load_texts()
     kb = [[InlineKeyboardButton(text=texts["buttons"]["back"], callback_data=cb_data)]]
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
-def items_list_kb(items: list, item_type: str, purchased_ids: set[int] | None = None, page: int = 1, total: int | None = None, page_size: int = 5) -> InlineKeyboardMarkup:
+@_cached(_items_list_key)
+def items_list_kb(items: list, item_type: str, purchased_ids: set[int] | None = None, cursor: str = "", next_cursor: str | None = None, prev_cursor: str | None = None) -> InlineKeyboardMarkup:
     texts = load_texts()
     purchased_ids = purchased_ids or set()
     # Create buttons for each item
@@ -69,23 +146,24 @@ def items_list_kb(items: list, item_type: str, purchased_ids: set[int] | None =
         title = item.title
         if item_type == "digital" and item.id in purchased_ids:
             title = f"{title} (✅ Уже куплено)"
-        kb.append([InlineKeyboardButton(text=title, callback_data=f"item:{item.id}:{item_type}:{page}")])
+        kb.append([InlineKeyboardButton(text=title, callback_data=f"item:{item.id}:{item_type}:{cursor}")])
     # Add back button
     # Pagination controls + Back in one row
     controls = [InlineKeyboardButton(text=texts["buttons"]["back"], callback_data="back:main")]
-    if total is not None:
-        if page > 1:
-            controls.append(InlineKeyboardButton(text="◀️", callback_data=f"list:{item_type}:{page-1}"))
-        if page * page_size < total:
-            controls.append(InlineKeyboardButton(text="▶️", callback_data=f"list:{item_type}:{page+1}"))
+    # Курсоры страниц (app/utils/pagination.py): переход не зависит от номера страницы
+    if prev_cursor:
+        controls.append(InlineKeyboardButton(text="◀️", callback_data=f"list:{item_type}:{prev_cursor}"))
+    if next_cursor:
+        controls.append(InlineKeyboardButton(text="▶️", callback_data=f"list:{item_type}:{next_cursor}"))
     if controls:
         kb.append(controls)
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
-def item_card_kb(item_id: int, item_type: str, purchased: bool = False, from_purchased: bool = False, page: int = 1, in_cart: bool = False) -> InlineKeyboardMarkup:
+@_cached()
+def item_card_kb(item_id: int, item_type: str, purchased: bool = False, from_purchased: bool = False, cursor: str = "", in_cart: bool = False) -> InlineKeyboardMarkup:
     texts = load_texts()
     rows = []
-    back_cb = "back:purchased" if from_purchased else f"back:list:{item_type}:{page}"
+    back_cb = "back:purchased" if from_purchased else f"back:list:{item_type}:{cursor}"
   
     # Проверяем, разрешена ли прямая покупка (приоритет: env -> texts.yml -> default true)
     enable_direct_purchase = settings.enable_direct_purchase
@@ -109,6 +187,7 @@ def item_card_kb(item_id: int, item_type: str, purchased: bool = False, from_pur
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
+@_cached()
 def payment_method_kb(item_id: int) -> InlineKeyboardMarkup:
     texts = load_texts()
     kb = [
@@ -117,6 +196,7 @@ def payment_method_kb(item_id: int) -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
+@_cached()
 def main_menu_only_kb() -> InlineKeyboardMarkup:
     texts = load_texts()
     kb = [[InlineKeyboardButton(text=texts["buttons"]["main_menu"], callback_data="back:main")]]
@@ -131,16 +211,19 @@ def payment_link_kb(url: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 
+@_cached()
 def admin_menu_kb() -> InlineKeyboardMarkup:
     texts = load_texts()
     b = texts.get("admin", {}).get("buttons", {})
     kb = [
         [InlineKeyboardButton(text=b.get("create_invoice", "🧾 Создать счёт"), callback_data="admin:create_invoice")],
+        [InlineKeyboardButton(text=b.get("broadcast", "📣 Рассылка"), callback_data="admin:broadcast")],
         [InlineKeyboardButton(text=load_texts()["buttons"]["back"], callback_data="back:main")],
     ]
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 
+@_cached(lambda: settings.donate_amounts)
 def donate_amounts_kb() -> InlineKeyboardMarkup:
     # Читаем суммы из env: формат "100,200,500"
     raw = settings.donate_amounts or "100,200,500"
@@ -162,6 +245,7 @@ def donate_amounts_kb() -> InlineKeyboardMarkup:
     rows.append([InlineKeyboardButton(text=load_texts()["buttons"]["back"], callback_data="back:main")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
+@_cached(_cart_key)
 def cart_kb(items_in_cart: list, total_price: int) -> InlineKeyboardMarkup:
     texts = load_texts()
     kb = []
@@ -191,6 +275,7 @@ def cart_kb(items_in_cart: list, total_price: int) -> InlineKeyboardMarkup:
     kb.append([InlineKeyboardButton(text=texts["buttons"]["back"], callback_data="back:main")])
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
+@_cached()
 def skip_kb(callback_data: str = "skip_comment") -> InlineKeyboardMarkup:
     """Клавиатура с кнопкой 'Пропустить'"""
     texts = load_texts()
@@ -217,6 +302,7 @@ def order_confirmation_kb(order_id: str, is_pharmacy: bool=False) -> InlineKeybo
         kb.append([InlineKeyboardButton(text=texts["buttons"]["back"], callback_data="menu:cart")])
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
+@_cached()
 def offline_delivery_kb() -> InlineKeyboardMarkup:
     texts = load_texts()
     kb = [
@@ -224,3 +310,22 @@ def offline_delivery_kb() -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text=texts["buttons"]["back"], callback_data="menu:cart")],
     ]
     return InlineKeyboardMarkup(inline_keyboard=kb)
+
+@_cached()
+def broadcast_confirm_kb() -> InlineKeyboardMarkup:
+    texts = load_texts()
+    b = texts.get("admin", {}).get("buttons", {})
+    kb = [
+        [InlineKeyboardButton(text=b.get("broadcast_send", "📣 Отправить всем"), callback_data="admin:broadcast_send")],
+        [InlineKeyboardButton(text=texts["buttons"]["back"], callback_data="menu:admin")],
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
+def broadcast_status_kb(broadcast_id: int) -> InlineKeyboardMarkup:
+    texts = load_texts()
+    b = texts.get("admin", {}).get("buttons", {})
+    kb = [
+        [InlineKeyboardButton(text=b.get("broadcast_refresh", "🔄 Обновить"), callback_data=f"admin:broadcast_status:{broadcast_id}")],
+        [InlineKeyboardButton(text=texts["buttons"]["back"], callback_data="menu:admin")],
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=kb)
@@ -1,18 +1,29 @@
 import asyncio
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
-from aiogram.fsm.storage.memory import MemoryStorage
 
 from app.config import settings
+from app.services.media_cache import media_cache
+from app.services.yookassa import start_yookassa_client, close_yookassa_client
 from .handlers import main_router
+from .fsm_storage import create_fsm_storage
+from .send_scheduler import install_send_scheduler
+from .user_middleware import install_user_middleware
 
 
 async def main() -> None:
     bot = Bot(token=settings.bot_token, default=DefaultBotProperties(parse_mode=None))
-    dp = Dispatcher(storage=MemoryStorage())
+    install_send_scheduler(bot)
+    bot.session.middleware(media_cache)
+    dp = Dispatcher(storage=create_fsm_storage())
     dp.include_router(main_router)
+    install_user_middleware(dp)
 
-    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    await start_yookassa_client()
+    try:
+        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        await close_yookassa_client()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,34 @@
+import asyncio
+import signal
+
+from app.config import settings
+from app.services.yookassa import close_yookassa_client
+from .durable_queue import DurableUpdateWorker
+from .webhook_app import bot, dp
+
+
+async def main() -> None:
+    # Воркер надёжной очереди (TG_UPDATE_MODE=durable): вебхук пишет обновления в Postgres,
+    # а этот процесс забирает их и прогоняет через Dispatcher. Можно запускать несколько экземпляров.
+    worker = DurableUpdateWorker(
+        bot,
+        dp,
+        worker_id=settings.tg_worker_id,
+        concurrency=settings.tg_update_workers,
+        batch_size=settings.tg_queue_batch_size,
+        poll_interval=settings.tg_queue_poll_interval,
+        visibility_timeout=settings.tg_queue_visibility_timeout,
+        max_attempts=settings.tg_queue_max_attempts,
+    )
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+    try:
+        await worker.run()
+    finally:
+        await close_yookassa_client()
+        await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
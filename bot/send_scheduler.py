@@ -0,0 +1,241 @@
+"""
+Планировщик исходящих запросов к Telegram: лимиты скорости, приоритеты и повтор после RetryAfter
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Dict, Iterator, List, Optional, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from loguru import logger
+
+from app.config import settings
+from app.utils.metrics import LatencyStats
+
+
+class SendPriority(IntEnum):
+    """Чем меньше значение, тем раньше запрос получит место в общем лимите"""
+
+    DELIVERY = 0  # выдача оплаченного товара
+    INTERACTIVE = 1  # ответы пользователю в обработчиках
+    NOTIFICATION = 2  # уведомления администратору
+    BROADCAST = 3  # рассылки
+
+
+_current_priority: ContextVar[SendPriority] = ContextVar("tg_send_priority", default=SendPriority.INTERACTIVE)
+
+
+@contextmanager
+def send_priority(priority: SendPriority) -> Iterator[None]:
+    """Все отправки внутри блока получают указанный приоритет"""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def set_send_priority(priority: SendPriority) -> None:
+    """Приоритет для всех последующих отправок текущей задачи (например, обработки одного HTTP-запроса)"""
+    _current_priority.set(priority)
+
+
+# Ограничиваются только методы, которые что-то пишут в чат
+_THROTTLED_PREFIXES = ("Send", "Copy", "Forward", "Edit")
+
+
+class TokenBucket:
+    """Классическое ведро токенов; take() соблюдает порядок вызовов благодаря блокировке"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until", "lock")
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд ждать до появления токена"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def consume(self) -> None:
+        self.tokens -= 1.0
+
+    def block(self, seconds: float) -> None:
+        """Telegram попросил подождать — ничего не отправляем до истечения паузы"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    async def take(self) -> None:
+        async with self.lock:
+            while True:
+                wait = self.delay(time.monotonic())
+                if wait <= 0:
+                    self.consume()
+                    return
+                await asyncio.sleep(wait)
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Middleware сессии бота, через которое проходят все отправки.
+
+    Сначала запрос ждёт токен в ведре своего чата (для групп и чата администратора оно строже),
+    затем встаёт в общую очередь с приоритетом: при исчерпании глобального лимита первыми
+    уходят выдачи товара, последними — рассылки. TelegramRetryAfter не теряет сообщение:
+    ведро чата и общее ведро блокируются на указанное время и запрос повторяется — флуд-контроль
+    Telegram бывает и на весь бот, и отправки в другие чаты в эту паузу тоже получили бы 429.
+    Число вёдер чатов ограничено.
+    """
+
+    def __init__(
+        self,
+        rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        group_rate: float = 20 / 60,
+        max_retries: int = 3,
+        max_chats: int = 10_000,
+        admin_chat_id: Optional[str] = None,
+    ) -> None:
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max(0, max_retries)
+        self.max_chats = max(1, max_chats)
+        self.admin_chat_id = str(admin_chat_id) if admin_chat_id else None
+        self._global = TokenBucket(rate, rate)
+        self._chats: "OrderedDict[Union[int, str], TokenBucket]" = OrderedDict()
+        self._waiters: List[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+        self._wait_stats: Dict[SendPriority, LatencyStats] = {p: LatencyStats() for p in SendPriority}
+        self.sent = 0
+        self.retried = 0
+        self.failed_retry_after = 0
+
+    # --- вёдра ---
+
+    def _is_group(self, chat_id: Union[int, str]) -> bool:
+        if self.admin_chat_id is not None and str(chat_id) == self.admin_chat_id:
+            return True
+        if isinstance(chat_id, str):
+            return chat_id.startswith("@") or chat_id.startswith("-")
+        return chat_id < 0
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if self._is_group(chat_id):
+                bucket = TokenBucket(self.group_rate, 1.0)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    # --- общая очередь ---
+
+    async def _acquire_global(self, priority: SendPriority) -> None:
+        if not self._waiters and self._global.delay(time.monotonic()) <= 0:
+            self._global.consume()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (int(priority), next(self._seq), future))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run_pump())
+        await future
+
+    async def _run_pump(self) -> None:
+        while self._waiters:
+            wait = self._global.delay(time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._global.consume()
+            future.set_result(None)
+
+    # --- middleware ---
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not type(method).__name__.startswith(_THROTTLED_PREFIXES):
+            return await make_request(bot, method)
+
+        priority = _current_priority.get()
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            bucket = self._chat_bucket(chat_id)
+            await bucket.take()
+            await self._acquire_global(priority)
+            self._wait_stats[priority].observe(time.monotonic() - started)
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    self.failed_retry_after += 1
+                    raise
+                attempt += 1
+                self.retried += 1
+                bucket.block(e.retry_after)
+                self._global.block(e.retry_after)
+                logger.bind(event="tg.send.retry_after", chat_id=chat_id, retry_after=e.retry_after).warning(
+                    "Telegram просит подождать {} сек, повтор {}/{}", e.retry_after, attempt, self.max_retries
+                )
+                continue
+            self.sent += 1
+            return response
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed_retry_after": self.failed_retry_after,
+            "waiting": len(self._waiters),
+            "chats_tracked": len(self._chats),
+            "queue_seconds": {p.name.lower(): s.snapshot() for p, s in self._wait_stats.items()},
+        }
+
+
+def install_send_scheduler(bot: Bot) -> SendScheduler:
+    """Подключить планировщик к сессии бота с лимитами из настроек"""
+    scheduler = SendScheduler(
+        rate=settings.tg_send_rate,
+        chat_rate=settings.tg_send_chat_rate,
+        chat_burst=settings.tg_send_chat_burst,
+        group_rate=settings.tg_send_group_rate,
+        max_retries=settings.tg_send_max_retries,
+        max_chats=settings.tg_send_max_chats,
+        admin_chat_id=settings.admin_chat_id,
+    )
+    bot.session.middleware(scheduler)
+    return scheduler
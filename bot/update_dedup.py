@@ -0,0 +1,139 @@
+"""
+Отсев повторных доставок обновлений Telegram по update_id
+"""
+import asyncio
+import time
+from array import array
+from datetime import datetime, timedelta
+from typing import Optional
+
+from loguru import logger
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.db.session import AsyncSessionLocal
+from app.models import ProcessedUpdate
+
+
+class UpdateDeduplicator:
+    """Запоминает последние update_id и отбрасывает повторы.
+
+    В памяти — кольцо фиксированного размера: слот update_id % window хранит сам update_id,
+    а битовая карта отмечает занятые слоты. update_id у Telegram идут подряд, поэтому окно
+    в window последних обновлений проверяется точно и без выделения памяти на каждый запрос.
+    При shared=True дополнительно используется таблица tg_processed_updates — повтор,
+    пришедший в другой процесс, тоже будет отброшен.
+    """
+
+    def __init__(
+        self,
+        window: int = 65536,
+        shared: bool = False,
+        retention: float = 24 * 3600.0,
+        purge_interval: float = 3600.0,
+    ) -> None:
+        self.window = max(8, window)
+        self.shared = shared
+        self.retention = retention
+        self.purge_interval = purge_interval
+        self._ring = array("q", bytes(8 * self.window))
+        self._bitmap = bytearray((self.window + 7) // 8)
+        self._last_purge = time.monotonic()
+        self._purge_task: Optional[asyncio.Task] = None
+        self.accepted = 0
+        self.dropped = 0
+        self.shared_errors = 0
+
+    # --- кольцо в памяти ---
+
+    def _seen_local(self, update_id: int) -> bool:
+        slot = update_id % self.window
+        return bool(self._bitmap[slot >> 3] & (1 << (slot & 7))) and self._ring[slot] == update_id
+
+    def _remember_local(self, update_id: int) -> None:
+        slot = update_id % self.window
+        self._ring[slot] = update_id
+        self._bitmap[slot >> 3] |= 1 << (slot & 7)
+
+    def _forget_local(self, update_id: int) -> None:
+        slot = update_id % self.window
+        if self._ring[slot] == update_id:
+            self._bitmap[slot >> 3] &= ~(1 << (slot & 7)) & 0xFF
+
+    # --- общий журнал ---
+
+    async def _claim_shared(self, update_id: int) -> bool:
+        try:
+            async with AsyncSessionLocal() as db:
+                claimed = (await db.execute(
+                    pg_insert(ProcessedUpdate)
+                    .values(update_id=update_id, created_at=datetime.utcnow())
+                    .on_conflict_do_nothing(index_elements=[ProcessedUpdate.update_id])
+                    .returning(ProcessedUpdate.update_id)
+                )).scalar_one_or_none()
+                await db.commit()
+        except Exception as e:
+            # Лучше обработать возможный повтор, чем потерять обновление из-за недоступности БД
+            self.shared_errors += 1
+            logger.bind(event="tg.dedup_error", update_id=update_id).warning("Ошибка журнала дедупликации: {}", e)
+            return True
+        self._maybe_purge()
+        return claimed is not None
+
+    def _maybe_purge(self) -> None:
+        if time.monotonic() - self._last_purge < self.purge_interval:
+            return
+        if self._purge_task and not self._purge_task.done():
+            return
+        self._last_purge = time.monotonic()
+        self._purge_task = asyncio.create_task(self.purge_expired())
+
+    async def purge_expired(self) -> int:
+        """Удалить записи старше retention: Telegram не повторяет доставку дольше суток"""
+        border = datetime.utcnow() - timedelta(seconds=self.retention)
+        try:
+            async with AsyncSessionLocal() as db:
+                removed = (await db.execute(
+                    delete(ProcessedUpdate).where(ProcessedUpdate.created_at < border)
+                )).rowcount
+                await db.commit()
+        except Exception as e:
+            logger.bind(event="tg.dedup_purge_error").warning("Не удалось очистить журнал дедупликации: {}", e)
+            return 0
+        return removed
+
+    # --- API ---
+
+    async def accept(self, update_id: int) -> bool:
+        """True — обновление пришло впервые и его нужно обработать, False — это повтор"""
+        if self._seen_local(update_id):
+            self.dropped += 1
+            return False
+        if self.shared and not await self._claim_shared(update_id):
+            self._remember_local(update_id)
+            self.dropped += 1
+            return False
+        self._remember_local(update_id)
+        self.accepted += 1
+        return True
+
+    async def forget(self, update_id: int) -> None:
+        """Снять отметку, чтобы повторная доставка после ошибки обработки не была отброшена"""
+        self._forget_local(update_id)
+        if not self.shared:
+            return
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(delete(ProcessedUpdate).where(ProcessedUpdate.update_id == update_id))
+                await db.commit()
+        except Exception as e:
+            logger.bind(event="tg.dedup_error", update_id=update_id).warning("Ошибка журнала дедупликации: {}", e)
+
+    def stats(self) -> dict:
+        return {
+            "window": self.window,
+            "shared": self.shared,
+            "accepted": self.accepted,
+            "dropped_duplicates": self.dropped,
+            "shared_errors": self.shared_errors,
+        }
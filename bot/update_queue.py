@@ -0,0 +1,163 @@
+"""
+Ограниченная очередь входящих обновлений Telegram с сохранением порядка внутри чата
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+from aiogram.types import Update
+from loguru import logger
+
+from app.utils.metrics import LatencyStats
+
+
+class UpdateQueueFull(Exception):
+    """Очередь переполнена — вебхук должен ответить отказом, чтобы Telegram повторил доставку позже"""
+
+
+def update_chat_key(update: Update) -> Hashable:
+    """Ключ упорядочивания: id чата, иначе id пользователя, иначе само обновление"""
+    try:
+        event = update.event
+    except Exception:
+        return ("update", update.update_id)
+    chat = getattr(event, "chat", None)
+    if chat is None and getattr(event, "message", None) is not None:
+        chat = getattr(event.message, "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    return ("update", update.update_id)
+
+
+class UpdateQueue:
+    """Пул воркеров, обрабатывающих обновления параллельно, но строго по порядку в рамках одного чата.
+
+    Для каждого чата ведётся собственный «почтовый ящик». В очередь готовых попадает чат, а не
+    обновление, поэтому пока воркер обрабатывает сообщение чата, следующие сообщения того же чата
+    ждут, а остальные чаты обслуживаются свободными воркерами. Общая ёмкость ограничена — при
+    переполнении put() ждёт enqueue_timeout и затем бросает UpdateQueueFull.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[Update], Awaitable[Any]],
+        workers: int = 8,
+        maxsize: int = 1000,
+        enqueue_timeout: float = 0.5,
+        name: str = "tg-updates",
+    ) -> None:
+        self._process = process
+        self._workers_count = max(1, workers)
+        self._maxsize = max(1, maxsize)
+        self._enqueue_timeout = enqueue_timeout
+        self._name = name
+
+        self._slots = asyncio.Semaphore(self._maxsize)
+        self._mailboxes: Dict[Hashable, Deque[tuple[Update, float]]] = {}
+        self._ready: "asyncio.Queue[Hashable]" = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._depth = 0
+        self._active = 0
+
+        self._started_at: Optional[float] = None
+        self._busy_time = 0.0
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._wait = LatencyStats()
+        self._handle = LatencyStats()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._started_at = time.monotonic()
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"{self._name}-{i}")
+            for i in range(self._workers_count)
+        ]
+        logger.bind(event="tg.queue.start").info(
+            "Очередь обновлений запущена: воркеров={}, ёмкость={}", self._workers_count, self._maxsize
+        )
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Дождаться опустошения очереди (не дольше timeout) и остановить воркеров"""
+        if not self._tasks:
+            return
+        deadline = time.monotonic() + timeout
+        while (self._depth or self._active) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.bind(event="tg.queue.stop").info("Очередь обновлений остановлена, не обработано: {}", self._depth)
+
+    async def put(self, update: Update) -> None:
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self._enqueue_timeout)
+        except asyncio.TimeoutError:
+            self._rejected += 1
+            raise UpdateQueueFull()
+        key = update_chat_key(update)
+        mailbox = self._mailboxes.get(key)
+        self._depth += 1
+        if mailbox is not None:
+            # Чат уже ожидает или обрабатывается — просто встаём в его очередь
+            mailbox.append((update, time.monotonic()))
+            return
+        self._mailboxes[key] = deque([(update, time.monotonic())])
+        self._ready.put_nowait(key)
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            mailbox = self._mailboxes[key]
+            update, enqueued_at = mailbox.popleft()
+            self._depth -= 1
+            self._active += 1
+            started = time.monotonic()
+            self._wait.observe(started - enqueued_at)
+            try:
+                await self._process(update)
+                self._processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._failed += 1
+                logger.bind(event="tg.queue.error").exception("Ошибка обработки обновления {}", update.update_id)
+            finally:
+                elapsed = time.monotonic() - started
+                self._handle.observe(elapsed)
+                self._busy_time += elapsed
+                self._active -= 1
+                self._slots.release()
+                if mailbox:
+                    # Возвращаем чат в конец очереди готовых, чтобы не держать воркер за одним чатом
+                    self._ready.put_nowait(key)
+                else:
+                    del self._mailboxes[key]
+
+    def stats(self) -> dict:
+        uptime = (time.monotonic() - self._started_at) if self._started_at else 0.0
+        return {
+            "running": self.running,
+            "depth": self._depth,
+            "capacity": self._maxsize,
+            "chats_waiting": len(self._mailboxes),
+            "workers": self._workers_count,
+            "active_workers": self._active,
+            "utilisation": round(self._busy_time / (self._workers_count * uptime), 4) if uptime else 0.0,
+            "processed": self._processed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "wait_seconds": self._wait.snapshot(),
+            "handle_seconds": self._handle.snapshot(),
+        }
@@ -0,0 +1,166 @@
+"""
+Пользователь бота для каждого обновления: один поиск по tg_id с LRU-кэшем вместо запроса в каждом обработчике.
+Незнакомый отправитель регистрируется тут же, как по /start, поэтому обработчики получают пользователя всегда
+"""
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject, User as TelegramUser
+from loguru import logger
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models import User
+from app.services.outbox import enqueue_message, wake_outbox
+from app.services.stats import record_user_created
+
+
+class BotUser(NamedTuple):
+    """Строка users, нужная обработчикам (id для связей с корзиной, покупками и заказами)"""
+    id: int
+    tg_id: int
+    username: Optional[str]
+
+
+class UserCache:
+    """LRU-кэш пользователей по tg_id с TTL.
+
+    id пользователя не меняется, поэтому кэш безопасен при нескольких процессах-обработчиках;
+    TTL ограничивает только устаревание username. Отсутствие пользователя не кэшируется —
+    он может появиться по /start или первому обновлению в другом процессе.
+    """
+
+    def __init__(self, size: int = 10_000, ttl: float = 300.0) -> None:
+        self.size = max(0, size)
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, tuple[BotUser, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+
+    def get_cached(self, tg_id: int) -> Optional[BotUser]:
+        entry = self._entries.get(tg_id)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            del self._entries[tg_id]
+            return None
+        self._entries.move_to_end(tg_id)
+        return entry[0]
+
+    def put(self, user: BotUser) -> None:
+        if not self.size:
+            return
+        self._entries[user.tg_id] = (user, time.monotonic() + self.ttl)
+        self._entries.move_to_end(user.tg_id)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def remember(self, user: User) -> BotUser:
+        """Положить в кэш строку, только что прочитанную или созданную обработчиком"""
+        record = BotUser(user.id, user.tg_id, user.username)
+        self.put(record)
+        return record
+
+    async def resolve(self, tg_id: int, profile: Optional[TelegramUser] = None) -> Optional[BotUser]:
+        """Пользователь по tg_id; если его нет и передан profile отправителя — зарегистрировать"""
+        user = self.get_cached(tg_id)
+        if user is not None:
+            self.hits += 1
+            return user
+        self.misses += 1
+        lookup = select(User.id, User.tg_id, User.username).where(User.tg_id == tg_id)
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(lookup)).one_or_none()
+            if row is None and profile is not None:
+                row = await self._register(db, profile)
+                if row is None:
+                    # Параллельное обновление или /start в другом процессе успели создать пользователя
+                    row = (await db.execute(lookup)).one_or_none()
+        if row is None:
+            return None
+        user = BotUser(*row)
+        self.put(user)
+        return user
+
+    async def _register(self, db, profile: TelegramUser) -> Optional[tuple]:
+        """Создать пользователя так же, как /start: строка users, сводка new_users и уведомление администратору.
+
+        INSERT ... ON CONFLICT DO NOTHING: при гонке двух обновлений создаёт один, другой получает None.
+        """
+        row = (await db.execute(
+            pg_insert(User)
+            .values(tg_id=profile.id, username=profile.username or None, created_at=datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=[User.tg_id])
+            .returning(User.id, User.tg_id, User.username)
+        )).one_or_none()
+        if row is None:
+            await db.rollback()
+            return None
+        await record_user_created(db)
+        if settings.admin_chat_id:
+            total = (await db.execute(select(func.count()).select_from(User))).scalar_one()
+            enqueue_message(db, int(settings.admin_chat_id), new_user_notice(profile, total))
+        await db.commit()
+        wake_outbox()
+        self.created += 1
+        logger.bind(event="user_middleware.created", tg_id=profile.id).info("Новый пользователь зарегистрирован при первом обновлении")
+        return row
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "created": self.created}
+
+
+def new_user_notice(profile: TelegramUser, total: int) -> str:
+    """Уведомление администратору о новом пользователе (total — пользователей всего, с ним)"""
+    username = f"@{profile.username}" if profile.username else "—"
+    return (
+        "✅ Новый пользователь\n"
+        f"{profile.full_name}\n"
+        f"Username: {username}\n"
+        f"ID: {profile.id}\n"
+        f"Всего: {total}"
+    )
+
+
+class UserMiddleware(BaseMiddleware):
+    """Outer-middleware обновлений: кладёт пользователя в аргумент user обработчиков.
+
+    Незнакомый отправитель регистрируется; None обработчики получают, только если база недоступна
+    или у обновления нет отправителя.
+    """
+
+    def __init__(self, cache: UserCache) -> None:
+        self.cache = cache
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        from_user = data.get("event_from_user")
+        user = None
+        if from_user is not None:
+            try:
+                user = await self.cache.resolve(from_user.id, from_user)
+            except Exception as e:
+                # Обработчики сами сообщают «Пользователь не найден»; обновление не теряем
+                logger.bind(event="user_middleware.error", tg_id=from_user.id).warning("Не удалось получить пользователя: {}", e)
+        data["user"] = user
+        return await handler(event, data)
+
+
+user_cache = UserCache(size=settings.user_cache_size, ttl=settings.user_cache_ttl)
+
+
+def install_user_middleware(dp: Dispatcher) -> UserMiddleware:
+    """Подключить к диспетчеру после его UserContextMiddleware (он заполняет event_from_user)"""
+    middleware = UserMiddleware(user_cache)
+    dp.update.outer_middleware(middleware)
+    return middleware
@@ -1,17 +1,54 @@
+import re
+from collections import Counter
+
 from fastapi import APIRouter, Request, HTTPException
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.types import Update
+from aiogram.types.update import UpdateTypeLookupError
 
 from app.config import settings
+from app.services.media_cache import media_cache
 from .handlers import main_router
+from .update_queue import UpdateQueue, UpdateQueueFull
+from .durable_queue import enqueue_update
+from .fsm_storage import create_fsm_storage
+from .update_dedup import UpdateDeduplicator
+from .send_scheduler import install_send_scheduler
+from .user_middleware import install_user_middleware
 
 
-api_router = APIRouter(prefix="/telegram", tags=["telegram"]) 
+api_router = APIRouter(prefix="/telegram", tags=["telegram"])
 
 bot = Bot(token=settings.bot_token, default=DefaultBotProperties(parse_mode=None))
-dp = Dispatcher()
+send_scheduler = install_send_scheduler(bot)
+bot.session.middleware(media_cache)
+dp = Dispatcher(storage=create_fsm_storage())
 dp.include_router(main_router)
+install_user_middleware(dp)
+
+# Типы обновлений, на которые есть обработчики: их же получает Telegram в allowed_updates
+allowed_update_types = frozenset(dp.resolve_used_update_types())
+skipped_update_types: Counter = Counter()
+# Обновления, у которых update_id и тип не нашлись в начале тела и потребовался полный разбор, по типам
+peek_fallbacks: Counter = Counter()
+
+# Telegram присылает update_id первым ключом, следом — ключ с типом обновления
+_UPDATE_HEAD_RE = re.compile(rb'\s*\{\s*"update_id"\s*:\s*(\d+)\s*,\s*"([a-z_]+)"')
+
+# Режим queue: вебхук только ставит обновление в очередь, обработку выполняют воркеры
+update_queue = UpdateQueue(
+    lambda update: dp.feed_update(bot, update),
+    workers=settings.tg_update_workers,
+    maxsize=settings.tg_update_queue_size,
+    enqueue_timeout=settings.tg_update_enqueue_timeout,
+)
+
+# Повторные доставки одного update_id отбрасываются до разбора обновления
+update_dedup = UpdateDeduplicator(
+    window=settings.tg_dedup_window,
+    shared=settings.tg_dedup == "postgres",
+) if settings.tg_dedup != "off" else None
 
 
 @api_router.post("/webhook")
@@ -19,16 +56,85 @@ async def telegram_webhook(request: Request) -> dict:
     if settings.webhook_secret:
         if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != settings.webhook_secret:
             raise HTTPException(status_code=401, detail="invalid secret")
-    data = await request.json()
-    update = Update.model_validate(data)
-    await dp.feed_update(bot, update)
+    body = await request.body()
+    update = None
+    update_id, update_type = _peek_update(body)
+    if update_id is None:
+        # Другой порядок ключей или форматирование: разбираем целиком, иначе не сработает дедупликация
+        update = _parse_update(body)
+        update_id, update_type = update.update_id, _event_type(update)
+        peek_fallbacks[update_type or "unknown"] += 1
+    if update_type is not None and update_type not in allowed_update_types:
+        # Обработчиков для такого типа нет — не тратим время на разбор
+        skipped_update_types[update_type] += 1
+        return {"ok": True}
+    if update_dedup is not None and update_id is not None:
+        if not await update_dedup.accept(update_id):
+            return {"ok": True}
+    try:
+        await _process_update(body, update)
+    except BaseException:
+        # Telegram повторит доставку — она не должна быть отброшена как дубликат
+        if update_dedup is not None and update_id is not None:
+            await update_dedup.forget(update_id)
+        raise
     return {"ok": True}
 
 
+def _peek_update(body: bytes) -> tuple[int | None, str | None]:
+    """update_id и тип обновления по началу тела запроса, без разбора всего JSON"""
+    match = _UPDATE_HEAD_RE.match(body)
+    if match is None:
+        return None, None
+    return int(match.group(1)), match.group(2).decode()
+
+
+def _parse_update(body: bytes) -> Update:
+    # Модель строится прямо из байтов запроса, без промежуточного dict
+    return Update.model_validate_json(body, context={"bot": bot})
+
+
+def _event_type(update: Update) -> str | None:
+    try:
+        return update.event_type
+    except UpdateTypeLookupError:
+        return None
+
+
+async def _process_update(body: bytes, update: Update | None = None) -> None:
+    if update is None:
+        update = _parse_update(body)
+    if settings.tg_update_mode == "durable":
+        # Обработку выполнит отдельный процесс bot.run_worker
+        await enqueue_update(update, body.decode("utf-8"))
+        return
+    if update_queue.running:
+        try:
+            await update_queue.put(update)
+        except UpdateQueueFull:
+            # Telegram повторит доставку позже — это и есть обратное давление
+            raise HTTPException(status_code=503, detail="update queue is full")
+        return
+    await dp.feed_update(bot, update)
+
+
 async def setup_webhook() -> None:
     if settings.webhook_url:
-        await bot.set_webhook(settings.webhook_url, secret_token=settings.webhook_secret)
+        await bot.set_webhook(
+            settings.webhook_url,
+            secret_token=settings.webhook_secret,
+            allowed_updates=sorted(allowed_update_types),
+        )
 
 
 async def delete_webhook() -> None:
     await bot.delete_webhook(drop_pending_updates=True)
+
+
+async def start_update_processing() -> None:
+    if settings.tg_update_mode == "queue":
+        update_queue.start()
+
+
+async def stop_update_processing() -> None:
+    await update_queue.stop()
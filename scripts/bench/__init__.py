@@ -0,0 +1,7 @@
+"""
+Воспроизводимые замеры горячих путей магазина.
+
+Запуск из корня репозитория: `python -m scripts.bench.<имя> --help`. Замеры без базы подставляют
+заглушки обязательных переменных окружения; замеры с базой требуют DATABASE_URL отдельной базы
+с применёнными миграциями — они создают свои строки и удаляют их по окончании.
+"""
@@ -0,0 +1,149 @@
+"""
+Нажатие «Купить»: ссылка на оплату через HTTP-запрос к своему /orders/, как делал прежний OrdersClient
+(новый httpx-клиент на нажатие, API в отдельном процессе), против вызова сервиса заказов в процессе бота.
+ЮKassa — поддельная (scripts/bench/fake_yookassa.py), у обоих путей общий пул соединений к ней.
+
+    DATABASE_URL=... python -m scripts.bench.buy_click [--number 200]
+
+Товар, заказы и его строки сводок создаются во время замера и удаляются после него.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from scripts.bench.common import latency_ms, print_table, require_database, serve
+from scripts.bench.fake_yookassa import create_fake_yookassa
+
+require_database()
+
+from fastapi import FastAPI  # noqa: E402
+from loguru import logger  # noqa: E402
+from sqlalchemy import delete, select, update  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.db.session import AsyncSessionLocal, engine  # noqa: E402
+from app.models import DailyStats, Item, ItemType, Order, TOTAL_ITEM_ID  # noqa: E402
+from app.services.orders_client import OrdersClient  # noqa: E402
+from app.services.yookassa import close_yookassa_client, start_yookassa_client  # noqa: E402
+
+BUYER = 990000011
+
+# Строки лога на каждый заказ заняли бы весь вывод замера
+logger.disable("app")
+
+
+def orders_app() -> FastAPI:
+    """API только с /orders/ — то, во что ходил прежний OrdersClient (uvicorn --factory)"""
+    from app.routers.orders import router
+
+    app = FastAPI()
+    app.include_router(router)
+    app.add_event_handler("startup", start_yookassa_client)
+    app.add_event_handler("shutdown", close_yookassa_client)
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_api(yk_url: str) -> tuple:
+    port = _free_port()
+    env = {**os.environ, "YK_API_URL": yk_url, "LOGURU_LEVEL": "WARNING"}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "--factory", "scripts.bench.buy_click:orders_app",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(300):
+        if process.poll() is not None:
+            sys.exit("API для замера не запустился")
+        try:
+            httpx.get(f"{base_url}/openapi.json")
+            return process, base_url
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.terminate()
+    sys.exit("API для замера не ответил за 30 с")
+
+
+async def _cleanup(item: Item) -> None:
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(Order).where(Order.item_id == item.id))
+        # Оформления товара учтены и в итогах магазина — вычитаем их по дням
+        for day, checkouts in (await db.execute(
+            select(DailyStats.day, DailyStats.checkouts).where(DailyStats.item_id == item.id)
+        )).all():
+            await db.execute(
+                update(DailyStats)
+                .where(DailyStats.day == day, DailyStats.item_id == TOTAL_ITEM_ID)
+                .values(checkouts=DailyStats.checkouts - checkouts)
+            )
+        await db.execute(delete(DailyStats).where(DailyStats.item_id == item.id))
+        await db.execute(delete(Item).where(Item.id == item.id))
+        await db.commit()
+
+
+async def run(yk_url: str, api_url: str, number: int) -> None:
+    settings.yk_api_url = yk_url
+    item = Item(title="Замер", description="", price_minor=100, item_type=ItemType.DIGITAL)
+    async with AsyncSessionLocal() as db:
+        db.add(item)
+        await db.commit()
+
+    async def over_http() -> str:
+        # Прежний OrdersClient
+        client = httpx.AsyncClient(base_url=api_url, headers={"Content-Type": "application/json"})
+        try:
+            resp = await client.post("/orders/", json={"item_id": item.id, "tg_id": BUYER})
+            resp.raise_for_status()
+            return resp.json()["payment_url"]
+        finally:
+            await client.aclose()
+
+    async def in_process() -> str:
+        async with OrdersClient() as client:
+            return await client.create_order(item.id, BUYER)
+
+    rows = []
+    try:
+        for name, click in (("HTTP к /orders/", over_http), ("в процессе", in_process)):
+            await click()
+            samples = []
+            for _ in range(number):
+                started = time.perf_counter()
+                await click()
+                samples.append(time.perf_counter() - started)
+            rows.append((name, *latency_ms(samples)))
+    finally:
+        await _cleanup(item)
+        await close_yookassa_client()
+        await engine.dispose()
+    print(f"нажатий: {number}")
+    print_table(("путь", "среднее, мс", "p50, мс", "p95, мс", "p99, мс", "max, мс"), rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=200, help="нажатий на замер")
+    args = parser.parse_args()
+    with serve(create_fake_yookassa()) as yk_url:
+        process, api_url = _start_api(f"{yk_url}/")
+        try:
+            asyncio.run(run(f"{yk_url}/", api_url, args.number))
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
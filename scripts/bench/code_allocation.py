@@ -0,0 +1,143 @@
+"""
+Резерв кодов при оплате больших корзин параллельными платежами на пуле из миллиона кодов:
+прежний выбор по одному коду (SELECT ... LIMIT 1 и UPDATE через ORM на каждый код)
+против _allocate_codes (один UPDATE ... RETURNING с LATERAL и FOR UPDATE SKIP LOCKED).
+
+    DATABASE_URL=... python -m scripts.bench.code_allocation [--pool 1000000] [--items 20] [--cart 50] [--payments 200]
+
+Коды и заказы создаются во время замера и удаляются после него.
+"""
+import argparse
+import asyncio
+import time
+from collections import Counter
+
+from scripts.bench.common import count_statements, print_table, require_database
+
+require_database()
+
+from sqlalchemy import delete, func, insert, literal, select  # noqa: E402
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.models import Item, ItemCode, ItemType, Order, OrderStatus, PaymentMethod  # noqa: E402
+from app.services.payments import PaymentError, _allocate_codes  # noqa: E402
+
+
+async def _per_code(db, order: Order, needed: dict, items: dict) -> dict:
+    """Резерв до _allocate_codes: отдельный SELECT на каждый код, UPDATE уходит автосбросом сессии"""
+    codes: dict = {}
+    for item_id, count in needed.items():
+        for _ in range(count):
+            code_row = (await db.execute(
+                select(ItemCode).where(ItemCode.item_id == item_id, ItemCode.is_sold == False).limit(1)
+            )).scalars().first()
+            if not code_row:
+                raise PaymentError(500, f"Item {items[item_id].title} out of stock")
+            code_row.is_sold = True
+            code_row.sold_order_id = order.id
+            codes.setdefault(item_id, []).append(code_row.code)
+    await db.flush()
+    return codes
+
+
+async def _seed(session, pool: int, items: int) -> list:
+    rows = [
+        Item(title=f"Замер кодов {n}", description="", price_minor=100, item_type=ItemType.DIGITAL, delivery_type="codes")
+        for n in range(items)
+    ]
+    async with session() as db:
+        db.add_all(rows)
+        await db.flush()
+        for item in rows:
+            await db.execute(insert(ItemCode).from_select(
+                ["item_id", "code", "is_sold"],
+                select(literal(item.id), func.concat(f"BENCH-{item.id}-", func.generate_series(1, pool // items)), literal(False)),
+            ))
+        await db.commit()
+    return rows
+
+
+async def _round(session, engine, allocate, needed: dict, items: dict, payments: int) -> tuple:
+    async with session() as db:
+        orders = [
+            Order(amount_minor=100, payment_method=PaymentMethod.CARD_RF, status=OrderStatus.PENDING)
+            for _ in range(payments)
+        ]
+        db.add_all(orders)
+        await db.commit()
+    latencies: list = []
+
+    async def pay(order: Order):
+        started = time.perf_counter()
+        async with session() as db:
+            try:
+                codes = await allocate(db, order, needed, items)
+            except PaymentError:
+                await db.rollback()
+                raise
+            await db.commit()
+        latencies.append(time.perf_counter() - started)
+        return codes
+
+    try:
+        with count_statements(engine) as counts:
+            started = time.perf_counter()
+            results = await asyncio.gather(*(pay(order) for order in orders), return_exceptions=True)
+            elapsed = time.perf_counter() - started
+    finally:
+        async with session() as db:
+            await db.execute(delete(Order).where(Order.id.in_([order.id for order in orders])))
+            await db.commit()
+
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        raise errors[0]
+    issued = Counter(code for codes in results for item_codes in codes.values() for code in item_codes)
+    latencies.sort()
+    return (
+        f"{elapsed:.2f}",
+        f"{payments / elapsed:.0f}",
+        f"{latencies[len(latencies) // 2] * 1000:.0f}",
+        f"{latencies[int(len(latencies) * 0.99) - 1] * 1000:.0f}",
+        round(sum(counts.values()) / payments, 1),
+        sum(n - 1 for n in issued.values()),
+    )
+
+
+async def run(pool: int, items: int, cart: int, payments: int, concurrency: int) -> None:
+    engine = create_async_engine(settings.database_url, pool_size=concurrency, max_overflow=0, pool_timeout=600)
+    session = async_sessionmaker(engine, expire_on_commit=False)
+    rows: list = []
+    seeded: list = []
+    try:
+        started = time.perf_counter()
+        seeded = await _seed(session, pool, items)
+        print(f"пул: {pool} кодов на {items} товаров, заполнен за {time.perf_counter() - started:.1f} с")
+        by_id = {item.id: item for item in seeded}
+        # Корзина из cart кодов, разложенных по всем товарам пула
+        needed = Counter(seeded[n % items].id for n in range(cart))
+        for name, allocate in (("по одному коду", _per_code), ("_allocate_codes", _allocate_codes)):
+            rows.append((name, *await _round(session, engine, allocate, dict(needed), by_id, payments)))
+    finally:
+        async with session() as db:
+            await db.execute(delete(Item).where(Item.id.in_([item.id for item in seeded])))
+            await db.commit()
+        await engine.dispose()
+    print(f"корзина: {cart} кодов, оплат: {payments}, соединений: {concurrency}")
+    print_table(("резерв", "с", "оплат/с", "p50, мс", "p99, мс", "запросов/оплату", "выдано повторно"), rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pool", type=int, default=1_000_000, help="кодов в пуле")
+    parser.add_argument("--items", type=int, default=20, help="товаров, между которыми поделён пул")
+    parser.add_argument("--cart", type=int, default=50, help="кодов в одной корзине")
+    parser.add_argument("--payments", type=int, default=200, help="параллельных оплат")
+    parser.add_argument("--concurrency", type=int, default=20, help="соединений с базой")
+    args = parser.parse_args()
+    asyncio.run(run(args.pool, args.items, args.cart, args.payments, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
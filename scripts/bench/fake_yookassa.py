@@ -0,0 +1,40 @@
+"""
+Поддельный API ЮKassa для замеров: POST /payments и GET /payments/{id} отвечают как настоящий
+сервис (id, статус, confirmation_url), ничего не проверяя. latency — искусственная задержка ответа, с.
+
+Замеры поднимают его в отдельном потоке (common.serve) и направляют на него клиент через settings.yk_api_url.
+"""
+import asyncio
+import uuid
+
+from fastapi import FastAPI, Request
+
+
+def create_fake_yookassa(latency: float = 0.0) -> FastAPI:
+    app = FastAPI()
+    payments: dict = {}
+
+    @app.post("/payments")
+    async def create_payment(request: Request) -> dict:
+        body = await request.json()
+        if latency:
+            await asyncio.sleep(latency)
+        payment_id = str(uuid.uuid4())
+        payments[payment_id] = payment = {
+            "id": payment_id,
+            "status": "pending",
+            "paid": False,
+            "amount": body["amount"],
+            "description": body.get("description"),
+            "metadata": body.get("metadata") or {},
+            "confirmation": {"type": "redirect", "confirmation_url": f"https://yoomoney.test/checkout/{payment_id}"},
+        }
+        return payment
+
+    @app.get("/payments/{payment_id}")
+    async def get_payment(payment_id: str) -> dict:
+        if latency:
+            await asyncio.sleep(latency)
+        return payments.get(payment_id) or {"id": payment_id, "status": "canceled", "paid": False}
+
+    return app
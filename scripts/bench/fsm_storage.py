@@ -0,0 +1,70 @@
+"""
+Чтение FSM на одно обновление (get_state + get_data, как у FSMContextMiddleware и обработчика):
+MemoryStorage, Postgres без кэша и Postgres с кэшем, проверяемым по версии записи.
+
+    DATABASE_URL=... python -m scripts.bench.fsm_storage [--number 2000] [--payload 50]
+"""
+import argparse
+import asyncio
+
+from scripts.bench.common import count_statements, per_call_async, print_table, require_database
+
+require_database()
+
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+from aiogram.fsm.storage.memory import MemoryStorage  # noqa: E402
+from sqlalchemy import delete  # noqa: E402
+
+from app.db.session import AsyncSessionLocal, engine  # noqa: E402
+from app.models import FsmState  # noqa: E402
+from bot.fsm_storage import PostgresStorage  # noqa: E402
+
+KEY = StorageKey(bot_id=1, chat_id=990000077, user_id=990000077)
+
+
+async def run(number: int, payload: int) -> None:
+    data = {
+        "cart_items": list(range(payload)),
+        "total_amount": 990000,
+        "delivery_fullname": "Иванов Иван Иванович",
+        "delivery_address": "г. Москва, ул. Тверская, д. 1, кв. 1",
+    }
+    storages = {
+        "memory": MemoryStorage(),
+        "postgres, без кэша": PostgresStorage(cache_size=0),
+        "postgres, кэш с версией": PostgresStorage(),
+    }
+    rows = []
+    try:
+        for name, storage in storages.items():
+            await storage.set_state(KEY, "OfflineDeliveryStates:waiting_for_comment")
+            await storage.set_data(KEY, data)
+
+            async def update() -> None:
+                await storage.get_state(KEY)
+                await storage.get_data(KEY)
+
+            await update()
+            with count_statements(engine) as counts:
+                await update()
+            micros = await per_call_async(update, number)
+            rows.append((name, f"{micros:.0f}", sum(counts.values())))
+    finally:
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(FsmState).where(FsmState.key == PostgresStorage().key_builder.build(KEY)))
+            await db.commit()
+        await engine.dispose()
+    print(f"данные: {payload} позиций корзины")
+    print_table(("хранилище", "мкс/обновление", "запросов/обновление"), rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=2000, help="обновлений на замер")
+    parser.add_argument("--payload", type=int, default=50, help="позиций корзины в данных FSM")
+    args = parser.parse_args()
+    asyncio.run(run(args.number, args.payload))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Клавиатуры одного типичного нажатия (главное меню, список товаров, корзина, донат, админка):
+построение заново, как было до кэша, против кэша bot/keyboards.py.
+
+    python -m scripts.bench.keyboards [--number 5000] [--items 10]
+"""
+import argparse
+from types import SimpleNamespace
+
+from scripts.bench.common import offline_env, per_call, print_table
+
+offline_env()
+
+from app.utils.texts import load_texts  # noqa: E402
+from bot import keyboards  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=5000, help="построений на замер")
+    parser.add_argument("--items", type=int, default=10, help="товаров на странице списка и в корзине")
+    args = parser.parse_args()
+
+    texts = load_texts()
+    items = [SimpleNamespace(id=n, title=f"Товар {n}", price_minor=n * 1000) for n in range(1, args.items + 1)]
+    purchased = {n for n in range(1, args.items + 1, 3)}
+    cases = {
+        "main_menu_kb": lambda kb: kb(texts, is_admin=True, cart_count=2),
+        "items_list_kb": lambda kb: kb(items, "digital", purchased, "Y2E", "YTE", None),
+        "cart_kb": lambda kb: kb(items, sum(item.price_minor for item in items)),
+        "donate_amounts_kb": lambda kb: kb(),
+        "admin_menu_kb": lambda kb: kb(),
+    }
+    builders = {name: getattr(keyboards, name) for name in cases}
+
+    rows = []
+    totals = {"заново": 0.0, "кэш": 0.0}
+    for name, build in cases.items():
+        cached = builders[name]
+        # __wrapped__ — построитель без кэша (functools.wraps в keyboards._cached)
+        fresh = per_call(lambda: build(cached.__wrapped__), args.number)
+        hit = per_call(lambda: build(cached), args.number)
+        totals["заново"] += fresh
+        totals["кэш"] += hit
+        rows.append((name, f"{fresh:.1f}", f"{hit:.1f}"))
+    rows.append(("всего на нажатие", f"{totals['заново']:.1f}", f"{totals['кэш']:.1f}"))
+    print_table(("клавиатура", "заново, мкс", "кэш, мкс"), rows)
+    print(f"кэш: {keyboards.keyboard_cache_stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Список заказов админки на миллионе заказов: страница по курсору (keyset_page) на разной глубине
+против прежнего OFFSET, и estimated_count против COUNT(*).
+
+    DATABASE_URL=... python -m scripts.bench.pagination [--orders 1000000] [--page-size 10] [--number 20]
+
+Заказы создаются во время замера (покупатель BUYER) и удаляются после него.
+"""
+import argparse
+import asyncio
+import time
+
+from scripts.bench.common import per_call_async, print_table, require_database
+
+require_database()
+
+from sqlalchemy import delete, func, insert, literal, select, text  # noqa: E402
+
+from app.db.session import AsyncSessionLocal, engine  # noqa: E402
+from app.models import Order, OrderStatus, PaymentMethod  # noqa: E402
+from app.routers.admin import _orders_view_stmt  # noqa: E402
+from app.utils.pagination import AFTER, encode_cursor, estimated_count, keyset_page  # noqa: E402
+
+BUYER = "bench-pagination"
+
+
+async def _seed(orders: int) -> None:
+    columns = Order.__table__.c
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(Order).from_select(
+            ["amount_minor", "currency", "payment_method", "status", "buyer_tg_id", "created_at"],
+            select(
+                func.generate_series(1, orders),
+                literal("RUB"),
+                literal(PaymentMethod.CARD_RF, columns.payment_method.type),
+                literal(OrderStatus.PAID, columns.status.type),
+                literal(BUYER),
+                func.now(),
+            ),
+        ))
+        await db.commit()
+    # Свежая статистика planner'а — как после autovacuum на рабочей базе
+    async with engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("ANALYZE orders"))
+
+
+async def run(orders: int, page_size: int, number: int) -> None:
+    stmt = _orders_view_stmt()
+    rows = []
+    try:
+        started = time.perf_counter()
+        await _seed(orders)
+        print(f"заказов: {orders}, созданы за {time.perf_counter() - started:.1f} с; строк на странице: {page_size}")
+        async with AsyncSessionLocal() as db:
+            for page in (1, 10, 1_000, orders // page_size // 2, orders // page_size - 1):
+                skip = (page - 1) * page_size
+                # Курсор, который дала бы навигация «вперёд» до этой страницы: id последней строки предыдущей
+                boundary = await db.scalar(select(Order.id).order_by(Order.id.desc()).offset(skip - 1).limit(1)) if skip else None
+                cursor = encode_cursor(AFTER, boundary) if boundary else None
+
+                async def by_cursor() -> None:
+                    await keyset_page(db, stmt, Order.id, cursor, page_size, scalars=False)
+
+                async def by_offset() -> None:
+                    (await db.execute(stmt.order_by(Order.id.desc()).offset(skip).limit(page_size))).all()
+
+                rows.append((
+                    page,
+                    f"{await per_call_async(by_cursor, number) / 1000:.2f}",
+                    f"{await per_call_async(by_offset, number) / 1000:.2f}",
+                ))
+
+            async def estimate() -> None:
+                await estimated_count(db, Order)
+
+            async def exact() -> None:
+                await db.scalar(select(func.count()).select_from(Order))
+
+            counts = (
+                f"{await per_call_async(estimate, number) / 1000:.2f}",
+                f"{await per_call_async(exact, max(1, number // 10)) / 1000:.2f}",
+            )
+    finally:
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(Order).where(Order.buyer_tg_id == BUYER))
+            await db.commit()
+        await engine.dispose()
+    print_table(("страница", "курсор, мс", "OFFSET, мс"), rows)
+    print()
+    print_table(("estimated_count, мс", "COUNT(*), мс"), [counts])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=1_000_000, help="заказов в таблице")
+    parser.add_argument("--page-size", type=int, default=10, help="строк на странице")
+    parser.add_argument("--number", type=int, default=20, help="запросов на замер")
+    args = parser.parse_args()
+    asyncio.run(run(args.orders, args.page_size, args.number))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Разбор обновления Telegram в вебхуке: json.loads + model_validate против model_validate_json
+из байтов тела, чтение update_id и типа из начала тела и запасной путь с полным разбором.
+
+    python -m scripts.bench.webhook_updates [--number 20000]
+"""
+import argparse
+import json
+
+from scripts.bench.common import offline_env, per_call, print_table
+
+offline_env()
+
+from aiogram.types import Update  # noqa: E402
+
+from bot import webhook_app  # noqa: E402
+
+MESSAGE = {
+    "message_id": 7,
+    "date": 1700000000,
+    "chat": {"id": 42, "type": "private", "first_name": "Покупатель", "username": "buyer"},
+    "from": {"id": 42, "is_bot": False, "first_name": "Покупатель", "username": "buyer", "language_code": "ru"},
+    "text": "🛒 Корзина",
+}
+CALLBACK = {
+    "id": "4382bfdwdsb323b2d9",
+    "from": MESSAGE["from"],
+    "message": MESSAGE,
+    "chat_instance": "-1234567890",
+    "data": "cart:checkout",
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000, help="вызовов на замер")
+    args = parser.parse_args()
+
+    bot = webhook_app.bot
+    bodies = {
+        "message": json.dumps({"update_id": 1001, "message": MESSAGE}, ensure_ascii=False).encode(),
+        "callback_query": json.dumps({"update_id": 1002, "callback_query": CALLBACK}, ensure_ascii=False).encode(),
+    }
+    rows = []
+    for name, body in bodies.items():
+        reordered = json.dumps({name: json.loads(body)[name], "update_id": 1003}, indent=1, ensure_ascii=False).encode()
+        cases = {
+            "json.loads + model_validate": lambda: Update.model_validate(json.loads(body), context={"bot": bot}),
+            "model_validate_json": lambda: webhook_app._parse_update(body),
+            "peek (update_id, тип)": lambda: webhook_app._peek_update(body),
+            "peek + полный разбор (другой порядок ключей)": lambda: (
+                webhook_app._peek_update(reordered), webhook_app._event_type(webhook_app._parse_update(reordered))
+            ),
+        }
+        for case, fn in cases.items():
+            rows.append((name, case, f"{per_call(fn, args.number):.1f}"))
+    print_table(("обновление", "путь", "мкс/вызов"), rows)
+
+
+if __name__ == "__main__":
+    main()
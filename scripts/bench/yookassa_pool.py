@@ -0,0 +1,93 @@
+"""
+Создание платежа в ЮKassa на поддельном сервере (scripts/bench/fake_yookassa.py): новый httpx-клиент
+на каждый платёж, как было до общего пула, против общего пула с keep-alive. Для каждого пути —
+распределение задержек одного create_payment.
+
+    python -m scripts.bench.yookassa_pool [--number 300] [--concurrency 1] [--latency 0]
+
+Сервер локальный и без TLS, поэтому разница — только TCP-соединение и создание клиента;
+с api.yookassa.ru к ней добавляется TLS-рукопожатие на каждый платёж.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from scripts.bench.common import latency_ms, offline_env, print_table, serve
+from scripts.bench.fake_yookassa import create_fake_yookassa
+
+offline_env()
+
+from loguru import logger  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.services import yookassa  # noqa: E402
+from app.services.yookassa import YooKassaClient, close_yookassa_client  # noqa: E402
+
+# Две строки лога на платёж заняли бы весь вывод замера
+logger.disable("app.services.yookassa")
+
+
+async def _create_payment(client: YooKassaClient) -> None:
+    payment_id = str(uuid.uuid4())
+    await client.create_payment(100, "Замер", payment_id, payment_method_type="bank_card", metadata={"paymentId": payment_id})
+
+
+async def _per_payment() -> None:
+    # Прежний YooKassaClient: свой AsyncClient, закрываемый после платежа
+    client = YooKassaClient()
+    client._client = yookassa._build_client()
+    try:
+        await _create_payment(client)
+    finally:
+        await client._client.aclose()
+
+
+async def _shared() -> None:
+    client = YooKassaClient()
+    try:
+        await _create_payment(client)
+    finally:
+        await client.close()
+
+
+async def _measure(call, number: int, concurrency: int) -> list:
+    samples = []
+    queue = iter(range(number))
+
+    async def worker() -> None:
+        for _ in queue:
+            started = time.perf_counter()
+            await call()
+            samples.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples
+
+
+async def run(number: int, concurrency: int, latency: float) -> None:
+    rows = []
+    with serve(create_fake_yookassa(latency)) as base_url:
+        settings.yk_api_url = f"{base_url}/"
+        try:
+            for name, call in (("клиент на платёж", _per_payment), ("общий пул", _shared)):
+                # Прогрев: импорт, первое соединение пула
+                await _measure(call, concurrency, concurrency)
+                rows.append((name, *latency_ms(await _measure(call, number, concurrency))))
+        finally:
+            await close_yookassa_client()
+    print(f"платежей: {number}, одновременно: {concurrency}")
+    print_table(("путь", "среднее, мс", "p50, мс", "p95, мс", "p99, мс", "max, мс"), rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=300, help="платежей на замер")
+    parser.add_argument("--concurrency", type=int, default=1, help="одновременных платежей")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа поддельной ЮKassa, с")
+    args = parser.parse_args()
+    asyncio.run(run(args.number, args.concurrency, args.latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Список заказов админки строится одним запросом страницы и одним подсчётом при любом размере страницы
+"""
+import asyncio
+from pathlib import Path
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.config import settings
+from app.db.session import get_db_session
+from app.models import Item, ItemType, Order, OrderStatus, PaymentMethod, Purchase
+from app.routers import admin
+
+BUYER = "990000042"
+ORDERS = 30
+
+
+async def _seed(session) -> list:
+    async with session() as db:
+        items = [Item(title=f"Товар {n}", description="", price_minor=100, item_type=ItemType.DIGITAL) for n in range(3)]
+        db.add_all(items)
+        await db.flush()
+        orders = []
+        for n in range(ORDERS):
+            # Заказы одного товара и корзины из нескольких позиций
+            order = Order(
+                item_id=items[0].id if n % 2 else None, amount_minor=100, payment_method=PaymentMethod.CARD_RF,
+                status=OrderStatus.PAID, buyer_tg_id=BUYER,
+            )
+            db.add(order)
+            await db.flush()
+            if order.item_id is None:
+                db.add_all([Purchase(order_id=order.id, item_id=item.id) for item in items])
+            orders.append(order)
+        await db.commit()
+        return [item.id for item in items]
+
+
+async def _cleanup(session, item_ids: list) -> None:
+    async with session() as db:
+        await db.execute(delete(Order).where(Order.buyer_tg_id == BUYER))
+        await db.execute(delete(Item).where(Item.id.in_(item_ids)))
+        await db.commit()
+
+
+def test_orders_page_query_count_is_constant(database, monkeypatch):
+    monkeypatch.chdir(Path(__file__).resolve().parent.parent)
+    engine = create_async_engine(settings.database_url, poolclass=NullPool)
+    session = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def db_session():
+        async with session() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(admin.router)
+    app.dependency_overrides[get_db_session] = db_session
+    app.dependency_overrides[admin.ensure_auth] = lambda: None
+
+    statements = []
+    event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    item_ids = asyncio.run(_seed(session))
+    try:
+        counts = {}
+        with TestClient(app) as client:
+            for page_size in (5, 25):
+                statements.clear()
+                resp = client.get("/admin/orders", params={"q": BUYER, "page_size": page_size})
+                assert resp.status_code == 200
+                # Строки таблицы без заголовка
+                assert resp.text.count("<tr>") - 1 == page_size
+                counts[page_size] = len(statements)
+        # Подсчёт заказов покупателя и сама страница — независимо от числа строк на ней
+        assert counts == {5: 2, 25: 2}, statements
+    finally:
+        asyncio.run(_cleanup(session, item_ids))
+        asyncio.run(engine.dispose())
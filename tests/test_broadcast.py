@@ -0,0 +1,75 @@
+"""
+Исполнитель рассылки: пульс обновляется и во время долгой пачки, а ошибка останавливает рассылку статусом failed
+"""
+import asyncio
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+from sqlalchemy.sql import Select, Update
+
+from app.models import BroadcastStatus
+from app.services import broadcast
+from app.services.broadcast import DELIVERED, BroadcastService
+
+
+@pytest.fixture
+def service(monkeypatch):
+    heartbeats = []
+    pages = [[(1, 11), (2, 12)], []]
+
+    async def execute(statement, *args, **kwargs):
+        if isinstance(statement, Update):
+            heartbeats.append(statement)
+            return mock.Mock()
+        assert isinstance(statement, Select)
+        return mock.Mock(all=mock.Mock(return_value=pages.pop(0)))
+
+    db = mock.AsyncMock()
+    db.execute.side_effect = execute
+    session = mock.MagicMock()
+    session.return_value.__aenter__.return_value = db
+    monkeypatch.setattr(broadcast, "AsyncSessionLocal", session)
+    monkeypatch.setattr(broadcast, "HEARTBEAT_EVERY", timedelta(seconds=0.01))
+    monkeypatch.setattr(broadcast.settings, "broadcast_concurrency", 2)
+
+    async def slow_send(tg_id, text):
+        # Пачка под RetryAfter: отправка идёт дольше интервала пульса
+        await asyncio.sleep(0.1)
+        return DELIVERED, None
+
+    svc = BroadcastService(mock.Mock())
+    svc._claim = mock.AsyncMock(return_value=("Привет", 0))
+    svc._record = mock.AsyncMock(return_value=BroadcastStatus.RUNNING)
+    svc._finish = mock.AsyncMock()
+    svc._fail = mock.AsyncMock()
+    svc._release = mock.AsyncMock()
+    svc._send_one = slow_send
+    return svc, heartbeats
+
+
+def test_heartbeat_ticks_during_long_chunk(service):
+    svc, heartbeats = service
+    asyncio.run(svc._run(7))
+    assert len(heartbeats) >= 3
+    svc._finish.assert_awaited_once_with(7)
+    svc._fail.assert_not_awaited()
+    svc._release.assert_awaited_once_with(7)
+
+
+def test_error_marks_broadcast_failed(service):
+    svc, heartbeats = service
+    svc._record.side_effect = RuntimeError("connection reset")
+
+    async def run():
+        await svc._run(7)
+        ticks = len(heartbeats)
+        await asyncio.sleep(0.05)
+        # Пульс остановлен вместе с исполнителем: рассылка не выглядит живой
+        assert len(heartbeats) == ticks
+
+    asyncio.run(run())
+    svc._fail.assert_awaited_once_with(7)
+    svc._finish.assert_not_awaited()
+    svc._release.assert_awaited_once_with(7)
+    assert 7 not in broadcast._tasks
@@ -0,0 +1,284 @@
+"""
+Карточка товара в боте: товар из кэша каталога, «куплен» и «в корзине» — одним запросом.
+Кэш каталога: страницы снимка совпадают с keyset_page, правка в одном процессе видна другим по версии в БД
+"""
+import asyncio
+import time
+from datetime import datetime
+from unittest import mock
+
+import pytest
+from sqlalchemy import create_engine, delete, event, insert, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import CartItem, Item, ItemType, Order, OrderStatus, PaymentMethod, Purchase, User
+from app.services import catalog
+from app.services.catalog import CatalogItem, bump_catalog_version, load_item_card
+from app.utils.pagination import AFTER, BEFORE, decode_cursor, encode_cursor, keyset_page
+from tests.test_pagination import Row, _Base, _SyncSession
+
+ITEM = CatalogItem(3, "Ключ", "Лицензия на год", 19900, ItemType.DIGITAL, None, "codes", True)
+
+
+@pytest.fixture
+def card_db(monkeypatch):
+    """Сессия-заглушка: запоминает запросы карточки и отвечает строкой row"""
+    statements = []
+    row = [True, True]
+
+    async def execute(statement, *args, **kwargs):
+        statements.append(statement)
+        return mock.Mock(one=mock.Mock(return_value=tuple(row[:len(statement.selected_columns)])))
+
+    db = mock.AsyncMock()
+    db.execute.side_effect = execute
+    session = mock.MagicMock()
+    session.return_value.__aenter__.return_value = db
+    monkeypatch.setattr(catalog, "AsyncSessionLocal", session)
+    monkeypatch.setattr(catalog.catalog_cache, "get", mock.AsyncMock(side_effect=lambda item_id: ITEM if item_id == ITEM.id else None))
+    return statements, row
+
+
+def _sql(statement) -> str:
+    return str(statement.compile(dialect=postgresql.dialect()))
+
+
+def test_card_is_one_query_with_two_exists(card_db):
+    statements, row = card_db
+    row[:] = [True, False]
+    card = asyncio.run(load_item_card(ITEM.id, 7))
+    assert (card.item, card.purchased, card.in_cart) == (ITEM, True, False)
+    assert len(statements) == 1
+    sql = _sql(statements[0])
+    assert sql.count("EXISTS") == 2 and "FROM purchases" in sql and "FROM cart_items" in sql
+
+
+def test_known_cart_flag_skips_cart_exists(card_db):
+    statements, row = card_db
+    row[:] = [False, False]
+    # Обработчик только что добавил товар в корзину: спрашиваем только «куплен»
+    card = asyncio.run(load_item_card(ITEM.id, 7, in_cart=True))
+    assert (card.purchased, card.in_cart) == (False, True)
+    assert len(statements) == 1
+    sql = _sql(statements[0])
+    assert sql.count("EXISTS") == 1 and "cart_items" not in sql
+
+
+@pytest.mark.parametrize("item_id, user_id", [(ITEM.id, None), (404, 7)])
+def test_no_query_without_user_or_item(card_db, item_id, user_id):
+    statements, _ = card_db
+    card = asyncio.run(load_item_card(item_id, user_id))
+    assert statements == []
+    assert card is None if item_id == 404 else (card.purchased, card.in_cart) == (False, False)
+
+
+def test_caption_marks_purchase(card_db):
+    card = asyncio.run(load_item_card(ITEM.id, 7))
+    assert card.caption == "*Ключ*\n\nЛицензия на год\n\n💰 Цена: `199.00` ₽\n\n✅ _Вы уже покупали этот товар_"
+
+
+CARD_CALLS = 200
+# Запрос по индексам (user_id, item_id): даже на медленной тестовой машине заметно меньше этого
+CARD_MAX_MS = 25
+
+
+async def _card_on_database() -> None:
+    # Пул, как у приложения: замер — сам запрос карточки, а не открытие соединения
+    engine = create_async_engine(settings.database_url, pool_size=2)
+    session = async_sessionmaker(engine, expire_on_commit=False)
+    statements = []
+    async with session() as db:
+        user = User(tg_id=990000225, created_at=datetime.utcnow())
+        bought = Item(title="Куплен", description="", price_minor=100, item_type=ItemType.DIGITAL)
+        carted = Item(title="В корзине", description="", price_minor=100, item_type=ItemType.DIGITAL)
+        db.add_all([user, bought, carted])
+        await db.flush()
+        order = Order(item_id=bought.id, amount_minor=100, payment_method=PaymentMethod.CARD_RF, status=OrderStatus.PAID)
+        db.add(order)
+        await db.flush()
+        db.add_all([Purchase(order_id=order.id, user_id=user.id, item_id=bought.id), CartItem(user_id=user.id, item_id=carted.id)])
+        await db.commit()
+    try:
+        with mock.patch.object(catalog, "AsyncSessionLocal", session), \
+                mock.patch.object(catalog.catalog_cache, "get", mock.AsyncMock(side_effect=lambda item_id: ITEM._replace(id=item_id))):
+            event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+            cards = [await load_item_card(item_id, user.id) for item_id in (bought.id, carted.id)]
+            assert [(card.purchased, card.in_cart) for card in cards] == [(True, False), (False, True)]
+            assert len(statements) == 2
+
+            started = time.perf_counter()
+            for _ in range(CARD_CALLS):
+                await load_item_card(bought.id, user.id)
+            per_call_ms = (time.perf_counter() - started) / CARD_CALLS * 1000
+            assert len(statements) == 2 + CARD_CALLS
+            assert per_call_ms < CARD_MAX_MS, f"{per_call_ms:.1f} мс на карточку"
+    finally:
+        async with session() as db:
+            await db.execute(delete(Order).where(Order.id == order.id))
+            await db.execute(delete(User).where(User.id == user.id))
+            await db.execute(delete(Item).where(Item.id.in_([bought.id, carted.id])))
+            await db.commit()
+        await engine.dispose()
+
+
+def test_card_query_on_database(database):
+    asyncio.run(_card_on_database())
+
+
+def _items(*ids, hidden=(), item_type=ItemType.DIGITAL):
+    return [ITEM._replace(id=item_id, item_type=item_type, is_visible=item_id not in hidden) for item_id in ids]
+
+
+@pytest.fixture
+def snapshot():
+    # Видимые цифровые товары 12, 11, 9..1 (10 скрыт) и одна услуга
+    return catalog._Snapshot(1, _items(*range(1, 13), hidden=(10,)) + _items(20, item_type=ItemType.SERVICE))
+
+
+def _ids(page):
+    return [item.id for item in page.rows]
+
+
+def test_slice_pages_forwards_and_backwards(snapshot):
+    first = snapshot.page(ItemType.DIGITAL, None, 5)
+    assert _ids(first) == [12, 11, 9, 8, 7]
+    assert first.prev_cursor is None and decode_cursor(first.next_cursor) == (AFTER, 7)
+
+    second = snapshot.page(ItemType.DIGITAL, first.next_cursor, 5)
+    assert _ids(second) == [6, 5, 4, 3, 2]
+    last = snapshot.page(ItemType.DIGITAL, second.next_cursor, 5)
+    assert _ids(last) == [1] and last.next_cursor is None
+
+    back = snapshot.page(ItemType.DIGITAL, last.prev_cursor, 5)
+    assert back == second
+    top = snapshot.page(ItemType.DIGITAL, back.prev_cursor, 5)
+    assert _ids(top) == _ids(first) and top.prev_cursor is None
+    assert _ids(snapshot.page(ItemType.SERVICE, None, 5)) == [20]
+
+
+def test_slice_cursor_on_missing_item_keeps_position(snapshot):
+    # Курсор на скрытый или удалённый после выдачи товар: соседние страницы те же, что у keyset_page
+    assert _ids(snapshot.page(ItemType.DIGITAL, encode_cursor(AFTER, 10), 5)) == [9, 8, 7, 6, 5]
+    assert _ids(snapshot.page(ItemType.DIGITAL, encode_cursor(BEFORE, 10), 5)) == [12, 11]
+
+
+@pytest.mark.parametrize("cursor", [encode_cursor(AFTER, 1), encode_cursor(BEFORE, 12), "!!!"])
+def test_slice_stale_cursor_falls_back_to_first_page(snapshot, cursor):
+    page = snapshot.page(ItemType.DIGITAL, cursor, 5)
+    assert _ids(page) == [12, 11, 9, 8, 7] and page.prev_cursor is None
+
+
+def test_slice_matches_keyset_page(snapshot):
+    engine = create_engine("sqlite://")
+    _Base.metadata.create_all(engine)
+    with Session(engine) as sqlite:
+        sqlite.execute(insert(Row), [{"id": item.id} for item in snapshot.by_type[ItemType.DIGITAL]])
+        db = _SyncSession(sqlite)
+        for cursor in [None] + [encode_cursor(direction, key) for direction in (AFTER, BEFORE) for key in range(0, 14)]:
+            for page_size in (1, 4, 5, 20):
+                expected = asyncio.run(keyset_page(db, select(Row), Row.id, cursor, page_size))
+                page = snapshot.page(ItemType.DIGITAL, cursor, page_size)
+                where = (decode_cursor(cursor), page_size)
+                assert _ids(page) == _ids(expected), where
+                # keyset_page не знает, есть ли строки по другую сторону курсора, и даёт ссылку туда всегда;
+                # снимок знает и не даёт ссылку на первой и последней странице
+                at_top, at_bottom = _ids(page)[:1] == [12], _ids(page)[-1:] == [1]
+                assert page.prev_cursor == (None if at_top else expected.prev_cursor), where
+                assert page.next_cursor == (None if at_bottom else expected.next_cursor), where
+    engine.dispose()
+
+
+def test_slice_empty_type(snapshot):
+    page = snapshot.page(ItemType.OFFLINE, encode_cursor(AFTER, 5), 5)
+    assert page.rows == [] and page.next_cursor is None and page.prev_cursor is None
+
+
+@pytest.fixture
+def catalog_db(monkeypatch):
+    """Сессия-заглушка кэша каталога: версия в БД задаётся тестом, товары — из _items"""
+    state = {"version": 3, "error": None}
+    db = mock.AsyncMock()
+
+    async def scalar(statement):
+        if state["error"]:
+            raise state["error"]
+        return state["version"]
+
+    db.scalar.side_effect = scalar
+    db.execute.return_value = mock.Mock(scalars=mock.Mock(return_value=mock.Mock(all=mock.Mock(return_value=[]))))
+    session = mock.MagicMock()
+    session.return_value.__aenter__.return_value = db
+    monkeypatch.setattr(catalog, "AsyncSessionLocal", session)
+    monkeypatch.setattr(settings, "catalog_cache_ttl", 3600)
+    return state, db
+
+
+def test_cache_reloads_when_shared_version_changes(catalog_db, monkeypatch):
+    state, db = catalog_db
+    monkeypatch.setattr(settings, "catalog_version_check", 0)
+    cache = catalog.CatalogCache()
+    asyncio.run(cache.get(1))
+    assert (cache.misses, db.execute.await_count) == (1, 1)
+
+    # Версия в БД та же: одна сверка по ключу, товары не перечитываются
+    asyncio.run(cache.get(1))
+    assert (cache.hits, cache.version_checks, db.execute.await_count) == (1, 1, 1)
+
+    # Другой процесс изменил каталог
+    state["version"] = 4
+    asyncio.run(cache.get(1))
+    assert (cache.misses, db.execute.await_count) == (2, 2)
+    assert cache.stats()["shared_version"] == 4
+
+
+def test_version_check_is_throttled(catalog_db, monkeypatch):
+    state, db = catalog_db
+    monkeypatch.setattr(settings, "catalog_version_check", 3600)
+    cache = catalog.CatalogCache()
+    asyncio.run(cache.get(1))
+    state["version"] = 4
+    for _ in range(3):
+        asyncio.run(cache.get(1))
+    assert (cache.hits, cache.version_checks, db.scalar.await_count) == (3, 0, 1)
+
+
+def test_version_check_error_serves_snapshot(catalog_db, monkeypatch):
+    state, db = catalog_db
+    monkeypatch.setattr(settings, "catalog_version_check", 0)
+    cache = catalog.CatalogCache()
+    asyncio.run(cache.get(1))
+    state["error"] = ConnectionError("db down")
+    asyncio.run(cache.get(1))
+    assert (cache.hits, cache.misses, db.execute.await_count) == (1, 1, 1)
+
+
+async def _two_processes() -> None:
+    engine = create_async_engine(settings.database_url, pool_size=2)
+    session = async_sessionmaker(engine, expire_on_commit=False)
+    admin, bot_process = catalog.CatalogCache(), catalog.CatalogCache()
+    item = Item(title="Новинка", description="", price_minor=100, item_type=ItemType.DIGITAL)
+    try:
+        with mock.patch.object(catalog, "AsyncSessionLocal", session):
+            await bot_process.page(ItemType.DIGITAL)
+            # Правка в процессе админки: товар и версия каталога в одной транзакции
+            async with session() as db:
+                db.add(item)
+                await bump_catalog_version(db)
+                await db.commit()
+            admin.invalidate()
+            assert await bot_process.get(item.id) is not None
+            assert bot_process.misses == 2 and bot_process.version_checks == 1
+    finally:
+        async with session() as db:
+            await db.execute(delete(Item).where(Item.id == item.id))
+            await db.commit()
+        await engine.dispose()
+
+
+def test_edit_in_one_process_reaches_another(database, monkeypatch):
+    monkeypatch.setattr(settings, "catalog_cache_ttl", 3600)
+    monkeypatch.setattr(settings, "catalog_version_check", 0)
+    asyncio.run(_two_processes())
@@ -0,0 +1,55 @@
+"""
+Выдача цифрового товара: временные ошибки отдаются outbox на повтор, постоянные — заменяются сообщением
+"""
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import SendDocument
+
+from app.models import ItemType
+from app.services import delivery
+from app.services.delivery import DeliveryService
+
+ITEM = SimpleNamespace(id=3, title="Шаблон", item_type=ItemType.DIGITAL, digital_file_path="BQACAgIAAxkBAAI")
+METHOD = SendDocument(chat_id=42, document="BQACAgIAAxkBAAI")
+
+
+def _deliver(error: Exception):
+    bot = mock.Mock(send_document=mock.AsyncMock(side_effect=error), send_message=mock.AsyncMock())
+    notify = mock.AsyncMock()
+    with mock.patch.object(DeliveryService, "_notify_admin", notify):
+        asyncio.run(DeliveryService(bot).deliver(42, ITEM))
+    return bot, notify
+
+
+@pytest.mark.parametrize("error", [
+    TelegramNetworkError(method=METHOD, message="timeout"),
+    TelegramRetryAfter(method=METHOD, message="Too Many Requests", retry_after=5),
+    RuntimeError("Internal Server Error"),
+])
+def test_transient_error_is_retried_by_outbox(error):
+    with pytest.raises(type(error)):
+        _deliver(error)
+
+
+def test_bad_file_id_falls_back_and_notifies_admin():
+    bot, notify = _deliver(TelegramBadRequest(method=METHOD, message="Bad Request: wrong file identifier"))
+    bot.send_message.assert_awaited_once()
+    notify.assert_awaited_once()
+    assert notify.await_args.args[:2] == (42, ITEM)
+
+
+def test_admin_notice_goes_through_outbox():
+    db = mock.AsyncMock()
+    db.add = mock.Mock()
+    session = mock.MagicMock()
+    session.return_value.__aenter__.return_value = db
+    with mock.patch.object(delivery, "AsyncSessionLocal", session), \
+            mock.patch.object(delivery.settings, "admin_chat_id", "100"):
+        asyncio.run(DeliveryService(mock.Mock())._notify_admin(42, ITEM, "wrong file identifier"))
+    row = db.add.call_args.args[0]
+    assert row.chat_id == 100 and "Шаблон" in row.payload["text"]
+    db.commit.assert_awaited_once()
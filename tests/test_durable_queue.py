@@ -0,0 +1,94 @@
+"""
+Очередь обновлений: воркер записывает итог обработки только в строки, которые всё ещё за его захватом
+"""
+import asyncio
+import json
+from datetime import datetime
+from unittest import mock
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.config import settings
+from app.models import QueuedUpdate
+from bot import durable_queue
+from bot.durable_queue import STATUS_PENDING, STATUS_PROCESSING, DurableUpdateWorker
+
+UPDATE_ID = 990000002
+CHAT_ID = 990000002
+
+
+def _worker(worker_id: str, visibility_timeout: float = 300.0) -> DurableUpdateWorker:
+    return DurableUpdateWorker(bot=None, dp=None, worker_id=worker_id, visibility_timeout=visibility_timeout)
+
+
+def test_flush_reports_rows_claimed_again(monkeypatch):
+    statements = []
+
+    async def execute(stmt):
+        # Ни одна строка не совпала: их уже захватили заново
+        statements.append(stmt)
+        return mock.Mock(rowcount=0)
+
+    db = mock.AsyncMock(execute=execute)
+    session = mock.MagicMock()
+    session.return_value.__aenter__.return_value = db
+    monkeypatch.setattr(durable_queue, "AsyncSessionLocal", session)
+    warning = mock.Mock()
+    monkeypatch.setattr(durable_queue.logger, "bind", mock.Mock(return_value=mock.Mock(warning=warning)))
+
+    worker = _worker("a")
+    claim = (1, datetime(2026, 10, 18, 12, 0, 0, 123456))
+    worker._done.append(claim)
+    asyncio.run(worker._flush())
+
+    sql = str(statements[0].compile(dialect=postgresql.dialect()))
+    assert "(tg_update_queue.id, tg_update_queue.locked_at) IN" in sql
+    assert "tg_update_queue.locked_by =" in sql
+    assert warning.call_args.args[1:] == ("a", 1)
+
+
+async def _stale_worker_keeps_hands_off() -> None:
+    engine = create_async_engine(settings.database_url, poolclass=NullPool)
+    session = async_sessionmaker(engine, expire_on_commit=False)
+    payload = json.dumps({
+        "update_id": UPDATE_ID,
+        "message": {"message_id": 1, "date": 1700000000, "chat": {"id": CHAT_ID, "type": "private"}, "text": "x"},
+    })
+    try:
+        async with session() as db:
+            db.add(QueuedUpdate(
+                update_id=UPDATE_ID, chat_id=CHAT_ID, payload=payload, status=STATUS_PENDING, attempts=0,
+                created_at=datetime.utcnow(),
+            ))
+            await db.commit()
+
+        with mock.patch.object(durable_queue, "AsyncSessionLocal", session):
+            slow, fresh = _worker("slow"), _worker("fresh", visibility_timeout=0)
+            await slow._claim(100)
+            assert UPDATE_ID in slow._rows
+            # slow обрабатывает дольше visibility_timeout, и строку забирает другой воркер
+            await fresh._claim(100)
+            assert UPDATE_ID in fresh._rows
+
+            slow._done.append(slow._rows.pop(UPDATE_ID))
+            await slow._flush()
+            async with session() as db:
+                row = (await db.execute(select(QueuedUpdate).where(QueuedUpdate.update_id == UPDATE_ID))).scalar_one()
+            assert (row.status, row.locked_by, row.attempts) == (STATUS_PROCESSING, "fresh", 2)
+
+            fresh._done.append(fresh._rows.pop(UPDATE_ID))
+            await fresh._flush()
+            async with session() as db:
+                assert await db.scalar(select(QueuedUpdate.id).where(QueuedUpdate.update_id == UPDATE_ID)) is None
+    finally:
+        async with session() as db:
+            await db.execute(delete(QueuedUpdate).where(QueuedUpdate.update_id == UPDATE_ID))
+            await db.commit()
+        await engine.dispose()
+
+
+def test_stale_claim_does_not_finish_reclaimed_row(database):
+    asyncio.run(_stale_worker_keeps_hands_off())
@@ -0,0 +1,56 @@
+"""
+Postgres-хранилище FSM: кэш одного процесса не отдаёт состояние, которое изменил другой процесс
+"""
+import asyncio
+from unittest import mock
+
+from aiogram.fsm.storage.base import StorageKey
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.config import settings
+from app.models import FsmState
+from bot import fsm_storage
+from bot.fsm_storage import PostgresStorage
+
+KEY = StorageKey(bot_id=1, chat_id=990000042, user_id=990000042)
+
+
+async def _two_processes() -> None:
+    engine = create_async_engine(settings.database_url, poolclass=NullPool)
+    session = async_sessionmaker(engine, expire_on_commit=False)
+    # Два хранилища со своими кэшами — как два воркера uvicorn
+    first, second = PostgresStorage(), PostgresStorage()
+    try:
+        with mock.patch.object(fsm_storage, "AsyncSessionLocal", session):
+            await first.set_state(KEY, "Checkout:fullname")
+            await first.set_data(KEY, {"cart_items": [1, 2]})
+            assert await first.get_data(KEY) == {"cart_items": [1, 2]}
+            assert await first.get_state(KEY) == "Checkout:fullname"
+            assert first.hits == 1
+
+            await second.set_state(KEY, "Checkout:phone")
+            await second.set_data(KEY, {"cart_items": [1, 2], "delivery_fullname": "Иванов"})
+            assert await first.get_state(KEY) == "Checkout:phone"
+            assert await first.get_data(KEY) == {"cart_items": [1, 2], "delivery_fullname": "Иванов"}
+            assert first.stale == 1
+
+            # Другой процесс завершил сценарий и удалил запись
+            await second.set_state(KEY, None)
+            await second.set_data(KEY, {})
+            assert await first.get_state(KEY) is None
+            assert await first.get_data(KEY) == {}
+
+            # Запись создана заново: версия новая, а не повтор удалённой
+            await second.set_data(KEY, {"cart_items": [3]})
+            assert await first.get_data(KEY) == {"cart_items": [3]}
+    finally:
+        async with session() as db:
+            await db.execute(delete(FsmState).where(FsmState.key == first.key_builder.build(KEY)))
+            await db.commit()
+        await engine.dispose()
+
+
+def test_cache_sees_writes_from_other_process(database):
+    asyncio.run(_two_processes())
@@ -0,0 +1,30 @@
+"""
+Проверка живости открыта, а метрики отдаются только с логином и паролем админки
+"""
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.routers import health
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(settings, "admin_username", "admin")
+    monkeypatch.setattr(settings, "admin_password", "secret")
+    app = FastAPI()
+    app.include_router(health.router)
+    return TestClient(app)
+
+
+def test_healthcheck_is_public(client):
+    assert client.get("/health/").json() == {"status": "ok"}
+
+
+def test_metrics_require_admin_auth(client):
+    assert client.get("/health/metrics").status_code == 401
+    assert client.get("/health/metrics", auth=("admin", "wrong")).status_code == 401
+    response = client.get("/health/metrics", auth=("admin", "secret"))
+    assert response.status_code == 200
+    assert "telegram_updates" in response.json()
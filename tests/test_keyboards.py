@@ -0,0 +1,37 @@
+"""
+Клавиатуры из кэша общие для всех пользователей: изменить их на месте нельзя, а в Telegram они уходят как обычные
+"""
+import pytest
+from aiogram import Bot
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from app.utils.texts import load_texts
+from bot.keyboards import SharedKeyboard, main_menu_kb
+
+
+def test_cached_keyboard_is_shared_and_immutable():
+    kb = main_menu_kb(load_texts())
+    assert isinstance(kb, SharedKeyboard)
+    assert main_menu_kb(load_texts()) is kb
+    extra = InlineKeyboardButton(text="x", callback_data="x")
+    with pytest.raises(AttributeError):
+        kb.inline_keyboard.append([extra])
+    with pytest.raises(AttributeError):
+        kb.inline_keyboard[0].append(extra)
+    with pytest.raises(TypeError):
+        kb.inline_keyboard[0][0] = extra
+
+
+def test_copy_before_changing():
+    kb = main_menu_kb(load_texts())
+    rows = len(kb.inline_keyboard)
+    changed = InlineKeyboardMarkup(inline_keyboard=[list(row) for row in kb.inline_keyboard] + [[InlineKeyboardButton(text="x", callback_data="x")]])
+    assert len(changed.inline_keyboard) == rows + 1
+    assert len(main_menu_kb(load_texts()).inline_keyboard) == rows
+
+
+def test_shared_keyboard_is_sent_like_plain_one():
+    bot = Bot("123456:TEST-token")
+    kb = main_menu_kb(load_texts())
+    plain = InlineKeyboardMarkup(inline_keyboard=[list(row) for row in kb.inline_keyboard])
+    assert bot.session.prepare_value(kb, bot, {}) == bot.session.prepare_value(plain, bot, {})
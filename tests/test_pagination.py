@@ -0,0 +1,152 @@
+"""
+Постраничный вывод по ключу: курсоры, листание вперёд и назад и возврат на первую страницу при плохом курсоре
+"""
+import asyncio
+import base64
+from unittest import mock
+
+import pytest
+from sqlalchemy import Integer, create_engine, delete, insert, select
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
+
+from app.utils import pagination
+from app.utils.pagination import AFTER, BEFORE, decode_cursor, encode_cursor, estimated_count, keyset_page
+
+ROWS = 25
+PAGE = 10
+
+
+class _Base(DeclarativeBase):
+    pass
+
+
+class Row(_Base):
+    __tablename__ = "rows"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+
+class _SyncSession:
+    """AsyncSession поверх синхронной сессии SQLite: keyset_page нужен только await db.execute()"""
+
+    def __init__(self, session: Session) -> None:
+        self.session = session
+
+    async def execute(self, statement, *args, **kwargs):
+        return self.session.execute(statement, *args, **kwargs)
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    _Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.execute(insert(Row), [{"id": n} for n in range(1, ROWS + 1)])
+        yield _SyncSession(session)
+    engine.dispose()
+
+
+def _page(db, cursor=None):
+    return asyncio.run(keyset_page(db, select(Row), Row.id, cursor, PAGE))
+
+
+def _ids(page):
+    return [row.id for row in page.rows]
+
+
+@pytest.mark.parametrize("direction", [AFTER, BEFORE])
+@pytest.mark.parametrize("key", [0, 1, 2**31 - 1, 10**18])
+def test_cursor_round_trip(direction, key):
+    cursor = encode_cursor(direction, key)
+    assert decode_cursor(cursor) == (direction, key)
+    # В callback_data Telegram рядом с курсором остаётся место под префикс
+    assert len(cursor) < 32 and "=" not in cursor
+
+
+@pytest.mark.parametrize("cursor", [
+    None,
+    "",
+    "!!!",
+    base64.urlsafe_b64encode(b"x15").decode(),
+    base64.urlsafe_b64encode(b"afifteen").decode(),
+    base64.urlsafe_b64encode(b"a").decode(),
+    base64.urlsafe_b64encode(b"\xff\xfe").decode(),
+])
+def test_invalid_cursor_decodes_to_none(cursor):
+    assert decode_cursor(cursor) is None
+
+
+def test_pages_forwards_and_backwards(db):
+    first = _page(db)
+    assert _ids(first) == list(range(25, 15, -1))
+    assert first.prev_cursor is None and first.next_cursor
+
+    second = _page(db, first.next_cursor)
+    assert _ids(second) == list(range(15, 5, -1))
+    assert second.prev_cursor and second.next_cursor
+
+    last = _page(db, second.next_cursor)
+    assert _ids(last) == [5, 4, 3, 2, 1]
+    assert last.next_cursor is None and last.prev_cursor
+
+    # Назад: та же вторая страница в том же порядке, и с неё снова можно уйти вперёд
+    back = _page(db, last.prev_cursor)
+    assert _ids(back) == _ids(second)
+    assert back.next_cursor == second.next_cursor
+    top = _page(db, back.prev_cursor)
+    assert _ids(top) == _ids(first)
+    assert top.prev_cursor is None
+
+
+def test_before_cursor_near_top_returns_short_page(db):
+    # Курсор «назад» от строки 20: новее неё только 5 строк, и предыдущей страницы нет
+    page = _page(db, encode_cursor(BEFORE, 20))
+    assert _ids(page) == [25, 24, 23, 22, 21]
+    assert page.prev_cursor is None
+    assert decode_cursor(page.next_cursor) == (AFTER, 21)
+
+
+def test_new_rows_do_not_shift_next_page(db):
+    first = _page(db)
+    db.session.execute(insert(Row), [{"id": n} for n in range(26, 31)])
+    # В отличие от OFFSET, вставка новых строк не сдвигает уже открытую выдачу
+    assert _ids(_page(db, first.next_cursor)) == list(range(15, 5, -1))
+
+
+@pytest.mark.parametrize("cursor", ["!!!", encode_cursor(AFTER, 1), encode_cursor(BEFORE, 25)])
+def test_bad_or_stale_cursor_shows_first_page(db, cursor):
+    page = _page(db, cursor)
+    assert _ids(page) == list(range(25, 15, -1))
+    assert page.prev_cursor is None
+
+
+def test_cursor_past_deleted_rows_shows_first_page(db):
+    cursor = _page(db, _page(db).next_cursor).next_cursor
+    db.session.execute(delete(Row).where(Row.id <= 5))
+    page = _page(db, cursor)
+    assert _ids(page) == list(range(25, 15, -1))
+
+
+def test_rows_mode_keys_on_first_column(db):
+    page = asyncio.run(keyset_page(db, select(Row, Row.id.label("n")), Row.id, None, PAGE, scalars=False))
+    assert [row.n for row in page.rows] == list(range(25, 15, -1))
+    assert decode_cursor(page.next_cursor) == (AFTER, 16)
+
+
+@pytest.mark.parametrize("estimate, exact, expected", [
+    (None, 7, 7),
+    (pagination.EXACT_COUNT_BELOW - 1, 9_999, 9_999),
+    (1_000_000, None, 1_000_000),
+])
+def test_estimated_count(estimate, exact, expected):
+    db = mock.AsyncMock()
+    db.execute.side_effect = [
+        mock.Mock(scalar_one_or_none=mock.Mock(return_value=estimate)),
+        mock.Mock(scalar_one=mock.Mock(return_value=exact)),
+    ]
+    model = mock.Mock(__tablename__="orders")
+    with mock.patch.object(pagination, "select") as select_count:
+        assert asyncio.run(estimated_count(db, model)) == expected
+    # Точный COUNT(*) — только когда оценки нет или таблица маленькая
+    assert db.execute.await_count == (1 if exact is None else 2)
+    assert select_count.called == (exact is not None)
@@ -0,0 +1,42 @@
+"""
+Оплата отменённого заказа: коды и остатки не списываются, покупателю и администратору уходит сообщение о возврате
+"""
+import asyncio
+from unittest import mock
+
+import pytest
+
+from app.models import Order, OrderStatus, PaymentMethod
+from app.services import payments
+
+
+@pytest.mark.parametrize("metadata", [{"cart_order_id": "15"}, {"offline_order_id": "15"}, {"paymentId": "15"}])
+def test_canceled_order_is_not_fulfilled(metadata):
+    order = Order(
+        id=15, amount_minor=100, payment_method=PaymentMethod.CARD_RF,
+        status=OrderStatus.CANCELED, buyer_tg_id="42", fk_order_id="2c1e-yk",
+    )
+    db = mock.AsyncMock()
+    db.execute.side_effect = [
+        mock.Mock(scalar_one_or_none=mock.Mock(return_value=order)),
+        mock.Mock(scalar_one_or_none=mock.Mock(return_value="buyer")),
+    ]
+    enqueue = mock.Mock()
+    consume = mock.AsyncMock()
+    allocate = mock.AsyncMock()
+    with mock.patch.object(payments, "enqueue_message", enqueue), \
+            mock.patch.object(payments, "wake_outbox"), \
+            mock.patch.object(payments, "consume_stock", consume), \
+            mock.patch.object(payments, "_allocate_codes", allocate), \
+            mock.patch.object(payments.settings, "admin_chat_id", "100"):
+        result = asyncio.run(payments.process_payment_event(
+            db, "payment.succeeded", {"id": "2c1e-yk", "status": "succeeded", "metadata": metadata},
+        ))
+    assert result == {"ok": True}
+    assert order.status == OrderStatus.CANCELED
+    consume.assert_not_awaited()
+    allocate.assert_not_awaited()
+    db.add.assert_not_called()
+    assert [call.args[1] for call in enqueue.call_args_list] == [42, 100]
+    assert "2c1e-yk" in enqueue.call_args_list[1].args[2]
+    db.commit.assert_awaited_once()
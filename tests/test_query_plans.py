@@ -0,0 +1,156 @@
+"""
+Планы горячих запросов бота, вебхука, админки и очередей: без Seq Scan по большим таблицам.
+
+Таблицы тестовой базы маленькие, и planner выбрал бы Seq Scan где угодно, поэтому он выключается
+в сессии (enable_seqscan = off): при подходящем индексе planner берёт индекс, без него в плане
+остаётся Seq Scan. Запросы очередей берутся у самих сервисов — подменяется только сессия.
+"""
+import asyncio
+import json
+from unittest import mock
+
+import pytest
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from app.config import settings
+from app.models import Item, ItemType, Order, Purchase
+from app.routers.admin import _orders_view_stmt
+from app.services import catalog, outbox, reconciler
+from app.services.catalog import CatalogItem, load_item_card
+from app.services.outbox import OutboxDispatcher
+from app.services.reconciler import PaymentReconciler
+from app.utils.pagination import keyset_page
+from bot import durable_queue, user_middleware
+from bot.durable_queue import DurableUpdateWorker
+from bot.user_middleware import UserCache
+
+LARGE_TABLES = {
+    "users", "orders", "purchases", "cart_items", "items", "item_codes", "outbox", "tg_update_queue",
+}
+
+
+class Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, statement) -> None:
+        self.statement = statement
+
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element, compiler, **kw):
+    sql = compiler.process(element.statement, **kw)
+    # Результат — одна строка плана, а не колонки RETURNING запроса
+    compiler.isinsert = compiler.isupdate = compiler.isdelete = False
+    compiler._result_columns = []
+    return "EXPLAIN (FORMAT JSON) " + sql
+
+
+class CapturingSession:
+    """Подмена AsyncSessionLocal: запоминает запросы вместо выполнения, возвращает пустой результат"""
+
+    def __init__(self) -> None:
+        self.statements = []
+
+    def __call__(self) -> "CapturingSession":
+        return self
+
+    async def __aenter__(self) -> "CapturingSession":
+        return self
+
+    async def __aexit__(self, *exc) -> bool:
+        return False
+
+    async def execute(self, statement, *args, **kwargs):
+        self.statements.append(statement)
+        return mock.Mock(**{
+            "all.return_value": [],
+            "one.return_value": (False, False),
+            "one_or_none.return_value": None,
+            "scalars.return_value": [],
+        })
+
+    async def commit(self) -> None:
+        pass
+
+
+def _capture(module, call) -> list:
+    session = CapturingSession()
+    with mock.patch.object(module, "AsyncSessionLocal", session):
+        asyncio.run(call())
+    return session.statements
+
+
+def _seq_scans(plan: dict) -> list:
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in LARGE_TABLES:
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", ()):
+        found.extend(_seq_scans(child))
+    return found
+
+
+async def _explain(statements) -> dict:
+    engine = create_async_engine(settings.database_url, poolclass=NullPool)
+    plans = {}
+    try:
+        async with engine.connect() as conn:
+            await conn.execute(text("SET enable_seqscan = off"))
+            for statement in statements:
+                plan = (await conn.execute(Explain(statement))).scalar_one()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                plans[str(statement)] = plan[0]["Plan"]
+            await conn.rollback()
+    finally:
+        await engine.dispose()
+    return plans
+
+
+def _catalog_page():
+    stmt = select(Item).where(Item.item_type == ItemType.DIGITAL, Item.is_visible.is_(True))
+    return _capture_db(lambda db: keyset_page(db, stmt, Item.id, None, 5))
+
+
+def _admin_orders_by_buyer():
+    stmt = _orders_view_stmt().where(Order.buyer_tg_id == "42")
+    return _capture_db(lambda db: keyset_page(db, stmt, Order.id, None, 10, scalars=False))
+
+
+def _capture_db(call) -> list:
+    session = CapturingSession()
+    asyncio.run(call(session))
+    return session.statements
+
+
+def _item_card():
+    item = CatalogItem(1, "t", "d", 100, ItemType.DIGITAL, None, None, True)
+    with mock.patch.object(catalog.catalog_cache, "get", mock.AsyncMock(return_value=item)):
+        return _capture(catalog, lambda: load_item_card(1, 1))
+
+
+HOT_QUERIES = {
+    "bot catalog page": _catalog_page,
+    "bot item card": _item_card,
+    "bot user by tg_id": lambda: _capture(user_middleware, lambda: UserCache().resolve(42)),
+    "webhook order": lambda: [select(Order).where(Order.id == 1).with_for_update()],
+    "webhook order purchases": lambda: [select(Purchase).where(Purchase.order_id == 1)],
+    "admin orders by buyer": _admin_orders_by_buyer,
+    "outbox claim": lambda: _capture(outbox, lambda: OutboxDispatcher(bot=None)._claim()),
+    "update queue claim": lambda: _capture(
+        durable_queue, lambda: DurableUpdateWorker(bot=None, dp=None, worker_id="test")._claim(10)
+    ),
+    "reconciler claim": lambda: _capture(reconciler, lambda: PaymentReconciler()._claim(reconciler.datetime.utcnow())),
+}
+
+
+@pytest.mark.parametrize("name", HOT_QUERIES)
+def test_hot_query_uses_indexes(database, name):
+    statements = HOT_QUERIES[name]()
+    assert statements
+    plans = asyncio.run(_explain(statements))
+    for sql, plan in plans.items():
+        assert not _seq_scans(plan), f"{name}: Seq Scan в плане\n{sql}"
@@ -0,0 +1,36 @@
+"""
+Планировщик отправок: после TelegramRetryAfter пауза действует на весь бот, а не только на чат с ошибкой
+"""
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from bot.send_scheduler import SendScheduler
+
+
+async def _retry_after_blocks_other_chats() -> None:
+    scheduler = SendScheduler(rate=100, chat_rate=100, chat_burst=100, max_retries=1)
+    calls = []
+
+    async def make_request(bot, method):
+        calls.append(method.chat_id)
+        if calls == [1]:
+            raise TelegramRetryAfter(method, "Flood control exceeded", retry_after=1)
+        return method.chat_id
+
+    first = asyncio.create_task(scheduler(make_request, None, SendMessage(chat_id=1, text="выдача")))
+    while not calls:
+        await asyncio.sleep(0)
+    # Первая отправка получила 429 и ждёт повтора; отправка в другой чат ждёт ту же паузу
+    started = time.monotonic()
+    assert await scheduler(make_request, None, SendMessage(chat_id=2, text="ответ")) == 2
+    assert time.monotonic() - started >= 0.9
+    assert await first == 1
+    assert sorted(calls) == [1, 1, 2]
+    assert scheduler.stats()["retried"] == 1
+
+
+def test_retry_after_blocks_global_bucket():
+    asyncio.run(_retry_after_blocks_other_chats())
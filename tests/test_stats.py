@@ -0,0 +1,81 @@
+"""
+Сводки дашборда: пересборка по исходным таблицам совпадает с тем, что накопил инкрементальный путь,
+а сверка находит расхождение продаж по отдельному товару
+"""
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.config import settings
+from app.models import DailyStats, Item, ItemType, Order, OrderStatus, PaymentMethod, Purchase, User
+from app.services.stats import COUNTERS, backfill, check_drift, record_checkout, record_payment, record_user_created
+
+
+async def _snapshot(db) -> dict:
+    rows = (await db.execute(select(DailyStats))).scalars()
+    return {(row.day, row.item_id): tuple(getattr(row, name) for name in COUNTERS) for row in rows}
+
+
+async def _order(db, item: Item | None, amount: int, status: OrderStatus, url: str | None) -> Order:
+    order = Order(
+        item_id=item.id if item else None, amount_minor=amount, payment_method=PaymentMethod.CARD_RF,
+        status=status, fk_payment_url=url,
+    )
+    db.add(order)
+    await db.flush()
+    return order
+
+
+async def _backfill_matches_incremental() -> None:
+    engine = create_async_engine(settings.database_url, poolclass=NullPool)
+    session = async_sessionmaker(engine, expire_on_commit=False)
+    try:
+        async with session() as db:
+            # Всё в одной транзакции с откатом в конце: сводки и строки тестовой базы не меняются
+            await backfill(db)
+            now = datetime.utcnow()
+            for tg_id in (990000201, 990000202):
+                db.add(User(tg_id=tg_id, created_at=now, updated_at=now))
+                await record_user_created(db)
+            key = Item(title="Ключ", description="", price_minor=100, item_type=ItemType.DIGITAL)
+            box = Item(title="Коробка", description="", price_minor=250, item_type=ItemType.OFFLINE)
+            db.add_all([key, box])
+            await db.flush()
+
+            # Оплаченный заказ одного товара
+            single = await _order(db, key, 100, OrderStatus.PAID, "https://yk/1")
+            await record_checkout(db, [key])
+            await record_payment(db, single, [key])
+            # Оплаченная корзина: товар повторяется по числу единиц
+            cart = await _order(db, None, 600, OrderStatus.PAID, "https://yk/2")
+            db.add_all([Purchase(order_id=cart.id, item_id=item.id) for item in (key, box, box)])
+            await record_checkout(db, [key, box, box])
+            await record_payment(db, cart, [key, box, box])
+            # Оформлен, но не оплачен; и заказ, до ссылки на оплату не дошедший, — в сводках его нет
+            await _order(db, box, 250, OrderStatus.PENDING, "https://yk/3")
+            await record_checkout(db, [box])
+            await _order(db, key, 100, OrderStatus.CREATED, None)
+            await db.flush()
+
+            incremental = await _snapshot(db)
+            await backfill(db)
+            assert await _snapshot(db) == incremental
+            assert await check_drift(db) == []
+
+            # Расхождение продаж одного товара, при котором итоги магазина сходятся
+            await db.execute(
+                update(DailyStats)
+                .where(DailyStats.item_id == box.id)
+                .values(units_sold=DailyStats.units_sold + 1)
+            )
+            assert await check_drift(db) == [{"metric": "units_sold", "item_id": box.id, "raw": 2, "rollup": 3}]
+            await db.rollback()
+    finally:
+        await engine.dispose()
+
+
+def test_backfill_matches_incremental_path(database):
+    asyncio.run(_backfill_matches_incremental())
@@ -0,0 +1,202 @@
+"""
+Резерв остатка при оформлении заказа: последний экземпляр достаётся одному покупателю,
+а при распродаже резервов ровно столько, сколько было товара
+"""
+import asyncio
+from unittest import mock
+
+import pytest
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.config import settings
+from app.models import Item, ItemStock, ItemType, Order, OrderStatus, PaymentMethod, StockHold
+from app.schemas.orders import CreateOrderRequest
+from app.services import orders
+from app.services import stock as stock_service
+from app.services.orders import OrderError, hold_for_checkout, release_checkout
+from app.services.stock import OutOfStock, check_stock, hold_stock, release_expired
+from app.services.yookassa import YooKassaUnavailable
+
+
+async def _race_for_last_unit() -> None:
+    engine = create_async_engine(settings.database_url, poolclass=NullPool)
+    session = async_sessionmaker(engine, expire_on_commit=False)
+    item = Item(title="Последний экземпляр", description="", price_minor=100, item_type=ItemType.OFFLINE, stock=1)
+    buyers = []
+    try:
+        async with session() as db:
+            db.add(item)
+            await db.flush()
+            buyers = [
+                Order(item_id=item.id, amount_minor=100, payment_method=PaymentMethod.CARD_RF, status=OrderStatus.CREATED)
+                for _ in range(2)
+            ]
+            db.add_all(buyers)
+            db.add(ItemStock(item_id=item.id, available=1))
+            await db.commit()
+
+        async def checkout(order: Order) -> None:
+            async with session() as db:
+                await hold_stock(db, order.id, [item])
+                # Держим блокировку строки остатка, пока второй покупатель её ждёт
+                await asyncio.sleep(0.2)
+                await db.commit()
+
+        results = await asyncio.gather(*(checkout(order) for order in buyers), return_exceptions=True)
+        assert sum(isinstance(result, OutOfStock) for result in results) == 1, results
+        assert sum(result is None for result in results) == 1, results
+
+        async with session() as db:
+            stock = await db.get(ItemStock, item.id)
+            assert (stock.available, stock.held) == (0, 1)
+    finally:
+        async with session() as db:
+            await db.execute(delete(Order).where(Order.id.in_([order.id for order in buyers if order.id])))
+            if item.id:
+                await db.execute(delete(Item).where(Item.id == item.id))
+            await db.commit()
+        await engine.dispose()
+
+
+def test_two_buyers_race_for_last_unit(database):
+    asyncio.run(_race_for_last_unit())
+
+
+# Распродажа: тысячи одновременных оформлений на товар с небольшим остатком
+STRESS_AVAILABLE = 50
+STRESS_CHECKOUTS = 2000
+
+
+async def _flash_sale() -> None:
+    engine = create_async_engine(settings.database_url, pool_size=20, max_overflow=0, pool_timeout=120)
+    session = async_sessionmaker(engine, expire_on_commit=False)
+    item = Item(title="Распродажа", description="", price_minor=100, item_type=ItemType.OFFLINE, stock=STRESS_AVAILABLE)
+    order_ids: list = []
+    try:
+        async with session() as db:
+            db.add(item)
+            await db.flush()
+            buyers = [
+                Order(item_id=item.id, amount_minor=100, payment_method=PaymentMethod.CARD_RF, status=OrderStatus.CREATED)
+                for _ in range(STRESS_CHECKOUTS)
+            ]
+            db.add_all(buyers)
+            db.add(ItemStock(item_id=item.id, available=STRESS_AVAILABLE))
+            await db.commit()
+            order_ids = [order.id for order in buyers]
+
+        async def checkout(order_id: int) -> None:
+            async with session() as db:
+                try:
+                    await hold_stock(db, order_id, [item], ttl=1)
+                except OutOfStock:
+                    await db.rollback()
+                    raise
+                await db.commit()
+
+        results = await asyncio.gather(*(checkout(order_id) for order_id in order_ids), return_exceptions=True)
+        errors = [result for result in results if result is not None and not isinstance(result, OutOfStock)]
+        assert not errors, errors[:3]
+        assert sum(result is None for result in results) == STRESS_AVAILABLE
+
+        async with session() as db:
+            stock = await db.get(ItemStock, item.id)
+            assert (stock.available, stock.held, stock.sold) == (0, STRESS_AVAILABLE, 0)
+            holds = await db.scalar(select(func.count()).select_from(StockHold).where(StockHold.item_id == item.id))
+            assert holds == STRESS_AVAILABLE
+            assert not [row for row in await check_stock(db) if row["item_id"] == item.id]
+
+        # После TTL все резервы возвращаются в продажу
+        await asyncio.sleep(1.5)
+        with mock.patch.object(stock_service, "AsyncSessionLocal", session):
+            assert await release_expired() >= STRESS_AVAILABLE
+        async with session() as db:
+            stock = await db.get(ItemStock, item.id)
+            assert (stock.available, stock.held) == (STRESS_AVAILABLE, 0)
+            assert not await db.scalar(select(func.count()).select_from(StockHold).where(StockHold.item_id == item.id))
+            assert not [row for row in await check_stock(db) if row["item_id"] == item.id]
+    finally:
+        async with session() as db:
+            if order_ids:
+                await db.execute(delete(Order).where(Order.id.in_(order_ids)))
+            if item.id:
+                await db.execute(delete(Item).where(Item.id == item.id))
+            await db.commit()
+        await engine.dispose()
+
+
+def test_flash_sale_holds_exactly_available(database, monkeypatch):
+    monkeypatch.setattr(settings, "stock_low_threshold", -1)
+    asyncio.run(_flash_sale())
+
+
+def _create_order(payment_error=None, hold_error=None):
+    item = Item(id=3, title="Товар", description="", price_minor=100, item_type=ItemType.DIGITAL)
+    db = mock.AsyncMock()
+    db.add = mock.Mock()
+    db.execute.return_value = mock.Mock(scalar_one_or_none=mock.Mock(return_value=item))
+    client = mock.Mock(close=mock.AsyncMock())
+    client.create_payment = mock.AsyncMock(
+        side_effect=payment_error, return_value={"id": "2c1e-yk", "confirmation": {"confirmation_url": "https://yk/pay"}}
+    )
+    hold = mock.AsyncMock(side_effect=hold_error)
+    release = mock.AsyncMock()
+    with mock.patch.object(orders, "YooKassaClient", return_value=client), \
+            mock.patch.object(orders, "hold_for_checkout", hold), \
+            mock.patch.object(orders, "release_checkout", release), \
+            mock.patch.object(orders, "record_checkout", mock.AsyncMock()):
+        try:
+            return asyncio.run(orders.create_order(db, CreateOrderRequest(item_id=3, tg_id=42))), client, hold, release
+        except OrderError as e:
+            return e, client, hold, release
+
+
+def test_hold_is_taken_before_payment():
+    response, client, hold, release = _create_order()
+    assert response.payment_url == "https://yk/pay"
+    hold.assert_awaited_once()
+    client.create_payment.assert_awaited_once()
+    release.assert_not_awaited()
+
+
+def test_out_of_stock_creates_no_payment():
+    error, client, hold, release = _create_order(hold_error=OutOfStock(["Товар"]))
+    assert error.status_code == 409
+    client.create_payment.assert_not_awaited()
+    release.assert_not_awaited()
+
+
+def test_failed_payment_releases_hold():
+    error, client, hold, release = _create_order(payment_error=YooKassaUnavailable("circuit open"))
+    assert error.status_code == 503
+    release.assert_awaited_once()
+    assert release.await_args.args[1] is hold.await_args.args[1]
+
+
+def test_failed_hold_rolls_back_order():
+    db = mock.AsyncMock()
+    with mock.patch.object(orders, "hold_stock", mock.AsyncMock(side_effect=OutOfStock(["Товар"]))):
+        with pytest.raises(OutOfStock):
+            asyncio.run(hold_for_checkout(db, Order(id=15), []))
+    db.rollback.assert_awaited_once()
+    db.commit.assert_not_awaited()
+
+
+@pytest.mark.parametrize("status, deleted", [(OrderStatus.CREATED, True), (OrderStatus.PENDING, False)])
+def test_release_checkout_removes_only_unpaid_order(status, deleted):
+    db = mock.AsyncMock()
+    db.execute.return_value = mock.Mock(scalar_one_or_none=mock.Mock(return_value=status))
+    release_holds = mock.AsyncMock()
+    with mock.patch.object(orders, "release_holds", release_holds):
+        asyncio.run(release_checkout(db, Order(id=15)))
+    if deleted:
+        release_holds.assert_awaited_once_with(db, 15)
+        # Блокировка заказа, удаление позиций и самого заказа
+        assert db.execute.await_count == 3
+        db.commit.assert_awaited_once()
+    else:
+        release_holds.assert_not_awaited()
+        assert db.execute.await_count == 1
+        db.commit.assert_not_awaited()
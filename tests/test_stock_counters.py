@@ -0,0 +1,278 @@
+"""
+Счётчики остатков: загрузка кодов, продажи, одно уведомление о малом остатке, сверка и починка
+счётчиков и их начальное заполнение миграцией 20261018_000011
+"""
+import asyncio
+import contextlib
+import importlib.util
+from pathlib import Path
+from unittest import mock
+
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, func, select, text, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.config import settings
+from app.db.session import get_db_session
+from app.models import Item, ItemCode, ItemStock, ItemType, Order, OrderStatus, PaymentMethod, StockHold
+from app.routers import admin
+from app.services import stock as stock_service
+from app.services.stock import add_stock, check_stock, consume_stock, hold_stock, set_stock
+
+BUYER = "990000018"
+MIGRATION = Path(__file__).resolve().parent.parent / "alembic" / "versions" / "20261018_000011_item_stock.py"
+
+
+def _codes_item(title: str = "Коды") -> Item:
+    return Item(title=title, description="", price_minor=100, item_type=ItemType.DIGITAL, delivery_type="codes")
+
+
+def _offline_item(stock: int | None, title: str = "Оффлайн") -> Item:
+    return Item(title=title, description="", price_minor=100, item_type=ItemType.OFFLINE, stock=stock)
+
+
+async def _seed(session, items) -> None:
+    async with session() as db:
+        db.add_all(items)
+        await db.commit()
+
+
+async def _cleanup(session, items) -> None:
+    async with session() as db:
+        await db.execute(delete(Order).where(Order.buyer_tg_id == BUYER))
+        await db.execute(delete(Item).where(Item.id.in_([item.id for item in items if item.id])))
+        await db.commit()
+
+
+@contextlib.asynccontextmanager
+async def _shop(*items: Item):
+    """Сессии отдельной базы тестов с товарами items; товары и заказы покупателя BUYER удаляются после теста"""
+    engine = create_async_engine(settings.database_url, poolclass=NullPool)
+    session = async_sessionmaker(engine, expire_on_commit=False)
+    try:
+        await _seed(session, items)
+        yield engine, session
+    finally:
+        await _cleanup(session, items)
+        await engine.dispose()
+
+
+async def _counter(session, item_id: int):
+    async with session() as db:
+        row = await db.get(ItemStock, item_id)
+        return None if row is None else (row.available, row.held, row.sold)
+
+
+async def _order(db) -> int:
+    order = Order(amount_minor=100, payment_method=PaymentMethod.CARD_RF, status=OrderStatus.CREATED, buyer_tg_id=BUYER)
+    db.add(order)
+    await db.flush()
+    return order.id
+
+
+def test_code_upload_adds_stock(database):
+    item = _codes_item()
+    engine = create_async_engine(settings.database_url, poolclass=NullPool)
+    session = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def db_session():
+        async with session() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(admin.router)
+    app.dependency_overrides[get_db_session] = db_session
+    app.dependency_overrides[admin.ensure_auth] = lambda: None
+
+    asyncio.run(_seed(session, [item]))
+    try:
+        with TestClient(app) as client:
+            for body, added in ((b"AAA-1\nAAA-2\n\nAAA-3\n", 3), (b"BBB-1\r\nBBB-2\r\n", 2)):
+                resp = client.post(f"/admin/items/{item.id}/add_codes", files={"file": ("codes.txt", body)})
+                assert resp.json() == {"ok": True, "added": added}
+        # Счётчик пополнен в той же транзакции, что и вставка кодов
+        assert asyncio.run(_counter(session, item.id)) == (5, 0, 0)
+    finally:
+        asyncio.run(_cleanup(session, [item]))
+        asyncio.run(engine.dispose())
+
+
+async def _sales() -> None:
+    codes, offline = _codes_item(), _offline_item(4)
+    async with _shop(codes, offline) as (_, session):
+        async with session() as db:
+            await add_stock(db, codes.id, 5)
+            await add_stock(db, codes.id, 0)
+            await set_stock(db, offline.id, offline.stock)
+            await db.commit()
+        assert await _counter(session, codes.id) == (5, 0, 0)
+        items = {codes.id: codes, offline.id: offline}
+
+        # Оплата заказа с резервом: резерв превращается в продажу
+        async with session() as db:
+            order_id = await _order(db)
+            await hold_stock(db, order_id, [codes, codes, offline])
+            await db.commit()
+        assert await _counter(session, codes.id) == (3, 2, 0)
+        assert await _counter(session, offline.id) == (3, 1, 0)
+        async with session() as db:
+            await consume_stock(db, {codes.id: 2, offline.id: 1}, items, order_id=order_id)
+            await db.commit()
+        assert await _counter(session, codes.id) == (3, 0, 2)
+        assert await _counter(session, offline.id) == (3, 0, 1)
+
+        # Продажа без резерва (резерв истёк) списывается из свободного остатка, Item.stock тоже уменьшается
+        async with session() as db:
+            await consume_stock(db, {codes.id: 1, offline.id: 2}, items)
+            await db.commit()
+            assert await db.scalar(select(StockHold.id).where(StockHold.order_id == order_id)) is None
+        assert await _counter(session, codes.id) == (2, 0, 3)
+        assert await _counter(session, offline.id) == (1, 0, 3)
+        async with session() as db:
+            assert await db.scalar(select(Item.stock).where(Item.id == offline.id)) == 1
+
+        # «Количество на складе» в админке включает резерв; пустое поле снимает учёт остатков
+        async with session() as db:
+            await hold_stock(db, await _order(db), [offline])
+            await set_stock(db, offline.id, 10)
+            await db.commit()
+        assert await _counter(session, offline.id) == (9, 1, 3)
+        async with session() as db:
+            await set_stock(db, offline.id, None)
+            await db.commit()
+        assert await _counter(session, offline.id) is None
+
+
+def test_sales_move_counters(database, monkeypatch):
+    monkeypatch.setattr(settings, "stock_low_threshold", -1)
+    asyncio.run(_sales())
+
+
+async def _low_stock_alert(enqueue: mock.Mock) -> None:
+    item = _codes_item("Ключ")
+    async with _shop(item) as (_, session):
+        async def sell(n: int = 1) -> None:
+            for _ in range(n):
+                async with session() as db:
+                    await consume_stock(db, {item.id: 1}, {item.id: item})
+                    await db.commit()
+
+        async with session() as db:
+            await add_stock(db, item.id, 5)
+            await db.commit()
+        await sell(2)
+        enqueue.assert_not_called()
+        # Остаток дошёл до порога: одно уведомление, дальнейшие продажи его не повторяют
+        await sell(3)
+        assert enqueue.call_count == 1
+        assert enqueue.call_args.args[1:] == (100, "⚠️ Заканчивается товар\n• Ключ: 2")
+
+        # Пополнение, после которого остаток всё ещё не выше порога, уведомление не взводит
+        async with session() as db:
+            await add_stock(db, item.id, 1)
+            await db.commit()
+        await sell()
+        assert enqueue.call_count == 1
+
+        # Пополнение выше порога взводит уведомление снова
+        async with session() as db:
+            await add_stock(db, item.id, 5)
+            await db.commit()
+            assert (await db.get(ItemStock, item.id)).low_alerted is False
+        await sell(2)
+        assert enqueue.call_count == 1
+        await sell()
+        assert enqueue.call_count == 2
+        assert enqueue.call_args.args[2] == "⚠️ Заканчивается товар\n• Ключ: 2"
+
+
+def test_single_low_stock_alert_and_rearm(database, monkeypatch):
+    monkeypatch.setattr(settings, "stock_low_threshold", 2)
+    monkeypatch.setattr(settings, "admin_chat_id", "100")
+    enqueue = mock.Mock()
+    monkeypatch.setattr(stock_service, "enqueue_message", enqueue)
+    asyncio.run(_low_stock_alert(enqueue))
+
+
+async def _repair() -> None:
+    codes, offline = _codes_item(), _offline_item(6)
+    async with _shop(codes, offline) as (_, session):
+        async with session() as db:
+            db.add_all([ItemCode(item_id=codes.id, code=f"C-{n}", is_sold=n < 2) for n in range(5)])
+            order_id = await _order(db)
+            db.add(StockHold(order_id=order_id, item_id=codes.id, quantity=1, expires_at=func.now()))
+            # Счётчики сломаны нарочно: у кодов неверные числа, у оффлайн-товара счётчика нет вовсе
+            db.add(ItemStock(item_id=codes.id, available=99, held=5, sold=0))
+            await db.commit()
+
+        ids = {codes.id, offline.id}
+        async with session() as db:
+            drift = {row["item_id"]: row for row in await check_stock(db) if row["item_id"] in ids}
+            await db.commit()
+        assert drift[codes.id] == {
+            "item_id": codes.id, "expected_available": 2, "expected_held": 1, "expected_sold": 2,
+            "available": 99, "held": 5, "sold": 0,
+        }
+        assert drift[offline.id]["available"] is None and drift[offline.id]["expected_available"] == 6
+        # Без repair ничего не меняется
+        assert await _counter(session, codes.id) == (99, 5, 0)
+
+        async with session() as db:
+            repaired = [row for row in await check_stock(db, repair=True) if row["item_id"] in ids]
+            await db.commit()
+        assert len(repaired) == 2
+        assert await _counter(session, codes.id) == (2, 1, 2)
+        assert await _counter(session, offline.id) == (6, 0, 0)
+        async with session() as db:
+            assert not [row for row in await check_stock(db) if row["item_id"] in ids]
+
+        # Расхождение только в проданном тоже находится
+        async with session() as db:
+            await db.execute(update(ItemStock).where(ItemStock.item_id == codes.id).values(sold=7))
+            await db.commit()
+            assert [row["item_id"] for row in await check_stock(db) if row["item_id"] in ids] == [codes.id]
+
+
+def test_check_stock_repairs_broken_counters(database):
+    asyncio.run(_repair())
+
+
+def _upgrade(connection) -> None:
+    spec = importlib.util.spec_from_file_location("item_stock_migration", MIGRATION)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    with Operations.context(MigrationContext.configure(connection)):
+        migration.upgrade()
+
+
+async def _migration() -> None:
+    codes, offline, legacy = _codes_item(), _offline_item(4), _offline_item(0, "Без учёта")
+    async with _shop(codes, offline, legacy) as (engine, session):
+        async with session() as db:
+            db.add_all([ItemCode(item_id=codes.id, code=f"M-{n}", is_sold=n < 2) for n in range(5)])
+            await db.commit()
+        async with engine.connect() as conn:
+            # DDL в Postgres транзакционна: таблица удаляется и заполняется миграцией заново, затем откат
+            await conn.execute(text("DROP TABLE item_stock"))
+            await conn.run_sync(_upgrade)
+            rows = (await conn.execute(
+                text("SELECT item_id, available, sold, low_alerted FROM item_stock WHERE item_id = ANY(:ids)"),
+                {"ids": [codes.id, offline.id, legacy.id]},
+            )).all()
+            legacy_stock = await conn.scalar(select(Item.stock).where(Item.id == legacy.id))
+            await conn.rollback()
+        assert {row[0]: tuple(row[1:]) for row in rows} == {
+            codes.id: (3, 2, False),
+            offline.id: (4, 0, False),
+        }
+        # Прежний 0 означал «без учёта остатков»: теперь это NULL и счётчика нет
+        assert legacy_stock is None
+        assert await _counter(session, codes.id) is None
+
+
+def test_migration_backfills_counters(database):
+    asyncio.run(_migration())
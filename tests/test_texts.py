@@ -0,0 +1,27 @@
+"""
+Шаблоны texts.yml отрисовываются так же, как str.format
+"""
+import pytest
+
+from app.utils.texts import Template
+
+
+@pytest.mark.parametrize("source, kwargs", [
+    ("Просто текст", {}),
+    ("Скобки {{в тексте}}", {}),
+    ("Скобки {{в тексте}}", {"name": "лишний аргумент"}),
+    ("Привет, {name}! {{не поле}}", {"name": "Ира"}),
+    ("Сумма: {amount} ₽", {"amount": "10.00"}),
+])
+def test_render_matches_format(source, kwargs):
+    assert Template(source).render(**kwargs) == source.format(**kwargs)
+
+
+def test_fields_are_parsed_once():
+    assert Template("{item} за {amount}").fields == ("item", "amount")
+    assert Template("{{item}}").fields == ()
+
+
+def test_missing_field_fails_like_format():
+    with pytest.raises(KeyError):
+        Template("Заказ {order_id}").render()
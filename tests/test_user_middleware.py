@@ -0,0 +1,229 @@
+"""
+Обработчики получают пользователя из UserMiddleware и передают его во вспомогательные обработчики;
+незнакомый отправитель регистрируется, а с тёплым кэшем обновление не обращается к users
+"""
+import asyncio
+from collections import Counter
+from datetime import datetime
+from unittest import mock
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+from sqlalchemy import delete, event, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.config import settings
+from app.models import CartItem, DailyStats, Item, ItemType, OutboxMessage, TOTAL_ITEM_ID
+from app.models import User as DbUser
+from app.services import catalog
+from app.services.catalog import catalog_cache
+from app.services.stats import _today
+from bot import user_middleware
+from bot.handlers import cart
+from bot.user_middleware import BotUser, UserCache, user_cache
+from bot.webhook_app import bot, dp
+
+TG_ID = 42
+USER = BotUser(id=7, tg_id=TG_ID, username="buyer")
+
+
+def _callback(data: str, update_id: int = 1, tg_id: int = TG_ID) -> Update:
+    return Update(
+        update_id=update_id,
+        callback_query=CallbackQuery(
+            id=str(update_id),
+            from_user=User(id=tg_id, is_bot=False, first_name="Buyer"),
+            chat_instance="test",
+            data=data,
+            message=Message(
+                message_id=1,
+                date=datetime.now(),
+                chat=Chat(id=tg_id, type="private"),
+                text="🛒 Корзина",
+            ),
+        ),
+    )
+
+
+async def _feed(data: str, target: str, state: dict | None = None) -> mock.AsyncMock:
+    """Прогнать callback через диспетчер бота и вернуть заглушку вызванного обработчика target"""
+    if state is not None:
+        await dp.storage.set_data(StorageKey(bot_id=bot.id, chat_id=TG_ID, user_id=TG_ID), state)
+    helper = mock.AsyncMock()
+    with mock.patch.object(user_cache, "resolve", mock.AsyncMock(return_value=USER)), \
+            mock.patch.object(cart, target, helper):
+        await dp.feed_update(bot, _callback(data))
+    return helper
+
+
+def test_menu_cart_passes_user():
+    helper = asyncio.run(_feed("menu:cart", "show_cart"))
+    helper.assert_awaited_once()
+    assert helper.await_args.args[1] == USER
+
+
+def test_checkout_confirm_passes_user():
+    helper = asyncio.run(_feed("cart:checkout:confirm", "checkout_cart", state={"cart_item_ids": [1]}))
+    helper.assert_awaited_once()
+    assert helper.await_args.args[2] == USER
+
+
+def test_checkout_cancel_passes_user():
+    helper = asyncio.run(_feed("cart:checkout:cancel", "show_cart"))
+    helper.assert_awaited_once()
+    assert helper.await_args.args[1] == USER
+
+
+def _session(*results) -> mock.MagicMock:
+    db = mock.AsyncMock()
+    db.add = mock.Mock()
+    db.execute.side_effect = list(results)
+    session = mock.MagicMock()
+    session.return_value.__aenter__.return_value = db
+    return session
+
+
+def _row(value):
+    return mock.Mock(one_or_none=mock.Mock(return_value=value))
+
+
+PROFILE = User(id=TG_ID, is_bot=False, first_name="Buyer", username="buyer")
+
+
+def test_middleware_passes_sender_profile():
+    resolve = mock.AsyncMock(return_value=USER)
+    with mock.patch.object(user_cache, "resolve", resolve), mock.patch.object(cart, "show_cart", mock.AsyncMock()):
+        asyncio.run(dp.feed_update(bot, _callback("menu:cart")))
+    tg_id, profile = resolve.await_args.args
+    # Профиль отправителя нужен для регистрации незнакомого пользователя
+    assert tg_id == TG_ID and (profile.id, profile.first_name) == (TG_ID, "Buyer")
+
+
+def test_unknown_sender_is_registered(monkeypatch):
+    monkeypatch.setattr(user_middleware.settings, "admin_chat_id", "100")
+    session = _session(_row(None), _row((7, TG_ID, "buyer")), mock.Mock(scalar_one=mock.Mock(return_value=5)))
+    enqueue, record = mock.Mock(), mock.AsyncMock()
+    cache = UserCache()
+    with mock.patch.object(user_middleware, "AsyncSessionLocal", session), \
+            mock.patch.object(user_middleware, "enqueue_message", enqueue), \
+            mock.patch.object(user_middleware, "record_user_created", record), \
+            mock.patch.object(user_middleware, "wake_outbox"):
+        assert asyncio.run(cache.resolve(TG_ID, PROFILE)) == USER
+    db = session.return_value.__aenter__.return_value
+    record.assert_awaited_once_with(db)
+    assert enqueue.call_args.args[1:] == (100, "✅ Новый пользователь\nBuyer\nUsername: @buyer\nID: 42\nВсего: 5")
+    db.commit.assert_awaited_once()
+    assert cache.get_cached(TG_ID) == USER and cache.created == 1
+
+
+def test_registration_race_reads_winner():
+    # Пользователя создал параллельный процесс между поиском и INSERT: ON CONFLICT вернул пусто
+    session = _session(_row(None), _row(None), _row((7, TG_ID, "buyer")))
+    record = mock.AsyncMock()
+    cache = UserCache()
+    with mock.patch.object(user_middleware, "AsyncSessionLocal", session), \
+            mock.patch.object(user_middleware, "record_user_created", record):
+        assert asyncio.run(cache.resolve(TG_ID, PROFILE)) == USER
+    record.assert_not_awaited()
+    session.return_value.__aenter__.return_value.commit.assert_not_awaited()
+    assert cache.created == 0
+
+
+def test_lookup_without_profile_does_not_register():
+    session = _session(_row(None))
+    assert asyncio.run(_resolve_with(session, UserCache(), TG_ID)) is None
+    assert session.return_value.__aenter__.return_value.execute.await_count == 1
+
+
+async def _resolve_with(session, cache: UserCache, *args):
+    with mock.patch.object(user_middleware, "AsyncSessionLocal", session):
+        return await cache.resolve(*args)
+
+
+DB_TG_ID = 990000024
+NEW_TG_ID = 990000025
+ADMIN_CHAT = 990000100
+
+
+def _kinds(statements: list) -> list:
+    return [sql.lstrip().split(None, 1)[0].upper() for sql in statements]
+
+
+def _user_lookups(statements: list) -> int:
+    return sum("FROM users" in sql for sql in statements)
+
+
+async def _statements_per_update(session, statements: list) -> dict:
+    async with session() as db:
+        db.add(DbUser(tg_id=DB_TG_ID, created_at=datetime.utcnow()))
+        item = Item(title="Замер", description="", price_minor=100, item_type=ItemType.DIGITAL)
+        db.add(item)
+        await db.commit()
+    card, add = f"item:{item.id}:digital", f"cart:add:{item.id}"
+    counted = {}
+    try:
+        async def feed(data: str, n: int, tg_id: int = DB_TG_ID) -> list:
+            statements.clear()
+            await dp.feed_update(bot, _callback(data, update_id=n, tg_id=tg_id))
+            return list(statements)
+
+        await feed(card, 1)  # прогрев витрины и кэша пользователей
+        counted["card, тёплый кэш"] = await feed(card, 2)
+        counted["cart add, тёплый кэш"] = await feed(add, 3)
+        with mock.patch.object(user_cache, "size", 0):
+            user_cache._entries.clear()
+            counted["card, без кэша"] = await feed(card, 4)
+        counted["card, новый пользователь"] = await feed(card, 5, tg_id=NEW_TG_ID)
+        user_cache._entries.clear()
+        counted["card, другой процесс"] = await feed(card, 6, tg_id=NEW_TG_ID)
+    finally:
+        async with session() as db:
+            await db.execute(delete(CartItem).where(CartItem.item_id == item.id))
+            await db.execute(delete(Item).where(Item.id == item.id))
+            await db.execute(delete(DbUser).where(DbUser.tg_id == DB_TG_ID))
+            registered = (await db.execute(delete(DbUser).where(DbUser.tg_id == NEW_TG_ID))).rowcount
+            await db.execute(delete(OutboxMessage).where(OutboxMessage.chat_id == ADMIN_CHAT))
+            # Сводку new_users, пополненную регистрацией, возвращаем как было
+            await db.execute(
+                update(DailyStats)
+                .where(DailyStats.day == _today(), DailyStats.item_id == TOTAL_ITEM_ID)
+                .values(new_users=DailyStats.new_users - registered)
+            )
+            await db.commit()
+    return counted
+
+
+def test_statements_per_update(database, monkeypatch):
+    engine = create_async_engine(settings.database_url, poolclass=NullPool)
+    session = async_sessionmaker(engine, expire_on_commit=False)
+    statements: list = []
+    event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    monkeypatch.setattr(settings, "admin_chat_id", str(ADMIN_CHAT))
+    # Сверка версии каталога раз в секунду добавила бы SELECT в случайное обновление
+    monkeypatch.setattr(settings, "catalog_version_check", 3600)
+    for module in (user_middleware, cart, catalog):
+        monkeypatch.setattr(module, "AsyncSessionLocal", session)
+    # Ответы Telegram не нужны: считаем только запросы к базе
+    monkeypatch.setattr(type(bot), "__call__", mock.AsyncMock(return_value=True))
+    catalog_cache.invalidate()
+    user_cache._entries.clear()
+    try:
+        counted = asyncio.run(_statements_per_update(session, statements))
+    finally:
+        catalog_cache.invalidate()
+        user_cache._entries.clear()
+        asyncio.run(engine.dispose())
+
+    # Тёплый кэш: карточка — один SELECT с двумя EXISTS, добавление в корзину — он же и INSERT; к users не ходим
+    assert _kinds(counted["card, тёплый кэш"]) == ["SELECT"], counted
+    assert _kinds(counted["cart add, тёплый кэш"]) == ["SELECT", "INSERT"], counted
+    # Без кэша к карточке добавляется ровно один поиск пользователя — столько же, сколько раньше делал обработчик
+    assert _user_lookups(counted["card, без кэша"]) == 1
+    assert len(counted["card, без кэша"]) == 2
+    # Незнакомый отправитель: поиск, INSERT users, сводка new_users, число пользователей и уведомление в outbox
+    registration = counted["card, новый пользователь"][:5]
+    assert Counter(_kinds(registration)) == {"SELECT": 2, "INSERT": 3}, counted
+    assert _kinds(counted["card, новый пользователь"][5:]) == ["SELECT"]
+    # Другой процесс (пустой кэш) находит уже зарегистрированного пользователя одним SELECT
+    assert _kinds(counted["card, другой процесс"]) == ["SELECT", "SELECT"]
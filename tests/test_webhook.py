@@ -0,0 +1,60 @@
+"""
+Вебхук Telegram: update_id и тип берутся из начала тела, а при другом порядке ключей — из полного разбора
+"""
+import json
+from unittest import mock
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from bot import webhook_app
+from bot.update_dedup import UpdateDeduplicator
+
+MESSAGE = {
+    "message_id": 7,
+    "date": 1700000000,
+    "chat": {"id": 42, "type": "private"},
+    "from": {"id": 42, "is_bot": False, "first_name": "Покупатель"},
+    "text": "/start",
+}
+
+
+@pytest.fixture
+def webhook(monkeypatch):
+    process = mock.AsyncMock()
+    monkeypatch.setattr(webhook_app, "_process_update", process)
+    monkeypatch.setattr(webhook_app, "update_dedup", UpdateDeduplicator(window=64))
+    monkeypatch.setattr(webhook_app, "peek_fallbacks", webhook_app.Counter())
+    monkeypatch.setattr(webhook_app.settings, "webhook_secret", None)
+    app = FastAPI()
+    app.include_router(webhook_app.api_router)
+    return TestClient(app), process
+
+
+def test_peek_reads_update_head():
+    body = json.dumps({"update_id": 1001, "message": MESSAGE}).encode()
+    assert webhook_app._peek_update(body) == (1001, "message")
+
+
+def test_reordered_keys_fall_back_to_full_parse(webhook):
+    client, process = webhook
+    body = json.dumps({"message": MESSAGE, "update_id": 1002}, indent=2).encode()
+    assert webhook_app._peek_update(body) == (None, None)
+
+    for _ in range(2):
+        assert client.post("/telegram/webhook", content=body).json() == {"ok": True}
+
+    # Повтор отброшен дедупликацией, а разобранная модель передана дальше без второго разбора
+    process.assert_awaited_once()
+    update = process.await_args.args[1]
+    assert (update.update_id, update.event_type) == (1002, "message")
+    assert webhook_app.peek_fallbacks == {"message": 2}
+
+
+def test_fast_path_does_not_count_fallback(webhook):
+    client, process = webhook
+    body = json.dumps({"update_id": 1003, "message": MESSAGE}).encode()
+    client.post("/telegram/webhook", content=body)
+    assert process.await_args.args[1] is None
+    assert not webhook_app.peek_fallbacks
@@ -0,0 +1,190 @@
+"""
+Автомат защиты, повторы и адаптивный таймаут запросов к ЮKassa (без сети: HTTP-клиент или транспорт подменяется)
+"""
+import asyncio
+import time
+from unittest import mock
+
+import httpx
+import pytest
+
+from app.services import yookassa
+from app.services.yookassa import CircuitBreaker, YooKassaClient, YooKassaUnavailable
+
+
+def _trip(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.threshold):
+        assert breaker.allow()
+        breaker.record_failure()
+
+
+def test_breaker_opens_after_threshold_failures():
+    breaker = CircuitBreaker(threshold=3, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    assert breaker.failures == 0
+    _trip(breaker)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.stats()["rejected"] == 1 and breaker.stats()["trips"] == 1
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0)
+    _trip(breaker)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=0)
+    _trip(breaker)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def _client(*responses):
+    client = YooKassaClient()
+    client._client = mock.Mock(request=mock.AsyncMock(side_effect=list(responses)))
+    return client
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0)
+    monkeypatch.setattr(yookassa, "breaker", breaker)
+    monkeypatch.setattr(yookassa.settings, "yk_retries", 2)
+    monkeypatch.setattr(yookassa.settings, "yk_retry_backoff", 0)
+    return breaker
+
+
+def test_retries_transient_errors(breaker):
+    client = _client(httpx.ConnectError("refused"), httpx.Response(503), httpx.Response(200))
+    resp = asyncio.run(client._request("test", "GET", "payments/1"))
+    assert resp.status_code == 200
+    assert client._client.request.await_count == 3
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_client_error_is_not_retried(breaker):
+    client = _client(httpx.Response(400))
+    assert asyncio.run(client._request("test", "GET", "payments/1")).status_code == 400
+    assert client._client.request.await_count == 1
+
+
+def test_gives_up_after_retries(breaker):
+    breaker.threshold = 10
+    client = _client(*(httpx.Response(502) for _ in range(3)))
+    with pytest.raises(YooKassaUnavailable):
+        asyncio.run(client._request("test", "GET", "payments/1"))
+    assert client._client.request.await_count == 3
+
+
+@pytest.mark.parametrize("error", [asyncio.CancelledError(), httpx.DecodingError("bad gzip")])
+def test_interrupted_probe_does_not_wedge_breaker(breaker, error):
+    _trip(breaker)
+    client = _client(error, httpx.Response(200))
+    with pytest.raises(type(error)):
+        asyncio.run(client._request("test", "GET", "payments/1"))
+    # Следующий вызов снова пропускается пробным запросом
+    assert asyncio.run(client._request("test", "GET", "payments/1")).status_code == 200
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_one_failure_per_call_after_retries(breaker):
+    breaker.threshold = 2
+    client = _client(*(httpx.Response(503) for _ in range(6)))
+    with pytest.raises(YooKassaUnavailable):
+        asyncio.run(client._request("test", "GET", "payments/1"))
+    # Три попытки одного вызова — один сбой, автомат ещё замкнут
+    assert (breaker.failures, breaker.state) == (1, CircuitBreaker.CLOSED)
+    with pytest.raises(YooKassaUnavailable):
+        asyncio.run(client._request("test", "GET", "payments/1"))
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+class _ChaosStub:
+    """Заглушка API ЮKassa поверх httpx.MockTransport: задержка ответа и код ответа меняются по ходу теста.
+
+    MockTransport не соблюдает таймауты, поэтому заглушка сама обрывает ответ, который не
+    укладывается в таймаут чтения запроса, как это сделал бы настоящий транспорт.
+    """
+
+    def __init__(self) -> None:
+        self.latency = 0.0
+        self.status = 200
+        self.requests = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        read = request.extensions["timeout"]["read"]
+        await asyncio.sleep(min(self.latency, read))
+        if self.latency > read:
+            raise httpx.ReadTimeout("stub: read timeout", request=request)
+        return httpx.Response(self.status, json={"id": "2c1e-yk", "status": "pending"})
+
+
+async def _chaos(stub: _ChaosStub, breaker: CircuitBreaker, timeout: yookassa.AdaptiveTimeout) -> None:
+    client = YooKassaClient()
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(stub), base_url="https://yk.test/v3/")
+
+    async def call() -> None:
+        await client._request("get_payment", "GET", "payments/2c1e-yk")
+
+    try:
+        # Быстрые ответы: таймаут чтения сжимается от максимума к нижней границе
+        # (нижняя граница с запасом: p99 двадцати пяти замеров — это самый медленный из них)
+        stub.latency = 0.005
+        assert timeout.current() == timeout.maximum
+        for _ in range(25):
+            await call()
+        assert timeout.current() == timeout.minimum
+
+        # Всплеск задержки: каждая попытка обрывается по короткому таймауту, а не ждёт ответа
+        stub.latency = 0.5
+        requests = stub.requests
+        started = time.monotonic()
+        for n in range(breaker.threshold):
+            assert breaker.state == CircuitBreaker.CLOSED and breaker.failures == n
+            with pytest.raises(YooKassaUnavailable):
+                await call()
+        assert time.monotonic() - started < 3 * breaker.threshold * stub.latency
+        assert stub.requests - requests == 3 * breaker.threshold
+        assert breaker.state == CircuitBreaker.OPEN and breaker.trips == 1
+
+        # Разомкнутый автомат отклоняет вызовы, не обращаясь к API
+        requests = stub.requests
+        with pytest.raises(YooKassaUnavailable, match="circuit open"):
+            await call()
+        assert stub.requests == requests
+
+        # 5xx на пробном запросе: одна попытка без повторов, автомат снова разомкнут
+        stub.latency, stub.status = 0.0, 503
+        await asyncio.sleep(breaker.reset_timeout)
+        with pytest.raises(YooKassaUnavailable):
+            await call()
+        assert stub.requests == requests + 1
+        assert breaker.state == CircuitBreaker.OPEN and breaker.trips == 2
+
+        # API восстановилось: пробный запрос замыкает автомат
+        stub.status = 200
+        await asyncio.sleep(breaker.reset_timeout)
+        await call()
+        assert breaker.state == CircuitBreaker.CLOSED and breaker.failures == 0
+    finally:
+        await client._client.aclose()
+
+
+def test_chaos_latency_and_5xx(monkeypatch):
+    breaker = CircuitBreaker(threshold=3, reset_timeout=0.05)
+    timeout = yookassa.AdaptiveTimeout(minimum=0.1, maximum=1.0)
+    monkeypatch.setattr(yookassa, "breaker", breaker)
+    monkeypatch.setattr(yookassa, "read_timeout", timeout)
+    monkeypatch.setattr(yookassa.settings, "yk_retries", 2)
+    monkeypatch.setattr(yookassa.settings, "yk_retry_backoff", 0)
+    asyncio.run(_chaos(_ChaosStub(), breaker, timeout))